@@ -1,8 +1,12 @@
 import sqlite3
 import sys
 import os
+import time
 from datetime import datetime, date, timedelta
 
+# Referencia para medir el arranque completo (imports incluidos)
+_T_INICIO = time.perf_counter()
+
 # SOPORTE PARA DPI ALTO (Windows)
 if os.name == 'nt':
     try:
@@ -41,9 +45,11 @@ from gui.keyboard_shortcuts import setup_keyboard_shortcuts
 from gui.theme_manager import create_theme_manager
 from gui.styles import Styles
 from gui.tab_manager import TabManager
-from gui.services.notification_service import NotificationService
+from gui.services.notification_service import NotificationService, InventoryChangeSubscriber
 from gui.services.cache_service import CacheService
+from gui.services.startup_service import StartupService
 from gui.components.log_viewer import LogViewerWindow
+from gui.components.pool_diagnostics import PoolDiagnosticsWindow
 from functools import wraps
 
 
@@ -83,6 +89,8 @@ class ModernInventarioApp:
         
         # Initialize Services
         self.cache_service = CacheService()
+        # Cambios en vivo (se activa cuando el esquema está listo; las pestañas se registran al crearse)
+        self.live_updates = InventoryChangeSubscriber(self.master, self.cache_service)
         
         # CONFIGURAR ICONO - NUEVO: Agregar ícono del programa
         self.configurar_icono()
@@ -111,11 +119,9 @@ class ModernInventarioApp:
         # Crear interfaz moderna
         self.create_modern_gui()
         
-        # CARGAR DASHBOARD INMEDIATAMENTE (Para que no esté vacío al inicio)
-        self.tab_manager.load_tab("Dashboard")
-        
-        # Sincronizar Cache al inicio
-        self.refresh_app_cache()
+        # DASHBOARD: se importa en segundo plano apenas la ventana esté visible
+        # (la caché y el esquema se calientan en paralelo desde iniciar_aplicacion_principal)
+        self.master.after(0, lambda: self.tab_manager.load_tab("Dashboard", en_segundo_plano=True))
         
         # Initialize keyboard shortcuts
         self.keyboard_shortcuts = setup_keyboard_shortcuts(self.master, self)
@@ -407,6 +413,13 @@ class ModernInventarioApp:
                             command=self.show_log_viewer)
         btn_logs.pack(side='bottom', fill='x', pady=10)
 
+        btn_pool = tk.Button(self.sidebar, text="  🩺  Conexiones BD", anchor='w',
+                            font=('Segoe UI', 9), bg=self.primary_color, fg='#94a3b8',
+                            activebackground='#334155', activeforeground='white',
+                            relief='flat', bd=0, padx=20, pady=8,
+                            command=self.show_pool_diagnostics)
+        btn_pool.pack(side='bottom', fill='x')
+
         # INICIALIZAR EL GESTOR DE PESTAÑAS (DEBE IR AL FINAL DE create_modern_gui)
         self.tab_manager = TabManager(self)
 
@@ -414,6 +427,10 @@ class ModernInventarioApp:
         """Abre la ventana del visor de logs."""
         LogViewerWindow(self.master)
 
+    def show_pool_diagnostics(self):
+        """Abre el panel de diagnóstico del pool de conexiones."""
+        PoolDiagnosticsWindow(self.master)
+
     def set_status(self, text, is_busy=False, timeout=None):
         """Actualiza el mensaje de la barra de estado."""
         self.status_label.config(text=text)
@@ -563,27 +580,8 @@ def iniciar_aplicacion_principal():
     """Inicia el flujo normal -> App. La conexión DB se realiza en segundo plano."""
     root = tk.Tk()
     root.withdraw()
-
-    # --- PANTALLA DE CARGA (Splash) ---
-    splash = tk.Toplevel(root)
-    splash.overrideredirect(True)  # Sin bordes
-    splash.configure(bg='#2c3e50')
-    sw, sh = 360, 200
-    x = (splash.winfo_screenwidth() - sw) // 2
-    y = (splash.winfo_screenheight() - sh) // 2
-    splash.geometry(f"{sw}x{sh}+{x}+{y}")
-
-    tk.Label(splash, text="🚀 StockWare", font=('Segoe UI', 22, 'bold'),
-             bg='#2c3e50', fg='white').pack(pady=(30, 5))
-    tk.Label(splash, text="Conectando a la base de datos...", font=('Segoe UI', 10),
-             bg='#2c3e50', fg='#95a5a6').pack()
-    splash_status = tk.Label(splash, text="⏳ Iniciando...", font=('Segoe UI', 9),
-                             bg='#2c3e50', fg='#3498db')
-    splash_status.pack(pady=5)
-    tk.Label(splash, text="v2.5.0 Enterprise", font=('Segoe UI', 8),
-             bg='#2c3e50', fg='#566573').pack(side='bottom', pady=10)
-    splash.lift()
-    splash.update()
+    arranque = StartupService()
+    arranque.marcar('imports', _T_INICIO)
 
     def iniciar_tareas_segundo_plano():
         def run_optimization():
@@ -596,6 +594,7 @@ def iniciar_aplicacion_principal():
 
     def bootstrap_app():
         logger.info("Bootstrap Start")
+        inicio = time.perf_counter()
         try:
             logger.info("[INIT] Iniciando aplicación principal")
             logger.debug("Instantiating ModernInventarioApp...")
@@ -608,50 +607,70 @@ def iniciar_aplicacion_principal():
             logger.critical(traceback.format_exc())
             messagebox.showerror("Fatal Error", msg)
             root.destroy()
-            return
+            return None
 
         root.deiconify()
+        arranque.marcar('ventana', inicio)
 
         def on_closing():
             if messagebox.askokcancel("Salir", "¿Está seguro que desea salir de la aplicación?"):
                 root.destroy()
 
         root.protocol("WM_DELETE_WINDOW", on_closing)
+        return app
+
+    # La ventana se muestra de inmediato; la BD se prepara después, en paralelo
+    app = bootstrap_app()
+    if app is None:
+        return
+
+    def _verificar_esquema():
+        if not inicializar_bd(mostrar_errores=False):
+            raise RuntimeError("No se pudo inicializar el esquema de la base de datos.")
+        purgar_cambios()
+        # Indexa para el historial los movimientos escritos por fuera de data_layer
+        poner_al_dia_indice()
+        # Con REPLICA_LOCAL=1, las lecturas frecuentes pasan a un espejo SQLite local
+        iniciar_replica_local()
+
+    def _precargar_indice_escaneo():
+        # Los escáneres de Abasto/Reverso/Movimientos encuentran el índice ya cargado
+        from gui.services.scan_index import ScanIndex
+        ScanIndex.obtener().listo.wait(timeout=60)
+
+    def _cache():
+        ok, error = app.cache_service.refresh_now()
+        if not ok:
+            raise RuntimeError(error)
+
+    def _fase_lista(nombre, ok, resultado):
+        if ok:
+            return
+        if nombre == 'esquema':
+            messagebox.showerror(
+                "Error de Conexión",
+                f"No se pudo conectar a la Base de Datos:\n\n{resultado}\n\n"
+                "Verifique su conexión a Internet y vuelva a intentarlo."
+            )
+            root.destroy()
+        elif nombre == 'cache':
+            app.set_status(f"⚠️ Error de sincronización: {resultado}", timeout=5000)
 
-    def _init_db_en_background():
-        """Ejecuta la inicialización de DB en hilo secundario y luego lanza la app."""
-        db_ok = False
-        error_msg = None
+    def _arranque_listo(tiempos):
         try:
-            root.after(0, lambda: splash_status.config(text="🔌 Conectando a MySQL..."))
-            inicializar_bd()
-            db_ok = True
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Error en inicializar_bd: {e}")
-
-        def _continuar():
-            try:
-                splash.destroy()
-            except Exception:
-                pass
-
-            if not db_ok:
-                messagebox.showerror(
-                    "Error de Conexión",
-                    f"No se pudo conectar a la Base de Datos:\n\n{error_msg}\n\n"
-                    "Verifique su conexión a Internet y vuelva a intentarlo."
-                )
-                root.destroy()
-                return
-
-            # DB lista — lanzar app
-            bootstrap_app()
-
-        root.after(0, _continuar)
-
-    hilo_db = threading.Thread(target=_init_db_en_background, daemon=True)
-    hilo_db.start()
+            app.set_status(f"✅ Datos listos ({tiempos.get('total', 0):.1f}s)", timeout=3000)
+            app.live_updates.start()
+        except tk.TclError:
+            pass  # La ventana ya se cerró
+
+    app.set_status("🔄 Conectando y sincronizando datos...", is_busy=True)
+    arranque.agregar_fase('esquema', _verificar_esquema)
+    arranque.agregar_fase('cache', _cache)
+    arranque.agregar_fase('indice_escaneo', _precargar_indice_escaneo)
+    arranque.ejecutar(
+        al_terminar_fase=lambda nombre, ok, resultado: root.after(0, _fase_lista, nombre, ok, resultado),
+        al_terminar=lambda tiempos: root.after(0, _arranque_listo, tiempos),
+    )
 
     # MANEJADOR GLOBAL DE EXCEPCIONES GUI
     def report_callback_exception(exc, val, tb):
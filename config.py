@@ -44,6 +44,12 @@ MYSQL_DB = os.getenv("MYSQL_DATABASE_OVERRIDE", os.getenv("MYSQL_DATABASE"))
 MYSQL_DB_SANTIAGO = None # Deprecated: Ahora usamos la misma DB filtrando por columna sucursal
 MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
 
+# Réplica local del escritorio (solo con MySQL): espejo SQLite de productos, asignaciones,
+# series, móviles y técnicos; las lecturas frecuentes no cruzan la WAN (data_layer/replica.py)
+REPLICA_LOCAL = os.getenv("REPLICA_LOCAL", "0") == "1"
+REPLICA_DB_NAME = os.path.join(application_path, "replica_local.db")
+REPLICA_INTERVALO_SEG = float(os.getenv("REPLICA_INTERVALO", 3))
+
 # Branch Name for UI title
 BRANCH_NAME = os.getenv("CURRENT_BRANCH_NAME", "")
 
@@ -75,6 +81,9 @@ TIPOS_CONSUMO = ['SALIDA', 'CONSUMO_MOVIL', 'DESCARTE']
 TIPOS_ABASTO = ['ENTRADA', 'ABASTO']
 TIPOS_MOVIMIENTO = ['ENTRADA', 'ABASTO', 'SALIDA_MOVIL', 'RETORNO_MOVIL', 'CONSUMO_MOVIL', 'DESCARTE', 'SALIDA', 'TRASLADO', 'PRESTAMO_SANTIAGO']
 
+# PAQUETES_MATERIALES, MATERIALES_COMPARTIDOS y PRODUCTOS_CON_CODIGO_BARRA solo siembran
+# el catálogo en BD (migración 2) y sirven de respaldo sin conexión. En tiempo de
+# ejecución se consulta data_layer/catalog.py (obtener_catalogo, es_equipo_serializado...).
 PAQUETES_MATERIALES = {
     "PAQUETE A": [
         ("1-4-61", 5),      # PLACAS_F_O
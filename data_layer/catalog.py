@@ -0,0 +1,190 @@
+import time
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+from utils.db_connector import db_session
+
+from data_layer.core import run_query, run_many, marcar_inventario_movil
+
+# ─────────────────────────────────────────────────────────
+# CATÁLOGO DE PRODUCTOS (nombres Excel, equipos con serial, compartidos, paquetes)
+# ─────────────────────────────────────────────────────────
+# Vive en catalogo_productos / catalogo_paquetes (migración 2) y se carga en
+# estructuras inmutables compartidas por escritorio y portal. Cada proceso solo
+# relee las tablas cuando cambia la versión '__CATALOGO__' de inventario_movil_version.
+CLAVE_VERSION_CATALOGO = '__CATALOGO__'
+SUCURSAL_CATALOGO = 'GLOBAL'
+# Cada cuánto se consulta la versión (una lectura de una fila)
+CATALOGO_TTL_SEG = 30
+
+
+class Catalogo(NamedTuple):
+    version: object                 # int de BD, o None si viene de config.py (respaldo)
+    nombres_excel: MappingProxyType  # sku -> nombre corto del Excel/portal
+    con_serial: frozenset           # SKUs con código de barra/serial por unidad
+    compartidos: frozenset          # SKUs que no se dividen entre paquetes
+    paquetes: MappingProxyType      # paquete -> ((sku, cantidad), ...)
+
+
+_catalogo = None
+_catalogo_verificado = 0.0
+_lock_catalogo = threading.Lock()
+
+
+def _catalogo_desde_config():
+    """Valores de config.py: siembra de la migración y respaldo si la BD no responde."""
+    from config import PRODUCTOS_INICIALES, PRODUCTOS_CON_CODIGO_BARRA, MATERIALES_COMPARTIDOS, PAQUETES_MATERIALES
+    return Catalogo(
+        version=None,
+        nombres_excel=MappingProxyType({sku: nombre for nombre, sku, *_ in PRODUCTOS_INICIALES}),
+        con_serial=frozenset(PRODUCTOS_CON_CODIGO_BARRA),
+        compartidos=frozenset(MATERIALES_COMPARTIDOS),
+        paquetes=MappingProxyType({p: tuple((sku, int(c)) for sku, c in items) for p, items in PAQUETES_MATERIALES.items()}),
+    )
+
+
+def _leer_version_catalogo(cursor):
+    run_query(cursor, "SELECT version FROM inventario_movil_version WHERE clave = ? AND sucursal = ?",
+              (CLAVE_VERSION_CATALOGO, SUCURSAL_CATALOGO))
+    fila = cursor.fetchone()
+    return fila[0] if fila else 0
+
+
+def _leer_catalogo(cursor, version):
+    run_query(cursor, "SELECT sku, nombre_excel, con_serial, compartido FROM catalogo_productos")
+    productos = cursor.fetchall()
+    run_query(cursor, "SELECT paquete, sku, cantidad FROM catalogo_paquetes ORDER BY paquete, orden")
+    paquetes = {}
+    for paquete, sku, cantidad in cursor.fetchall():
+        paquetes.setdefault(paquete, []).append((sku, int(cantidad)))
+    return Catalogo(
+        version=version,
+        nombres_excel=MappingProxyType({sku: nombre for sku, nombre, _, _ in productos if nombre}),
+        con_serial=frozenset(sku for sku, _, serial, _ in productos if serial),
+        compartidos=frozenset(sku for sku, _, _, compartido in productos if compartido),
+        paquetes=MappingProxyType({p: tuple(items) for p, items in paquetes.items()}),
+    )
+
+
+def obtener_catalogo(forzar=False, existing_conn=None):
+    """
+    Catálogo vigente (Catalogo inmutable). Con la versión sin cambios no toca las tablas;
+    si la BD falla se mantiene el último cargado o, al arrancar, el de config.py.
+    """
+    global _catalogo, _catalogo_verificado
+    ahora = time.monotonic()
+    if not forzar and _catalogo is not None and ahora - _catalogo_verificado < CATALOGO_TTL_SEG:
+        return _catalogo
+
+    with _lock_catalogo:
+        if not forzar and _catalogo is not None and time.monotonic() - _catalogo_verificado < CATALOGO_TTL_SEG:
+            return _catalogo
+        try:
+            with db_session(existing_conn=existing_conn) as (conn, cursor):
+                version = _leer_version_catalogo(cursor)
+                if forzar or _catalogo is None or _catalogo.version != version:
+                    nuevo = _leer_catalogo(cursor, version)
+                    if nuevo.nombres_excel or nuevo.paquetes:
+                        if _catalogo is not None:
+                            logger.info(f"Catálogo de productos recargado (versión {version})")
+                        _catalogo = nuevo
+                    elif _catalogo is None:
+                        _catalogo = _catalogo_desde_config()  # Migración 2 aún no aplicada
+        except Exception as e:
+            logger.warning(f"No se pudo leer el catálogo de productos: {e}")
+            if _catalogo is None:
+                _catalogo = _catalogo_desde_config()
+        _catalogo_verificado = time.monotonic()
+        return _catalogo
+
+
+def invalidar_catalogo():
+    """Fuerza la verificación de versión en la próxima lectura de este proceso."""
+    global _catalogo_verificado
+    _catalogo_verificado = 0.0
+
+
+def es_equipo_serializado(sku):
+    return sku in obtener_catalogo().con_serial
+
+
+def es_material_compartido(sku):
+    return sku in obtener_catalogo().compartidos
+
+
+def nombre_excel(sku, defecto=None):
+    return obtener_catalogo().nombres_excel.get(sku, sku if defecto is None else defecto)
+
+
+def _marcar_catalogo(cursor):
+    """
+    Sube la versión del catálogo y, en ambas sucursales, la de globales (invalida los
+    snapshots por móvil) y la general (las páginas del portal incrustan el catálogo).
+    """
+    marcar_inventario_movil(cursor, SUCURSAL_CATALOGO, [CLAVE_VERSION_CATALOGO])
+    for suc in ('CHIRIQUI', 'SANTIAGO'):
+        marcar_inventario_movil(cursor, suc, globales=True)
+
+
+def sembrar_catalogo(cursor):
+    """Copia los valores de config.py a las tablas del catálogo si están vacías (migración 2)."""
+    run_query(cursor, "SELECT COUNT(*) FROM catalogo_productos")
+    if cursor.fetchone()[0] == 0:
+        base = _catalogo_desde_config()
+        skus = sorted(set(base.nombres_excel) | base.con_serial | base.compartidos)
+        run_many(cursor, "INSERT INTO catalogo_productos (sku, nombre_excel, con_serial, compartido) VALUES (?, ?, ?, ?)",
+                 [(sku, base.nombres_excel.get(sku), int(sku in base.con_serial), int(sku in base.compartidos)) for sku in skus])
+        logger.info(f"Catálogo sembrado con {len(skus)} productos desde config.py")
+
+    run_query(cursor, "SELECT COUNT(*) FROM catalogo_paquetes")
+    if cursor.fetchone()[0] == 0:
+        base = _catalogo_desde_config()
+        run_many(cursor, "INSERT INTO catalogo_paquetes (paquete, sku, cantidad, orden) VALUES (?, ?, ?, ?)",
+                 [(p, sku, cant, i) for p, items in base.paquetes.items() for i, (sku, cant) in enumerate(items)])
+    _marcar_catalogo(cursor)
+
+
+def guardar_producto_catalogo(sku, nombre_excel=None, con_serial=None, compartido=None, existing_conn=None):
+    """Crea o actualiza un producto del catálogo (solo los campos indicados). Retorna (bool, msg)."""
+    sku = str(sku or '').strip()
+    if not sku:
+        return False, "SKU vacío."
+    try:
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            run_query(cursor, "SELECT nombre_excel, con_serial, compartido FROM catalogo_productos WHERE sku = ?", (sku,))
+            actual = cursor.fetchone()
+            valores = (
+                nombre_excel if nombre_excel is not None else (actual[0] if actual else None),
+                int(con_serial) if con_serial is not None else (actual[1] if actual else 0),
+                int(compartido) if compartido is not None else (actual[2] if actual else 0),
+            )
+            if actual:
+                run_query(cursor, "UPDATE catalogo_productos SET nombre_excel = ?, con_serial = ?, compartido = ? WHERE sku = ?", valores + (sku,))
+            else:
+                run_query(cursor, "INSERT INTO catalogo_productos (nombre_excel, con_serial, compartido, sku) VALUES (?, ?, ?, ?)", valores + (sku,))
+            _marcar_catalogo(cursor)
+        invalidar_catalogo()
+        return True, f"Producto {sku} actualizado en el catálogo."
+    except Exception as e:
+        logger.error(f"Error al guardar {sku} en el catálogo: {e}")
+        return False, str(e)
+
+
+def guardar_paquetes_catalogo(paquetes, existing_conn=None):
+    """Reemplaza la definición de paquetes ({paquete: [(sku, cantidad), ...]}). Retorna (bool, msg)."""
+    filas = [(p, sku, int(cant), i) for p, items in paquetes.items() for i, (sku, cant) in enumerate(items)]
+    try:
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            run_query(cursor, "DELETE FROM catalogo_paquetes")
+            if filas:
+                run_many(cursor, "INSERT INTO catalogo_paquetes (paquete, sku, cantidad, orden) VALUES (?, ?, ?, ?)", filas)
+            _marcar_catalogo(cursor)
+        invalidar_catalogo()
+        return True, f"{len(paquetes)} paquetes guardados."
+    except Exception as e:
+        logger.error(f"Error al guardar paquetes: {e}")
+        return False, str(e)
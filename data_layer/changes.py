@@ -0,0 +1,246 @@
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+from utils.db_connector import db_session
+
+from data_layer.core import run_query, run_many, sql_hace_segundos
+
+# ─────────────────────────────────────────────────────────
+# OUTBOX / FEED DE CAMBIOS DE INVENTARIO
+# ─────────────────────────────────────────────────────────
+# Los escritores de stock agregan a cambios_inventario (migración 3), en su misma
+# transacción, un evento compacto por (sku, ubicación, paquete) con el delta neto.
+# 'ubicacion' es BODEGA, DESCARTE o el nombre del móvil. Los lectores (dashboard,
+# analítica, portal) guardan el último id visto y piden solo lo nuevo con changes_since().
+#
+# Los id AUTO_INCREMENT no salen en orden de commit (TiDB los reparte por lotes de cada
+# nodo y en MySQL una transacción con id menor puede confirmar después): un id > cursor
+# pierde esos eventos para siempre. Los lectores que mantienen caché (difusor, réplica)
+# usan LectorCambios, que relee además una ventana de CAMBIOS_SOLAPE_SEG según creado_en
+# y descarta los ids ya entregados (mismo solape que la réplica y el ScanIndex).
+CAMBIOS_RETENCION_DIAS = 7
+CAMBIOS_LIMITE_LECTURA = 500
+CAMBIOS_SOLAPE_SEG = 10
+_COLUMNAS_CAMBIO = ('id', 'sucursal', 'sku', 'ubicacion', 'paquete', 'delta', 'origen', 'creado_en')
+# Cada cuánto el difusor consulta el feed (una lectura por rango de id, sin importar cuántos suscriptores)
+DIFUSION_INTERVALO_SEG = 1.0
+
+
+def registrar_cambios(cursor, sucursal, deltas, origen):
+    """
+    Agrega eventos al outbox dentro de la transacción del llamador.
+    'deltas': {(sku, ubicacion, paquete): delta} o iterable de esas 4-tuplas; se omiten los ceros.
+    Igual que marcar_inventario_movil, un fallo aquí nunca bloquea la escritura de negocio.
+    """
+    items = deltas.items() if isinstance(deltas, dict) else ((d[:3], d[3]) for d in deltas)
+    suc = (sucursal or 'CHIRIQUI').upper()
+    filas = [(suc, sku, ubicacion, paquete, delta, origen)
+             for (sku, ubicacion, paquete), delta in items if delta]
+    if not filas:
+        return
+    try:
+        run_many(cursor, "INSERT INTO cambios_inventario (sucursal, sku, ubicacion, paquete, delta, origen) VALUES (?, ?, ?, ?, ?, ?)", filas)
+    except Exception as e:
+        logger.warning(f"No se pudieron registrar {len(filas)} cambios de inventario ({origen}): {e}")
+
+
+def changes_since(cursor_id=0, sucursal=None, limite=CAMBIOS_LIMITE_LECTURA, existing_conn=None):
+    """
+    Eventos con id > cursor_id (de la sucursal indicada o de todas), en orden.
+    Retorna (nuevo_cursor, [ {id, sucursal, sku, ubicacion, paquete, delta, origen, creado_en} ]).
+    Si la lista trae 'limite' eventos puede haber más: volver a llamar con el nuevo cursor.
+    Ante un error retorna (cursor_id, []) para que el lector reintente después.
+    Sin estado no ve los eventos confirmados tarde con id <= cursor_id: un lector que
+    mantiene caché usa LectorCambios.
+    """
+    sql = f"SELECT {', '.join(_COLUMNAS_CAMBIO)} FROM cambios_inventario WHERE id > ?"
+    params = [int(cursor_id or 0)]
+    if sucursal:
+        sql += " AND sucursal = ?"
+        params.append(sucursal.upper())
+    sql += f" ORDER BY id LIMIT {int(limite)}"
+    try:
+        with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+            run_query(cursor, sql, tuple(params))
+            filas = cursor.fetchall()
+    except Exception as e:
+        logger.warning(f"No se pudo leer el feed de cambios: {e}")
+        return cursor_id, []
+
+    eventos = [dict(zip(_COLUMNAS_CAMBIO, fila)) for fila in filas]
+    return (eventos[-1]['id'] if eventos else cursor_id), eventos
+
+
+def ultimo_cambio(existing_conn=None):
+    """
+    Id del último evento (0 si no hay, None si falla la lectura): cursor inicial
+    de un lector que no necesita el histórico.
+    """
+    try:
+        with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+            run_query(cursor, "SELECT MAX(id) FROM cambios_inventario")
+            fila = cursor.fetchone()
+            return fila[0] if fila and fila[0] else 0
+    except Exception as e:
+        logger.warning(f"No se pudo leer el último cambio: {e}")
+        return None
+
+
+def purgar_cambios(dias=CAMBIOS_RETENCION_DIAS, existing_conn=None):
+    """Borra eventos más viejos que 'dias'. Un lector con un cursor anterior debe recargar completo."""
+    try:
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            # creado_en lo pone la BD: se compara con su propio reloj
+            return run_query(cursor, f"DELETE FROM cambios_inventario WHERE creado_en < {sql_hace_segundos(dias * 86400)}")
+    except Exception as e:
+        logger.warning(f"No se pudieron purgar los cambios de inventario: {e}")
+        return 0
+
+
+def _texto_fecha(valor):
+    """creado_en como texto comparable (MySQL devuelve datetime, SQLite texto)."""
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    return str(valor)[:19] if valor else None
+
+
+class LectorCambios:
+    """
+    Lector con estado del feed que no pierde los eventos confirmados fuera de orden de id.
+
+    Cada lectura trae los id > cursor y relee los eventos con id <= cursor creados dentro
+    de los CAMBIOS_SOLAPE_SEG anteriores al último evento visto (hora de la BD): los que
+    aún no había entregado (confirmados tarde) se entregan, el resto se descarta.
+    La primera lectura solo toma la posición actual del feed, sin entregar el histórico.
+    """
+
+    def __init__(self, sucursal=None, solape_seg=CAMBIOS_SOLAPE_SEG):
+        self.sucursal = (sucursal or '').upper() or None
+        self.solape_seg = solape_seg
+        self.cursor = None        # mayor id visto (None: sin posición todavía)
+        self._marca = None        # mayor creado_en visto
+        self._vistos = {}         # id -> creado_en de los eventos entregados dentro de la ventana
+
+    def _desde(self, marca):
+        return (datetime.strptime(marca, '%Y-%m-%d %H:%M:%S') - timedelta(seconds=self.solape_seg)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def leer(self, limite=CAMBIOS_LIMITE_LECTURA, existing_conn=None):
+        """
+        Eventos nuevos y tardíos, en orden de id. Si hay 'limite' nuevos puede haber más:
+        volver a llamar. Ante un error retorna [] y conserva el estado para reintentar.
+        """
+        filtro, extra = (" AND sucursal = ?", (self.sucursal,)) if self.sucursal else ("", ())
+        columnas = ', '.join(_COLUMNAS_CAMBIO)
+        cursor_id, marca = self.cursor, self._marca
+        try:
+            with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+                iniciando = cursor_id is None
+                if iniciando:
+                    run_query(cursor, "SELECT MAX(id), MAX(creado_en) FROM cambios_inventario")
+                    fila = cursor.fetchone() or (None, None)
+                    cursor_id, marca = fila[0] or 0, _texto_fecha(fila[1])
+                    nuevos = []
+                else:
+                    run_query(cursor, f"SELECT {columnas} FROM cambios_inventario WHERE id > ?{filtro} ORDER BY id LIMIT {int(limite)}",
+                              (cursor_id,) + extra)
+                    nuevos = [dict(zip(_COLUMNAS_CAMBIO, f)) for f in cursor.fetchall()]
+                    marcas = [m for m in [marca] + [_texto_fecha(e['creado_en']) for e in nuevos] if m]
+                    marca = max(marcas) if marcas else None
+                ventana = []
+                if marca:
+                    run_query(cursor, f"SELECT {columnas} FROM cambios_inventario WHERE creado_en >= ? AND id <= ?{filtro}",
+                              (self._desde(marca), cursor_id) + extra)
+                    ventana = [dict(zip(_COLUMNAS_CAMBIO, f)) for f in cursor.fetchall()]
+        except Exception as e:
+            logger.warning(f"No se pudo leer el feed de cambios: {e}")
+            return []
+
+        tardios = [e for e in ventana if e['id'] not in self._vistos]
+        if tardios and not iniciando:
+            logger.debug(f"[CAMBIOS] {len(tardios)} eventos confirmados fuera de orden de id")
+        for evento in tardios + nuevos:
+            self._vistos[evento['id']] = _texto_fecha(evento['creado_en']) or marca
+        if marca:
+            desde = self._desde(marca)
+            self._vistos = {i: c for i, c in self._vistos.items() if c and c >= desde}
+        self.cursor = max([cursor_id] + [e['id'] for e in nuevos])
+        self._marca = marca
+        if iniciando:
+            return []
+        return sorted(tardios + nuevos, key=lambda e: e['id'])
+
+
+class DifusorCambios:
+    """
+    Un solo hilo por proceso lee el feed y reparte los eventos nuevos a los suscriptores
+    (clientes SSE del portal, servicios del escritorio). El hilo arranca con el primer
+    suscriptor y se detiene cuando no queda ninguno.
+
+    Los callbacks reciben una lista de eventos y corren en el hilo del difusor:
+    deben ser rápidos (encolar, o after() en Tk).
+    """
+
+    _instancia = None
+    _lock_instancia = threading.Lock()
+
+    @classmethod
+    def obtener(cls):
+        with cls._lock_instancia:
+            if cls._instancia is None:
+                cls._instancia = cls()
+            return cls._instancia
+
+    def __init__(self, intervalo=DIFUSION_INTERVALO_SEG):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._suscriptores = {}   # token -> (sucursal o None, callback)
+        self._tokens = itertools.count(1)
+        self._hilo = None
+        self.lector = None        # LectorCambios del hilo (None mientras no hay suscriptores)
+
+    def suscribir(self, callback, sucursal=None):
+        """Registra 'callback(eventos)' (solo de 'sucursal' si se indica). Retorna el token para desuscribir."""
+        with self._lock:
+            token = next(self._tokens)
+            self._suscriptores[token] = ((sucursal or '').upper() or None, callback)
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, daemon=True, name="difusor-cambios")
+                self._hilo.start()
+        return token
+
+    def desuscribir(self, token):
+        with self._lock:
+            self._suscriptores.pop(token, None)
+
+    def _bucle(self):
+        while True:
+            with self._lock:
+                if not self._suscriptores:
+                    # Sin nadie escuchando no se acumula: el próximo arranque parte del último id
+                    self._hilo = None
+                    self.lector = None
+                    return
+            if self.lector is None:
+                self.lector = LectorCambios()
+            eventos = self.lector.leer()
+            if eventos:
+                self._repartir(eventos)
+            if len(eventos) < CAMBIOS_LIMITE_LECTURA:
+                time.sleep(self.intervalo)
+
+    def _repartir(self, eventos):
+        with self._lock:
+            suscriptores = list(self._suscriptores.values())
+        for sucursal, callback in suscriptores:
+            propios = [e for e in eventos if sucursal is None or e['sucursal'] == sucursal]
+            if not propios:
+                continue
+            try:
+                callback(propios)
+            except Exception as e:
+                logger.warning(f"Suscriptor de cambios falló: {e}")
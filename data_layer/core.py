@@ -17,7 +17,7 @@ from utils.logger import get_logger
 logger = get_logger(__name__)
 from utils.validators import validate_sku, validate_quantity, validate_date, validate_movil, validate_tipo_movimiento, validate_observaciones, ValidationError
 from config import DATABASE_NAME, DB_TYPE, MYSQL_HOST, MYSQL_USER, MYSQL_PASS, MYSQL_DB, MYSQL_PORT, MOVILES_DISPONIBLES, MOVILES_SANTIAGO, UBICACION_DESCARTE, TIPO_MOVIMIENTO_DESCARTE, TIPOS_CONSUMO, TIPOS_ABASTO, PAQUETES_MATERIALES, PRODUCTOS_INICIALES, MATERIALES_COMPARTIDOS
-from utils.db_connector import get_db_connection, close_connection, db_session, run_query
+from utils.db_connector import get_db_connection, close_connection, db_session, run_query, run_many
 
 try:
     from tkinter import messagebox
@@ -44,6 +44,90 @@ def safe_messagebox(title, message, type="error"):
         logger.warning(f"[{title.upper()}] {message}")
 
 
+
+# ─────────────────────────────────────────────────────────
+# VERSIONES DE INVENTARIO POR MÓVIL
+# ─────────────────────────────────────────────────────────
+CLAVE_VERSION_GLOBALES = '__GLOBALES__'
+CLAVE_VERSION_SUCURSAL = '__SUCURSAL__'
+
+def marcar_inventario_movil(cursor, sucursal, moviles=(), globales=False):
+    """
+    Incrementa el contador de versión de los móviles indicados (y, si 'globales',
+    el de los productos globales de la sucursal) dentro de la transacción del llamador.
+    Invalida los snapshots de /api/inventario/<movil> sin tocarlos.
+    El contador general de la sucursal sube siempre (caché de páginas del portal).
+    """
+    claves = {str(m).strip().upper() for m in moviles if m and str(m).strip()}
+    claves.add(CLAVE_VERSION_SUCURSAL)
+    if globales:
+        claves.add(CLAVE_VERSION_GLOBALES)
+    if DB_TYPE == 'MYSQL':
+        sql = "INSERT INTO inventario_movil_version (clave, sucursal, version) VALUES (?, ?, 1) ON DUPLICATE KEY UPDATE version = version + 1"
+    else:
+        sql = "INSERT INTO inventario_movil_version (clave, sucursal, version) VALUES (?, ?, 1) ON CONFLICT(clave, sucursal) DO UPDATE SET version = version + 1"
+    try:
+        run_many(cursor, sql, [(c, (sucursal or 'CHIRIQUI').upper()) for c in sorted(claves)])
+    except Exception as e:
+        # Nunca bloquear la escritura de negocio: el snapshot expira por TTL
+        logger.warning(f"No se pudo versionar inventario de {sorted(claves)}: {e}")
+
+
+def obtener_version_sucursal(sucursal, target_db=None, clave=CLAVE_VERSION_SUCURSAL, existing_conn=None):
+    """
+    Versión general de datos de la sucursal (0 si nunca hubo escrituras, None si falla la lectura).
+    Con 'clave' se lee otro contador de la sucursal (p. ej. CLAVE_VERSION_GLOBALES).
+    """
+    try:
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            run_query(cursor, "SELECT version FROM inventario_movil_version WHERE clave = ? AND sucursal = ?",
+                      (clave, (sucursal or 'CHIRIQUI').upper()))
+            fila = cursor.fetchone()
+            return fila[0] if fila else 0
+    except Exception as e:
+        logger.warning(f"No se pudo leer la versión de {sucursal}: {e}")
+        return None
+
+
+# Tabla de idempotencia del portal. Los workers del web server no ejecutan inicializar_bd, por eso
+# también la crea bajo demanda (ver asegurar_tabla_envios en mobile.py).
+SQL_TABLA_ENVIOS_PORTAL = """
+    CREATE TABLE IF NOT EXISTS envios_portal (
+        clave VARCHAR(64) NOT NULL PRIMARY KEY,
+        ruta VARCHAR(50) NOT NULL,
+        respuesta TEXT,
+        creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Trabajos en segundo plano del portal (ver data_layer/jobs.py); misma creación bajo demanda
+SQL_TABLA_TRABAJOS_PORTAL = """
+    CREATE TABLE IF NOT EXISTS trabajos_portal (
+        id VARCHAR(36) NOT NULL PRIMARY KEY,
+        tipo VARCHAR(50) NOT NULL,
+        estado VARCHAR(20) NOT NULL DEFAULT 'PENDIENTE',
+        progreso INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        resultado LONGTEXT,
+        error TEXT,
+        creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        actualizado_en DATETIME
+    )
+"""
+
+
+def sql_hace_segundos(segundos):
+    """
+    Expresión SQL del instante 'ahora menos N segundos' según el reloj de la BD.
+    Para comparar columnas con DEFAULT CURRENT_TIMESTAMP sin depender de la zona
+    horaria del proceso (TiDB en UTC, escritorio en hora local). En SQLite ambos son UTC.
+    """
+    segundos = int(segundos)
+    if DB_TYPE == 'MYSQL':
+        return f"(CURRENT_TIMESTAMP - INTERVAL {segundos} SECOND)"
+    return f"datetime('now', '-{segundos} seconds')"
+
+
 def _get_sql_types():
     """Retorna tipos SQL compatibles según el motor de BD configurado."""
     return {
@@ -67,12 +151,14 @@ def _make_column_helpers(cursor):
             cursor.execute(f"SHOW COLUMNS FROM {table}")
             cols = [r[0] for r in cursor.fetchall()]
         else:
-            cursor.execute(f"PRAGMA table_info({table})")
+            # table_xinfo incluye las columnas generadas (table_info las oculta)
+            cursor.execute(f"PRAGMA table_xinfo({table})")
             cols = [r[1] for r in cursor.fetchall()]
         _cache[table] = cols
         return cols
 
-    def add_col(table, column, col_type, default=None):
+    def add_col(table, column, col_type, default=None, critica=False):
+        """Con 'critica' un fallo se propaga: la migración no queda registrada y se reintenta."""
         try:
             if column not in _get_cols(table):
                 sql = f"ALTER TABLE {table} ADD COLUMN {column} {col_type}"
@@ -82,10 +168,12 @@ def _make_column_helpers(cursor):
                 logger.info(f"Columna '{column}' añadida a '{table}'")
                 _cache.pop(table, None)
         except Exception as e:
+            if critica:
+                raise
             logger.warning(f"add_col({table}.{column}): {e}")
 
-    def add_idx(name, table, cols):
-        """Añade un índice MySQL de forma segura e idempotente."""
+    def add_idx(name, table, cols, critica=False):
+        """Añade un índice MySQL de forma segura e idempotente ('critica' igual que en add_col)."""
         if DB_TYPE != 'MYSQL':
             return
         import re
@@ -95,6 +183,8 @@ def _make_column_helpers(cursor):
             cursor.execute(f"CREATE INDEX {name} ON {table}({cols})")
         except Exception as e:
             if "1061" not in str(e) and "Duplicate" not in str(e):
+                if critica:
+                    raise
                 logger.warning(f"Indice {name} en {table}: {e}")
 
     return add_col, add_idx
@@ -289,6 +379,31 @@ def _crear_tablas(cursor, T):
             cursor.execute(f"CREATE TABLE IF NOT EXISTS series_registradas (id {INT} PRIMARY KEY {AUTOINC}, sku VARCHAR(50) NOT NULL, serial_number VARCHAR(100) NOT NULL)")
         except Exception: pass
 
+    # Snapshot de inventario por móvil (API de técnicos) y sus contadores de versión
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS inventario_movil_version (
+            clave VARCHAR(100) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (clave, sucursal)
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS inventario_movil_snapshot (
+            movil VARCHAR(100) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            version_movil INTEGER NOT NULL DEFAULT 0,
+            version_globales INTEGER NOT NULL DEFAULT 0,
+            payload {LONGTEXT},
+            generado_en DATETIME,
+            PRIMARY KEY (movil, sucursal)
+        )
+    """)
+
+    # Claves de idempotencia de los envíos del portal (cola offline) y trabajos en segundo plano
+    cursor.execute(SQL_TABLA_ENVIOS_PORTAL)
+    cursor.execute(SQL_TABLA_TRABAJOS_PORTAL)
+
     # productos_globales (NUEVO)
     cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS productos_globales (
@@ -376,6 +491,11 @@ def _ejecutar_migraciones(cursor, T, add_col):
     add_col('series_registradas', 'estado',   'VARCHAR(50)', "'DISPONIBLE'")
     try: run_query(cursor, "UPDATE series_registradas SET sucursal = 'CHIRIQUI' WHERE sucursal IS NULL")
     except Exception: pass
+    # Columnas normalizadas para búsquedas por escáner (indexables, sin UPPER() en el WHERE).
+    # Son generadas por el motor: quedan al día en cualquier INSERT/UPDATE, incluso de clientes antiguos.
+    # Críticas: todas las búsquedas de series las usan, si fallan la versión 1 no se registra.
+    add_col('series_registradas', 'serial_norm', "VARCHAR(100) GENERATED ALWAYS AS (UPPER(TRIM(serial_number))) VIRTUAL", critica=True)
+    add_col('series_registradas', 'mac_norm',    "VARCHAR(100) GENERATED ALWAYS AS (UPPER(TRIM(mac_number))) VIRTUAL", critica=True)
     if DB_TYPE == 'MYSQL':
         try:
             cursor.execute("SHOW CREATE TABLE series_registradas")
@@ -389,6 +509,26 @@ def _ejecutar_migraciones(cursor, T, add_col):
                 cursor.execute("ALTER TABLE series_registradas ADD UNIQUE KEY mac_sucursal (mac_number, sucursal)")
         except Exception: pass
 
+    # Marca de última modificación: permite sincronizar incrementalmente el índice de escaneo
+    for tabla in ('series_registradas', 'productos'):
+        if DB_TYPE == 'MYSQL':
+            add_col(tabla, 'actualizado_en', 'TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP', critica=True)
+        else:
+            # SQLite no admite ON UPDATE ni DEFAULT no constante en ALTER TABLE: se mantiene con triggers
+            add_col(tabla, 'actualizado_en', 'DATETIME', critica=True)
+            try:
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{tabla}_actualizado_ins AFTER INSERT ON {tabla}
+                    BEGIN UPDATE {tabla} SET actualizado_en = CURRENT_TIMESTAMP WHERE id = NEW.id; END
+                """)
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{tabla}_actualizado_upd AFTER UPDATE ON {tabla}
+                    WHEN NEW.actualizado_en IS OLD.actualizado_en
+                    BEGIN UPDATE {tabla} SET actualizado_en = CURRENT_TIMESTAMP WHERE id = NEW.id; END
+                """)
+            except Exception as e:
+                logger.warning(f"Triggers actualizado_en en {tabla}: {e}")
+
     # faltantes_registrados — columna paquete
     try:
         if DB_TYPE == 'MYSQL':
@@ -408,6 +548,10 @@ def _ejecutar_migraciones(cursor, T, add_col):
 # ─────────────────────────────────────────────────────────
 # ETAPA 3 — Índices de rendimiento
 # ─────────────────────────────────────────────────────────
+# Sin estos, cada búsqueda de serie recorre la tabla completa: un fallo no registra la versión
+_INDICES_CRITICOS = ('idx_series_serial_norm', 'idx_series_mac_norm')
+
+
 def _actualizar_indices(cursor, add_idx):
     """Crea índices de rendimiento para las tablas de mayor consulta (No bloqueante)."""
     if DB_TYPE == 'MYSQL':
@@ -430,10 +574,16 @@ def _actualizar_indices(cursor, add_idx):
             ("idx_cons_movil", "consumos_pendientes", "movil"),
             ("idx_series_serial", "series_registradas", "serial_number"),
             ("idx_series_sku", "series_registradas", "sku"),
+            ("idx_series_serial_norm", "series_registradas", "serial_norm, sucursal, ubicacion"),
+            ("idx_series_mac_norm", "series_registradas", "mac_norm, sucursal, ubicacion"),
+            ("idx_series_actualizado", "series_registradas", "actualizado_en"),
+            ("idx_productos_actualizado", "productos", "actualizado_en"),
         ]
         for name, table, cols in indices:
             try: cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({cols})")
-            except Exception: pass
+            except Exception:
+                if name in _INDICES_CRITICOS:
+                    raise
     else:
         add_idx('idx_productos_sku',            'productos',            'sku')
         add_idx('idx_productos_codigo_maestro', 'productos',            'codigo_barra_maestro')
@@ -447,6 +597,10 @@ def _actualizar_indices(cursor, add_idx):
         add_idx('idx_cons_movil',               'consumos_pendientes',  'movil')
         add_idx('idx_series_serial',            'series_registradas',   'serial_number')
         add_idx('idx_series_sku',               'series_registradas',   'sku')
+        add_idx('idx_series_serial_norm',       'series_registradas',   'serial_norm, sucursal, ubicacion', critica=True)
+        add_idx('idx_series_mac_norm',          'series_registradas',   'mac_norm, sucursal, ubicacion', critica=True)
+        add_idx('idx_series_actualizado',       'series_registradas',   'actualizado_en')
+        add_idx('idx_productos_actualizado',    'productos',            'actualizado_en')
 
     logger.info("Etapa 3 completada: indices de rendimiento verificados.")
 
@@ -455,28 +609,241 @@ def _actualizar_indices(cursor, add_idx):
 # ETAPA 4 — Poblar móviles iniciales
 # ─────────────────────────────────────────────────────────
 def _poblar_moviles(cursor):
-    """Asegura que todos los móviles configurados existan (Operación ligera)."""
+    """Asegura que todos los móviles configurados existan (Operación ligera). Un fallo se propaga."""
+    from config import ALL_MOVILES
+    if not ALL_MOVILES: return
+    if DB_TYPE == 'MYSQL':
+        placeholders = ", ".join(["(%s, 1)"] * len(ALL_MOVILES))
+        cursor.execute(f"INSERT IGNORE INTO moviles (nombre, activo) VALUES {placeholders}", tuple(ALL_MOVILES))
+    else:
+        for mv in ALL_MOVILES:
+            run_query(cursor, "INSERT OR IGNORE INTO moviles (nombre, activo) VALUES (?, 1)", (mv,))
+    logger.info("Etapa 4 completada: moviles verificados.")
+
+
+# ─────────────────────────────────────────────────────────
+# ETAPA 5 — Registro de migraciones versionadas
+# ─────────────────────────────────────────────────────────
+# 'checksum' queda por compatibilidad con las tablas ya creadas (NOT NULL): se escribe vacío.
+# Una versión se identifica solo por su número; el cuerpo de una migración aplicada no se revisa.
+SQL_TABLA_SCHEMA_VERSION = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER NOT NULL PRIMARY KEY,
+        descripcion VARCHAR(255),
+        checksum VARCHAR(40) NOT NULL DEFAULT '',
+        aplicado_en DATETIME
+    )
+"""
+
+
+# Candado de MySQL que serializa las migraciones entre procesos (escritorio, portal, scripts)
+MIGRACIONES_LOCK = 'stockware_migraciones'
+MIGRACIONES_LOCK_ESPERA_SEG = 120
+
+
+def _migracion_esquema_base(cursor, T, add_col, add_idx):
+    """
+    Etapas 1-4 (idempotentes). Los cambios nuevos de esquema van en una versión nueva.
+    Un fallo de una columna/índice crítico o de los móviles se propaga: la versión no se
+    registra y el próximo arranque la repite completa.
+    """
+    _crear_tablas(cursor, T)
+    crear_tablas_auditoria() # NUEVO: Módulo de Auditoría independiente
+    _ejecutar_migraciones(cursor, T, add_col)
+    _actualizar_indices(cursor, add_idx)
+    _poblar_moviles(cursor)
+
+
+def _migracion_catalogo_productos(cursor, T, add_col, add_idx):
+    """Catálogo de productos en BD (antes constantes de config.py), sembrado desde config."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo_productos (
+            sku VARCHAR(50) NOT NULL PRIMARY KEY,
+            nombre_excel VARCHAR(100),
+            con_serial INTEGER NOT NULL DEFAULT 0,
+            compartido INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo_paquetes (
+            paquete VARCHAR(50) NOT NULL,
+            sku VARCHAR(50) NOT NULL,
+            cantidad INTEGER NOT NULL DEFAULT 0,
+            orden INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (paquete, sku)
+        )
+    """)
+    from data_layer.catalog import sembrar_catalogo
+    sembrar_catalogo(cursor)
+
+
+def _migracion_cambios_inventario(cursor, T, add_col, add_idx):
+    """Outbox de cambios de stock (feed incremental para dashboard, analítica y portal)."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS cambios_inventario (
+            id {T['INT']} {T['AUTOINC']} PRIMARY KEY,
+            sucursal VARCHAR(50) NOT NULL,
+            sku VARCHAR(50) NOT NULL,
+            ubicacion VARCHAR(100) NOT NULL,
+            paquete VARCHAR(50),
+            delta INTEGER NOT NULL,
+            origen VARCHAR(30),
+            creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    add_idx('idx_cambios_creado', 'cambios_inventario', 'creado_en')
+
+
+def _migracion_saldos_movimientos(cursor, T, add_col, add_idx):
+    """Saldos acumulados de consumo/abasto por (sku, sucursal), poblados desde movimientos."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS saldos_movimientos (
+            sku VARCHAR(50) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            consumo_total INTEGER NOT NULL DEFAULT 0,
+            abasto_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sku, sucursal)
+        )
+    """)
+    from data_layer.ledger import reconstruir_saldos
+    reconstruir_saldos(cursor)
+
+
+def _migracion_resumen_diario(cursor, T, add_col, add_idx):
+    """Resumen diario de movimientos por (fecha, sucursal, sku, móvil, tipo), poblado desde movimientos."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resumen_diario_movimientos (
+            fecha DATE NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            sku VARCHAR(50) NOT NULL,
+            movil VARCHAR(100) NOT NULL DEFAULT '',
+            tipo_movimiento VARCHAR(50) NOT NULL,
+            cantidad INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, sucursal, sku, movil, tipo_movimiento)
+        )
+    """)
+    from data_layer.ledger import reconstruir_resumen_diario
+    reconstruir_resumen_diario(cursor)
+
+
+def _migracion_consumo_series(cursor, T, add_col, add_idx):
+    """Enlace consumo/movimiento -> serie normalizada, poblado desde seriales_usados y observaciones."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS consumo_series (
+            id {T['INT']} {T['AUTOINC']} PRIMARY KEY,
+            consumo_id INTEGER,
+            movimiento_id INTEGER,
+            serial_norm VARCHAR(100) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL
+        )
+    """)
+    if DB_TYPE == 'MYSQL':
+        add_idx('idx_consumo_series_serial', 'consumo_series', 'serial_norm, sucursal')
+        add_idx('idx_consumo_series_consumo', 'consumo_series', 'consumo_id')
+    else:
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_consumo_series_serial ON consumo_series(serial_norm, sucursal)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_consumo_series_consumo ON consumo_series(consumo_id)")
+    from data_layer.serials import backfill_consumo_series
+    backfill_consumo_series(cursor)
+
+
+def _migracion_indice_historial(cursor, T, add_col, add_idx):
+    """Índice de tokens del historial de movimientos, poblado desde todo el historial."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS movimientos_tokens (
+            sucursal VARCHAR(50) NOT NULL,
+            token VARCHAR(100) NOT NULL,
+            movimiento_id INTEGER NOT NULL,
+            PRIMARY KEY (sucursal, token, movimiento_id)
+        )
+    """)
+    if DB_TYPE == 'MYSQL':
+        add_idx('idx_movimientos_tokens_mov', 'movimientos_tokens', 'movimiento_id')
+    else:
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_tokens_mov ON movimientos_tokens(movimiento_id)")
+    from data_layer.search import reconstruir_indice
+    reconstruir_indice(cursor)
+
+
+# Registro ORDENADO: (versión, descripción, función(cursor, T, add_col, add_idx)).
+# Una versión aplicada no se vuelve a ejecutar: los cambios nuevos (aunque corrijan
+# una migración anterior) se agregan al final con la siguiente versión.
+MIGRACIONES_ESQUEMA = [
+    (1, "Esquema base: tablas, columnas, índices y móviles", _migracion_esquema_base),
+    (2, "Catálogo de productos y paquetes", _migracion_catalogo_productos),
+    (3, "Outbox de cambios de inventario", _migracion_cambios_inventario),
+    (4, "Saldos acumulados de movimientos", _migracion_saldos_movimientos),
+    (5, "Resumen diario de movimientos", _migracion_resumen_diario),
+    (6, "Enlace de consumos con series", _migracion_consumo_series),
+    (7, "Índice de búsqueda del historial", _migracion_indice_historial),
+]
+
+
+def _leer_schema_version(cursor):
     try:
-        from config import ALL_MOVILES
-        if not ALL_MOVILES: return
-        if DB_TYPE == 'MYSQL':
-            placeholders = ", ".join(["(%s, 1)"] * len(ALL_MOVILES))
-            cursor.execute(f"INSERT IGNORE INTO moviles (nombre, activo) VALUES {placeholders}", tuple(ALL_MOVILES))
-        else:
-            for mv in ALL_MOVILES:
-                try: run_query(cursor, "INSERT OR IGNORE INTO moviles (nombre, activo) VALUES (?, 1)", (mv,))
-                except Exception: pass
-        logger.info("Etapa 4 completada: moviles verificados.")
-    except Exception as e:
-        logger.warning(f"Etapa 4 no critica: {e}")
+        run_query(cursor, "SELECT version FROM schema_version")
+        return {int(f[0]) for f in cursor.fetchall()}
+    except Exception:
+        cursor.execute(SQL_TABLA_SCHEMA_VERSION)
+        return set()
+
+
+def _aplicar_migraciones_pendientes(conn, cursor, registro=None):
+    """
+    Lee schema_version (una consulta) y ejecuta solo las versiones que faltan, confirmando
+    cada una por separado. Retorna las versiones aplicadas.
+    Una versión ya aplicada nunca se repite (sus backfills tampoco). Si una migración
+    falla se propaga la excepción sin registrarla. En MySQL las aplica un solo proceso
+    a la vez (GET_LOCK).
+    """
+    registro = sorted(MIGRACIONES_ESQUEMA if registro is None else registro, key=lambda m: m[0])
+    aplicadas = _leer_schema_version(cursor)
+    if all(version in aplicadas for version, _, _ in registro):
+        return []
+
+    bloqueado = False
+    if DB_TYPE == 'MYSQL':
+        run_query(cursor, "SELECT GET_LOCK(?, ?)", (MIGRACIONES_LOCK, MIGRACIONES_LOCK_ESPERA_SEG))
+        fila = cursor.fetchone()
+        if not fila or fila[0] != 1:
+            raise RuntimeError("Otro proceso está aplicando migraciones; se reintentará en el próximo arranque.")
+        bloqueado = True
+    try:
+        # Releer bajo el candado: otro proceso pudo aplicarlas mientras esperábamos
+        aplicadas = _leer_schema_version(cursor)
+        pendientes = [m for m in registro if m[0] not in aplicadas]
+
+        T = _get_sql_types()
+        add_col, add_idx = _make_column_helpers(cursor)
+        for version, descripcion, funcion in pendientes:
+            inicio = datetime.now()
+            try:
+                funcion(cursor, T, add_col, add_idx)
+                run_query(cursor, "INSERT INTO schema_version (version, descripcion, checksum, aplicado_en) VALUES (?, ?, '', ?)",
+                          (version, descripcion, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Migración {version} ({descripcion}) falló, no se registra y se reintentará: {e}")
+                raise
+            conn.commit()
+            logger.info(f"Migración {version} aplicada ({descripcion}) en {(datetime.now() - inicio).total_seconds():.1f}s")
+        return [m[0] for m in pendientes]
+    finally:
+        if bloqueado:
+            try:
+                run_query(cursor, "SELECT RELEASE_LOCK(?)", (MIGRACIONES_LOCK,))
+                cursor.fetchall()
+            except Exception as e:
+                logger.warning(f"No se pudo liberar el candado de migraciones: {e}")
 
 
 # ─────────────────────────────────────────────────────────
 # PUNTO DE ENTRADA PÚBLICO
 # ─────────────────────────────────────────────────────────
-def inicializar_bd():
+def inicializar_bd(mostrar_errores=True):
     """
     Orquesta la inicialización completa de la base de datos (Resiliente).
+    Con el esquema al día solo cuesta una lectura de schema_version.
     Si ocurre un error de conexión, informa al usuario sin colgar la App.
     """
     conn = None
@@ -484,36 +851,24 @@ def inicializar_bd():
         conn = get_db_connection()
         cursor = conn.cursor(buffered=True) if DB_TYPE == 'MYSQL' else conn.cursor()
 
-        T = _get_sql_types()
-        add_col, add_idx = _make_column_helpers(cursor)
-
-        # Ejecución por etapas (Optimizado)
-        _crear_tablas(cursor, T)
-        crear_tablas_auditoria() # NUEVO: Módulo de Auditoría independiente
-        _ejecutar_migraciones(cursor, T, add_col)
-        
-        # Etapas no críticas que pueden fallar por red lenta
-        try: _actualizar_indices(cursor, add_idx)
-        except Exception as e: logger.warning(f"Indices: {e}")
-        
-        try: _poblar_moviles(cursor)
-        except Exception as e: logger.warning(f"Moviles: {e}")
-
-        conn.commit()
-        logger.info("Base de datos inicializada correctamente.")
+        aplicadas = _aplicar_migraciones_pendientes(conn, cursor)
+        if aplicadas:
+            logger.info(f"Base de datos inicializada correctamente (migraciones {aplicadas}).")
+        else:
+            logger.info("Esquema al día: se omite la inicialización.")
         return True
 
     except Exception as e:
         engine = "MySQL" if DB_TYPE == 'MYSQL' else "SQLite"
         logger.error(f"Error critico en inicializar_bd: {e}")
-        safe_messagebox("Error de Inicio", f"Error de {engine} al inicializar la base de datos:\n\n{e}\n\nVerifique su conexión.")
+        if mostrar_errores:
+            safe_messagebox("Error de Inicio", f"Error de {engine} al inicializar la base de datos:\n\n{e}\n\nVerifique su conexión.")
         return False
     finally:
         if conn:
             close_connection(conn)
 
 
-
 def poblar_datos_iniciales():
     """Inserta los productos de la lista inicial si no existen, con stock 0, solo en BODEGA."""
     conn = None
@@ -548,6 +903,8 @@ def poblar_datos_iniciales():
                     
                     sql_mov = "INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, movil_afectado, fecha_evento, paquete_asignado, sucursal) VALUES (?, ?, ?, ?, ?, ?, ?)"
                     run_query(cursor, sql_mov, (sku, 'INICIAL (0)', 0, None, fecha_hoy, None, suc))
+                    from data_layer.search import indexar_ids
+                    indexar_ids(cursor, [cursor.lastrowid])
                     inserted_count += 1
                 
         conn.commit()
@@ -569,7 +926,14 @@ def crear_respaldo_bd(dest_path):
         if not os.path.exists(DATABASE_NAME):
             return False, "La base de datos original no existe."
             
-        shutil.copy2(DATABASE_NAME, dest_path)
+        # API de respaldo de SQLite: en modo WAL la copia del archivo omitiría lo que aún está en el -wal
+        origen = sqlite3.connect(DATABASE_NAME)
+        destino = sqlite3.connect(dest_path)
+        try:
+            origen.backup(destino)
+        finally:
+            destino.close()
+            origen.close()
         return True, f"Respaldo creado con éxito en:\n{dest_path}"
     except Exception as e:
         return False, f"Error al crear el respaldo: {str(e)}"
@@ -594,7 +958,12 @@ def limpiar_base_datos():
             'consumos_pendientes',
             'recordatorios_pendientes',
             'prestamos_activos',
-            'series_registradas'
+            'series_registradas',
+            'movimientos_tokens',
+            'saldos_movimientos',
+            'resumen_diario_movimientos',
+            'consumo_series',
+            'cambios_inventario'
         ]
         
         for tabla in tablas_a_limpiar:
@@ -1,6 +1,8 @@
 import os
 import sys
 import csv
+import time
+import threading
 import sqlite3
 import mysql.connector
 from datetime import date
@@ -16,8 +18,12 @@ from utils.validators import validate_sku, validate_quantity, validate_date, val
 from config import DATABASE_NAME, DB_TYPE, MYSQL_HOST, MYSQL_USER, MYSQL_PASS, MYSQL_DB, MYSQL_PORT, MOVILES_DISPONIBLES, MOVILES_SANTIAGO, UBICACION_DESCARTE, TIPO_MOVIMIENTO_DESCARTE, TIPOS_CONSUMO, TIPOS_ABASTO, PAQUETES_MATERIALES, PRODUCTOS_INICIALES, MATERIALES_COMPARTIDOS
 from utils.db_connector import get_db_connection, close_connection, db_session
 
-from data_layer.core import run_query, safe_messagebox
+from data_layer.core import run_query, safe_messagebox, marcar_inventario_movil
 from data_layer.movements import sincronizar_stock_bodega_serializado
+from data_layer.ledger import acumular_movimientos, consultar_total_por_sku
+from data_layer.serials import buscar_consumo_de_serie
+from data_layer.search import indexar_ids
+from data_layer.replica import conexion_lectura, sesion_lectura
 
 def limpiar_productos_duplicados():
     """Elimina productos duplicados manteniendo el registro más reciente"""
@@ -70,23 +76,53 @@ def limpiar_productos_duplicados():
 # GESTIÓN DE PRODUCTOS GLOBALES (NUEVO)
 # ─────────────────────────────────────────────────────────
 
-def obtener_skus_globales(sucursal=None):
-    """Retorna una lista de SKUs marcados como globales para la sucursal actual."""
-    conn = None
+# Caché de proceso del conjunto global por sucursal: sucursal -> (version, frozenset).
+# 'version' es el contador CLAVE_VERSION_GLOBALES de inventario_movil_version, que suben
+# en su transacción las altas/bajas de globales de cualquier proceso (escritorio o portal):
+# cada lectura compara ese contador (una consulta por clave primaria) y solo relee
+# productos_globales si cambió.
+_globales_lock = threading.Lock()
+_globales_cache = {}
+
+def invalidar_cache_globales(sucursal=None):
+    """Descarta la caché de SKUs globales de este proceso (de una sucursal o de todas)."""
+    with _globales_lock:
+        if sucursal:
+            _globales_cache.pop(sucursal, None)
+        else:
+            _globales_cache.clear()
+
+def obtener_skus_globales(sucursal=None, existing_conn=None):
+    """
+    Retorna una lista de SKUs marcados como globales para la sucursal actual.
+    Se sirve desde la caché de proceso mientras la versión de globales en BD no cambie;
+    si se entrega 'existing_conn', se usa esa conexión (nunca se abre una conexión lateral).
+    """
+    from config import CURRENT_CONTEXT
+    from data_layer.core import obtener_version_sucursal, CLAVE_VERSION_GLOBALES
+    if not sucursal:
+        sucursal = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
+
     try:
-        from config import CURRENT_CONTEXT
-        if not sucursal:
-            sucursal = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
-            
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        run_query(cursor, "SELECT sku FROM productos_globales WHERE sucursal = ?", (sucursal,))
-        return [r[0] for r in cursor.fetchall()]
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            # La versión se lee antes que los SKUs: un cambio concurrente nunca queda bajo la versión nueva
+            version = obtener_version_sucursal(sucursal, clave=CLAVE_VERSION_GLOBALES, existing_conn=conn)
+            with _globales_lock:
+                entrada = _globales_cache.get(sucursal)
+            if version is not None and entrada and entrada[0] == version:
+                return list(entrada[1])
+            run_query(cursor, "SELECT sku FROM productos_globales WHERE sucursal = ?", (sucursal,))
+            skus = frozenset(r[0] for r in cursor.fetchall())
     except Exception as e:
         logger.error(f"Error obteniendo SKUs globales: {e}")
-        return []
-    finally:
-        if conn: close_connection(conn)
+        with _globales_lock:
+            entrada = _globales_cache.get(sucursal)
+        return list(entrada[1]) if entrada else []
+
+    if version is not None:
+        with _globales_lock:
+            _globales_cache[sucursal] = (version, skus)
+    return list(skus)
 
 def anadir_producto_global(sku, sucursal=None):
     """Marca un SKU como global para todas las unidades móviles."""
@@ -99,7 +135,9 @@ def anadir_producto_global(sku, sucursal=None):
         conn = get_db_connection()
         cursor = conn.cursor()
         run_query(cursor, "INSERT IGNORE INTO productos_globales (sku, sucursal) VALUES (?, ?)", (sku, sucursal))
+        marcar_inventario_movil(cursor, sucursal, globales=True)
         conn.commit()
+        invalidar_cache_globales(sucursal)
         return True, f"SKU {sku} ahora es Global."
     except Exception as e:
         return False, f"Error al añadir global: {e}"
@@ -117,7 +155,9 @@ def eliminar_producto_global(sku, sucursal=None):
         conn = get_db_connection()
         cursor = conn.cursor()
         run_query(cursor, "DELETE FROM productos_globales WHERE sku = ? AND sucursal = ?", (sku, sucursal))
+        marcar_inventario_movil(cursor, sucursal, globales=True)
         conn.commit()
+        invalidar_cache_globales(sucursal)
         return True, f"SKU {sku} ya no es Global."
     except Exception as e:
         return False, f"Error al eliminar global: {e}"
@@ -153,6 +193,8 @@ def anadir_producto(nombre, sku, cantidad, ubicacion, secuencia_vista, minimo_st
         
         sql_mov = "INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, movil_afectado, fecha_evento, paquete_asignado) VALUES (?, ?, ?, ?, ?, ?)"
         run_query(cursor, sql_mov, (sku, 'ENTRADA (Inicial)', cantidad, None, fecha_evento, None))
+        indexar_ids(cursor, [cursor.lastrowid])
+        acumular_movimientos(cursor, [(sku, 'ENTRADA (Inicial)', cantidad, None, fecha_evento, None)])
         
         conn.commit()
         return True, f"Producto '{nombre}' (SKU: {sku}) añadido exitosamente en {ubicacion}."
@@ -237,7 +279,7 @@ def obtener_todos_los_skus_para_movimiento(target_db=None, sucursal_context=None
     """
     conn = None
     try:
-        conn = get_db_connection(target_db=target_db)
+        conn = conexion_lectura(('productos',), target_db=target_db)
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -296,7 +338,10 @@ def eliminar_producto(sku):
             return False, f"No se encontró ningún producto con el SKU '{sku}'."
             
         run_query(cursor, "DELETE FROM productos WHERE sku = ?", (sku,))
+        run_query(cursor, "DELETE FROM movimientos_tokens WHERE movimiento_id IN (SELECT id FROM movimientos WHERE sku_producto = ?)", (sku,))
         run_query(cursor, "DELETE FROM movimientos WHERE sku_producto = ?", (sku,))
+        run_query(cursor, "DELETE FROM saldos_movimientos WHERE sku = ?", (sku,))
+        run_query(cursor, "DELETE FROM resumen_diario_movimientos WHERE sku = ?", (sku,))
         run_query(cursor, "DELETE FROM asignacion_moviles WHERE sku_producto = ?", (sku,))
         run_query(cursor, "DELETE FROM prestamos_activos WHERE sku = ?", (sku,))
 
@@ -465,39 +510,7 @@ def obtener_historial_producto_para_exportar(sku, fecha_inicio=None, fecha_fin=N
 
 def obtener_reporte_abasto(fecha_inicio, fecha_fin):
     """Obtiene el abasto/entrada total de material (ENTRADA, ABASTO) entre two fechas."""
-    conn = None
-    try:
-        conn = get_db_connection()
-        if DB_TYPE == 'MYSQL':
-            cursor = conn.cursor(buffered=True)
-        else:
-            cursor = conn.cursor()
-        
-        sql_query = f"""
-            SELECT 
-                p.nombre, 
-                m.sku_producto, 
-                SUM(m.cantidad_afectada) AS Abasto_Total
-            FROM movimientos m
-            JOIN productos p ON m.sku_producto = p.sku AND p.ubicacion = 'BODEGA'
-            WHERE 
-                m.tipo_movimiento IN ({', '.join(['?' for _ in TIPOS_ABASTO])}) AND
-                m.fecha_evento BETWEEN ? AND ?
-            GROUP BY 
-                m.sku_producto, p.nombre
-            ORDER BY 
-                p.secuencia_vista ASC
-        """
-        
-        params = TIPOS_ABASTO + [fecha_inicio, fecha_fin]
-        run_query(cursor, sql_query, params)
-        return cursor.fetchall()
-        
-    except Exception as e:
-        logger.error(f"Error al generar reporte de abasto: {e}")
-        return []
-    finally:
-        if conn: close_connection(conn)
+    return consultar_total_por_sku(fecha_inicio, fecha_fin, TIPOS_ABASTO)
 
 def obtener_estadisticas_reales():
     """Obtiene estadísticas reales para el dashboard filtrando por sucursal actual"""
@@ -506,7 +519,7 @@ def obtener_estadisticas_reales():
         from config import CURRENT_CONTEXT
         sucursal_target = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
         
-        conn = get_db_connection()
+        conn = conexion_lectura(('productos', 'asignacion_moviles'))
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -537,13 +550,14 @@ def obtener_estadisticas_reales():
         """, (sucursal_target,))
         stock_total = cursor.fetchone()[0] or 0
         
-        # 4. Préstamos Activos
-        if sucursal_target == 'SANTIAGO':
-            # Solo préstamos hechos en Santiago
-            run_query(cursor, "SELECT COUNT(*) FROM movimientos WHERE tipo_movimiento = 'PRESTAMO_SANTIAGO' AND sucursal = 'SANTIAGO'")
-        else:
-            run_query(cursor, "SELECT COUNT(*) FROM prestamos_activos WHERE estado = 'ACTIVO'")
-        prestamos_activos = cursor.fetchone()[0] or 0
+        # 4. Préstamos Activos (movimientos/prestamos_activos no están en la réplica local)
+        with db_session(solo_lectura=True) as (conn_bd, cursor_bd):
+            if sucursal_target == 'SANTIAGO':
+                # Solo préstamos hechos en Santiago
+                run_query(cursor_bd, "SELECT COUNT(*) FROM movimientos WHERE tipo_movimiento = 'PRESTAMO_SANTIAGO' AND sucursal = 'SANTIAGO'")
+            else:
+                run_query(cursor_bd, "SELECT COUNT(*) FROM prestamos_activos WHERE estado = 'ACTIVO'")
+            prestamos_activos = cursor_bd.fetchone()[0] or 0
         
         # 5. Bajo Stock (Alertar si están por debajo del mínimo configurado)
         run_query(cursor, """
@@ -611,7 +625,7 @@ def buscar_equipo_global(termino, sucursal_context=None):
                 s.estado,
                 s.paquete
             FROM series_registradas s
-            WHERE (UPPER(s.serial_number) = ? OR UPPER(s.mac_number) = ?)
+            WHERE (s.serial_norm = ? OR s.mac_norm = ?)
               AND (UPPER(s.sucursal) = UPPER(?) OR (s.sucursal IS NULL AND UPPER(?) = 'CHIRIQUI'))
         """
         
@@ -632,27 +646,17 @@ def buscar_equipo_global(termino, sucursal_context=None):
         contrato_final = None
         fecha_final = None
         
-        # --- PLAN A: Buscar en consumos_pendientes (Búsqueda Directa por Serial/MAC) ---
-        sql_c = """
-            SELECT movil, COALESCE(NULLIF(TRIM(num_contrato), ''), NULLIF(TRIM(ticket), '')), fecha 
-            FROM consumos_pendientes 
-            WHERE (seriales_usados LIKE ? OR seriales_usados LIKE ? OR seriales_usados LIKE ? OR seriales_usados LIKE ?)
-              AND sucursal = ?
-            ORDER BY id DESC LIMIT 1
-        """
-        pattern_s_json = f'%"{serial}"%' if serial else "%\"___NONE___\"%"
-        pattern_m_json = f'%"{mac}"%' if mac else "%\"___NONE___\"%"
-        pattern_s_raw = f'%{serial}%' if serial else "%___NONE___%"
-        pattern_m_raw = f'%{mac}%' if mac else "%___NONE___%"
-        
-        run_query(cursor, sql_c, (pattern_s_json, pattern_m_json, pattern_s_raw, pattern_m_raw, sucursal_target))
-        cons_extra = cursor.fetchone()
+        # --- PLAN A: consumo_series (una lectura indexada por serial/MAC normalizados) ---
+        # Cubre consumos_pendientes.seriales_usados y los movimientos con seriales (antes LIKE sobre ambos)
+        normas = [str(v).strip().upper() for v in (serial, mac) if v]
+        cons_extra = buscar_consumo_de_serie(cursor, normas, sucursal_target)
         
         if cons_extra:
             movil_final, contrato_final, fecha_final = cons_extra
-            logger.info(f"   [PLAN A] Encontrado en consumos_pendientes: Movil={movil_final}, Contrato={contrato_final}, Fecha={fecha_final}")
+            logger.info(f"   [PLAN A] Encontrado en consumo_series: Movil={movil_final}, Contrato={contrato_final}, Fecha={fecha_final}")
         else:
-            # --- PLAN B: Buscar en movimientos (Observaciones o Documento) ---
+            # --- PLAN B: movimientos que nombran la serie solo en observaciones/documento ---
+            # (texto libre que consumo_series no enlaza); acotado al SKU del equipo
             sql_m = """
                 SELECT movil_afectado, documento_referencia, fecha_evento 
                 FROM movimientos 
@@ -712,16 +716,17 @@ def verificar_serie_existe(serial, sku=None, ubicacion_requerida=None, estado_re
         
         ph = '%s' if DB_TYPE == 'MYSQL' else '?'
         
-        # Buscar en serial_number O mac_number
-        query = f"SELECT sku, estado, ubicacion, serial_number, mac_number FROM series_registradas WHERE serial_number = {ph} OR mac_number = {ph}"
-        params = (serial, serial)
+        # Buscar en serial_norm O mac_norm
+        serial_clean = str(serial).strip().upper()
+        query = f"SELECT sku, estado, ubicacion, serial_norm, mac_norm FROM series_registradas WHERE serial_norm = {ph} OR mac_norm = {ph}"
+        params = (serial_clean, serial_clean)
             
         cursor.execute(query, params)
         result = cursor.fetchone()
         
         if result:
             sku_existente, estado, ubicacion, s_found, m_found = result
-            tipo = "Serial" if s_found == serial else "MAC"
+            tipo = "Serial" if s_found == serial_clean else "MAC"
             
             # Validaciones adicionales para Salida
             if estado_requerido and estado != estado_requerido:
@@ -787,17 +792,17 @@ def registrar_series_bulk(series_data, fecha_ingreso=None, paquete=None, existin
             data_to_insert.append((item['sku'], item['serial'], mac, item['ubicacion'], fecha_ingreso, item_paquete, item_sucursal))
             
         cursor.executemany(sql, data_to_insert)
+
+        # Sincronizar el stock de BODEGA de los SKUs tocados, en la misma transacción
+        skus_por_sucursal = {}
+        for d in data_to_insert:
+            skus_por_sucursal.setdefault(d[-1], set()).add(d[0])
+        for suc, skus in skus_por_sucursal.items():
+            if not sincronizar_stock_bodega_serializado(sucursal_context=suc, skus=skus, existing_conn=conn):
+                raise Exception(f"No se pudo sincronizar el stock de BODEGA en {suc}")
+
         if not existing_conn:
             conn.commit()
-        
-        # NUEVO: Sincronizar stock en la tabla productos después de un bulk exitoso
-        try:
-            # Identificar que sucursales se vieron afectadas
-            sucursales_afectadas = list(set([d[-1] for d in data_to_insert]))
-            for suc in sucursales_afectadas:
-                sincronizar_stock_bodega_serializado(sucursal_context=suc)
-        except Exception as e_sync:
-            logger.error(f"Error en sincronizacion post-bulk: {e_sync}")
 
         return True, f"{len(data_to_insert)} items registrados correctamente."
         
@@ -827,7 +832,7 @@ def obtener_info_serial(serial_number):
         sql = """
             SELECT sku, ubicacion
             FROM series_registradas
-            WHERE UPPER(serial_number) = ? OR UPPER(mac_number) = ?
+            WHERE serial_norm = ? OR mac_norm = ?
             LIMIT 1
         """
         
@@ -858,7 +863,7 @@ def obtener_detalles_serial(serial_number):
         sql = """
             SELECT sku, ubicacion, serial_number, mac_number
             FROM series_registradas
-            WHERE UPPER(serial_number) = ? OR UPPER(mac_number) = ?
+            WHERE serial_norm = ? OR mac_norm = ?
             LIMIT 1
         """
         
@@ -912,13 +917,20 @@ def actualizar_ubicacion_serial(serial_number, nueva_ubicacion, paquete=None, ex
         # Normalizar paquete para persistencia y filtros
         pq_norm = paquete if paquete else 'NINGUNO'
 
+        # Ubicación previa: el móvil de origen también cambia de inventario
+        serial_clean = str(serial_number).strip().upper()
+        run_query(cursor, "SELECT DISTINCT ubicacion FROM series_registradas WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?",
+                  (serial_clean, serial_clean, sucursal))
+        ubicaciones = {r[0] for r in cursor.fetchall()} | {nueva_ubicacion}
+
         sql = """
             UPDATE series_registradas
             SET ubicacion = ?, paquete = ?
-            WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?
+            WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?
         """
         
-        run_query(cursor, sql, (nueva_ubicacion, pq_norm, serial_number, serial_number, sucursal))
+        run_query(cursor, sql, (nueva_ubicacion, pq_norm, serial_clean, serial_clean, sucursal))
+        marcar_inventario_movil(cursor, sucursal, ubicaciones)
         
         if should_close:
             conn.commit()
@@ -933,6 +945,42 @@ def actualizar_ubicacion_serial(serial_number, nueva_ubicacion, paquete=None, ex
         if conn and should_close:
             close_connection(conn)
 
+def actualizar_ubicacion_series_bulk(seriales, nueva_ubicacion, paquete=None, existing_conn=None, sucursal_context=None):
+    """
+    Versión masiva de actualizar_ubicacion_serial: un UPDATE por bloque de seriales.
+    Retorna: (exito: bool, mensaje: str)
+    """
+    seriales = sorted({str(s).strip().upper() for s in seriales if s and str(s).strip()})
+    if not seriales:
+        return True, "Sin seriales para actualizar"
+    try:
+        sucursal = sucursal_context
+        if not sucursal:
+            sucursal = 'SANTIAGO' if os.environ.get('SANTIAGO_DIRECT_MODE') == '1' else 'CHIRIQUI'
+        pq_norm = paquete if paquete else 'NINGUNO'
+
+        total = 0
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            ubicaciones = {nueva_ubicacion}
+            for i in range(0, len(seriales), 200):
+                bloque = seriales[i:i + 200]
+                ph = ','.join(['?'] * len(bloque))
+                run_query(cursor, f"SELECT DISTINCT ubicacion FROM series_registradas WHERE (serial_norm IN ({ph}) OR mac_norm IN ({ph})) AND sucursal = ?",
+                          tuple(bloque + bloque + [sucursal]))
+                ubicaciones.update(r[0] for r in cursor.fetchall())
+                sql = f"""
+                    UPDATE series_registradas
+                    SET ubicacion = ?, paquete = ?
+                    WHERE (serial_norm IN ({ph}) OR mac_norm IN ({ph})) AND sucursal = ?
+                """
+                total += run_query(cursor, sql, tuple([nueva_ubicacion, pq_norm] + bloque + bloque + [sucursal]))
+            marcar_inventario_movil(cursor, sucursal, ubicaciones)
+
+        return True, f"{total} seriales actualizados"
+    except Exception as e:
+        logger.error(f"Error actualizando ubicación de seriales: {e}")
+        return False, f"Error: {e}"
+
 def obtener_series_por_sku_y_ubicacion(sku, ubicacion, paquete=None):
     """
     Retorna una lista de seriales (MACs) para un SKU en una ubicación específica,
@@ -1098,7 +1146,10 @@ def identificar_codigo_escaneado_gui(codigo):
         # Prioridades: 1. Serial, 2. Codigo Barra, 3. Maestro, 4. SKU
         sql = """
             SELECT sku, ubicacion, 1 as priority, 1 as is_serial, paquete FROM series_registradas 
-            WHERE UPPER(serial_number) = ? OR UPPER(mac_number) = ?
+            WHERE serial_norm = ?
+            UNION ALL
+            SELECT sku, ubicacion, 1 as priority, 1 as is_serial, paquete FROM series_registradas 
+            WHERE mac_norm = ?
             UNION ALL
             SELECT sku, NULL as ubicacion, 2 as priority, 0 as is_serial, NULL as paquete FROM productos 
             WHERE codigo_barra = ? OR codigo_barra = ?
@@ -1151,7 +1202,7 @@ def obtener_sku_por_serial(serial):
         serial_clean = str(serial).strip().upper().replace("'", "-")
         
         # Búsqueda insensible a mayúsculas: busca en serial_number O mac_number
-        sql = "SELECT sku, ubicacion FROM series_registradas WHERE UPPER(serial_number) = UPPER(?) OR UPPER(mac_number) = UPPER(?) LIMIT 1"
+        sql = "SELECT sku, ubicacion FROM series_registradas WHERE serial_norm = ? OR mac_norm = ? LIMIT 1"
         run_query(cursor, sql, (serial_clean, serial_clean))
         result = cursor.fetchone()
         
@@ -1211,6 +1262,50 @@ def obtener_diccionarios_escaneo(sucursal_context=None):
     finally:
         if conn: close_connection(conn)
 
+def obtener_cambios_escaneo(desde=None, sucursal_context=None):
+    """
+    Fuente del índice de escaneo incremental (gui/services/scan_index.py).
+
+    Sin 'desde' devuelve la carga completa de la sucursal; con 'desde' solo las filas
+    cuyo 'actualizado_en' sea >= a esa marca (en todas las sucursales, para detectar
+    equipos que salieron de la sucursal).
+
+    Retorna: (series, productos, marca) o None si hubo error.
+        series:    [(id, sku, serial_norm, mac_norm, ubicacion, paquete, sucursal)]
+        productos: [(id, sku, codigo_barra, codigo_barra_maestro, ubicacion)]
+        marca:     mayor 'actualizado_en' observado (o 'desde' si no hubo cambios)
+    """
+    try:
+        from config import CURRENT_CONTEXT
+        sucursal = sucursal_context or CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
+
+        with sesion_lectura(('series_registradas', 'productos')) as (conn, cursor):
+            # La marca se toma ANTES de leer para no perder cambios que lleguen durante la lectura
+            run_query(cursor, """
+                SELECT (SELECT MAX(actualizado_en) FROM series_registradas),
+                       (SELECT MAX(actualizado_en) FROM productos)
+            """)
+            marcas = [m for m in cursor.fetchone() if m is not None]
+            marca = max(str(m)[:19] for m in marcas) if marcas else desde
+
+            sql_series = "SELECT id, sku, serial_norm, mac_norm, ubicacion, paquete, UPPER(COALESCE(sucursal, 'CHIRIQUI')) FROM series_registradas"
+            sql_productos = "SELECT id, sku, codigo_barra, codigo_barra_maestro, ubicacion FROM productos"
+            if desde is None:
+                run_query(cursor, sql_series + " WHERE sucursal = ? OR (sucursal IS NULL AND ? = 'CHIRIQUI')", (sucursal, sucursal))
+                series = cursor.fetchall()
+                run_query(cursor, sql_productos + " WHERE ubicacion = 'BODEGA'")
+                productos = cursor.fetchall()
+            else:
+                run_query(cursor, sql_series + " WHERE actualizado_en >= ?", (desde,))
+                series = cursor.fetchall()
+                run_query(cursor, sql_productos + " WHERE actualizado_en >= ?", (desde,))
+                productos = cursor.fetchall()
+
+            return series, productos, marca
+    except Exception as e:
+        logger.error(f"❌ Error obteniendo cambios para el índice de escaneo: {e}")
+        return None
+
 def buscar_producto_por_codigo_barra_maestro(codigo_barra, sucursal_context=None):
     """
     Busca un producto por su código de barra maestro o por SKU.
@@ -1226,7 +1321,7 @@ def buscar_producto_por_codigo_barra_maestro(codigo_barra, sucursal_context=None
     
     conn = None
     try:
-        conn = get_db_connection()
+        conn = conexion_lectura(('productos',))
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -1258,8 +1353,8 @@ def buscar_producto_por_codigo_barra_maestro(codigo_barra, sucursal_context=None
         sku, nombre, stock = resultado
         
         # Determinar si tiene seriales
-        from config import PRODUCTOS_CON_CODIGO_BARRA
-        tiene_seriales = sku in PRODUCTOS_CON_CODIGO_BARRA
+        from data_layer.catalog import es_equipo_serializado
+        tiene_seriales = es_equipo_serializado(sku)
         
         return {
             'sku': sku,
@@ -1311,7 +1406,7 @@ def buscar_producto_por_mac(mac_address, sucursal_context=None):
         # Normalizar MAC (uppercase y trim)
         mac = mac_address.strip().upper()
         
-        with db_session() as (conn, cursor):
+        with sesion_lectura(('series_registradas', 'productos')) as (conn, cursor):
             # Buscar en tabla series_registradas
             # CLAVE: Unir con productos también filtrando por sucursal
             run_query(cursor, """
@@ -1407,43 +1502,111 @@ def actualizar_codigo_barra_maestro(sku, codigo_barra_maestro):
         if conn:
             close_connection(conn)
 
+def validar_seriales_lote(seriales, sucursal_context='CHIRIQUI', sku_esperado=None, target_db=None, existing_conn=None):
+    """
+    Valida una lista de seriales/MACs con consultas IN (...) por bloques sobre
+    las columnas normalizadas (serial_norm / mac_norm).
+
+    'seriales' acepta strings o dicts {'serial': ..., 'sku': ...}; el 'sku' del item
+    tiene prioridad sobre 'sku_esperado'.
+
+    Estado por serial:
+        OK             -> existe en BODEGA de la sucursal (y con el SKU esperado)
+        NO_EXISTE      -> no está registrado en ninguna sucursal
+        OTRA_SUCURSAL  -> registrado, pero en otra sucursal
+        NO_EN_BODEGA   -> registrado en la sucursal, con otra ubicación
+        SKU_INCORRECTO -> en la sucursal, pero pertenece a otro SKU
+
+    Retorna (True, [ {serial, estado, mensaje, sku, nombre, ubicacion, sucursal} ... ])
+    en el mismo orden de entrada, o (False, mensaje_error).
+    """
+    items = []
+    for it in seriales or []:
+        if isinstance(it, dict):
+            serial, sku_item = it.get('serial'), it.get('sku')
+        else:
+            serial, sku_item = it, None
+        serial = str(serial or '').strip()
+        if serial:
+            items.append((serial, serial.upper(), sku_item or sku_esperado))
+    if not items:
+        return True, []
+
+    sucursal = (sucursal_context or 'CHIRIQUI').upper()
+    try:
+        encontrados = {}  # clave_norm -> [(sku, ubicacion, estado, sucursal)]
+        nombres = {}
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            claves = sorted({norm for _, norm, _ in items})
+            for i in range(0, len(claves), 200):
+                bloque = claves[i:i + 200]
+                ph = ','.join(['?'] * len(bloque))
+                sql = f"""
+                    SELECT serial_norm, mac_norm, sku, ubicacion, estado, UPPER(COALESCE(sucursal, 'CHIRIQUI'))
+                    FROM series_registradas
+                    WHERE serial_norm IN ({ph}) OR mac_norm IN ({ph})
+                """
+                run_query(cursor, sql, tuple(bloque + bloque))
+                for serial_norm, mac_norm, sku, ubicacion, estado, suc in cursor.fetchall():
+                    for clave in {serial_norm, mac_norm}:
+                        if clave:
+                            encontrados.setdefault(clave, []).append((sku, ubicacion, estado, suc))
+
+            skus = sorted({f[0] for filas in encontrados.values() for f in filas})
+            for i in range(0, len(skus), 200):
+                bloque = skus[i:i + 200]
+                run_query(cursor, f"SELECT sku, MAX(nombre) FROM productos WHERE sku IN ({','.join(['?'] * len(bloque))}) GROUP BY sku", tuple(bloque))
+                nombres.update({sku: nombre for sku, nombre in cursor.fetchall()})
+    except Exception as e:
+        logger.error(f"Error en validar_seriales_lote: {e}")
+        return False, f"Error de validación: {e}"
+
+    resultados = []
+    for serial, norm, sku_item in items:
+        filas = encontrados.get(norm, [])
+        local = next((f for f in filas if f[3] == sucursal), None)
+        fila = local or (filas[0] if filas else None)
+        db_sku, db_ubicacion, _, db_sucursal = fila if fila else (None, None, None, None)
+        db_nombre = nombres.get(db_sku) or "Equipo Serializado"
+
+        if not fila:
+            estado, mensaje = 'NO_EXISTE', f"El serial/MAC {norm} no existe en nuestra base de datos."
+        elif not local:
+            estado, mensaje = 'OTRA_SUCURSAL', f"El serial/MAC {norm} está registrado en la sucursal {db_sucursal}, no en {sucursal}."
+        elif db_ubicacion != 'BODEGA':
+            estado, mensaje = 'NO_EN_BODEGA', f"El equipo {db_nombre} ({db_sku}) no está en BODEGA (Ubicación actual: {db_ubicacion})."
+        elif sku_item and db_sku != sku_item:
+            estado, mensaje = 'SKU_INCORRECTO', f"El serial corresponde a: {db_nombre} (SKU: {db_sku}), pero se esperaba este producto (SKU: {sku_item})."
+        else:
+            estado, mensaje = 'OK', "Validado"
+
+        resultados.append({
+            'serial': serial,
+            'estado': estado,
+            'mensaje': mensaje,
+            'sku': db_sku,
+            'nombre': db_nombre if fila else None,
+            'ubicacion': db_ubicacion,
+            'sucursal': db_sucursal,
+        })
+    return True, resultados
+
 def verificar_seriales_bodega(seriales, sucursal_context='CHIRIQUI', target_db=None):
     """
     Verifica si una lista de seriales existe en la BODEGA de la sucursal especificada.
     Retorna (True, None) si todos existen, o (False, mensaje) con los faltantes.
     """
     if not seriales: return True, None
-    conn = None
-    try:
-        conn = get_db_connection(target_db=target_db)
-        if DB_TYPE == 'MYSQL':
-            cursor = conn.cursor(buffered=True)
-        else:
-            cursor = conn.cursor()
-        
-        sucursal = sucursal_context.upper()
-        faltantes = []
-        for sn in seriales:
-            clean_sn = sn.strip().upper()
-            sql = """
-                SELECT id FROM series_registradas 
-                WHERE (UPPER(serial_number) = ? OR UPPER(mac_number) = ?) 
-                AND ubicacion = 'BODEGA' 
-                AND sucursal = ?
-            """
-            run_query(cursor, sql, (clean_sn, clean_sn, sucursal))
-            if not cursor.fetchone():
-                faltantes.append(sn)
-        
-        if faltantes:
-            return False, f"Los siguientes seriales/MACs no están registrados en Bodega {sucursal}: {', '.join(faltantes)}"
-        
-        return True, None
-    except Exception as e:
-        logger.error(f"Error en verificar_seriales_bodega: {e}")
-        return False, f"Error de validación: {e}"
-    finally:
-        if conn: close_connection(conn)
+    sucursal = sucursal_context.upper()
+    ok, resultados = validar_seriales_lote(seriales, sucursal_context=sucursal, target_db=target_db)
+    if not ok:
+        return False, resultados
+
+    faltantes = [r['serial'] for r in resultados if r['estado'] != 'OK']
+    if faltantes:
+        return False, f"Los siguientes seriales/MACs no están registrados en Bodega {sucursal}: {', '.join(faltantes)}"
+
+    return True, None
 
 
 def obtener_todos_los_seriales_sucursal(sucursal_context=None):
@@ -0,0 +1,111 @@
+import json
+import uuid
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+from utils.db_connector import db_session
+
+from data_layer.core import run_query, sql_hace_segundos, SQL_TABLA_TRABAJOS_PORTAL
+
+# ─────────────────────────────────────────────────────────
+# TRABAJOS EN SEGUNDO PLANO DEL PORTAL
+# ─────────────────────────────────────────────────────────
+# Estado persistido en BD para que cualquier worker de gunicorn pueda responder
+# /api/jobs/<id>, aunque el trabajo lo ejecute el hilo de otro proceso.
+# Las marcas de tiempo las pone y las compara la BD (CURRENT_TIMESTAMP): la hora
+# local del proceso no coincide con la del servidor (TiDB en UTC).
+TRABAJO_PENDIENTE = 'PENDIENTE'
+TRABAJO_EN_PROCESO = 'EN_PROCESO'
+TRABAJO_COMPLETADO = 'COMPLETADO'
+TRABAJO_ERROR = 'ERROR'
+
+# Un trabajo sin noticias en este tiempo se da por perdido (reinicio del proceso)
+TRABAJO_ABANDONADO_SEG = 300
+TRABAJOS_RETENCION_HORAS = 24
+_tabla_trabajos_lista = False
+
+
+def asegurar_tabla_trabajos(target_db=None):
+    """Crea trabajos_portal si falta y purga los trabajos viejos (una vez por proceso)."""
+    global _tabla_trabajos_lista
+    if _tabla_trabajos_lista:
+        return True
+    try:
+        with db_session(target_db=target_db) as (conn, cursor):
+            cursor.execute(SQL_TABLA_TRABAJOS_PORTAL)
+            run_query(cursor, f"DELETE FROM trabajos_portal WHERE creado_en < {sql_hace_segundos(TRABAJOS_RETENCION_HORAS * 3600)}")
+        _tabla_trabajos_lista = True
+    except Exception as e:
+        logger.warning(f"No se pudo preparar trabajos_portal: {e}")
+    return _tabla_trabajos_lista
+
+
+def crear_trabajo(tipo, total=0, target_db=None, existing_conn=None):
+    """Registra un trabajo nuevo y retorna su id (None si no se pudo guardar)."""
+    id_trabajo = uuid.uuid4().hex
+    try:
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            run_query(cursor, """
+                INSERT INTO trabajos_portal (id, tipo, estado, total, actualizado_en)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (id_trabajo, tipo, TRABAJO_PENDIENTE, total))
+        return id_trabajo
+    except Exception as e:
+        logger.error(f"Error al crear trabajo {tipo}: {e}")
+        return None
+
+
+def actualizar_trabajo(id_trabajo, estado=None, progreso=None, total=None, resultado=None, error=None,
+                       target_db=None, existing_conn=None):
+    """Actualiza solo los campos indicados; 'resultado' se guarda como JSON."""
+    campos = {}
+    if estado is not None: campos['estado'] = estado
+    if progreso is not None: campos['progreso'] = progreso
+    if total is not None: campos['total'] = total
+    if resultado is not None: campos['resultado'] = json.dumps(resultado, ensure_ascii=False, default=str)
+    if error is not None: campos['error'] = str(error)[:2000]
+    try:
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            asignaciones = [f'{c} = ?' for c in campos] + ['actualizado_en = CURRENT_TIMESTAMP']
+            run_query(cursor, f"UPDATE trabajos_portal SET {', '.join(asignaciones)} WHERE id = ?",
+                      tuple(campos.values()) + (id_trabajo,))
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo actualizar el trabajo {id_trabajo}: {e}")
+        return False
+
+
+def obtener_trabajo(id_trabajo, target_db=None, existing_conn=None):
+    """
+    Retorna el trabajo como dict (con 'resultado' ya decodificado) o None si no existe.
+    Los trabajos sin avance reciente se reportan como ERROR (proceso reiniciado).
+    """
+    try:
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            run_query(cursor, f"""
+                SELECT id, tipo, estado, progreso, total, resultado, error, creado_en,
+                       CASE WHEN actualizado_en < {sql_hace_segundos(TRABAJO_ABANDONADO_SEG)} THEN 1 ELSE 0 END
+                FROM trabajos_portal WHERE id = ?
+            """, (id_trabajo,))
+            fila = cursor.fetchone()
+        if not fila:
+            return None
+
+        id_t, tipo, estado, progreso, total, resultado, error, creado_en, sin_avance = fila
+        if estado in (TRABAJO_PENDIENTE, TRABAJO_EN_PROCESO) and sin_avance:
+            estado, error = TRABAJO_ERROR, "El trabajo se interrumpió (reinicio del servidor). Vuelva a enviarlo."
+
+        return {
+            'id': id_t,
+            'tipo': tipo,
+            'estado': estado,
+            'progreso': progreso or 0,
+            'total': total or 0,
+            'resultado': json.loads(resultado) if resultado else None,
+            'error': error,
+            'creado_en': str(creado_en) if creado_en else None,
+        }
+    except Exception as e:
+        logger.error(f"Error al obtener trabajo {id_trabajo}: {e}")
+        return None
@@ -0,0 +1,278 @@
+from datetime import date
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+from utils.db_connector import db_session
+from config import DB_TYPE, TIPOS_CONSUMO, TIPOS_ABASTO
+
+from data_layer.core import run_query, run_many
+
+# ─────────────────────────────────────────────────────────
+# AGREGADOS DE MOVIMIENTOS MANTENIDOS AL ESCRIBIR
+# ─────────────────────────────────────────────────────────
+# Los escritores de movimientos llaman a acumular_movimientos() en su misma transacción,
+# que actualiza dos tablas derivadas de movimientos:
+#   - saldos_movimientos (migración 4): suma histórica de TIPOS_CONSUMO / TIPOS_ABASTO por
+#     (sku, sucursal). obtener_stock_actual_y_moviles lee un total por SKU en vez de
+#     recorrer todo el historial.
+#   - resumen_diario_movimientos (migración 5): cantidad por (fecha, sucursal, sku, móvil,
+#     tipo). Analítica y reportes consultan cualquier rango sin escanear movimientos.
+# A diferencia del outbox, un fallo aquí se propaga: el agregado se confirma junto con el
+# movimiento o no se confirma. Si se cambian TIPOS_CONSUMO / TIPOS_ABASTO en config, o se
+# escribió en movimientos por fuera de los escritores, hay que reconstruir:
+#   python -m data_layer.ledger --reconstruir
+
+
+def _fecha_dia(fecha):
+    """'YYYY-MM-DD' de una fecha/fecha-hora (date, datetime o texto); hoy si falta."""
+    if not fecha:
+        return date.today().isoformat()
+    return str(fecha)[:10]
+
+
+def acumular_movimientos(cursor, movimientos):
+    """
+    Suma a los agregados los movimientos recién escritos, con el cursor del llamador.
+    'movimientos': iterable de (sku, tipo, cantidad, movil, fecha_evento, sucursal);
+    una cantidad negativa descuenta (edición de un movimiento).
+    """
+    saldos, diario = {}, {}
+    for sku, tipo, cantidad, movil, fecha, sucursal in movimientos:
+        if not cantidad:
+            continue
+        suc = (sucursal or 'CHIRIQUI').upper()
+        clave = (_fecha_dia(fecha), suc, sku, movil or '', tipo)
+        diario[clave] = diario.get(clave, 0) + cantidad
+        if tipo in TIPOS_CONSUMO or tipo in TIPOS_ABASTO:
+            fila = saldos.setdefault((sku, suc), [0, 0])
+            fila[0 if tipo in TIPOS_CONSUMO else 1] += cantidad
+
+    if saldos:
+        if DB_TYPE == 'MYSQL':
+            sql = ("INSERT INTO saldos_movimientos (sku, sucursal, consumo_total, abasto_total) VALUES (?, ?, ?, ?) "
+                   "ON DUPLICATE KEY UPDATE consumo_total = consumo_total + VALUES(consumo_total), "
+                   "abasto_total = abasto_total + VALUES(abasto_total)")
+        else:
+            sql = ("INSERT INTO saldos_movimientos (sku, sucursal, consumo_total, abasto_total) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT(sku, sucursal) DO UPDATE SET consumo_total = consumo_total + excluded.consumo_total, "
+                   "abasto_total = abasto_total + excluded.abasto_total")
+        run_many(cursor, sql, [(sku, suc, consumo, abasto) for (sku, suc), (consumo, abasto) in saldos.items()])
+
+    if diario:
+        run_many(cursor, _sql_sumar_resumen(), [clave + (cantidad,) for clave, cantidad in diario.items()])
+
+
+def _sql_sumar_resumen():
+    """Upsert que suma 'cantidad' a la fila (fecha, sucursal, sku, movil, tipo) del resumen diario."""
+    if DB_TYPE == 'MYSQL':
+        return ("INSERT INTO resumen_diario_movimientos (fecha, sucursal, sku, movil, tipo_movimiento, cantidad) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON DUPLICATE KEY UPDATE cantidad = cantidad + VALUES(cantidad)")
+    return ("INSERT INTO resumen_diario_movimientos (fecha, sucursal, sku, movil, tipo_movimiento, cantidad) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(fecha, sucursal, sku, movil, tipo_movimiento) "
+            "DO UPDATE SET cantidad = cantidad + excluded.cantidad")
+
+
+def renombrar_movil_resumen(cursor, anterior, nuevo):
+    """
+    Pasa las filas del resumen diario de 'anterior' a 'nuevo' (renombre de un móvil), con el
+    cursor del llamador. Si 'nuevo' ya tenía filas para la misma clave, las cantidades se suman.
+    """
+    if not anterior or not nuevo or anterior == nuevo:
+        return 0
+    run_query(cursor, "SELECT fecha, sucursal, sku, tipo_movimiento, cantidad FROM resumen_diario_movimientos WHERE movil = ?", (anterior,))
+    filas = [(fecha, suc, sku, nuevo, tipo, cantidad) for fecha, suc, sku, tipo, cantidad in cursor.fetchall()]
+    if not filas:
+        return 0
+    run_query(cursor, "DELETE FROM resumen_diario_movimientos WHERE movil = ?", (anterior,))
+    run_many(cursor, _sql_sumar_resumen(), filas)
+    return len(filas)
+
+
+def _sql_saldos_desde_movimientos():
+    """SELECT sku, sucursal, consumo, abasto agregando todo movimientos (la fuente de verdad)."""
+    ph_consumo = ','.join(['?' for _ in TIPOS_CONSUMO])
+    ph_abasto = ','.join(['?' for _ in TIPOS_ABASTO])
+    sql = f"""
+        SELECT sku_producto, UPPER(COALESCE(sucursal, 'CHIRIQUI')) AS suc,
+               SUM(CASE WHEN tipo_movimiento IN ({ph_consumo}) THEN cantidad_afectada ELSE 0 END),
+               SUM(CASE WHEN tipo_movimiento IN ({ph_abasto}) THEN cantidad_afectada ELSE 0 END)
+        FROM movimientos
+        WHERE tipo_movimiento IN ({ph_consumo}, {ph_abasto})
+        GROUP BY sku_producto, UPPER(COALESCE(sucursal, 'CHIRIQUI'))
+    """
+    return sql, tuple(TIPOS_CONSUMO + TIPOS_ABASTO + TIPOS_CONSUMO + TIPOS_ABASTO)
+
+
+# Misma clave que acumular_movimientos: día de fecha_evento (o del registro si falta) y móvil '' si no hay
+SQL_RESUMEN_DESDE_MOVIMIENTOS = """
+    SELECT SUBSTR(COALESCE(fecha_evento, fecha_movimiento), 1, 10) AS dia,
+           UPPER(COALESCE(sucursal, 'CHIRIQUI')) AS suc, sku_producto, COALESCE(movil_afectado, '') AS mov,
+           tipo_movimiento, SUM(cantidad_afectada)
+    FROM movimientos
+    GROUP BY SUBSTR(COALESCE(fecha_evento, fecha_movimiento), 1, 10), UPPER(COALESCE(sucursal, 'CHIRIQUI')),
+             sku_producto, COALESCE(movil_afectado, ''), tipo_movimiento
+    HAVING SUM(cantidad_afectada) <> 0
+"""
+
+
+def reconstruir_saldos(cursor):
+    """Rehace saldos_movimientos desde cero con el cursor del llamador (migración o --reconstruir)."""
+    sql, params = _sql_saldos_desde_movimientos()
+    run_query(cursor, sql, params)
+    filas = [(sku, suc, consumo or 0, abasto or 0) for sku, suc, consumo, abasto in cursor.fetchall()]
+    run_query(cursor, "DELETE FROM saldos_movimientos")
+    run_many(cursor, "INSERT INTO saldos_movimientos (sku, sucursal, consumo_total, abasto_total) VALUES (?, ?, ?, ?)", filas)
+    return len(filas)
+
+
+def reconstruir_resumen_diario(cursor):
+    """Rehace resumen_diario_movimientos desde cero con el cursor del llamador."""
+    run_query(cursor, SQL_RESUMEN_DESDE_MOVIMIENTOS)
+    filas = cursor.fetchall()
+    run_query(cursor, "DELETE FROM resumen_diario_movimientos")
+    run_many(cursor, "INSERT INTO resumen_diario_movimientos (fecha, sucursal, sku, movil, tipo_movimiento, cantidad) VALUES (?, ?, ?, ?, ?, ?)", filas)
+    return len(filas)
+
+
+def _diferencias(reales, guardados):
+    """[(clave, guardado, real)] donde no coinciden; un faltante cuenta como ceros."""
+    vacio = next(iter(reales.values() or guardados.values()), ())
+    cero = tuple(0 for _ in vacio)
+    diferencias = []
+    for clave in sorted(set(reales) | set(guardados)):
+        real = reales.get(clave, cero)
+        guardado = guardados.get(clave, cero)
+        if tuple(float(v) for v in real) != tuple(float(v) for v in guardado):
+            diferencias.append((clave, guardado, real))
+    return diferencias
+
+
+def verificar_saldos(existing_conn=None):
+    """
+    Compara saldos_movimientos con la agregación completa de movimientos.
+    Retorna la lista de diferencias [(sku, sucursal, (consumo, abasto) guardado, (consumo, abasto) real)];
+    vacía si cuadra. Ante un error retorna None.
+    """
+    try:
+        with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+            sql, params = _sql_saldos_desde_movimientos()
+            run_query(cursor, sql, params)
+            reales = {(sku, suc): (consumo or 0, abasto or 0) for sku, suc, consumo, abasto in cursor.fetchall()}
+            run_query(cursor, "SELECT sku, sucursal, consumo_total, abasto_total FROM saldos_movimientos")
+            guardados = {(sku, suc): (consumo or 0, abasto or 0) for sku, suc, consumo, abasto in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"No se pudieron verificar los saldos de movimientos: {e}")
+        return None
+    return [(sku, suc, guardado, real) for (sku, suc), guardado, real in _diferencias(reales, guardados)]
+
+
+def verificar_resumen_diario(existing_conn=None):
+    """
+    Compara resumen_diario_movimientos con movimientos.
+    Retorna [((fecha, sucursal, sku, movil, tipo), guardado, real)]; vacía si cuadra, None ante un error.
+    """
+    try:
+        with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+            run_query(cursor, SQL_RESUMEN_DESDE_MOVIMIENTOS)
+            reales = {(str(f[0]),) + tuple(f[1:5]): (f[5],) for f in cursor.fetchall()}
+            run_query(cursor, "SELECT fecha, sucursal, sku, movil, tipo_movimiento, cantidad FROM resumen_diario_movimientos WHERE cantidad <> 0")
+            guardados = {(str(f[0]),) + tuple(f[1:5]): (f[5],) for f in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"No se pudo verificar el resumen diario de movimientos: {e}")
+        return None
+    return [(clave, guardado[0], real[0]) for clave, guardado, real in _diferencias(reales, guardados)]
+
+
+# ─────────────────────────────────────────────────────────
+# CONSULTAS SOBRE EL RESUMEN DIARIO (analítica y reportes)
+# ─────────────────────────────────────────────────────────
+_COLUMNAS_RESUMEN = {'fecha': 'r.fecha', 'sucursal': 'r.sucursal', 'sku': 'r.sku',
+                     'movil': 'r.movil', 'tipo': 'r.tipo_movimiento', 'mes': 'SUBSTR(r.fecha, 1, 7)'}
+
+
+def consultar_resumen(fecha_inicio, fecha_fin, agrupar=('fecha',), tipos=None, sucursal=None,
+                      solo_moviles=False, limite=None, existing_conn=None):
+    """
+    Totales del resumen diario entre dos fechas (inclusive), agrupados por las columnas de
+    'agrupar' ('fecha', 'mes', 'sucursal', 'sku', 'movil', 'tipo'). Filtra por 'tipos' y
+    'sucursal' si se indican; 'solo_moviles' descarta filas sin móvil.
+    Con 'limite' ordena por total descendente; si no, por las columnas agrupadas.
+    Retorna [(col1, ..., total)]; [] ante un error.
+    """
+    columnas = [_COLUMNAS_RESUMEN[c] for c in agrupar]
+    sql = f"SELECT {', '.join(columnas)}, SUM(r.cantidad) AS total FROM resumen_diario_movimientos r WHERE r.fecha BETWEEN ? AND ?"
+    params = [_fecha_dia(fecha_inicio), _fecha_dia(fecha_fin)]
+    if tipos:
+        sql += f" AND r.tipo_movimiento IN ({','.join(['?' for _ in tipos])})"
+        params.extend(tipos)
+    if sucursal:
+        sql += " AND r.sucursal = ?"
+        params.append(sucursal.upper())
+    if solo_moviles:
+        sql += " AND r.movil <> ''"
+    sql += f" GROUP BY {', '.join(columnas)}"
+    if limite:
+        sql += f" ORDER BY total DESC LIMIT {int(limite)}"
+    else:
+        sql += f" ORDER BY {', '.join(columnas)}"
+    try:
+        with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+            run_query(cursor, sql, tuple(params))
+            return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error consultando el resumen diario de movimientos: {e}")
+        return []
+
+
+def consultar_total_por_sku(fecha_inicio, fecha_fin, tipos, sucursal=None, limite=None, existing_conn=None):
+    """
+    (nombre, sku, total) por SKU entre dos fechas para los tipos indicados.
+    Sin 'limite' en el orden de vista de BODEGA; con 'limite', los de mayor total.
+    """
+    orden = f"total DESC LIMIT {int(limite)}" if limite else "secuencia ASC"
+    filtro_suc = " AND r.sucursal = ?" if sucursal else ""
+    sql = f"""
+        SELECT p.nombre, r.sku, SUM(r.cantidad) AS total, MIN(p.secuencia_vista) AS secuencia
+        FROM resumen_diario_movimientos r
+        JOIN (SELECT sku, MIN(nombre) AS nombre, MIN(secuencia_vista) AS secuencia_vista
+              FROM productos WHERE ubicacion = 'BODEGA' GROUP BY sku) p ON p.sku = r.sku
+        WHERE r.fecha BETWEEN ? AND ? AND r.tipo_movimiento IN ({','.join(['?' for _ in tipos])}){filtro_suc}
+        GROUP BY r.sku, p.nombre
+        ORDER BY {orden}
+    """
+    params = [_fecha_dia(fecha_inicio), _fecha_dia(fecha_fin)] + list(tipos) + ([sucursal.upper()] if sucursal else [])
+    try:
+        with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+            run_query(cursor, sql, tuple(params))
+            return [(nombre, sku, total) for nombre, sku, total, _ in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error consultando totales por SKU del resumen diario: {e}")
+        return []
+
+
+if __name__ == '__main__':
+    # python -m data_layer.ledger [--reconstruir]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verifica (o reconstruye) los agregados de movimientos")
+    parser.add_argument('--reconstruir', action='store_true', help="rehace las tablas completas desde movimientos")
+    args = parser.parse_args()
+
+    if args.reconstruir:
+        with db_session() as (conn, cursor):
+            saldos = reconstruir_saldos(cursor)
+            dias = reconstruir_resumen_diario(cursor)
+        print(f"Saldos reconstruidos: {saldos} pares (sku, sucursal); resumen diario: {dias} filas.")
+    else:
+        dif_saldos = verificar_saldos()
+        dif_diario = verificar_resumen_diario()
+        if dif_saldos is None or dif_diario is None:
+            raise SystemExit("No se pudo verificar (ver logs).")
+        for sku, suc, guardado, real in dif_saldos:
+            print(f"saldos   {suc:<10} {sku:<15} guardado={guardado} real={real}")
+        for clave, guardado, real in dif_diario:
+            print(f"diario   {' | '.join(str(c) for c in clave)} guardado={guardado} real={real}")
+        total = len(dif_saldos) + len(dif_diario)
+        print(f"{total} diferencias.")
+        raise SystemExit(1 if total else 0)
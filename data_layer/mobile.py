@@ -10,9 +10,15 @@ from utils.validators import validate_sku, validate_quantity, validate_date, val
 from config import DATABASE_NAME, DB_TYPE, MYSQL_HOST, MYSQL_USER, MYSQL_PASS, MYSQL_DB, MYSQL_PORT, MOVILES_DISPONIBLES, MOVILES_SANTIAGO, UBICACION_DESCARTE, TIPO_MOVIMIENTO_DESCARTE, TIPOS_CONSUMO, TIPOS_ABASTO, PAQUETES_MATERIALES, PRODUCTOS_INICIALES, MATERIALES_COMPARTIDOS
 from utils.db_connector import get_db_connection, close_connection, db_session
 
-from data_layer.core import run_query, safe_messagebox
+from data_layer.core import run_query, safe_messagebox, marcar_inventario_movil, sql_hace_segundos, SQL_TABLA_ENVIOS_PORTAL
 from data_layer.inventory import sincronizar_stock_bodega_serializado, obtener_skus_globales
 from data_layer.movements import registrar_movimiento_gui
+from data_layer.catalog import obtener_catalogo
+from data_layer.changes import registrar_cambios
+from data_layer.ledger import acumular_movimientos, consultar_total_por_sku, renombrar_movil_resumen
+from data_layer.serials import registrar_series_consumo
+from data_layer.search import buscar_historial, reindexar_movimientos, indexar_ids, HISTORIAL_PAGINA
+from data_layer.replica import conexion_lectura
 
 def diagnosticar_duplicados_movil(movil):
     """Diagnóstico: Identifica duplicados exactos en asignacion_moviles"""
@@ -136,7 +142,7 @@ def obtener_asignacion_movil(movil):
     """Obtiene el inventario actual asignado a un móvil específico (usado en Consiliación)."""
     conn = None
     try:
-        conn = get_db_connection()
+        conn = conexion_lectura(('asignacion_moviles', 'productos'))
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -157,162 +163,85 @@ def obtener_asignacion_movil(movil):
     finally:
         if conn: close_connection(conn)
 
-def obtener_asignacion_movil_con_paquetes(movil):
+# Pivote de asignacion_moviles por SKU. 'total' solo suma filas positivas (y el SKU aparece solo
+# si tiene alguna); los paquetes suman todo. Cualquier otro paquete (NULL, 'NINGUNO'...) va a SIN PAQUETE.
+SQL_ASIGNACION_PIVOTE = """
+    SELECT a.sku_producto, p.nombre, p.secuencia_vista,
+           SUM(CASE WHEN a.cantidad > 0 THEN a.cantidad ELSE 0 END) AS total,
+           SUM(CASE WHEN a.paquete = 'PAQUETE A' THEN a.cantidad ELSE 0 END) AS paquete_a,
+           SUM(CASE WHEN a.paquete = 'PAQUETE B' THEN a.cantidad ELSE 0 END) AS paquete_b,
+           SUM(CASE WHEN a.paquete = 'CARRO' THEN a.cantidad ELSE 0 END) AS carro,
+           SUM(CASE WHEN a.paquete IS NULL OR a.paquete NOT IN ('PAQUETE A', 'PAQUETE B', 'CARRO', 'PERSONALIZADO')
+                    THEN a.cantidad ELSE 0 END) AS sin_paquete,
+           SUM(CASE WHEN a.paquete = 'PERSONALIZADO' THEN a.cantidad ELSE 0 END) AS personalizado
+    FROM asignacion_moviles a
+    LEFT JOIN (SELECT sku, MAX(nombre) as nombre, MAX(secuencia_vista) as secuencia_vista FROM productos GROUP BY sku) p ON a.sku_producto = p.sku
+    WHERE UPPER(TRIM(a.movil)) = UPPER(TRIM(?))
+    AND (UPPER(TRIM(a.sucursal)) = ? OR a.sucursal IS NULL OR a.sucursal = '')
+    GROUP BY a.sku_producto, p.nombre, p.secuencia_vista
+    HAVING SUM(CASE WHEN a.cantidad > 0 THEN 1 ELSE 0 END) > 0
+"""
+
+def obtener_asignacion_movil_con_paquetes(movil, existing_conn=None):
     """
     Obtiene el stock exacto por paquete (PAQUETE A, PAQUETE B, CARRO, SIN PAQUETE)
-    sin aplicar compensaciones incorrectas.
-    Basado 100% en movimientos reales - CORREGIDO: SIN DUPLICADOS.
-    """
-    conn = None
-    try:
-        conn = get_db_connection()
-        if DB_TYPE == 'MYSQL':
-            cursor = conn.cursor(buffered=True)
-        else:
-            cursor = conn.cursor()
-
-        # DETERMINAR FILTRO DE SUCURSAL
-        from config import CURRENT_CONTEXT
-        sucursal_target = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
+    sin aplicar compensaciones incorrectas, directo de asignacion_moviles.
 
-        # Usamos LEFT JOIN para que no desaparezcan items si falla el cruce de productos maestro
-        sql_total = """
-            SELECT p.nombre, a.sku_producto, SUM(a.cantidad) as total, p.secuencia_vista
-            FROM asignacion_moviles a
-            LEFT JOIN (SELECT sku, MAX(nombre) as nombre, MAX(secuencia_vista) as secuencia_vista FROM productos GROUP BY sku) p ON a.sku_producto = p.sku
-            WHERE UPPER(TRIM(a.movil)) = UPPER(TRIM(?)) AND a.cantidad > 0 
-            AND (UPPER(TRIM(a.sucursal)) = ? OR a.sucursal IS NULL OR a.sucursal = '')
-            GROUP BY a.sku_producto, p.nombre, p.secuencia_vista
-        """
-        run_query(cursor, sql_total, (movil, sucursal_target))
-        productos_asignados_raw = cursor.fetchall()
-        
-        # Ordenamos en Python para evitar problemas con SQLite/MySQL orderBy handling con NULLs
-        def sort_key(row):
-            seq = row[3]
-            try: return int(seq)
-            except: return 9999
-            
-        productos_asignados_raw.sort(key=sort_key)
-        
-        productos_asignados = []
-        for row in productos_asignados_raw:
-            nombre = row[0] if row[0] else f"Desconocido ({row[1]})"
-            productos_asignados.append((nombre, row[1], row[2]))
-
-        if not productos_asignados:
-            return []
+    Retorna [(nombre, sku, total, paquete_a, paquete_b, carro, sin_paquete, personalizado), ...]
+    ordenado por secuencia_vista. Son dos consultas fijas sin importar cuántos SKUs tenga
+    el móvil: el pivote agrupado por SKU y el stock de bodega de los productos globales
+    (que muestran ese stock en todas las columnas).
+    """
+    from config import CURRENT_CONTEXT
+    sucursal_target = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
 
-        # --- NUEVO: Encontrar el punto de corte (última limpieza total) ---
-        # Solo procesamos movimientos posteriores a la última limpieza del móvil para evitar stock "fantasma"
-        sql_last_clean = """
-            SELECT MAX(id) FROM movimientos 
-            WHERE UPPER(TRIM(movil_afectado)) = UPPER(TRIM(?)) 
-            AND tipo_movimiento = 'LIMPIEZA_MOVIL' 
-            AND (paquete_asignado = 'TODOS' OR paquete_asignado IS NULL)
-            AND (sucursal = ? OR (sucursal IS NULL AND ? = 'CHIRIQUI'))
-        """
-        run_query(cursor, sql_last_clean, (movil, sucursal_target, sucursal_target))
-        row_clean = cursor.fetchone()
-        last_cleaning_id = row_clean[0] if row_clean and row_clean[0] else 0
-
-        resultado = []
-
-        # 2. Optimización N+1: Obtener todos los movimientos relevantes para el móvil de una sola vez
-        sql_todos_movs = """
-            SELECT sku_producto, tipo_movimiento, cantidad_afectada, paquete_asignado
-            FROM movimientos 
-            WHERE UPPER(TRIM(movil_afectado)) = UPPER(TRIM(?))
-            AND tipo_movimiento IN ('SALIDA_MOVIL','RETORNO_MOVIL','CONSUMO_MOVIL')
-            AND id > ?
-            AND (sucursal = ? OR (sucursal IS NULL AND ? = 'CHIRIQUI'))
-            ORDER BY fecha_movimiento ASC, id ASC
-        """
-        run_query(cursor, sql_todos_movs, (movil, last_cleaning_id, sucursal_target, sucursal_target))
-        todos_movimientos = cursor.fetchall()
-
-        # Agrupar movimientos por SKU
-        movimientos_por_sku = {}
-        for row in todos_movimientos:
-            s_sku = row[0]
-            if s_sku not in movimientos_por_sku:
-                movimientos_por_sku[s_sku] = []
-            movimientos_por_sku[s_sku].append((row[1], row[2], row[3]))
-
-        # 3. Procesar cada SKU
-        for nombre, sku, total_real in productos_asignados:
-            
-            # Inicializar los saldos con lo que dice la tabla asignacion_moviles DIRECTAMENTE
-            # Esto evita que 'PAQUETE B' se muestre como 'PAQUETE A' por prioridades de relleno.
-            sql_pqs = """
-                SELECT COALESCE(paquete, 'SIN_PAQUETE'), SUM(cantidad) 
-                FROM asignacion_moviles 
-                WHERE sku_producto = ? AND UPPER(TRIM(movil)) = UPPER(TRIM(?)) 
-                AND (UPPER(TRIM(sucursal)) = ? OR sucursal IS NULL OR sucursal = '')
-                GROUP BY paquete
-            """
-            run_query(cursor, sql_pqs, (sku, movil, sucursal_target))
-            filas_pqs = cursor.fetchall()
-            
-            saldos = {
-                "PAQUETE A": 0, "PAQUETE B": 0, "CARRO": 0, 
-                "PERSONALIZADO": 0, "SIN_PAQUETE": 0
-            }
-            
-            for p_name, p_qty in filas_pqs:
-                p_key = p_name if p_name in saldos else "SIN_PAQUETE"
-                if p_name == "NINGUNO": p_key = "SIN_PAQUETE"
-                saldos[p_key] = p_qty
-
-            # Guardar resultado final para ese SKU
-            resultado.append((
-                nombre,
-                sku,
-                total_real,
-                saldos["PAQUETE A"],
-                saldos["PAQUETE B"],
-                saldos["CARRO"],
-                saldos["SIN_PAQUETE"],
-                saldos["PERSONALIZADO"]
-            ))
-
-        # --- SECCION: INYECCIÓN DE PRODUCTOS GLOBALES (NUEVO) ---
-        skus_globales = obtener_skus_globales(sucursal=sucursal_target)
-        # Evitar duplicar si ya estaba en la lista de asignación
-        skus_vistos = {item[1] for item in resultado}
-        
+    try:
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            # 1. Pivote: un renglón por SKU con el total (solo filas positivas) y el saldo de cada paquete
+            run_query(cursor, SQL_ASIGNACION_PIVOTE, (movil, sucursal_target))
+            filas = cursor.fetchall()
+            if not filas:
+                return []
+
+            # Ordenamos en Python para evitar problemas con SQLite/MySQL orderBy handling con NULLs
+            def sort_key(row):
+                try: return int(row[2])
+                except (TypeError, ValueError): return 9999
+            filas.sort(key=sort_key)
+
+            resultado = [
+                (nombre if nombre else f"Desconocido ({sku})", sku, total, pa, pb, carro, sin_paquete, personalizado)
+                for sku, nombre, _, total, pa, pb, carro, sin_paquete, personalizado in filas
+            ]
+
+            # 2. Productos globales: el stock de bodega es el de TODOS los paquetes (una sola consulta)
+            skus_globales = sorted(obtener_skus_globales(sucursal=sucursal_target, existing_conn=conn))
+            if not skus_globales:
+                return resultado
+
+            placeholders = ', '.join(['?'] * len(skus_globales))
+            run_query(cursor, f"""
+                SELECT sku, cantidad, nombre FROM productos
+                WHERE ubicacion = 'BODEGA' AND sucursal = ? AND sku IN ({placeholders})
+            """, [sucursal_target] + skus_globales)
+            bodega = {}
+            for g_sku, cant_g, nom_g in cursor.fetchall():
+                bodega.setdefault(g_sku, (nom_g, g_sku, cant_g, cant_g, cant_g, cant_g, cant_g, cant_g))
+
+        # Los globales ya asignados se reemplazan en su lugar; el resto va al final
+        posiciones = {row[1]: i for i, row in enumerate(resultado)}
         for g_sku in skus_globales:
-            if g_sku in skus_vistos:
-                # Si ya está asignado, opcionalmente podrías sobreescribir con el stock de bodega
-                # pero los productos globales NO deberían ser asignados manualmente.
-                # Vamos a actualizarlo para que refleje bodega si es global.
-                for i, row in enumerate(resultado):
-                    if row[1] == g_sku:
-                        # Obtener stock total en bodega para este sku
-                        run_query(cursor, "SELECT cantidad, nombre FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ? LIMIT 1", (g_sku, sucursal_target))
-                        res_g = cursor.fetchone()
-                        if res_g:
-                            cant_g = res_g[0]
-                            nom_g = res_g[1]
-                            resultado[i] = (nom_g, g_sku, cant_g, cant_g, cant_g, cant_g, cant_g, cant_g)
+            if g_sku not in bodega:
                 continue
-            
-            # Si no estaba en asignación, agregarlo de la bodega
-            run_query(cursor, "SELECT cantidad, nombre FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ? LIMIT 1", (g_sku, sucursal_target))
-            res_g = cursor.fetchone()
-            if res_g:
-                cant_g = res_g[0]
-                nom_g = res_g[1]
-                # En productos globales, el stock de bodega es el stock de TODOS los paquetes
-                resultado.append((nom_g, g_sku, cant_g, cant_g, cant_g, cant_g, cant_g, cant_g))
-
+            if g_sku in posiciones:
+                resultado[posiciones[g_sku]] = bodega[g_sku]
+            else:
+                resultado.append(bodega[g_sku])
         return resultado
 
     except Exception as e:
         logger.error(f"Error en obtener_asignacion_movil_con_paquetes: {e}")
         return []
-    finally:
-        if conn: close_connection(conn)
 
 def obtener_reporte_asignacion_moviles(movil=None):
     """Obtiene el inventario asignado a TODOS los móviles, opcionalmente filtrado por un móvil específico."""
@@ -349,39 +278,8 @@ def obtener_reporte_asignacion_moviles(movil=None):
 
 def obtener_reporte_consumo(fecha_inicio, fecha_fin):
     """Obtiene el consumo total de material (SALIDA, CONSUMO_MOVIL, DESCARTE) entre dos fechas."""
-    conn = None
-    try:
-        conn = get_db_connection()
-        if DB_TYPE == 'MYSQL':
-            cursor = conn.cursor(buffered=True)
-        else:
-            cursor = conn.cursor()
-        
-        sql_query = f"""
-            SELECT 
-                p.nombre, 
-                m.sku_producto, 
-                SUM(m.cantidad_afectada) AS Consumo_Total
-            FROM movimientos m
-            JOIN productos p ON m.sku_producto = p.sku AND p.ubicacion = 'BODEGA'
-            WHERE 
-                m.tipo_movimiento IN ({', '.join(['?' for _ in TIPOS_CONSUMO])}) AND
-                m.fecha_evento BETWEEN ? AND ?
-            GROUP BY 
-                m.sku_producto, p.nombre
-            ORDER BY 
-                p.secuencia_vista ASC
-        """
-        
-        params = TIPOS_CONSUMO + [fecha_inicio, fecha_fin]
-        run_query(cursor, sql_query, params)
-        return cursor.fetchall()
-        
-    except Exception as e:
-        logger.error(f"Error al generar reporte de consumo: {e}")
-        return []
-    finally:
-        if conn: close_connection(conn)
+    # Sale del resumen diario: el costo depende de los días del rango, no del tamaño de movimientos
+    return consultar_total_por_sku(fecha_inicio, fecha_fin, TIPOS_CONSUMO)
 
 def obtener_stock_actual_y_moviles():
     """Obtiene el stock actual en bodega y el total asignado a móviles por cada SKU."""
@@ -397,7 +295,8 @@ def obtener_stock_actual_y_moviles():
         import os
         sucursal = 'SANTIAGO' if os.environ.get('SANTIAGO_DIRECT_MODE') == '1' else 'CHIRIQUI'
 
-        # OPTIMIZADO: Consolidar 5 queries en 1 sola usando CTEs para mejor rendimiento
+        # OPTIMIZADO: Consolidar 5 queries en 1 sola usando CTEs para mejor rendimiento.
+        # Consumo/abasto salen de saldos_movimientos (data_layer/ledger.py), no del historial completo.
         if DB_TYPE == 'MYSQL':
             sql_consolidada = f"""
                 WITH stock_bodega AS (
@@ -413,17 +312,10 @@ def obtener_stock_actual_y_moviles():
                     WHERE cantidad > 0
                     GROUP BY sku_producto
                 ),
-                consumo_total AS (
-                    SELECT sku_producto, SUM(cantidad_afectada) as cantidad
-                    FROM movimientos 
-                    WHERE tipo_movimiento IN ({{}}) AND sucursal = '{sucursal}'
-                    GROUP BY sku_producto
-                ),
-                abasto_total AS (
-                    SELECT sku_producto, SUM(cantidad_afectada) as cantidad
-                    FROM movimientos 
-                    WHERE tipo_movimiento IN ({{}}) AND sucursal = '{sucursal}'
-                    GROUP BY sku_producto
+                saldos AS (
+                    SELECT sku, consumo_total, abasto_total
+                    FROM saldos_movimientos
+                    WHERE sucursal = '{sucursal}'
                 )
                 SELECT 
                     p.nombre, 
@@ -431,20 +323,16 @@ def obtener_stock_actual_y_moviles():
                     COALESCE(sb.cantidad, 0) as stock_bodega,
                     COALESCE(sm.cantidad, 0) as stock_moviles,
                     COALESCE(sb.cantidad, 0) + COALESCE(sm.cantidad, 0) as stock_total,
-                    COALESCE(ct.cantidad, 0) as consumo,
-                    COALESCE(at.cantidad, 0) as abasto
+                    COALESCE(sa.consumo_total, 0) as consumo,
+                    COALESCE(sa.abasto_total, 0) as abasto
                 FROM productos p
                 LEFT JOIN stock_bodega sb ON p.sku = sb.sku
                 LEFT JOIN stock_moviles sm ON p.sku = sm.sku_producto
-                LEFT JOIN consumo_total ct ON p.sku = ct.sku_producto
-                LEFT JOIN abasto_total at ON p.sku = at.sku_producto
+                LEFT JOIN saldos sa ON p.sku = sa.sku
                 WHERE p.ubicacion = 'BODEGA' AND p.sucursal = '{sucursal}'
                 ORDER BY p.secuencia_vista ASC
-            """.format(
-                ','.join(['%s' for _ in TIPOS_CONSUMO]),
-                ','.join(['%s' for _ in TIPOS_ABASTO])
-            )
-            run_query(cursor, sql_consolidada, TIPOS_CONSUMO + TIPOS_ABASTO)
+            """
+            run_query(cursor, sql_consolidada)
         else:
             # SQLite también soporta CTEs desde versión 3.8.3
             sql_consolidada = """
@@ -460,17 +348,10 @@ def obtener_stock_actual_y_moviles():
                     WHERE cantidad > 0
                     GROUP BY sku_producto
                 ),
-                consumo_total AS (
-                    SELECT sku_producto, SUM(cantidad_afectada) as cantidad
-                    FROM movimientos 
-                    WHERE tipo_movimiento IN ({})
-                    GROUP BY sku_producto
-                ),
-                abasto_total AS (
-                    SELECT sku_producto, SUM(cantidad_afectada) as cantidad
-                    FROM movimientos 
-                    WHERE tipo_movimiento IN ({})
-                    GROUP BY sku_producto
+                saldos AS (
+                    SELECT sku, SUM(consumo_total) as consumo_total, SUM(abasto_total) as abasto_total
+                    FROM saldos_movimientos
+                    GROUP BY sku
                 )
                 SELECT 
                     p.nombre, 
@@ -478,20 +359,16 @@ def obtener_stock_actual_y_moviles():
                     COALESCE(sb.cantidad, 0) as stock_bodega,
                     COALESCE(sm.cantidad, 0) as stock_moviles,
                     COALESCE(sb.cantidad, 0) + COALESCE(sm.cantidad, 0) as stock_total,
-                    COALESCE(ct.cantidad, 0) as consumo,
-                    COALESCE(at.cantidad, 0) as abasto
+                    COALESCE(sa.consumo_total, 0) as consumo,
+                    COALESCE(sa.abasto_total, 0) as abasto
                 FROM productos p
                 LEFT JOIN stock_bodega sb ON p.sku = sb.sku
                 LEFT JOIN stock_moviles sm ON p.sku = sm.sku_producto
-                LEFT JOIN consumo_total ct ON p.sku = ct.sku_producto
-                LEFT JOIN abasto_total at ON p.sku = at.sku_producto
+                LEFT JOIN saldos sa ON p.sku = sa.sku
                 WHERE p.ubicacion = 'BODEGA'
                 ORDER BY p.secuencia_vista ASC
-            """.format(
-                ','.join(['?' for _ in TIPOS_CONSUMO]),
-                ','.join(['?' for _ in TIPOS_ABASTO])
-            )
-            run_query(cursor, sql_consolidada, TIPOS_CONSUMO + TIPOS_ABASTO)
+            """
+            run_query(cursor, sql_consolidada)
         
         return cursor.fetchall()
         
@@ -661,11 +538,16 @@ def obtener_consumos_pendientes(fecha_inicio=None, fecha_fin=None, estado=None,
     finally:
         if conn: close_connection(conn)
 
+def _marcar_catalogo_portal(cursor, moviles=()):
+    """Técnicos y móviles se comparten entre sucursales: versiona ambas (páginas del portal)."""
+    for suc in ('CHIRIQUI', 'SANTIAGO'):
+        marcar_inventario_movil(cursor, suc, moviles)
+
 def obtener_tecnicos(solo_activos=False):
     """Retorna una lista de técnicos [(id, nombre, activo)]"""
     conn = None
     try:
-        conn = get_db_connection()
+        conn = conexion_lectura(('tecnicos',))
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -691,6 +573,7 @@ def crear_tecnico(nombre):
         conn = get_db_connection()
         cursor = conn.cursor()
         run_query(cursor, "INSERT INTO tecnicos (nombre) VALUES (?)", (nombre,))
+        _marcar_catalogo_portal(cursor)
         conn.commit()
         return True, f"Técnico '{nombre}' creado."
     except Exception as e:
@@ -705,6 +588,7 @@ def editar_tecnico(id_tecnico, nuevo_nombre):
         conn = get_db_connection()
         cursor = conn.cursor()
         run_query(cursor, "UPDATE tecnicos SET nombre = ? WHERE id = ?", (nuevo_nombre, id_tecnico))
+        _marcar_catalogo_portal(cursor)
         conn.commit()
         return True, "Técnico actualizado."
     except Exception as e:
@@ -722,6 +606,7 @@ def eliminar_tecnico(id_tecnico, permanentemente=False):
             run_query(cursor, "DELETE FROM tecnicos WHERE id = ?", (id_tecnico,))
         else:
             run_query(cursor, "UPDATE tecnicos SET activo = 0 WHERE id = ?", (id_tecnico,))
+        _marcar_catalogo_portal(cursor)
         conn.commit()
         return True, "Técnico eliminado/desactivado."
     except Exception as e:
@@ -784,6 +669,183 @@ def obtener_inventario_movil(movil):
     finally:
         if conn: close_connection(conn)
 
+# ─────────────────────────────────────────────────────────
+# IDEMPOTENCIA DE ENVÍOS DEL PORTAL (cola offline)
+# ─────────────────────────────────────────────────────────
+# Las claves se conservan este tiempo; un reintento más tardío se aplicaría de nuevo
+ENVIOS_PORTAL_RETENCION_DIAS = 30
+_tabla_envios_lista = False
+
+
+def asegurar_tabla_envios(target_db=None):
+    """Crea envios_portal si falta y purga claves vencidas (una vez por proceso)."""
+    global _tabla_envios_lista
+    if _tabla_envios_lista:
+        return True
+    try:
+        with db_session(target_db=target_db) as (conn, cursor):
+            cursor.execute(SQL_TABLA_ENVIOS_PORTAL)
+            # creado_en lo pone la BD: se compara con su propio reloj
+            run_query(cursor, f"DELETE FROM envios_portal WHERE creado_en < {sql_hace_segundos(ENVIOS_PORTAL_RETENCION_DIAS * 86400)}")
+        _tabla_envios_lista = True
+    except Exception as e:
+        logger.warning(f"No se pudo preparar envios_portal: {e}")
+    return _tabla_envios_lista
+
+
+def obtener_respuesta_envio(clave, target_db=None, existing_conn=None):
+    """Respuesta guardada de un envío ya aplicado (dict), o None si la clave es nueva."""
+    try:
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            run_query(cursor, "SELECT respuesta FROM envios_portal WHERE clave = ?", (clave,))
+            fila = cursor.fetchone()
+        return json.loads(fila[0]) if fila else None
+    except Exception as e:
+        logger.warning(f"No se pudo consultar el envío {clave}: {e}")
+        return None
+
+
+def guardar_respuesta_envio(cursor, clave, ruta, respuesta):
+    """
+    Registra la clave DENTRO de la transacción del envío: si el INSERT choca con un
+    reintento concurrente, el llamador revierte todo y el consumo se aplica una sola vez.
+    """
+    run_query(cursor, "INSERT INTO envios_portal (clave, ruta, respuesta) VALUES (?, ?, ?)",
+              (clave, ruta, json.dumps(respuesta, ensure_ascii=False)))
+
+
+# ─────────────────────────────────────────────────────────
+# SNAPSHOT DE INVENTARIO POR MÓVIL (API /api/inventario/<movil>)
+# ─────────────────────────────────────────────────────────
+# Red de seguridad para escrituras que no versionan (scripts, SQL manual)
+SNAPSHOT_INVENTARIO_TTL_SEG = 600
+
+def _construir_inventario_movil(conn, cursor, movil, sucursal, nombres_globales=None):
+    """Calcula el inventario del técnico con consultas agrupadas (mismo formato que la API)."""
+    catalogo = obtener_catalogo(existing_conn=conn)
+    skus_globales = set(obtener_skus_globales(sucursal=sucursal, existing_conn=conn))
+
+    # HAVING > 0: No mostrar ítems con cantidad 0 (evita registros residuales)
+    run_query(cursor, """
+        SELECT sku_producto, SUM(cantidad) as total, COALESCE(paquete, 'NINGUNO') as paquete
+        FROM asignacion_moviles
+        WHERE movil = ? AND sucursal = ?
+        GROUP BY sku_producto, COALESCE(paquete, 'NINGUNO')
+        HAVING SUM(cantidad) > 0
+    """, (movil, sucursal))
+    asignacion_rows = cursor.fetchall()
+
+    nombres, bodega_globales, seriales_por_paquete = {}, {}, {}
+    skus = sorted({r[0] for r in asignacion_rows} | skus_globales)
+    if skus:
+        ph = ','.join(['?'] * len(skus))
+        run_query(cursor, f"SELECT sku, MAX(nombre) FROM productos WHERE sucursal = ? AND sku IN ({ph}) GROUP BY sku", (sucursal, *skus))
+        nombres = dict(cursor.fetchall())
+    if skus_globales:
+        ph = ','.join(['?'] * len(skus_globales))
+        run_query(cursor, f"SELECT sku, nombre, cantidad FROM productos WHERE ubicacion = 'BODEGA' AND sucursal = ? AND sku IN ({ph})", (sucursal, *sorted(skus_globales)))
+        bodega_globales = {sku: (nombre, cantidad) for sku, nombre, cantidad in cursor.fetchall()}
+    if any(r[0] in catalogo.con_serial for r in asignacion_rows):
+        # Separación estricta por paquete (días): los seriales se agrupan por (sku, paquete)
+        run_query(cursor, """
+            SELECT sku, COALESCE(paquete, 'NINGUNO'), serial_number
+            FROM series_registradas
+            WHERE ubicacion = ? AND sucursal = ?
+            ORDER BY serial_number
+        """, (movil, sucursal))
+        for sku, paquete, serial in cursor.fetchall():
+            seriales_por_paquete.setdefault((sku, paquete), []).append(serial)
+
+    inventario = []
+    for sku, cantidad, paquete in asignacion_rows:
+        es_global = sku in skus_globales
+        item = {"sku": sku, "nombre": nombres.get(sku), "paquete": paquete}
+        if sku in catalogo.con_serial:
+            seriales = seriales_por_paquete.get((sku, paquete or 'NINGUNO'), [])
+            item.update({"seriales": seriales, "cantidad_total": len(seriales), "tiene_series": True})
+        else:
+            item.update({"cantidad_total": cantidad, "tiene_series": False})
+        # SI ES GLOBAL: Sobre-escribir cantidad con la de BODEGA
+        if es_global and sku in bodega_globales:
+            item["cantidad_total"] = bodega_globales[sku][1]
+        item["compartido"] = (sku in catalogo.compartidos or es_global or paquete == 'PERSONALIZADO')
+        item["es_global"] = es_global
+        inventario.append(item)
+
+    # Globales sin ninguna asignación en el móvil: se muestran desde BODEGA en ambos paquetes
+    skus_en_inventario = {item['sku'] for item in inventario}
+    for g_sku in sorted(skus_globales - skus_en_inventario):
+        if g_sku not in bodega_globales:
+            continue
+        nombre_g, cant_g = bodega_globales[g_sku]
+        for p_tag in ['PAQUETE A', 'PAQUETE B']:
+            inventario.append({
+                "sku": g_sku,
+                "nombre": (nombres_globales or {}).get(g_sku, nombre_g),
+                "paquete": p_tag,
+                "cantidad_total": cant_g,
+                "tiene_series": False,
+                "compartido": True,
+                "es_global": True
+            })
+    return inventario
+
+def obtener_inventario_movil_snapshot(movil, sucursal_context=None, nombres_globales=None, target_db=None, existing_conn=None):
+    """
+    Inventario del técnico servido desde 'inventario_movil_snapshot'.
+
+    El snapshot es válido mientras coincidan las versiones del móvil y de los productos
+    globales (las incrementan los escritores con marcar_inventario_movil en su misma
+    transacción) y no supere SNAPSHOT_INVENTARIO_TTL_SEG. Si no, se recalcula y se guarda.
+
+    Retorna: (inventario, desde_snapshot)
+    """
+    from data_layer.core import CLAVE_VERSION_GLOBALES
+    sucursal = (sucursal_context or ('SANTIAGO' if movil in MOVILES_SANTIAGO else 'CHIRIQUI')).upper()
+    clave = str(movil).strip().upper()
+
+    with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+        try:
+            run_query(cursor, """
+                SELECT s.payload, s.version_movil, s.version_globales, s.generado_en,
+                       (SELECT v.version FROM inventario_movil_version v WHERE v.clave = ? AND v.sucursal = s.sucursal),
+                       (SELECT g.version FROM inventario_movil_version g WHERE g.clave = ? AND g.sucursal = s.sucursal)
+                FROM inventario_movil_snapshot s
+                WHERE s.movil = ? AND s.sucursal = ?
+            """, (clave, CLAVE_VERSION_GLOBALES, movil, sucursal))
+            fila = cursor.fetchone()
+            if fila:
+                payload, v_movil, v_globales, generado_en, v_movil_actual, v_globales_actual = fila
+                if isinstance(generado_en, str):
+                    generado_en = datetime.strptime(generado_en[:19], '%Y-%m-%d %H:%M:%S')
+                vigente = (generado_en and (datetime.now() - generado_en).total_seconds() < SNAPSHOT_INVENTARIO_TTL_SEG)
+                if vigente and v_movil == (v_movil_actual or 0) and v_globales == (v_globales_actual or 0):
+                    return json.loads(payload), True
+        except Exception as e:
+            logger.warning(f"Snapshot de inventario no disponible para {movil}: {e}")
+
+        # Versiones leídas ANTES de calcular: una escritura concurrente invalida el snapshot que guardemos
+        versiones = {}
+        try:
+            run_query(cursor, "SELECT clave, version FROM inventario_movil_version WHERE sucursal = ? AND clave IN (?, ?)",
+                      (sucursal, clave, CLAVE_VERSION_GLOBALES))
+            versiones = dict(cursor.fetchall())
+        except Exception:
+            pass
+
+        inventario = _construir_inventario_movil(conn, cursor, movil, sucursal, nombres_globales)
+
+        try:
+            run_query(cursor, """
+                REPLACE INTO inventario_movil_snapshot (movil, sucursal, version_movil, version_globales, payload, generado_en)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (movil, sucursal, versiones.get(clave, 0), versiones.get(CLAVE_VERSION_GLOBALES, 0),
+                  json.dumps(inventario, ensure_ascii=False), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        except Exception as e:
+            logger.warning(f"No se pudo guardar snapshot de inventario de {movil}: {e}")
+
+        return inventario, False
+
 def obtener_ultimos_movimientos(limite=15):
     """
     Obtiene los últimos movimientos registrados en el sistema.
@@ -842,60 +904,18 @@ def obtener_ultimos_movimientos(limite=15):
     finally:
         if conn: close_connection(conn)
 
-def obtener_historial_completo(limite=500, filtro_texto=None, sucursal_context=None):
+def obtener_historial_completo(limite=HISTORIAL_PAGINA, filtro_texto=None, sucursal_context=None, antes_de_id=None):
     """
-    Obtiene el historial completo de movimientos con filtros opcionales.
+    Obtiene una página del historial de movimientos (del más nuevo al más viejo), con filtro opcional.
+    Para la página siguiente, pasar antes_de_id = id de la última fila recibida.
     """
-    conn = None
     try:
         from config import CURRENT_CONTEXT
         sucursal_target = sucursal_context or CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
-        
-        conn = get_db_connection()
-        if DB_TYPE == 'MYSQL':
-            cursor = conn.cursor(buffered=True)
-        else:
-            cursor = conn.cursor()
-        
-        sql = """
-            SELECT 
-                m.id,
-                m.fecha_movimiento,
-                m.tipo_movimiento,
-                COALESCE(p.nombre, m.sku_producto) as nombre,
-                m.cantidad_afectada,
-                COALESCE(m.movil_afectado, '-') as detalle,
-                COALESCE(m.observaciones, '') as obs
-            FROM movimientos m
-            LEFT JOIN productos p ON m.sku_producto = p.sku AND p.ubicacion = 'BODEGA'
-            WHERE (m.sucursal = ? OR (m.sucursal IS NULL AND ? = 'CHIRIQUI'))
-        """
-        params = [sucursal_target, sucursal_target]
-        
-        if filtro_texto:
-            sql += """ AND (
-                m.sku_producto LIKE ? OR 
-                m.tipo_movimiento LIKE ? OR 
-                m.movil_afectado LIKE ? OR 
-                m.observaciones LIKE ? OR 
-                m.documento_referencia LIKE ? OR 
-                COALESCE(p.nombre, '') LIKE ?
-            )"""
-            params.extend([f"%{filtro_texto}%"] * 6)
-            
-        sql += " ORDER BY m.id DESC LIMIT ?"
-        params.append(limite)
-        
-        if DB_TYPE == 'MYSQL':
-            sql = sql.replace('?', '%s')
-            
-        run_query(cursor, sql, tuple(params))
-        return cursor.fetchall()
+        return buscar_historial(filtro_texto, sucursal_target, limite=limite, antes_de_id=antes_de_id)
     except Exception as e:
         logger.error(f"Error en obtener_historial_completo: {e}")
         return []
-    finally:
-        if conn: close_connection(conn)
 
 def crear_movil(nombre, patente=None, conductor=None, ayudante=None):
     """Crea un nuevo móvil en la base de datos."""
@@ -910,6 +930,7 @@ def crear_movil(nombre, patente=None, conductor=None, ayudante=None):
             INSERT INTO moviles (nombre, patente, conductor, ayudante, activo) 
             VALUES (?, ?, ?, ?, 1)
         """, (nombre, patente, conductor, ayudante))
+        _marcar_catalogo_portal(cursor, [nombre])
         conn.commit()
         return True, f"Móvil '{nombre}' creado con éxito."
     except sqlite3.IntegrityError:
@@ -926,7 +947,7 @@ def obtener_moviles(solo_activos=True):
         from config import CURRENT_CONTEXT
         moviles_permitidos = CURRENT_CONTEXT.get('MOVILES', [])
         
-        conn = get_db_connection()
+        conn = conexion_lectura(('moviles',))
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -992,9 +1013,14 @@ def editar_movil(nombre_actual, nuevo_nombre, nueva_patente, nuevo_conductor, nu
         if nombre_actual != nuevo_nombre:
             # Actualizar referencias en otras tablas
             run_query(cursor, "UPDATE asignacion_moviles SET movil = ? WHERE movil = ?", (nuevo_nombre, nombre_actual))
+            run_query(cursor, "SELECT id FROM movimientos WHERE movil_afectado = ?", (nombre_actual,))
+            ids_movimientos = [f[0] for f in cursor.fetchall()]
             run_query(cursor, "UPDATE movimientos SET movil_afectado = ? WHERE movil_afectado = ?", (nuevo_nombre, nombre_actual))
+            reindexar_movimientos(cursor, ids_movimientos)
+            renombrar_movil_resumen(cursor, nombre_actual, nuevo_nombre)
             run_query(cursor, "UPDATE recordatorios_pendientes SET movil = ? WHERE movil = ?", (nuevo_nombre, nombre_actual))
             
+        _marcar_catalogo_portal(cursor, [nombre_actual, nuevo_nombre])
         conn.commit()
         return True, f"Móvil '{nombre_actual}' actualizado con éxito."
     except sqlite3.IntegrityError:
@@ -1022,6 +1048,7 @@ def eliminar_movil(nombre):
             return False, "No se puede eliminar: El móvil tiene productos asignados. Realice un retorno o traslado primero."
 
         run_query(cursor, "UPDATE moviles SET activo = 0 WHERE nombre = ?", (nombre,))
+        _marcar_catalogo_portal(cursor, [nombre])
         conn.commit()
         return True, f"Móvil '{nombre}' desactivado correctamente (archivado)."
     except Exception as e:
@@ -1223,16 +1250,17 @@ def resetear_stock_movil(movil, paquete):
         # Caso 1: Resetear TODO el móvil
         if paquete_norm == 'TODOS':
             # 1. Contar items a eliminar
-            sql_check = f"SELECT SUM(cantidad) FROM asignacion_moviles WHERE UPPER(TRIM(movil)) = {ph} AND sucursal = {ph}"
+            sql_check = f"SELECT sku_producto, paquete, SUM(cantidad) FROM asignacion_moviles WHERE UPPER(TRIM(movil)) = {ph} AND sucursal = {ph} GROUP BY sku_producto, paquete"
             cursor.execute(sql_check, (movil_norm, sucursal_active))
-            res = cursor.fetchone()
-            total_items = res[0] if res and res[0] else 0
+            eliminadas = cursor.fetchall()
             
             # 2. Eliminar asignaciones
             sql_del = f"DELETE FROM asignacion_moviles WHERE UPPER(TRIM(movil)) = {ph} AND sucursal = {ph}"
             cursor.execute(sql_del, (movil_norm, sucursal_active))
             
             # 3. Resetear Series (Equipos) -> Volver a BODEGA y paquete NINGUNO
+            cursor.execute(f"SELECT DISTINCT sku FROM series_registradas WHERE UPPER(TRIM(ubicacion)) = {ph} AND sucursal = {ph}", (movil_norm, sucursal_active))
+            skus_series = [f[0] for f in cursor.fetchall()]
             sql_reset_series = f"UPDATE series_registradas SET ubicacion = 'BODEGA', estado = 'DISPONIBLE', paquete = 'NINGUNO' WHERE UPPER(TRIM(ubicacion)) = {ph} AND sucursal = {ph}"
             cursor.execute(sql_reset_series, (movil_norm, sucursal_active))
 
@@ -1245,16 +1273,17 @@ def resetear_stock_movil(movil, paquete):
         # Caso 2: Resetear un paquete específico
         else:
             # 1. Contar items
-            sql_check = f"SELECT SUM(cantidad) FROM asignacion_moviles WHERE UPPER(TRIM(movil)) = {ph} AND (COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') = {ph} OR COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') IN ('NINGUNO', 'SIN_PAQUETE')) AND sucursal = {ph}"
+            sql_check = f"SELECT sku_producto, paquete, SUM(cantidad) FROM asignacion_moviles WHERE UPPER(TRIM(movil)) = {ph} AND (COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') = {ph} OR COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') IN ('NINGUNO', 'SIN_PAQUETE')) AND sucursal = {ph} GROUP BY sku_producto, paquete"
             cursor.execute(sql_check, (movil_norm, paquete_norm, sucursal_active))
-            res = cursor.fetchone()
-            total_items = res[0] if res and res[0] else 0
+            eliminadas = cursor.fetchall()
             
             # 2. Eliminar asignaciones del paquete y huérfanos que fueron integrados en la auditoría
             sql_del = f"DELETE FROM asignacion_moviles WHERE UPPER(TRIM(movil)) = {ph} AND (COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') = {ph} OR COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') IN ('NINGUNO', 'SIN_PAQUETE')) AND sucursal = {ph}"
             cursor.execute(sql_del, (movil_norm, paquete_norm, sucursal_active))
 
             # 3. Resetear Series correspondientes al paquete -> Volver a BODEGA y paquete NINGUNO
+            cursor.execute(f"SELECT DISTINCT sku FROM series_registradas WHERE UPPER(TRIM(ubicacion)) = {ph} AND (COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') = {ph} OR COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') IN ('NINGUNO', 'SIN_PAQUETE')) AND sucursal = {ph}", (movil_norm, paquete_norm, sucursal_active))
+            skus_series = [f[0] for f in cursor.fetchall()]
             sql_reset_series = f"UPDATE series_registradas SET ubicacion = 'BODEGA', estado = 'DISPONIBLE', paquete = 'NINGUNO' WHERE UPPER(TRIM(ubicacion)) = {ph} AND (COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') = {ph} OR COALESCE(UPPER(TRIM(paquete)), 'NINGUNO') IN ('NINGUNO', 'SIN_PAQUETE')) AND sucursal = {ph}"
             cursor.execute(sql_reset_series, (movil_norm, paquete_norm, sucursal_active))
             
@@ -1264,6 +1293,7 @@ def resetear_stock_movil(movil, paquete):
             
             observacion = f"Limpieza de {paquete_norm} en móvil {movil_norm} (PIN 0440)"
         
+        total_items = sum(f[2] or 0 for f in eliminadas)
         # Registrar movimiento de 'LIMPIEZA'
         sql_mov = """
             INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, movil_afectado, 
@@ -1271,15 +1301,17 @@ def resetear_stock_movil(movil, paquete):
             VALUES ('N/A', 'LIMPIEZA_MOVIL', ?, ?, ?, CURRENT_DATE, ?)
         """
         run_query(cursor, sql_mov, (total_items, movil, paquete, observacion))
-        
+        indexar_ids(cursor, [cursor.lastrowid])
+        acumular_movimientos(cursor, [('N/A', 'LIMPIEZA_MOVIL', total_items, movil, None, None)])
+        # La sincronización de abajo puede mover la BODEGA de globales serializados
+        marcar_inventario_movil(cursor, sucursal_active, [movil], globales=True)
+        registrar_cambios(cursor, sucursal_active, [(sku, movil, pq, -(cant or 0)) for sku, pq, cant in eliminadas], 'reset')
+
+        # Sincronizar el stock de BODEGA solo para los seriales que regresaron, en la misma transacción
+        if skus_series and not sincronizar_stock_bodega_serializado(sucursal_context=sucursal_active, skus=skus_series, existing_conn=conn):
+            raise Exception("No se pudo sincronizar el stock de BODEGA")
+
         conn.commit()
-        
-        # NUEVO: Sincronizar stock en la tabla productos para los seriales que regresaron a BODEGA
-        try:
-            from data_layer.movements import sincronizar_stock_bodega_serializado
-            sincronizar_stock_bodega_serializado(sucursal_context=sucursal_active)
-        except Exception as e_sync:
-            logger.error(f"Error en sincronización post-reset móvil: {e_sync}")
 
         logger.info(f"🧹 Móvil {movil} ({paquete}) limpiado: {total_items} registros eliminados.")
         return True, f"Se ha limpiado el {movil} ({paquete}) correctamente. Se eliminaron registros de {total_items} unidades de stock."
@@ -1335,10 +1367,13 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
         
         exitos = 0
         errores = []
+        ubicaciones_afectadas = set()
+        cambios = {}
         
         for sn in seriales:
             # 1. Obtener ubicación REAL y SKU del equipo
-            run_query(cursor, "SELECT ubicacion, sku, paquete FROM series_registradas WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?", (sn, sn, sucursal))
+            sn_norm = str(sn).strip().upper()
+            run_query(cursor, "SELECT ubicacion, sku, paquete FROM series_registradas WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?", (sn_norm, sn_norm, sucursal))
             row = cursor.fetchone()
             if not row:
                 errores.append(f"Serial/MAC {sn} no encontrado.")
@@ -1347,6 +1382,7 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
             loc_real = row[0]
             sku_real = row[1]
             pq_real = row[2] if row[2] else 'NINGUNO'
+            ubicaciones_afectadas.add(loc_real)
             
             # 2. Descontar del inventario lógico según ubicación
             if loc_real == 'BODEGA':
@@ -1355,6 +1391,7 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
                 prod_row = cursor.fetchone()
                 if prod_row:
                     run_query(cursor, "UPDATE productos SET cantidad = cantidad - 1 WHERE sku = ? AND ubicacion = ? AND sucursal = ?", (sku_real, loc_real, sucursal))
+                    cambios[(sku_real, loc_real, None)] = cambios.get((sku_real, loc_real, None), 0) - 1
                 else:
                     logger.warning(f"Equipo {sn} en BODEGA pero no hay stock en tabla productos.")
             else:
@@ -1365,6 +1402,8 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
                 
                 if asig_row:
                     nueva_qty = max(0, float(asig_row[0]) - 1)
+                    clave_cambio = (sku_real, loc_real, None if pq_real == 'NINGUNO' else pq_real)
+                    cambios[clave_cambio] = cambios.get(clave_cambio, 0) - (float(asig_row[0]) - nueva_qty)
                     if nueva_qty > 0:
                         run_query(cursor, "UPDATE asignacion_moviles SET cantidad = ? WHERE sku_producto = ? AND movil = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?",
                                        (nueva_qty, sku_real, loc_real, pq_real, sucursal))
@@ -1380,10 +1419,12 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
                                        fecha_evento, observaciones, sucursal) 
                 VALUES (?, ?, 1, ?, ?, ?, ?)
             """, (sku_real, TIPO_MOVIMIENTO_DESCARTE, loc_real, fecha_evento, f"{obs} [Desde: {loc_real}]", sucursal))
+            indexar_ids(cursor, [cursor.lastrowid])
+            acumular_movimientos(cursor, [(sku_real, TIPO_MOVIMIENTO_DESCARTE, 1, loc_real, fecha_evento, sucursal)])
             
             # Actualizar la serie
-            run_query(cursor, "UPDATE series_registradas SET ubicacion = ?, estado = ? WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?",
-                        (UBICACION_DESCARTE, 'DESCARTE', sn, sn, sucursal))
+            run_query(cursor, "UPDATE series_registradas SET ubicacion = ?, estado = ? WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?",
+                        (UBICACION_DESCARTE, 'DESCARTE', sn_norm, sn_norm, sucursal))
                         
             # Asegurar que el inventario contable en DESCARTE se incremente
             run_query(cursor, "SELECT sku FROM productos WHERE sku = ? AND ubicacion = ? AND sucursal = ?", (sku_real, UBICACION_DESCARTE, sucursal))
@@ -1395,9 +1436,12 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
                 # Corregido: 'secuencia' -> 'secuencia_vista'
                 run_query(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) SELECT nombre, sku, 1, ?, '99z', ? FROM productos WHERE sku = ? LIMIT 1", 
                                (UBICACION_DESCARTE, sucursal, sku_real))
+            cambios[(sku_real, UBICACION_DESCARTE, None)] = cambios.get((sku_real, UBICACION_DESCARTE, None), 0) + 1
             
             exitos += 1
             
+        marcar_inventario_movil(cursor, sucursal, ubicaciones_afectadas - {'BODEGA'}, globales='BODEGA' in ubicaciones_afectadas)
+        registrar_cambios(cursor, sucursal, cambios, 'danado')
         conn.commit()
         if exitos == 0:
             return False, f"Ningún equipo procesado. Errores: {', '.join(errores)}"
@@ -1413,14 +1457,20 @@ def registrar_danado_directo(sku, cantidad, tecnico, observaciones=None, seriale
     finally:
         if conn: close_connection(conn)
 
-def registrar_consumo_directo(sku, cantidad, movil, tecnico, ayudante=None, ticket=None, colilla=None, fecha_evento=None, seriales=None, observaciones=None, tipo_custom=None, target_db=None, sucursal_context=None, paquete=None):
+def registrar_consumo_directo(sku, cantidad, movil, tecnico, ayudante=None, ticket=None, colilla=None, fecha_evento=None, seriales=None, observaciones=None, tipo_custom=None, target_db=None, sucursal_context=None, paquete=None, existing_conn=None):
     """
     Registra un consumo directo desde BODEGA para la sucursal de Santiago o Móvil.
+    Con existing_conn no confirma ni revierte: el llamador controla la transacción.
     """
     import json
     conn = None
+    should_close = True
     try:
-        conn = get_db_connection(target_db=target_db)
+        if existing_conn:
+            conn = existing_conn
+            should_close = False
+        else:
+            conn = get_db_connection(target_db=target_db)
         if DB_TYPE == 'MYSQL':
             cursor = conn.cursor(buffered=True)
         else:
@@ -1460,6 +1510,9 @@ def registrar_consumo_directo(sku, cantidad, movil, tecnico, ayudante=None, tick
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """
         run_query(cursor, sql_mov, (sku, tipo_mov, cantidad, movil, fecha_evento, obs_mov, ticket, sucursal))
+        id_movimiento = cursor.lastrowid
+        indexar_ids(cursor, [id_movimiento])
+        acumular_movimientos(cursor, [(sku, tipo_mov, cantidad, movil, fecha_evento, sucursal)])
         
         # 4. Registrar en consumos_pendientes (Audit Trail)
         seriales_json = json.dumps(seriales) if seriales else None
@@ -1474,6 +1527,7 @@ def registrar_consumo_directo(sku, cantidad, movil, tecnico, ayudante=None, tick
         
         # 5. Manejar Seriales
         if seriales:
+            registrar_series_consumo(cursor, sucursal, seriales, consumo_id=cursor.lastrowid, movimiento_id=id_movimiento)
             # Si es descarte, marcamos como tal, si no como consumido (Baja)
             new_loc = 'CONSUMIDO'
             new_status = 'BAJA'
@@ -1483,18 +1537,22 @@ def registrar_consumo_directo(sku, cantidad, movil, tecnico, ayudante=None, tick
                 
             for sn in seriales:
                 # Actualizar tanto por serial como por MAC por seguridad
-                run_query(cursor, "UPDATE series_registradas SET ubicacion = ?, estado = ? WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?", 
-                          (new_loc, new_status, sn, sn, sucursal))
+                sn_norm = str(sn).strip().upper()
+                run_query(cursor, "UPDATE series_registradas SET ubicacion = ?, estado = ? WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?", 
+                          (new_loc, new_status, sn_norm, sn_norm, sucursal))
                 
-        conn.commit()
+        marcar_inventario_movil(cursor, sucursal, [movil], globales=sku in obtener_skus_globales(sucursal=sucursal, existing_conn=conn))
+        registrar_cambios(cursor, sucursal, {(sku, 'BODEGA', None): -cantidad}, 'consumo')
+        if should_close:
+            conn.commit()
         return True, f"Consumo directo de {cantidad} {nombre_prod} registrado exitosamente."
         
     except Exception as e:
-        if conn: conn.rollback()
+        if conn and should_close: conn.rollback()
         logger.error(f"Error en registrar_consumo_directo: {e}")
         return False, str(e)
     finally:
-        if conn: close_connection(conn)
+        if conn and should_close: close_connection(conn)
 
 def registrar_faltante_audit(movil, sku, cantidad, seriales=None, sucursal=None, observaciones=None, paquete=None, existing_conn=None):
     """Registra permanentemente un faltante detectado durante el retorno."""
@@ -1531,8 +1589,8 @@ def registrar_faltante_audit(movil, sku, cantidad, seriales=None, sucursal=None,
                 run_query(cursor, """
                     UPDATE series_registradas 
                     SET ubicacion = 'FALTANTE', estado = 'FALTANTE'
-                    WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?
-                """, (s, s, sucursal))
+                    WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?
+                """, (str(s).strip().upper(), str(s).strip().upper(), sucursal))
         
         # 3. Restar de asignacion_moviles para mantener sincronía
         if cantidad > 0:
@@ -1562,6 +1620,7 @@ def registrar_faltante_audit(movil, sku, cantidad, seriales=None, sucursal=None,
                 # al día siguiente cuando se procesan otros movimientos del mismo móvil.
                 # Las filas con cantidad=0 se filtran en la API de inventario.
         
+        marcar_inventario_movil(cursor, sucursal, [movil])
         logger.info(f"🚩 Faltante registrado: {movil} - {sku} x{cantidad} ({sucursal})")
         if should_close:
             conn.commit()
@@ -1609,8 +1668,8 @@ def registrar_faltante_manual(movil, sku, cantidad, seriales=None, paquete=None,
                     run_query(cursor, """
                         UPDATE series_registradas 
                         SET ubicacion = 'FALTANTE', estado = 'FALTANTE'
-                        WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?
-                    """, (s, s, sucursal))
+                        WHERE (serial_norm = ? OR mac_norm = ?) AND sucursal = ?
+                    """, (str(s).strip().upper(), str(s).strip().upper(), sucursal))
             
             # SINCRONIZAR: Restar de asignacion_moviles
             if cantidad > 0:
@@ -1636,6 +1695,7 @@ def registrar_faltante_manual(movil, sku, cantidad, seriales=None, paquete=None,
                 # Eliminarlas causa desaparición de equipos en el portal Render.
                 # Las filas con cantidad=0 se filtran en la API de inventario.
 
+            marcar_inventario_movil(cursor, sucursal, [movil])
             logger.info(f"🚩 Faltante MANUAL registrado: {movil} - {sku} x{cantidad} en {paquete or 'NINGUNO'}")
             return True, "Faltante registrado correctamente"
     except Exception as e:
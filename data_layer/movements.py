@@ -10,254 +10,614 @@ from utils.validators import validate_sku, validate_quantity, validate_date, val
 from config import DATABASE_NAME, DB_TYPE, MYSQL_HOST, MYSQL_USER, MYSQL_PASS, MYSQL_DB, MYSQL_PORT, MOVILES_DISPONIBLES, MOVILES_SANTIAGO, UBICACION_DESCARTE, TIPO_MOVIMIENTO_DESCARTE, TIPOS_CONSUMO, TIPOS_ABASTO, PAQUETES_MATERIALES, PRODUCTOS_INICIALES, MATERIALES_COMPARTIDOS
 from utils.db_connector import get_db_connection, close_connection, db_session
 
-from data_layer.core import run_query, safe_messagebox
+from data_layer.core import run_query, run_many, safe_messagebox, marcar_inventario_movil
+from data_layer.catalog import obtener_catalogo
+from data_layer.changes import registrar_cambios
+from data_layer.ledger import acumular_movimientos
+from data_layer.serials import registrar_series_consumo
+from data_layer.search import reindexar_movimientos, indexar_movimientos, ultimo_id_movimiento
 from data_layer.inventory import *
 
 def registrar_movimiento_gui(sku, tipo_movimiento, cantidad_afectada, movil_afectado=None, fecha_evento=None, paquete_asignado=None, observaciones=None, documento_referencia=None, target_db_name=None, existing_conn=None, sucursal_context=None, seriales=None):
     """
     Registra un movimiento, actualiza la cantidad en Bodega/Asignación y maneja la ubicación DESCARTE.
+    Es un lote de un solo item de registrar_movimientos_batch (mismas reglas y guardas atómicas).
+    """
+    item = {
+        'sku': sku,
+        'tipo_movimiento': tipo_movimiento,
+        'cantidad_afectada': cantidad_afectada,
+        'movil_afectado': movil_afectado,
+        'fecha_evento': fecha_evento,
+        'paquete_asignado': paquete_asignado,
+        'observaciones': observaciones,
+        'documento_referencia': documento_referencia,
+        'seriales': seriales,
+    }
+    exito, mensaje, _ = registrar_movimientos_batch(
+        [item], target_db_name=target_db_name, existing_conn=existing_conn, sucursal_context=sucursal_context
+    )
+    return exito, mensaje
+
+# ─────────────────────────────────────────────────────────
+# MOTOR DE MOVIMIENTOS POR LOTE
+# ─────────────────────────────────────────────────────────
+# Flujo: normalizar items → precargar estado con pocas consultas IN (...)
+# → validar stock en memoria item por item → escribir con sentencias agrupadas.
+# Las restas de stock conservan la guarda atómica 'cantidad >= ?' en el UPDATE.
+
+_TAMANO_BLOQUE_IN = 200
+_TAMANO_BLOQUE_CASE = 100
+
+
+class _ConflictoConcurrente(Exception):
+    """Una guarda atómica (cantidad >= ?) no se cumplió: otra sesión modificó el stock."""
+    pass
+
+
+class _LoteRechazado(Exception):
+    """Un paso de negocio rechazó el lote; se propaga para que db_session haga rollback."""
+    pass
+
+
+def _placeholders(n):
+    return ','.join(['?'] * n)
+
+
+def _bloques(valores, tamano=_TAMANO_BLOQUE_IN):
+    valores = list(valores)
+    for i in range(0, len(valores), tamano):
+        yield valores[i:i + tamano]
+
+
+def _norm(valor):
+    """Clave de comparación equivalente a UPPER(TRIM(x)) (collation *_ci de MySQL)."""
+    return str(valor).strip().upper() if valor is not None else ''
+
+
+def _normalizar_item_movimiento(item, fecha_evento=None, documento_referencia=None, sucursal_context=None):
+    """
+    Valida un item del lote con las mismas reglas de registrar_movimiento_gui.
+    Retorna (movimiento_normalizado, None) o (None, mensaje_error).
     """
     try:
-        # Validación de entrada
-        sku = validate_sku(sku)
-        cantidad_afectada = validate_quantity(cantidad_afectada, allow_zero=False, allow_negative=False)
-        if movil_afectado:
-            if movil_afectado.upper() == 'SANTIAGO':
-                movil_afectado = 'SANTIAGO'
+        sku = validate_sku(item.get('sku'))
+        cantidad = validate_quantity(item.get('cantidad_afectada', item.get('cantidad')), allow_zero=False, allow_negative=False)
+        movil = item.get('movil_afectado', item.get('movil')) or None
+        if movil:
+            if movil.upper() == 'SANTIAGO':
+                movil = 'SANTIAGO'
             else:
                 from config import CURRENT_CONTEXT
-                movil_afectado = validate_movil(movil_afectado, CURRENT_CONTEXT['MOVILES'])
-        
+                movil = validate_movil(movil, CURRENT_CONTEXT['MOVILES'])
+
+        observaciones = item.get('observaciones')
         if observaciones:
             observaciones = validate_observaciones(observaciones)
-        
-        if seriales:
-            seriales_str = ", ".join(seriales)
-            observaciones = f"{observaciones} | Series: {seriales_str}" if observaciones else f"Series: {seriales_str}"
-                
-        if not fecha_evento: 
-             return False, "Error de Fecha: La fecha del evento es obligatoria."
-        
-        if paquete_asignado in ("NINGUNO", "PERSONALIZADO"):
-             if paquete_asignado == "NINGUNO":
-                 paquete_asignado = None
-        
-        from config import MOVILES_SANTIAGO
-        sucursal = sucursal_context
-        if not sucursal:
-            if movil_afectado and movil_afectado in MOVILES_SANTIAGO:
-                sucursal = 'SANTIAGO'
-            elif movil_afectado:
-                sucursal = 'CHIRIQUI'
+    except ValidationError as e:
+        return None, f"Error en la base de datos: {str(e)}"
+
+    seriales = [str(s) for s in (item.get('seriales') or []) if s]
+    if seriales:
+        seriales_str = ", ".join(seriales)
+        observaciones = f"{observaciones} | Series: {seriales_str}" if observaciones else f"Series: {seriales_str}"
+
+    fecha = item.get('fecha_evento') or fecha_evento
+    if not fecha:
+        return None, "Error de Fecha: La fecha del evento es obligatoria."
+
+    paquete = item.get('paquete_asignado', item.get('paquete'))
+    if paquete == "NINGUNO":
+        paquete = None
+
+    sucursal = sucursal_context
+    if not sucursal:
+        if movil and movil in MOVILES_SANTIAGO:
+            sucursal = 'SANTIAGO'
+        elif movil:
+            sucursal = 'CHIRIQUI'
+        else:
+            sucursal = 'SANTIAGO' if os.environ.get('SANTIAGO_DIRECT_MODE') == '1' else 'CHIRIQUI'
+
+    return {
+        'sku': sku,
+        'tipo': item.get('tipo_movimiento'),
+        'cantidad': cantidad,
+        'movil': movil,
+        'fecha': fecha,
+        'paquete': paquete,
+        'observaciones': observaciones,
+        'documento': item.get('documento_referencia', documento_referencia),
+        'seriales': seriales,
+        'sucursal': sucursal,
+    }, None
+
+
+def _precargar_estado_lote(conn, cursor, movs):
+    """
+    Carga en pocas consultas IN (...) todo lo que el lote necesita:
+    filas de BODEGA/DESCARTE, SKUs globales, asignaciones de los móviles,
+    seriales marcados como faltantes e IDs de series_registradas.
+    """
+    skus = sorted({m['sku'] for m in movs})
+    sucursales = sorted({m['sucursal'] for m in movs})
+    estado = {
+        'bodega': {},        # (sku, sucursal) -> {cantidad, inicial, nombre, secuencia, existe}
+        'meta': {},          # sku -> (nombre, secuencia) de cualquier BODEGA (fallback global)
+        'descarte': set(),   # (sku, sucursal) con fila DESCARTE existente
+        'globales': {},      # sucursal -> set(sku)
+        'asignaciones': {},  # (sku, sucursal) -> [ {id, movil, movil_norm, paquete, cantidad, inicial} ]
+        'faltantes': {},     # serial_norm -> (serial, faltante_id)
+        'series': {},        # (serial_norm, sucursal) -> set(id)
+        'compartidos': obtener_catalogo(existing_conn=conn).compartidos,  # frozenset(sku) del catálogo
+    }
+
+    for bloque in _bloques(skus):
+        run_query(cursor, f"SELECT sku, sucursal, ubicacion, cantidad, nombre, secuencia_vista FROM productos WHERE ubicacion IN ('BODEGA', ?) AND sku IN ({_placeholders(len(bloque))})",
+                  tuple([UBICACION_DESCARTE] + bloque))
+        for sku, suc, ubicacion, cantidad, nombre, secuencia in cursor.fetchall():
+            if ubicacion == 'BODEGA':
+                estado['meta'].setdefault(sku, (nombre, secuencia))
+                cantidad = float(cantidad or 0)
+                estado['bodega'][(sku, suc)] = {'cantidad': cantidad, 'inicial': cantidad, 'nombre': nombre, 'secuencia': secuencia, 'existe': True}
             else:
-                import os
-                sucursal = 'SANTIAGO' if os.environ.get('SANTIAGO_DIRECT_MODE') == '1' else 'CHIRIQUI'
+                estado['descarte'].add((sku, suc))
 
-        paquete_para_stock = paquete_asignado
-        
-        with db_session(target_db=target_db_name, existing_conn=existing_conn) as (conn, cursor):
-            run_query(cursor, "SELECT cantidad, nombre, secuencia_vista FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ?", (sku, sucursal))
-            resultado_bodega = cursor.fetchone()
-            
-            if not resultado_bodega:
-                run_query(cursor, "SELECT 0, nombre, secuencia_vista FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' LIMIT 1", (sku,))
-                resultado_bodega = cursor.fetchone()
-
-            if not resultado_bodega:
-                if tipo_movimiento not in ('ENTRADA', 'ABASTO'):
-                    return False, f"Producto con SKU '{sku}' no encontrado en BODEGA (ni local {sucursal} ni global)."
-                else:
-                    stock_bodega_actual = 0
-                    temp_data = next(((n, s) for n, current_sku, s in PRODUCTOS_INICIALES if current_sku == sku), (f"Producto temporal {sku}", '999'))
-                    nombre_producto, secuencia_vista = temp_data
+    # Caché de proceso; si hay que consultar se usa esta misma conexión (sin conexión lateral)
+    from data_layer.inventory import obtener_skus_globales
+    for suc in sucursales:
+        estado['globales'][suc] = set(obtener_skus_globales(sucursal=suc, existing_conn=conn))
+
+    moviles = sorted({_norm(m['movil']) for m in movs if m['movil']})
+    if moviles:
+        for bloque in _bloques(skus):
+            sql = (f"SELECT id, sku_producto, movil, COALESCE(paquete, 'NINGUNO'), cantidad, sucursal FROM asignacion_moviles "
+                   f"WHERE sku_producto IN ({_placeholders(len(bloque))}) AND sucursal IN ({_placeholders(len(sucursales))}) "
+                   f"AND UPPER(TRIM(movil)) IN ({_placeholders(len(moviles))})")
+            run_query(cursor, sql, tuple(bloque + sucursales + moviles))
+            for id_asig, sku, movil, paquete, cantidad, suc in cursor.fetchall():
+                cantidad = float(cantidad or 0)
+                estado['asignaciones'].setdefault((sku, suc), []).append({
+                    'id': id_asig, 'movil': movil, 'movil_norm': _norm(movil), 'paquete': paquete,
+                    'cantidad': cantidad, 'inicial': cantidad,
+                })
+
+    seriales = sorted({s for m in movs for s in m['seriales']})
+    if seriales:
+        try:
+            for bloque in _bloques(seriales):
+                run_query(cursor, f"SELECT serial, faltante_id FROM seriales_faltantes_detalle WHERE serial IN ({_placeholders(len(bloque))})", tuple(bloque))
+                for serial, faltante_id in cursor.fetchall():
+                    estado['faltantes'].setdefault(_norm(serial), (serial, faltante_id))
+        except Exception as e:
+            logger.warning(f"Error consultando seriales faltantes del lote: {e}")
+
+        seriales_norm = sorted({_norm(s) for s in seriales})
+        for bloque in _bloques(seriales_norm):
+            ph = _placeholders(len(bloque))
+            sql = (f"SELECT id, serial_norm, mac_norm, sucursal FROM series_registradas "
+                   f"WHERE (serial_norm IN ({ph}) OR mac_norm IN ({ph})) AND sucursal IN ({_placeholders(len(sucursales))})")
+            run_query(cursor, sql, tuple(bloque + bloque + sucursales))
+            for id_serie, serial_norm, mac_norm, suc in cursor.fetchall():
+                for clave in (serial_norm, mac_norm):
+                    if clave:
+                        estado['series'].setdefault((clave, suc), set()).add(id_serie)
+
+    return estado
+
+
+def _simular_movimiento(estado, plan, mov):
+    """
+    Aplica un movimiento sobre el estado en memoria con las reglas de negocio
+    de registrar_movimiento_gui. Si el movimiento no procede retorna el mensaje
+    de error SIN modificar el estado; si procede retorna None.
+    """
+    sku, tipo, cantidad = mov['sku'], mov['tipo'], mov['cantidad']
+    movil, paquete, sucursal = mov['movil'], mov['paquete'], mov['sucursal']
+    clave = (sku, sucursal)
+
+    fila_bodega = estado['bodega'].get(clave)
+    if fila_bodega:
+        stock_bodega, nombre_producto, secuencia_vista = fila_bodega['cantidad'], fila_bodega['nombre'], fila_bodega['secuencia']
+    elif sku in estado['meta']:
+        stock_bodega = 0
+        nombre_producto, secuencia_vista = estado['meta'][sku]
+    elif tipo not in ('ENTRADA', 'ABASTO'):
+        return f"Producto con SKU '{sku}' no encontrado en BODEGA (ni local {sucursal} ni global)."
+    else:
+        stock_bodega = 0
+        nombre_producto, secuencia_vista = next(((n, s) for n, current_sku, s in PRODUCTOS_INICIALES if current_sku == sku), (f"Producto temporal {sku}", '999'))
+
+    es_global = sku in estado['globales'].get(sucursal, set())
+    movil_norm = _norm(movil)
+    filas_movil = [f for f in estado['asignaciones'].get(clave, []) if f['movil_norm'] == movil_norm] if movil else []
+
+    stock_asignado = 0
+    if movil and tipo in ('SALIDA_MOVIL', 'RETORNO_MOVIL', 'CONSUMO_MOVIL'):
+        if es_global:
+            # Si es global, su "asignación" es el stock de bodega
+            stock_asignado = stock_bodega
+        elif (tipo in ('CONSUMO_MOVIL', 'RETORNO_MOVIL') and not paquete) or sku in estado['compartidos']:
+            stock_asignado = sum(f['cantidad'] for f in filas_movil)
+        else:
+            pq_query = paquete if paquete else 'NINGUNO'
+            stock_asignado = next((f['cantidad'] for f in filas_movil if f['paquete'] == pq_query), 0)
+
+    cambio_bodega = 0
+    cambio_asignacion = 0
+    cambio_descarte = 0
+
+    if tipo in ('ENTRADA', 'ABASTO'):
+        cambio_bodega = cantidad
+    elif tipo == 'SALIDA_MOVIL':
+        if es_global:
+            return f"El producto {sku} es GLOBAL. No requiere salida a móvil ya que se usa directo de bodega."
+        if stock_bodega < cantidad:
+            return f"Stock insuficiente en Bodega para {nombre_producto}. Solo hay {stock_bodega} unidades."
+        cambio_bodega = -cantidad
+        cambio_asignacion = cantidad
+    elif tipo == 'RETORNO_MOVIL':
+        cambio_bodega = cantidad
+        if not es_global:
+            cambio_asignacion = -cantidad
+    elif tipo == 'CONSUMO_MOVIL':
+        if es_global:
+            if stock_bodega < cantidad:
+                return f"Error: Stock GLOBAL insuficiente en BODEGA. Solo hay {stock_bodega} unidades de '{nombre_producto}'."
+            cambio_bodega = -cantidad
+        else:
+            if movil and stock_asignado < cantidad:
+                return f"Error: El {movil} solo tiene {stock_asignado} unidades asignadas de '{nombre_producto}'."
+            cambio_asignacion = -cantidad
+    elif tipo == TIPO_MOVIMIENTO_DESCARTE:
+        if es_global:
+            if stock_bodega < cantidad:
+                return f"Stock GLOBAL insuficiente para descarte. Solo hay {stock_bodega} unidades de {nombre_producto}."
+            cambio_bodega = -cantidad
+        elif movil:
+            if stock_asignado < cantidad:
+                return f"Stock insuficiente en {movil} para descarte. Solo tiene {stock_asignado} unidades de {nombre_producto}."
+            cambio_asignacion = -cantidad
+        else:
+            if stock_bodega < cantidad:
+                return f"Stock insuficiente en Bodega para {nombre_producto}. Solo hay {stock_bodega} unidades para descarte."
+            cambio_bodega = -cantidad
+        cambio_descarte = cantidad
+    elif tipo == 'SALIDA':
+        if stock_bodega < cantidad:
+            return f"Stock insuficiente en Bodega para {nombre_producto}. Solo hay {stock_bodega} unidades."
+        cambio_bodega = -cantidad
+
+    # ── A partir de aquí el movimiento procede: mutar estado y plan ──
+    if cambio_bodega:
+        if fila_bodega is None:
+            # ENTRADA/ABASTO (o retorno) sobre un SKU sin fila local: se crea la fila BODEGA de la sucursal
+            fila_bodega = {'cantidad': 0.0, 'inicial': 0.0, 'nombre': nombre_producto, 'secuencia': secuencia_vista, 'existe': False}
+            estado['bodega'][clave] = fila_bodega
+        fila_bodega['cantidad'] += cambio_bodega
+
+    if mov['seriales']:
+        # Si el equipo está siendo operado (salida, retorno o consumo), significa que NO falta.
+        for s in mov['seriales']:
+            faltante = estado['faltantes'].pop(_norm(s), None)
+            if faltante:
+                plan['faltantes'].append(faltante)
+
+        campos = None
+        if tipo in ('CONSUMO_MOVIL', 'SALIDA'):
+            campos = {'estado': 'CONSUMIDO', 'ubicacion': 'CONSUMIDO'}
+        elif tipo == 'SALIDA_MOVIL' and movil:
+            campos = {'ubicacion': movil, 'paquete': paquete or 'NINGUNO', 'estado': 'ASIGNADO'}
+        elif tipo in ('RETORNO_MOVIL', 'ENTRADA', 'ABASTO', 'ENTRADA_AJUSTE'):
+            campos = {'ubicacion': 'BODEGA', 'paquete': 'NINGUNO', 'estado': 'DISPONIBLE'}
+        if campos:
+            for s in mov['seriales']:
+                for id_serie in estado['series'].get((_norm(s), sucursal), ()):
+                    plan['series'].setdefault(id_serie, {}).update(campos)
+
+    if cambio_descarte > 0:
+        previo = plan['descarte'].get(clave)
+        plan['descarte'][clave] = (
+            (previo[0] if previo else 0) + cambio_descarte,
+            nombre_producto,
+            f'{secuencia_vista}z',
+        )
+
+    if movil and cambio_asignacion != 0:
+        if tipo in ('CONSUMO_MOVIL', 'RETORNO_MOVIL') and cambio_asignacion < 0:
+            # Respetar la separación estricta de paquetes: con PAQUETE A/B solo se drena ese paquete
+            # o los sin etiqueta ('NINGUNO', 'PERSONALIZADO'); nunca el otro paquete.
+            if paquete in ('PAQUETE A', 'PAQUETE B'):
+                candidatas = [f for f in filas_movil if f['cantidad'] > 0 and (f['paquete'] == paquete or f['paquete'] in ('NINGUNO', 'PERSONALIZADO'))]
+                candidatas.sort(key=lambda f: (0 if f['paquete'] == paquete else 1, -f['cantidad']))
             else:
-                stock_bodega_actual, nombre_producto, secuencia_vista = resultado_bodega
-            
-            # DETERMINAR SI ES GLOBAL (NUEVO)
-            from data_layer.inventory import obtener_skus_globales
-            skus_globales = obtener_skus_globales(sucursal=sucursal)
-            es_global = sku in skus_globales
-
-            stock_asignado = 0
-            if movil_afectado and tipo_movimiento in ('SALIDA_MOVIL', 'RETORNO_MOVIL', 'CONSUMO_MOVIL'):
-                 is_shared = sku in MATERIALES_COMPARTIDOS or es_global
-                 
-                 if es_global:
-                     # Si es global, su "asignación" es el stock de bodega
-                     stock_asignado = stock_bodega_actual
-                 elif (tipo_movimiento in ('CONSUMO_MOVIL', 'RETORNO_MOVIL') and not paquete_asignado) or is_shared:
-                     sql_asig = "SELECT COALESCE(SUM(cantidad), 0) FROM asignacion_moviles WHERE sku_producto = ? AND UPPER(TRIM(movil)) = UPPER(TRIM(?)) AND sucursal = ?"
-                     run_query(cursor, sql_asig, (sku, movil_afectado, sucursal))
-                     asignacion_actual = cursor.fetchone()
-                     stock_asignado = float(asignacion_actual[0]) if asignacion_actual and asignacion_actual[0] is not None else 0
-                 else:
-                     pq_query = paquete_asignado if paquete_asignado else 'NINGUNO'
-                     sql_asig = "SELECT cantidad FROM asignacion_moviles WHERE sku_producto = ? AND UPPER(TRIM(movil)) = UPPER(TRIM(?)) AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?"
-                     run_query(cursor, sql_asig, (sku, movil_afectado, pq_query, sucursal))
-                     asignacion_actual = cursor.fetchone()
-                     stock_asignado = float(asignacion_actual[0]) if asignacion_actual and asignacion_actual[0] is not None else 0
-            
-            cantidad_bodega_cambio = 0
-            cantidad_asignacion_cambio = 0
-            cantidad_descarte_cambio = 0 
-            
-            if tipo_movimiento in ('ENTRADA', 'ABASTO'):
-                if not resultado_bodega:
-                    run_query(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) VALUES (?, ?, ?, ?, ?, ?)",
-                                   (nombre_producto, sku, cantidad_afectada, "BODEGA", secuencia_vista, sucursal))
-                else:
-                    cantidad_bodega_cambio = cantidad_afectada
-            elif tipo_movimiento == 'SALIDA_MOVIL':
-                if es_global:
-                    return False, f"El producto {sku} es GLOBAL. No requiere salida a móvil ya que se usa directo de bodega."
-                if stock_bodega_actual < cantidad_afectada:
-                    return False, f"Stock insuficiente en Bodega para {nombre_producto}. Solo hay {stock_bodega_actual} unidades."
-                cantidad_bodega_cambio = -cantidad_afectada
-                cantidad_asignacion_cambio = cantidad_afectada
-            elif tipo_movimiento == 'RETORNO_MOVIL':
-                if es_global:
-                    # En retorno global, solo aseguramos que el stock regrese a bodega si se registró como salida (aunque no debería)
-                    cantidad_bodega_cambio = cantidad_afectada
-                else:
-                    cantidad_bodega_cambio = cantidad_afectada
-                    cantidad_asignacion_cambio = -cantidad_afectada
-            elif tipo_movimiento == 'CONSUMO_MOVIL':
-                if es_global:
-                    if stock_bodega_actual < cantidad_afectada:
-                        return False, f"Error: Stock GLOBAL insuficiente en BODEGA. Solo hay {stock_bodega_actual} unidades de '{nombre_producto}'."
-                    cantidad_bodega_cambio = -cantidad_afectada
-                else:
-                    if movil_afectado and stock_asignado < cantidad_afectada:
-                         return False, f"Error: El {movil_afectado} solo tiene {stock_asignado} unidades asignadas de '{nombre_producto}'."
-                    cantidad_asignacion_cambio = -cantidad_afectada
-            elif tipo_movimiento == TIPO_MOVIMIENTO_DESCARTE: 
-                if es_global:
-                    if stock_bodega_actual < cantidad_afectada:
-                        return False, f"Stock GLOBAL insuficiente para descarte. Solo hay {stock_bodega_actual} unidades de {nombre_producto}."
-                    cantidad_bodega_cambio = -cantidad_afectada
-                elif movil_afectado:
-                    if stock_asignado < cantidad_afectada:
-                        return False, f"Stock insuficiente en {movil_afectado} para descarte. Solo tiene {stock_asignado} unidades de {nombre_producto}."
-                    cantidad_asignacion_cambio = -cantidad_afectada
-                else:
-                    if stock_bodega_actual < cantidad_afectada:
-                        return False, f"Stock insuficiente en Bodega para {nombre_producto}. Solo hay {stock_bodega_actual} unidades para descarte."
-                    cantidad_bodega_cambio = -cantidad_afectada
-                cantidad_descarte_cambio = cantidad_afectada 
-            elif tipo_movimiento == 'SALIDA':
-                if stock_bodega_actual < cantidad_afectada:
-                    return False, f"Stock insuficiente en Bodega para {nombre_producto}. Solo hay {stock_bodega_actual} unidades."
-                cantidad_bodega_cambio = -cantidad_afectada
-
-            if cantidad_bodega_cambio != 0:
-                if cantidad_bodega_cambio < 0:
-                    abs_cambio = abs(cantidad_bodega_cambio)
-                    rc = run_query(cursor, "UPDATE productos SET cantidad = cantidad - ? WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ? AND cantidad >= ?", 
-                                   (abs_cambio, sku, sucursal, abs_cambio))
-                    if rc == 0:
-                         return False, f"Error atómico: Stock insuficiente en Bodega para {nombre_producto}. Probablemente modificado por otra sesión."
-                else:
-                    run_query(cursor, "UPDATE productos SET cantidad = cantidad + ? WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ?", 
-                                   (cantidad_bodega_cambio, sku, sucursal))
-            
-            if seriales:
-                # OPTIMIZACIÓN: Limpiar registros de 'FALTANTE' para cualquier serial que esté siendo operado.
-                # Si el equipo está siendo escaneado (ya sea para Salida, Retorno o Consumo), significa que NO falta.
-                for s in seriales:
-                    try:
-                        # Buscar si existe en el detalle de seriales faltantes
-                        run_query(cursor, "SELECT faltante_id FROM seriales_faltantes_detalle WHERE serial = ? OR serial = ?", (s, s))
-                        f_row = cursor.fetchone()
-                        if f_row:
-                            id_f = f_row[0]
-                            # Eliminar del detalle
-                            run_query(cursor, "DELETE FROM seriales_faltantes_detalle WHERE serial = ? OR serial = ?", (s, s))
-                            # Decrementar la cabecera
-                            run_query(cursor, "UPDATE faltantes_registrados SET cantidad = cantidad - 1 WHERE id = ?", (id_f,))
-                            # Eliminar cabecera si llegó a 0
-                            run_query(cursor, "DELETE FROM faltantes_registrados WHERE id = ? AND cantidad <= 0", (id_f,))
-                            logger.info(f"✨ Serial {s} recuperado automáticamente de estado FALTANTE.")
-                    except Exception as e_f:
-                        logger.warning(f"Error limpiando faltante para serial {s}: {e_f}")
-
-                if tipo_movimiento in ('CONSUMO_MOVIL', 'SALIDA'):
-                    for s in seriales:
-                        run_query(cursor, "UPDATE series_registradas SET estado = 'CONSUMIDO', ubicacion = 'CONSUMIDO' WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?", (s, s, sucursal))
-                elif tipo_movimiento == 'SALIDA_MOVIL' and movil_afectado:
-                    for s in seriales:
-                        run_query(cursor, "UPDATE series_registradas SET ubicacion = ?, paquete = ?, estado = 'ASIGNADO' WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?", (movil_afectado, paquete_asignado or 'NINGUNO', s, s, sucursal))
-                elif tipo_movimiento in ('RETORNO_MOVIL', 'ENTRADA', 'ABASTO', 'ENTRADA_AJUSTE'):
-                    for s in seriales:
-                        # ACTUALIZAR UBICACIÓN Y ESTADO A DISPONIBLE/BODEGA
-                        run_query(cursor, "UPDATE series_registradas SET ubicacion = 'BODEGA', paquete = 'NINGUNO', estado = 'DISPONIBLE' WHERE (serial_number = ? OR mac_number = ?) AND sucursal = ?", (s, s, sucursal))
-
-            if cantidad_descarte_cambio > 0:
-                run_query(cursor, "SELECT sku FROM productos WHERE sku = ? AND ubicacion = ? AND sucursal = ?", (sku, UBICACION_DESCARTE, sucursal))
-                descarte_existe = cursor.fetchone()
-                if descarte_existe:
-                     run_query(cursor, "UPDATE productos SET cantidad = cantidad + ? WHERE sku = ? AND ubicacion = ? AND sucursal = ?",
-                                    (cantidad_descarte_cambio, sku, UBICACION_DESCARTE, sucursal))
-                else:
-                    run_query(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) VALUES (?, ?, ?, ?, ?, ?)",
-                                   (nombre_producto, sku, cantidad_descarte_cambio, UBICACION_DESCARTE, f'{secuencia_vista}z', sucursal))
-
-            if movil_afectado and cantidad_asignacion_cambio != 0:
-                 is_shared = sku in MATERIALES_COMPARTIDOS
-                 # MEJORA: Para Retorno y Consumo, siempre intentar drenar de CUALQUIER paquete disponible en el móvil
-                 # para evitar que queden residuos teóricos en paquetes distintos al seleccionado en la UI.
-                 if (tipo_movimiento in ('CONSUMO_MOVIL', 'RETORNO_MOVIL')) and cantidad_asignacion_cambio < 0:
-                     # CORRECCIÓN VITAL: Respetar la separación estricta de paquetes. 
-                     # Si se especifica un paquete, SOLO drenar de ese paquete o de los sin etiqueta ('NINGUNO', 'PERSONALIZADO').
-                     # NUNCA drenar del PAQUETE B si estamos auditando el PAQUETE A.
-                     if paquete_para_stock in ['PAQUETE A', 'PAQUETE B']:
-                         sql_rows = "SELECT COALESCE(paquete, 'NINGUNO'), cantidad FROM asignacion_moviles WHERE sku_producto = ? AND movil = ? AND sucursal = ? AND cantidad > 0 AND (COALESCE(paquete, 'NINGUNO') = ? OR COALESCE(paquete, 'NINGUNO') IN ('NINGUNO', 'PERSONALIZADO')) ORDER BY CASE WHEN COALESCE(paquete, 'NINGUNO') = ? THEN 0 ELSE 1 END, cantidad DESC"
-                         run_query(cursor, sql_rows, (sku, movil_afectado, sucursal, paquete_para_stock, paquete_para_stock))
-                     else:
-                         sql_rows = "SELECT COALESCE(paquete, 'NINGUNO'), cantidad FROM asignacion_moviles WHERE sku_producto = ? AND movil = ? AND sucursal = ? AND cantidad > 0 ORDER BY cantidad DESC"
-                         run_query(cursor, sql_rows, (sku, movil_afectado, sucursal))
-                         
-                     filas_con_stock = cursor.fetchall()
-                     pendiente_descontar = abs(cantidad_asignacion_cambio)
-                     for fila_pq, fila_qty in filas_con_stock:
-                         if pendiente_descontar <= 0: break
-                         descontar_de_fila = min(fila_qty, pendiente_descontar)
-                         nueva_qty_fila = fila_qty - descontar_de_fila
-                         pendiente_descontar -= descontar_de_fila
-                         if nueva_qty_fila > 0:
-                             run_query(cursor, "UPDATE asignacion_moviles SET cantidad = ? WHERE sku_producto = ? AND movil = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?", (nueva_qty_fila, sku, movil_afectado, fila_pq, sucursal))
-                         else:
-                             run_query(cursor, "UPDATE asignacion_moviles SET cantidad = 0 WHERE sku_producto = ? AND movil = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?", (sku, movil_afectado, fila_pq, sucursal))
-                 else:
-                     pq_actual = paquete_para_stock if paquete_para_stock else 'NINGUNO'
-                     sql_sel = "SELECT SUM(cantidad) FROM asignacion_moviles WHERE sku_producto = ? AND movil = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?"
-                     run_query(cursor, sql_sel, (sku, movil_afectado, pq_actual, sucursal))
-                     resultado_asignacion = cursor.fetchone()
-                     valor_actual = float(resultado_asignacion[0]) if resultado_asignacion and resultado_asignacion[0] is not None else 0.0
-                     nueva_cantidad_asignacion = max(0, valor_actual + cantidad_asignacion_cambio)
-                     
-                     if DB_TYPE == 'MYSQL':
-                         sql_upsert = "INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE cantidad = VALUES(cantidad)"
-                         cursor.execute(sql_upsert, (sku, movil_afectado, pq_actual, nueva_cantidad_asignacion, sucursal))
-                     else:
-                         run_query(cursor, "UPDATE asignacion_moviles SET cantidad = 0 WHERE sku_producto = ? AND movil = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?", (sku, movil_afectado, pq_actual, sucursal))
-                         if nueva_cantidad_asignacion > 0:
-                             run_query(cursor, "UPDATE asignacion_moviles SET cantidad = ? WHERE sku_producto = ? AND movil = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?", (nueva_cantidad_asignacion, sku, movil_afectado, pq_actual, sucursal))
-                             # Note: For SQLite we try update first, but the logic above already implies record management.
-
-            sql_mov = "INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, movil_afectado, fecha_evento, paquete_asignado, observaciones, documento_referencia, sucursal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
-            run_query(cursor, sql_mov, (sku, tipo_movimiento, cantidad_afectada, movil_afectado, fecha_evento, paquete_asignado, observaciones, documento_referencia, sucursal))
-
-            if tipo_movimiento in ['RETORNO_MOVIL', 'CONSUMO_MOVIL'] and movil_afectado and paquete_asignado in ['PAQUETE A', 'PAQUETE B']:
-                tipo_recordatorio = 'RETORNO' if tipo_movimiento == 'RETORNO_MOVIL' else 'CONCILIACION'
-                run_query(cursor, "UPDATE recordatorios_pendientes SET completado = 1, fecha_completado = CURRENT_TIMESTAMP WHERE movil = ? AND paquete = ? AND tipo_recordatorio = ? AND fecha_recordatorio = ? AND completado = 0", (movil_afectado, paquete_asignado, tipo_recordatorio, fecha_evento))
-        
-        movil_msg = f" a/desde el {movil_afectado}" if movil_afectado else ""
-        paquete_msg = f" (Paq: {paquete_asignado})" if paquete_asignado else ""
-        return True, f"Movimiento {tipo_movimiento} registrado para SKU {sku} ({cantidad_afectada} unidades){movil_msg}{paquete_msg}."
+                candidatas = sorted((f for f in filas_movil if f['cantidad'] > 0), key=lambda f: -f['cantidad'])
+
+            pendiente = abs(cambio_asignacion)
+            for fila in candidatas:
+                if pendiente <= 0:
+                    break
+                descontar = min(fila['cantidad'], pendiente)
+                fila['cantidad'] -= descontar
+                pendiente -= descontar
+        else:
+            pq_actual = paquete if paquete else 'NINGUNO'
+            destino = [f for f in filas_movil if f['paquete'] == pq_actual]
+            nueva_cantidad = max(0, sum(f['cantidad'] for f in destino) + cambio_asignacion)
+            if destino:
+                destino[0]['cantidad'] = nueva_cantidad
+                for fila in destino[1:]:
+                    fila['cantidad'] = 0
+            elif nueva_cantidad > 0:
+                estado['asignaciones'].setdefault(clave, []).append({
+                    'id': None, 'movil': movil, 'movil_norm': movil_norm, 'paquete': pq_actual,
+                    'cantidad': nueva_cantidad, 'inicial': 0.0,
+                })
+
+    plan['movimientos'].append((sku, tipo, cantidad, movil, mov['fecha'], paquete, mov['observaciones'], mov['documento'], sucursal))
+    if mov['seriales']:
+        plan['seriales_mov'][len(plan['movimientos']) - 1] = mov['seriales']
+
+    if tipo in ('RETORNO_MOVIL', 'CONSUMO_MOVIL') and movil and paquete in ('PAQUETE A', 'PAQUETE B'):
+        tipo_recordatorio = 'RETORNO' if tipo == 'RETORNO_MOVIL' else 'CONCILIACION'
+        plan['recordatorios'].append((movil, paquete, tipo_recordatorio, mov['fecha']))
+
+    return None
+
+
+def _actualizar_cantidades(cursor, tabla, columna_clave, deltas, filtro='', filtro_params=(), restar_con_guarda=False):
+    """
+    Aplica varios deltas de 'cantidad' con UNA sentencia por bloque:
+        UPDATE tabla SET cantidad = cantidad + CASE clave WHEN ? THEN ? ... END WHERE clave IN (...)
+    Con restar_con_guarda=True resta los valores y exige 'cantidad >= valor' en cada fila,
+    igual que la guarda atómica de un UPDATE individual.
+    Retorna el total de filas afectadas.
+    """
+    total = 0
+    operador = '-' if restar_con_guarda else '+'
+    for bloque in _bloques(deltas.items(), _TAMANO_BLOQUE_CASE):
+        caso = "CASE {} {} END".format(columna_clave, " ".join(["WHEN ? THEN ?"] * len(bloque)))
+        params_caso = [v for par in bloque for v in par]
+        claves = [k for k, _ in bloque]
+        condicion = f"{filtro} AND " if filtro else ""
+        sql = f"UPDATE {tabla} SET cantidad = cantidad {operador} {caso} WHERE {condicion}{columna_clave} IN ({_placeholders(len(claves))})"
+        params = params_caso + list(filtro_params) + claves
+        if restar_con_guarda:
+            sql += f" AND cantidad >= {caso}"
+            params += params_caso
+        total += run_query(cursor, sql, tuple(params))
+    return total
+
+
+def _escribir_plan_lote(cursor, estado, plan):
+    """Persiste el resultado del lote. Lanza _ConflictoConcurrente si falla una guarda atómica."""
+    # 1. BODEGA: un delta neto por (sku, sucursal); primero las restas con guarda
+    restas, sumas, nuevas_bodega = {}, {}, []
+    for (sku, suc), fila in estado['bodega'].items():
+        if not fila['existe']:
+            nuevas_bodega.append((fila['nombre'], sku, fila['cantidad'], "BODEGA", fila['secuencia'], suc))
+            continue
+        delta = fila['cantidad'] - fila['inicial']
+        if delta < 0:
+            restas.setdefault(suc, {})[sku] = -delta
+        elif delta > 0:
+            sumas.setdefault(suc, {})[sku] = delta
+
+    for suc, deltas in restas.items():
+        rc = _actualizar_cantidades(cursor, 'productos', 'sku', deltas, "ubicacion = 'BODEGA' AND sucursal = ?", (suc,), restar_con_guarda=True)
+        if rc != len(deltas):
+            nombres = ", ".join(estado['bodega'][(sku, suc)]['nombre'] for sku in deltas)
+            raise _ConflictoConcurrente(f"Error atómico: Stock insuficiente en Bodega para {nombres}. Probablemente modificado por otra sesión.")
+    for suc, deltas in sumas.items():
+        _actualizar_cantidades(cursor, 'productos', 'sku', deltas, "ubicacion = 'BODEGA' AND sucursal = ?", (suc,))
+    run_many(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) VALUES (?, ?, ?, ?, ?, ?)", nuevas_bodega)
+
+    # 2. Seriales recuperados de FALTANTE
+    if plan['faltantes']:
+        try:
+            seriales = [serial for serial, _ in plan['faltantes']]
+            for bloque in _bloques(seriales):
+                run_query(cursor, f"DELETE FROM seriales_faltantes_detalle WHERE serial IN ({_placeholders(len(bloque))})", tuple(bloque))
+            por_cabecera = {}
+            for _, id_f in plan['faltantes']:
+                por_cabecera[id_f] = por_cabecera.get(id_f, 0) - 1
+            _actualizar_cantidades(cursor, 'faltantes_registrados', 'id', por_cabecera)
+            for bloque in _bloques(por_cabecera):
+                run_query(cursor, f"DELETE FROM faltantes_registrados WHERE id IN ({_placeholders(len(bloque))}) AND cantidad <= 0", tuple(bloque))
+            for serial in seriales:
+                logger.info(f"✨ Serial {serial} recuperado automáticamente de estado FALTANTE.")
+        except Exception as e_f:
+            logger.warning(f"Error limpiando faltantes del lote: {e_f}")
+
+    # 3. Estado/ubicación de series (agrupadas por juego de columnas)
+    grupos_series = {}
+    for id_serie, campos in plan['series'].items():
+        grupos_series.setdefault(tuple(sorted(campos.items())), []).append(id_serie)
+    for campos, ids in grupos_series.items():
+        set_sql = ", ".join(f"{col} = ?" for col, _ in campos)
+        valores = [v for _, v in campos]
+        for bloque in _bloques(ids):
+            run_query(cursor, f"UPDATE series_registradas SET {set_sql} WHERE id IN ({_placeholders(len(bloque))})", tuple(valores + bloque))
+
+    # 4. DESCARTE
+    sumas_descarte, nuevas_descarte = {}, []
+    for (sku, suc), (cantidad, nombre, secuencia) in plan['descarte'].items():
+        if (sku, suc) in estado['descarte']:
+            sumas_descarte.setdefault(suc, {})[sku] = cantidad
+        else:
+            nuevas_descarte.append((nombre, sku, cantidad, UBICACION_DESCARTE, secuencia, suc))
+    for suc, deltas in sumas_descarte.items():
+        _actualizar_cantidades(cursor, 'productos', 'sku', deltas, "ubicacion = ? AND sucursal = ?", (UBICACION_DESCARTE, suc))
+    run_many(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) VALUES (?, ?, ?, ?, ?, ?)", nuevas_descarte)
+
+    # 5. Asignaciones de móviles (por id; las restas también con guarda)
+    restas_asig, sumas_asig, nuevas_asig = {}, {}, []
+    for (sku, suc), filas in estado['asignaciones'].items():
+        for fila in filas:
+            if fila['id'] is None:
+                if fila['cantidad'] > 0:
+                    nuevas_asig.append((sku, fila['movil'], fila['paquete'], fila['cantidad'], suc))
+                continue
+            delta = fila['cantidad'] - fila['inicial']
+            if delta < 0:
+                restas_asig[fila['id']] = -delta
+            elif delta > 0:
+                sumas_asig[fila['id']] = delta
+
+    if restas_asig:
+        rc = _actualizar_cantidades(cursor, 'asignacion_moviles', 'id', restas_asig, restar_con_guarda=True)
+        if rc != len(restas_asig):
+            raise _ConflictoConcurrente("Error atómico: Stock asignado insuficiente en el móvil. Probablemente modificado por otra sesión.")
+    _actualizar_cantidades(cursor, 'asignacion_moviles', 'id', sumas_asig)
+    if nuevas_asig:
+        if DB_TYPE == 'MYSQL':
+            sql_upsert = "INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES (?, ?, ?, ?, ?) ON DUPLICATE KEY UPDATE cantidad = cantidad + VALUES(cantidad)"
+        else:
+            sql_upsert = "INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES (?, ?, ?, ?, ?) ON CONFLICT(sku_producto, movil, paquete, sucursal) DO UPDATE SET cantidad = cantidad + excluded.cantidad"
+        run_many(cursor, sql_upsert, nuevas_asig)
+
+    # 6. Movimientos y recordatorios. Los que traen seriales van uno a uno para enlazar su id
+    #    en consumo_series; los demás en bloques, conservando el orden del lote.
+    #    Todos quedan con id mayor al último visible: se indexan para el historial desde ahí.
+    desde_id = ultimo_id_movimiento(cursor)
+    sql_mov = "INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, movil_afectado, fecha_evento, paquete_asignado, observaciones, documento_referencia, sucursal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    bloque = []
+    for i, fila_mov in enumerate(plan['movimientos']):
+        seriales = plan['seriales_mov'].get(i)
+        if not seriales:
+            bloque.append(fila_mov)
+            continue
+        run_many(cursor, sql_mov, bloque)
+        bloque = []
+        run_query(cursor, sql_mov, fila_mov)
+        registrar_series_consumo(cursor, fila_mov[8], seriales, movimiento_id=cursor.lastrowid)
+    run_many(cursor, sql_mov, bloque)
+    indexar_movimientos(cursor, desde_id)
+    acumular_movimientos(cursor, ((m[0], m[1], m[2], m[3], m[4], m[8]) for m in plan['movimientos']))
+    run_many(cursor, "UPDATE recordatorios_pendientes SET completado = 1, fecha_completado = CURRENT_TIMESTAMP WHERE movil = ? AND paquete = ? AND tipo_recordatorio = ? AND fecha_recordatorio = ? AND completado = 0", plan['recordatorios'])
+
+    # 7. Versionar snapshots de inventario de los móviles afectados (y de globales si cambió su BODEGA)
+    por_sucursal = {}
+    for fila_mov in plan['movimientos']:
+        por_sucursal.setdefault(fila_mov[8], set()).add(fila_mov[3])
+    for suc in set(restas) | set(sumas):
+        por_sucursal.setdefault(suc, set())
+    for suc, moviles in por_sucursal.items():
+        cambiados = set(restas.get(suc, {})) | set(sumas.get(suc, {}))
+        marcar_inventario_movil(cursor, suc, moviles, globales=bool(cambiados & estado['globales'].get(suc, set())))
+
+    # 8. Outbox: delta neto por (sku, ubicación, paquete) en la misma transacción
+    cambios = {}
+    for (sku, suc), fila in estado['bodega'].items():
+        cambios.setdefault(suc, {})[(sku, 'BODEGA', None)] = fila['cantidad'] - fila['inicial']
+    for (sku, suc), (cantidad, _, _) in plan['descarte'].items():
+        cambios.setdefault(suc, {})[(sku, UBICACION_DESCARTE, None)] = cantidad
+    for (sku, suc), filas in estado['asignaciones'].items():
+        for fila in filas:
+            clave = (sku, fila['movil'], fila['paquete'])
+            por_suc = cambios.setdefault(suc, {})
+            por_suc[clave] = por_suc.get(clave, 0) + fila['cantidad'] - fila['inicial']
+    for suc, deltas in cambios.items():
+        registrar_cambios(cursor, suc, deltas, 'movimientos')
+
+
+def _escribir_plan_en_savepoint(conn, cursor, estado, plan):
+    """
+    _escribir_plan_lote dentro de la transacción del llamador: si falla a mitad
+    (guarda atómica o BD) vuelve al SAVEPOINT y no deja medio plan escrito.
+    """
+    if DB_TYPE != 'MYSQL' and not conn.in_transaction:
+        # En SQLite un SAVEPOINT fuera de transacción la abre y su RELEASE confirmaría
+        cursor.execute("BEGIN")
+    cursor.execute("SAVEPOINT lote_movimientos")
+    try:
+        _escribir_plan_lote(cursor, estado, plan)
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT lote_movimientos")
+        cursor.execute("RELEASE SAVEPOINT lote_movimientos")
+        raise
+    cursor.execute("RELEASE SAVEPOINT lote_movimientos")
+
+
+def _mensaje_movimiento(mov):
+    movil_msg = f" a/desde el {mov['movil']}" if mov['movil'] else ""
+    paquete_msg = f" (Paq: {mov['paquete']})" if mov['paquete'] else ""
+    return f"Movimiento {mov['tipo']} registrado para SKU {mov['sku']} ({mov['cantidad']} unidades){movil_msg}{paquete_msg}."
+
+
+def registrar_movimientos_batch(items, fecha_evento=None, documento_referencia=None, target_db_name=None, existing_conn=None, sucursal_context=None, atomico=True):
+    """
+    Registra varios movimientos en una sola transacción con consultas agrupadas.
+
+    Cada item es un dict con las claves de registrar_movimiento_gui: 'sku', 'tipo_movimiento',
+    'cantidad_afectada' (o 'cantidad'), 'movil_afectado' (o 'movil'), 'paquete_asignado' (o 'paquete'),
+    'observaciones', 'documento_referencia', 'seriales' y opcionalmente 'fecha_evento'.
+    'fecha_evento' y 'documento_referencia' del lote se usan cuando el item no trae los suyos.
+
+    El stock se valida en memoria en el orden de los items (un ABASTO seguido de una SALIDA
+    del mismo SKU funciona igual que en llamadas sucesivas) y las restas se escriben con la
+    guarda atómica 'cantidad >= ?'.
+
+    atomico=True: todo o nada; si un item falla no se escribe nada.
+    atomico=False: los items inválidos se omiten y el resto se registra.
+    Si falla una guarda atómica o la BD, no se registra ninguno; con existing_conn
+    se deshace solo lo escrito por este lote (SAVEPOINT) y la transacción del llamador sigue.
+
+    Returns:
+        (exito, mensaje, resultados) donde resultados es una lista de (exito, mensaje) por item.
+    """
+    resultados = [None] * len(items)
+    movs = []
+    for idx, item in enumerate(items):
+        mov, error = _normalizar_item_movimiento(item, fecha_evento, documento_referencia, sucursal_context)
+        if error:
+            resultados[idx] = (False, error)
+        else:
+            movs.append((idx, mov))
+
+    def _primer_error():
+        return next(r[1] for r in resultados if r and not r[0])
+
+    if not items:
+        return True, "Sin movimientos para registrar.", []
+    if atomico and len(movs) < len(items):
+        return False, _primer_error(), resultados
+
+    try:
+        with db_session(target_db=target_db_name, existing_conn=existing_conn) as (conn, cursor):
+            if movs:
+                estado = _precargar_estado_lote(conn, cursor, [m for _, m in movs])
+                plan = {'faltantes': [], 'series': {}, 'descarte': {}, 'movimientos': [], 'seriales_mov': {}, 'recordatorios': []}
+                for idx, mov in movs:
+                    error = _simular_movimiento(estado, plan, mov)
+                    resultados[idx] = (False, error) if error else (True, _mensaje_movimiento(mov))
+
+                if atomico and any(not ok for ok, _ in resultados):
+                    return False, _primer_error(), resultados
+
+                if plan['movimientos']:
+                    if existing_conn is None:
+                        _escribir_plan_lote(cursor, estado, plan)
+                    else:
+                        _escribir_plan_en_savepoint(conn, cursor, estado, plan)
 
     except Exception as e:
-        logger.error(f"Error en registrar_movimiento_gui para SKU {sku}: {e}")
-        return False, f"Error en la base de datos: {str(e)}"
+        if isinstance(e, _ConflictoConcurrente):
+            mensaje = str(e)
+        else:
+            logger.error(f"Error en registrar_movimientos_batch ({len(items)} items): {e}")
+            mensaje = f"Error en la base de datos: {str(e)}"
+        return False, mensaje, [(False, mensaje)] * len(items)
+
+    exitosos = sum(1 for ok, _ in resultados if ok)
+    if len(items) == 1:
+        return resultados[0][0], resultados[0][1], resultados
+    if exitosos == 0:
+        return False, _primer_error(), resultados
+    if exitosos < len(items):
+        return True, f"{exitosos} de {len(items)} movimientos registrados.", resultados
+    return True, f"{exitosos} movimientos registrados.", resultados
+
 
 def registrar_prestamo_santiago(sku, cantidad, fecha_evento, observaciones=None):
     """
@@ -280,7 +640,7 @@ def registrar_prestamo_santiago(sku, cantidad, fecha_evento, observaciones=None)
             )
             
             if not exito_local:
-                return False, f"Fallo en salida local: {msg_local}"
+                raise Exception(f"Fallo en salida local: {msg_local}")
                 
             # 2. Registrar ENTRADA en Bodega Santiago
             exito_santiago, msg_santiago = registrar_movimiento_gui(
@@ -329,16 +689,18 @@ def registrar_devolucion_santiago(sku, cantidad, seriales_nuevos, fecha_evento,
             )
             
             if not exito_salida:
-                return False, f"Error en retorno Santiago: {msg_salida}"
+                raise Exception(f"Error en retorno Santiago: {msg_salida}")
 
             # 3. Registrar seriales nuevos en Bodega (si los hay)
             if seriales_nuevos:
                 for serial in seriales_nuevos:
+                    serial = str(serial or '').strip()
                     if not serial: continue
-                    run_query(cursor, "SELECT id FROM series_registradas WHERE (serial_number = ? OR mac_number = ?)", (serial, serial))
+                    norma = _norm(serial)
+                    run_query(cursor, "SELECT id FROM series_registradas WHERE (serial_norm = ? OR mac_norm = ?)", (norma, norma))
                     existe = cursor.fetchone()
                     if existe:
-                        run_query(cursor, "UPDATE series_registradas SET ubicacion = 'BODEGA', paquete = 'NINGUNO', estado = 'DISPONIBLE' WHERE (serial_number = ? OR mac_number = ?)", (serial, serial))
+                        run_query(cursor, "UPDATE series_registradas SET ubicacion = 'BODEGA', paquete = 'NINGUNO', estado = 'DISPONIBLE' WHERE (serial_norm = ? OR mac_norm = ?)", (norma, norma))
                     else:
                         run_query(cursor, "INSERT INTO series_registradas (sku, serial_number, ubicacion, fecha_ingreso, paquete, estado, sucursal) VALUES (?, ?, 'BODEGA', ?, 'NINGUNO', 'DISPONIBLE', 'CHIRIQUI')", (sku, serial, fecha_evento))
 
@@ -398,74 +760,76 @@ def obtener_historial_prestamos_completo():
     finally:
         if conn: close_connection(conn)
 
-def sincronizar_stock_bodega_serializado(sucursal_context=None, target_db=None):
+def sincronizar_stock_bodega_serializado(sucursal_context=None, target_db=None, skus=None, existing_conn=None):
     """
     Sincroniza la columna 'cantidad' de la tabla 'productos' (ubicacion='BODEGA')
     con el conteo real de series en 'series_registradas' (estado='DISPONIBLE', ubicacion='BODEGA').
-    Solo para SKUs en PRODUCTOS_CON_CODIGO_BARRA.
+    Solo para los SKUs con serial del catálogo; con 'skus', solo los que tocó la operación.
+    Con 'existing_conn' corre en la transacción del llamador (no confirma).
     """
-    conn = None
     try:
-        from config import PRODUCTOS_CON_CODIGO_BARRA, CURRENT_CONTEXT
+        from config import CURRENT_CONTEXT
         sucursal = sucursal_context or CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
-        
-        conn = get_db_connection(target_db=target_db)
-        if DB_TYPE == 'MYSQL':
-            cursor = conn.cursor(buffered=True)
-        else:
-            cursor = conn.cursor()
+        with db_session(target_db=target_db, existing_conn=existing_conn) as (conn, cursor):
+            # El catálogo se lee (si hace falta) por la misma conexión, sin abrir otra del pool
+            con_serial = obtener_catalogo(existing_conn=conn).con_serial
+            objetivo = sorted(con_serial if skus is None else set(skus) & set(con_serial))
+            if not objetivo:
+                return True
+            marcas = ','.join(['?'] * len(objetivo))
 
-        logger.info(f"Sincronizando stock serializado para sucursal: {sucursal}")
-        
-        # 1. Obtener conteo real desde series_registradas
-        sql_counts = """
-            SELECT sku, COUNT(*) as real_qty
-            FROM series_registradas
-            WHERE ubicacion = 'BODEGA' AND estado = 'DISPONIBLE' AND sucursal = ?
-            AND sku IN ({})
-            GROUP BY sku
-        """.format(','.join(['?'] * len(PRODUCTOS_CON_CODIGO_BARRA)))
-        
-        params = [sucursal] + PRODUCTOS_CON_CODIGO_BARRA
-        run_query(cursor, sql_counts, tuple(params))
-        real_stock = {sku: qty for sku, qty in cursor.fetchall()}
-        
-        # 2. Asegurar que todos los productos serializados tengan una entrada en 'productos' para esa sucursal
-        for sku in PRODUCTOS_CON_CODIGO_BARRA:
-            qty = real_stock.get(sku, 0)
-            
-            # Ver si existe la entrada en productos
-            run_query(cursor, "SELECT cantidad FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ?", (sku, sucursal))
-            row = cursor.fetchone()
-            
-            if row is not None:
-                if row[0] != qty:
-                    run_query(cursor, "UPDATE productos SET cantidad = ? WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ?", (qty, sku, sucursal))
-                    logger.info(f"Stock sincronizado para {sku} en {sucursal}: {row[0]} -> {qty}")
+            # 1. Crear en BODEGA los SKUs que aún no tienen fila en la sucursal (caso raro)
+            run_query(cursor, f"SELECT sku FROM productos WHERE ubicacion = 'BODEGA' AND sucursal = ? AND sku IN ({marcas})",
+                      (sucursal, *objetivo))
+            existentes = {fila[0] for fila in cursor.fetchall()}
+            faltantes = [sku for sku in objetivo if sku not in existentes]
+            if faltantes:
+                from config import PRODUCTOS_INICIALES
+                run_query(cursor, f"SELECT sku, nombre, secuencia_vista FROM productos WHERE sku IN ({','.join(['?'] * len(faltantes))})",
+                          tuple(faltantes))
+                meta = {}
+                for sku, nombre, secuencia in cursor.fetchall():
+                    meta.setdefault(sku, (nombre, secuencia))
+                for nombre, sku, secuencia in PRODUCTOS_INICIALES:
+                    meta.setdefault(sku, (nombre, secuencia))
+                filas = []
+                for sku in faltantes:
+                    nombre, secuencia = meta.get(sku, (f"Producto {sku}", '999'))
+                    filas.append((nombre, sku, secuencia, sucursal))
+                run_many(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) VALUES (?, ?, 0, 'BODEGA', ?, ?)", filas)
+                logger.info(f"Creadas entradas de stock en {sucursal} para: {', '.join(faltantes)}")
+
+            # 2. Recalcular todas las cantidades en una sola sentencia contra el conteo agrupado
+            if DB_TYPE == 'MYSQL':
+                sql = f"""
+                    UPDATE productos p
+                    LEFT JOIN (
+                        SELECT sku, COUNT(*) AS real_qty
+                        FROM series_registradas
+                        WHERE ubicacion = 'BODEGA' AND estado = 'DISPONIBLE' AND sucursal = ? AND sku IN ({marcas})
+                        GROUP BY sku
+                    ) s ON s.sku = p.sku
+                    SET p.cantidad = COALESCE(s.real_qty, 0)
+                    WHERE p.ubicacion = 'BODEGA' AND p.sucursal = ? AND p.sku IN ({marcas})
+                """
+                params = (sucursal, *objetivo, sucursal, *objetivo)
             else:
-                run_query(cursor, "SELECT nombre, secuencia_vista FROM productos WHERE sku = ? LIMIT 1", (sku,))
-                meta = cursor.fetchone()
-                if not meta:
-                    from config import PRODUCTOS_INICIALES
-                    temp_data = next(((n, s) for n, current_sku, s in PRODUCTOS_INICIALES if current_sku == sku), (f"Producto {sku}", '999'))
-                    nombre, secuencia = temp_data
-                else:
-                    nombre, secuencia = meta
-                
-                run_query(cursor, "INSERT INTO productos (nombre, sku, cantidad, ubicacion, secuencia_vista, sucursal) VALUES (?, ?, ?, ?, ?, ?)",
-                               (nombre, sku, qty, "BODEGA", secuencia, sucursal))
-                logger.info(f"Creada entrada de stock para {sku} en {sucursal} con qty {qty}")
-                
-        if not target_db:
-            conn.commit()
-            
+                sql = f"""
+                    UPDATE productos SET cantidad = (
+                        SELECT COUNT(*) FROM series_registradas s
+                        WHERE s.sku = productos.sku AND s.ubicacion = 'BODEGA'
+                          AND s.estado = 'DISPONIBLE' AND s.sucursal = ?
+                    )
+                    WHERE ubicacion = 'BODEGA' AND sucursal = ? AND sku IN ({marcas})
+                """
+                params = (sucursal, sucursal, *objetivo)
+            run_query(cursor, sql, params)
+            logger.info(f"Stock serializado sincronizado en {sucursal}: {len(objetivo)} SKUs")
+
         return True
     except Exception as e:
         logger.error(f"Error al sincronizar stock serializado: {e}")
-        if conn: conn.rollback()
         return False
-    finally:
-        if conn: close_connection(conn)
 
 def actualizar_movimiento_abasto(id_movimiento, nueva_cantidad, nueva_referencia):
     """Actualiza la cantidad y referencia de un movimiento de abasto, ajustando el stock."""
@@ -478,13 +842,13 @@ def actualizar_movimiento_abasto(id_movimiento, nueva_cantidad, nueva_referencia
             cursor = conn.cursor()
         
         # 1. Obtener datos actuales del movimiento (incluye sucursal)
-        run_query(cursor, "SELECT sku_producto, cantidad_afectada, COALESCE(sucursal, 'CHIRIQUI') FROM movimientos WHERE id = ?", (id_movimiento,))
+        run_query(cursor, "SELECT sku_producto, cantidad_afectada, COALESCE(sucursal, 'CHIRIQUI'), tipo_movimiento, movil_afectado, COALESCE(fecha_evento, fecha_movimiento) FROM movimientos WHERE id = ?", (id_movimiento,))
         resultado = cursor.fetchone()
         
         if not resultado:
             return False, "Movimiento no encontrado."
             
-        sku, cantidad_anterior, sucursal = resultado
+        sku, cantidad_anterior, sucursal, tipo, movil, fecha = resultado
         
         # 2. Calcular diferencia
         diferencia = nueva_cantidad - cantidad_anterior
@@ -499,6 +863,8 @@ def actualizar_movimiento_abasto(id_movimiento, nueva_cantidad, nueva_referencia
             SET cantidad_afectada = ?, documento_referencia = ?
             WHERE id = ?
         """, (nueva_cantidad, nueva_referencia, id_movimiento))
+        acumular_movimientos(cursor, [(sku, tipo, diferencia, movil, fecha, sucursal)])
+        reindexar_movimientos(cursor, [id_movimiento])
         
         conn.commit()
         return True, "Abasto actualizado correctamente."
@@ -544,60 +910,29 @@ def obtener_movimientos_por_rango(fecha_inicio, fecha_fin):
 def registrar_abasto_batch(items_abasto, fecha_evento, numero_abasto=None, existing_conn=None, sucursal_context=None):
     """
     Registra múltiples items de abasto en una sola transacción.
+    Los movimientos se escriben con registrar_movimientos_batch (consultas agrupadas).
     """
-    conn = None
     try:
-        if existing_conn:
-            conn = existing_conn
-            if DB_TYPE == 'MYSQL':
-                cursor = conn.cursor(buffered=True)
-            else:
-                cursor = conn.cursor()
-        else:
-            conn = get_db_connection()
-            if DB_TYPE == 'MYSQL':
-                cursor = conn.cursor(buffered=True)
-            else:
-                cursor = conn.cursor()
-            
-            # Iniciar transacción explícita
-            if DB_TYPE == 'MYSQL':
-                cursor.execute("START TRANSACTION")
-            else:
-                cursor.execute("BEGIN IMMEDIATE")
-        
-        total_unidades = 0
-        series_globales = []
-        
         # SUCURSAL CONTEXT — usar el contexto activo de la sesión, no variable de entorno
         from config import CURRENT_CONTEXT
         sucursal = sucursal_context or CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
 
+        total_unidades = 0
+        series_globales = []
+        lote = []
+
         for item in items_abasto:
             sku = item['sku']
             cantidad = item['cantidad']
             seriales = item.get('seriales', [])
-            
-            observacion = f"Abasto por escaneo"
-            if numero_abasto:
-                observacion += f" #{numero_abasto}"
-            
-            # 1. Registrar movimiento
-            exito, msg = registrar_movimiento_gui(
-                sku=sku,
-                tipo_movimiento='ABASTO',
-                cantidad_afectada=cantidad,
-                fecha_evento=fecha_evento,
-                documento_referencia=numero_abasto,
-                existing_conn=conn,
-                sucursal_context=sucursal
-            )
-            
-            if not exito:
-                if not existing_conn: conn.rollback()
-                return False, f"Error en {sku}: {msg}"
-            
-            # 2. Preparar seriales para registro masivo
+
+            lote.append({
+                'sku': sku,
+                'tipo_movimiento': 'ABASTO',
+                'cantidad_afectada': cantidad,
+            })
+
+            # Preparar seriales para registro masivo
             if seriales:
                 for ser_item in seriales:
                     if isinstance(ser_item, dict):
@@ -606,7 +941,7 @@ def registrar_abasto_batch(items_abasto, fecha_evento, numero_abasto=None, exist
                     else:
                         s_val = str(ser_item)
                         m_val = None
-                    
+
                     if s_val:
                         series_globales.append({
                             'sku': sku,
@@ -615,29 +950,35 @@ def registrar_abasto_batch(items_abasto, fecha_evento, numero_abasto=None, exist
                             'ubicacion': 'BODEGA',
                             'sucursal': sucursal
                         })
-            
+
             total_unidades += cantidad
-        
-        # 3. Registrar todas las series
-        if series_globales:
-            # Import local para romper dependencia circular (inventory ↔ movements)
-            from data_layer.inventory import registrar_series_bulk
-            ok_s, msg_s = registrar_series_bulk(series_globales, fecha_ingreso=fecha_evento, paquete=None, existing_conn=conn)
-            if not ok_s:
-                if not existing_conn: conn.rollback()
-                return False, msg_s
-                
-        if not existing_conn:
-            conn.commit()
+
+        with db_session(existing_conn=existing_conn) as (conn, cursor):
+            # 1. Registrar movimientos (todo o nada)
+            exito, msg, resultados = registrar_movimientos_batch(
+                lote, fecha_evento=fecha_evento, documento_referencia=numero_abasto,
+                existing_conn=conn, sucursal_context=sucursal
+            )
+            if not exito:
+                fallido = next((i for i, r in enumerate(resultados) if not r[0]), None)
+                if fallido is not None and len(lote) > 1:
+                    msg = f"Error en {lote[fallido]['sku']}: {msg}"
+                raise _LoteRechazado(msg)
+
+            # 2. Registrar todas las series
+            if series_globales:
+                # Import local para romper dependencia circular (inventory ↔ movements)
+                from data_layer.inventory import registrar_series_bulk
+                ok_s, msg_s = registrar_series_bulk(series_globales, fecha_ingreso=fecha_evento, paquete=None, existing_conn=conn)
+                if not ok_s:
+                    raise _LoteRechazado(msg_s)
+
         return True, f"Abasto registrado: {len(items_abasto)} productos, {total_unidades} unidades."
-        
+
+    except _LoteRechazado as e:
+        # db_session ya hizo rollback si la conexión era propia
+        return False, str(e)
     except Exception as e:
-        if conn and not existing_conn:
-            conn.rollback()
         error_msg = f"Error al registrar abasto batch: {e}"
         logger.error(error_msg)
         return False, error_msg
-    finally:
-        if conn and not existing_conn:
-            close_connection(conn)
-
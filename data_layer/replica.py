@@ -0,0 +1,369 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+from utils.db_connector import db_session, get_db_connection, registrar_observador_escrituras
+from utils.sqlite_pool import obtener_sqlite
+from config import DB_TYPE, REPLICA_LOCAL, REPLICA_DB_NAME, REPLICA_INTERVALO_SEG
+
+from data_layer.core import run_query
+from data_layer.changes import LectorCambios, CAMBIOS_LIMITE_LECTURA
+
+# ─────────────────────────────────────────────────────────
+# RÉPLICA LOCAL DE LECTURA (ESCRITORIO + MYSQL)
+# ─────────────────────────────────────────────────────────
+# Con REPLICA_LOCAL=1 el escritorio mantiene en un SQLite local (REPLICA_DB_NAME) un espejo
+# de las tablas de abajo. Un hilo lo sincroniza cada REPLICA_INTERVALO_SEG:
+#   - productos / series_registradas: filas con actualizado_en >= última marca (con solape);
+#     los borrados se recogen comparando ids (periódicamente o tras un DELETE propio).
+#   - asignacion_moviles: los móviles que aparecen en el feed de cambios se releen completos.
+#   - asignacion_moviles / moviles / tecnicos: recarga completa al arrancar, tras una escritura
+#     propia y en cada reconciliación (REPLICA_RECONCILIAR_SEG).
+# Las escrituras siguen yendo a MySQL. Cada commit propio marca como sucias las tablas que
+# tocó (observador de utils/db_connector): hasta la siguiente sincronización, las lecturas
+# de esas tablas vuelven a MySQL. También se lee de MySQL si la réplica está atrasada.
+#
+# Los lectores optan con conexion_lectura(tablas) / sesion_lectura(tablas); su SQL debe
+# ser válido en ambos motores.
+TABLAS_REPLICA = ('productos', 'asignacion_moviles', 'series_registradas', 'moviles', 'tecnicos')
+_TABLAS_CON_MARCA = ('productos', 'series_registradas')
+_INDICES_LOCALES = {
+    'productos': ('sku, ubicacion, sucursal', 'codigo_barra_maestro', 'codigo_barra', 'actualizado_en'),
+    'series_registradas': ('serial_norm, sucursal', 'mac_norm, sucursal', 'sku', 'actualizado_en'),
+    'asignacion_moviles': ('movil', 'sku_producto'),
+}
+REPLICA_LOTE = 5000
+REPLICA_SOLAPE_SEG = 10
+REPLICA_RECONCILIAR_SEG = 300
+# Sin una sincronización exitosa en este tiempo, las lecturas vuelven a MySQL
+REPLICA_ATRASO_MAX_SEG = 60
+
+
+def _valor_local(valor):
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return int(valor) if valor == valor.to_integral_value() else float(valor)
+    if isinstance(valor, (bytes, bytearray)):
+        return bytes(valor).decode('utf-8', errors='replace')
+    return valor
+
+
+def _marca_texto(valor):
+    return str(valor)[:19] if valor is not None else None
+
+
+class ReplicaLocal:
+    """
+    Espejo SQLite local de TABLAS_REPLICA. Un solo hilo por proceso escribe en él;
+    los lectores abren conexiones de solo lectura (WAL) y nunca ven una carga a medias.
+    """
+
+    _instancia = None
+    _lock_instancia = threading.Lock()
+
+    @classmethod
+    def obtener(cls):
+        with cls._lock_instancia:
+            if cls._instancia is None:
+                cls._instancia = cls()
+            return cls._instancia
+
+    def __init__(self, ruta=REPLICA_DB_NAME, intervalo=REPLICA_INTERVALO_SEG):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._generacion = 0
+        self._sucias = {}          # tabla -> (generación de la última escritura propia, hubo borrados)
+        self._cargadas = set()
+        self._columnas = {}        # tabla -> columnas remotas (la primera es id)
+        self._marcas = {}          # tabla -> mayor actualizado_en aplicado
+        self._lector_cambios = LectorCambios()
+        self._ultima_sync = None
+        self._ultima_reconciliacion = 0.0
+
+    def iniciar(self):
+        """Arranca el hilo de sincronización (idempotente)."""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            registrar_observador_escrituras(self._invalidar)
+            self._hilo = threading.Thread(target=self._bucle, daemon=True, name="replica-local")
+            self._hilo.start()
+        self._despertar.set()
+
+    def _invalidar(self, tablas):
+        propias = {t: b for t, b in tablas.items() if t in TABLAS_REPLICA}
+        if not propias:
+            return
+        with self._lock:
+            self._generacion += 1
+            for tabla, borrados in propias.items():
+                previa = self._sucias.get(tabla)
+                self._sucias[tabla] = (self._generacion, borrados or bool(previa and previa[1]))
+        self._despertar.set()
+
+    def disponible(self, tablas):
+        """True si todas 'tablas' están cargadas, sin escrituras propias pendientes y al día."""
+        with self._lock:
+            if self._ultima_sync is None or time.monotonic() - self._ultima_sync > REPLICA_ATRASO_MAX_SEG:
+                return False
+            return all(t in self._cargadas and t not in self._sucias for t in tablas)
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            try:
+                self.sincronizar()
+            except Exception as e:
+                logger.warning(f"[REPLICA] Sincronización fallida: {e}")
+
+    # ─────────────────────────────────────────────────────────
+    # SINCRONIZACIÓN
+    # ─────────────────────────────────────────────────────────
+    def sincronizar(self, existing_conn=None):
+        """Un ciclo de sincronización completo. Lanza la excepción si falla (la réplica queda sucia)."""
+        with self._lock:
+            generacion = self._generacion
+            sucias = dict(self._sucias)
+        reconciliar = time.monotonic() - self._ultima_reconciliacion >= REPLICA_RECONCILIAR_SEG
+
+        local = obtener_sqlite(self.ruta)
+        try:
+            self._crear_estado(local)
+            with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+                if self._lector_cambios.cursor is None:
+                    # Se toma antes de cargar: los cambios que lleguen durante la carga se releen
+                    self._lector_cambios.leer(existing_conn=conn)
+                for tabla in TABLAS_REPLICA:
+                    if tabla in _TABLAS_CON_MARCA:
+                        if not self._reanudar(cursor, local, tabla):
+                            self._carga_completa(cursor, local, tabla)
+                            continue
+                        self._aplicar_desde_marca(cursor, local, tabla)
+                        if reconciliar or sucias.get(tabla, (0, False))[1]:
+                            self._reconciliar_ids(cursor, local, tabla)
+                    elif tabla not in self._cargadas or tabla in sucias or reconciliar:
+                        self._carga_completa(cursor, local, tabla)
+                self._aplicar_feed(conn, cursor, local)
+            local.commit()
+        finally:
+            local.close()
+
+        ahora = time.monotonic()
+        with self._lock:
+            self._cargadas.update(TABLAS_REPLICA)
+            for tabla in [t for t, (g, _) in self._sucias.items() if g <= generacion]:
+                del self._sucias[tabla]
+            self._ultima_sync = ahora
+            if reconciliar:
+                self._ultima_reconciliacion = ahora
+
+    def _crear_estado(self, local):
+        local.execute("""
+            CREATE TABLE IF NOT EXISTS replica_estado (
+                tabla TEXT PRIMARY KEY,
+                columnas TEXT NOT NULL,
+                marca TEXT
+            )
+        """)
+
+    def _columnas_remotas(self, cursor, tabla):
+        run_query(cursor, f"SELECT * FROM {tabla} LIMIT 0")
+        cursor.fetchall()
+        columnas = [d[0] for d in cursor.description]
+        # id primero: es la clave del espejo
+        return ['id'] + [c for c in columnas if c != 'id']
+
+    def _reanudar(self, cursor, local, tabla):
+        """
+        True si la tabla con marca puede seguir incrementalmente: ya cargada en este proceso,
+        o cargada en una ejecución anterior con las mismas columnas. Si no, hará carga completa.
+        """
+        if tabla in self._cargadas:
+            return bool(self._marcas.get(tabla))
+        columnas = self._columnas_remotas(cursor, tabla)
+        fila = local.execute("SELECT columnas, marca FROM replica_estado WHERE tabla = ?", (tabla,)).fetchone()
+        if not fila or fila[0] != ','.join(columnas) or not fila[1]:
+            return False
+        self._columnas[tabla] = columnas
+        self._marcas[tabla] = fila[1]
+        return True
+
+    def _preparar_tabla(self, cursor, local, tabla):
+        """Crea (o recrea si cambió el esquema remoto) la tabla local. Retorna sus columnas."""
+        columnas = self._columnas_remotas(cursor, tabla)
+        actuales = [f[1] for f in local.execute(f"PRAGMA table_info({tabla})").fetchall()]
+        if actuales != columnas:
+            local.execute(f"DROP TABLE IF EXISTS {tabla}")
+            otras = ''.join(f', "{c}"' for c in columnas[1:])
+            local.execute(f"CREATE TABLE {tabla} (id INTEGER PRIMARY KEY{otras})")
+            for i, cols in enumerate(_INDICES_LOCALES.get(tabla, ())):
+                if all(c.strip() in columnas for c in cols.split(',')):
+                    local.execute(f"CREATE INDEX IF NOT EXISTS idx_replica_{tabla}_{i} ON {tabla}({cols})")
+        self._columnas[tabla] = columnas
+        return columnas
+
+    def _insertar(self, local, tabla, filas):
+        if not filas:
+            return
+        columnas = self._columnas[tabla]
+        marcas = ','.join(['?' for _ in columnas])
+        local.executemany(f"INSERT OR REPLACE INTO {tabla} ({','.join(columnas)}) VALUES ({marcas})",
+                          [tuple(_valor_local(v) for v in fila) for fila in filas])
+
+    def _marca_remota(self, cursor, tabla):
+        run_query(cursor, f"SELECT MAX(actualizado_en) FROM {tabla}")
+        fila = cursor.fetchone()
+        return _marca_texto(fila[0]) if fila else None
+
+    def _guardar_marca(self, local, tabla, marca):
+        self._marcas[tabla] = marca
+        local.execute("INSERT OR REPLACE INTO replica_estado (tabla, columnas, marca) VALUES (?, ?, ?)",
+                      (tabla, ','.join(self._columnas[tabla]), marca))
+
+    def _carga_completa(self, cursor, local, tabla):
+        columnas = self._preparar_tabla(cursor, local, tabla)
+        # La marca se toma ANTES de leer para no perder cambios que lleguen durante la lectura
+        marca = self._marca_remota(cursor, tabla) if tabla in _TABLAS_CON_MARCA else None
+        local.execute(f"DELETE FROM {tabla}")
+        ultimo, total = 0, 0
+        while True:
+            run_query(cursor, f"SELECT {','.join(columnas)} FROM {tabla} WHERE id > ? ORDER BY id LIMIT ?", (ultimo, REPLICA_LOTE))
+            filas = cursor.fetchall()
+            self._insertar(local, tabla, filas)
+            total += len(filas)
+            if len(filas) < REPLICA_LOTE:
+                break
+            ultimo = filas[-1][0]
+        if tabla in _TABLAS_CON_MARCA:
+            self._guardar_marca(local, tabla, marca)
+        logger.debug(f"[REPLICA] {tabla}: carga completa ({total} filas)")
+
+    def _aplicar_desde_marca(self, cursor, local, tabla):
+        marca = self._marcas.get(tabla)
+        nueva = self._marca_remota(cursor, tabla) or marca
+        desde = (datetime.strptime(marca, '%Y-%m-%d %H:%M:%S') - timedelta(seconds=REPLICA_SOLAPE_SEG)).strftime('%Y-%m-%d %H:%M:%S')
+        run_query(cursor, f"SELECT {','.join(self._columnas[tabla])} FROM {tabla} WHERE actualizado_en >= ?", (desde,))
+        self._insertar(local, tabla, cursor.fetchall())
+        if nueva != marca:
+            self._guardar_marca(local, tabla, nueva)
+
+    def _reconciliar_ids(self, cursor, local, tabla):
+        """Quita del espejo las filas borradas en MySQL (los borrados no dejan marca)."""
+        run_query(cursor, f"SELECT id FROM {tabla}")
+        remotos = {f[0] for f in cursor.fetchall()}
+        sobrantes = [(f[0],) for f in local.execute(f"SELECT id FROM {tabla}") if f[0] not in remotos]
+        local.executemany(f"DELETE FROM {tabla} WHERE id = ?", sobrantes)
+
+    def _aplicar_feed(self, conn, cursor, local):
+        """Relee las asignaciones de los móviles que aparecen en el feed de cambios desde el último ciclo."""
+        moviles = set()
+        while True:
+            eventos = self._lector_cambios.leer(existing_conn=conn)
+            moviles.update(e['ubicacion'] for e in eventos if e['ubicacion'] not in ('BODEGA', 'DESCARTE'))
+            if len(eventos) < CAMBIOS_LIMITE_LECTURA:
+                break
+        if not moviles or 'asignacion_moviles' not in self._columnas:
+            return
+        moviles = sorted(moviles)
+        marcas = ','.join(['?' for _ in moviles])
+        run_query(cursor, f"SELECT {','.join(self._columnas['asignacion_moviles'])} FROM asignacion_moviles WHERE movil IN ({marcas})", tuple(moviles))
+        filas = cursor.fetchall()
+        local.execute(f"DELETE FROM asignacion_moviles WHERE movil IN ({marcas})", tuple(moviles))
+        self._insertar(local, 'asignacion_moviles', filas)
+
+
+# ─────────────────────────────────────────────────────────
+# LECTURAS
+# ─────────────────────────────────────────────────────────
+class _CursorReplica:
+    """Cursor de la réplica que acepta el SQL ya adaptado a MySQL por run_query (%s -> ?)."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=None):
+        self._cursor.execute(query.replace('%s', '?'), params or ())
+        return self
+
+    def executemany(self, query, seq_params):
+        self._cursor.executemany(query.replace('%s', '?'), seq_params)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class _ConexionReplica:
+    """Conexión de solo lectura a la réplica; cursor() ignora argumentos de MySQL (buffered=True)."""
+
+    es_replica = True
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return _CursorReplica(self._conn.cursor())
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+
+def _replica_para(tablas):
+    replica = ReplicaLocal._instancia
+    if replica is None or not replica.disponible(tablas):
+        return None
+    try:
+        return _ConexionReplica(obtener_sqlite(replica.ruta, solo_lectura=True))
+    except Exception as e:
+        logger.warning(f"[REPLICA] No se pudo abrir la réplica, se lee de la BD: {e}")
+        return None
+
+
+def conexion_lectura(tablas, target_db=None):
+    """
+    Conexión para una lectura que solo usa 'tablas': la réplica local si está al día para
+    todas ellas, si no una de solo lectura a la BD. Se cierra con close_connection().
+    """
+    conn = _replica_para(tablas) if target_db is None else None
+    return conn or get_db_connection(target_db, solo_lectura=True)
+
+
+@contextmanager
+def sesion_lectura(tablas):
+    """Como db_session(solo_lectura=True), sobre la réplica local cuando está al día para 'tablas'."""
+    conn = _replica_para(tablas)
+    if conn is None:
+        with db_session(solo_lectura=True) as (conn, cursor):
+            yield conn, cursor
+        return
+    cursor = conn.cursor()
+    try:
+        yield conn, cursor
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def iniciar_replica_local():
+    """Arranca la réplica si está activada en config y la BD es MySQL. Retorna la instancia o None."""
+    if not REPLICA_LOCAL or DB_TYPE != 'MYSQL':
+        return None
+    replica = ReplicaLocal.obtener()
+    replica.iniciar()
+    logger.info(f"[REPLICA] Réplica local activa en {replica.ruta}")
+    return replica
@@ -0,0 +1,240 @@
+import re
+import unicodedata
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+from utils.db_connector import db_session
+from config import DB_TYPE
+
+from data_layer.core import run_query, run_many
+
+# ─────────────────────────────────────────────────────────
+# ÍNDICE DE BÚSQUEDA DEL HISTORIAL
+# ─────────────────────────────────────────────────────────
+# movimientos_tokens (migración 7) guarda una fila por (sucursal, token, movimiento):
+# los términos de sku, tipo, móvil, observaciones, documento_referencia y nombre del
+# producto, normalizados (mayúsculas, sin tildes). Cada término buscado es un prefijo de
+# token resuelto con el índice, en vez de seis LIKE '%texto%' sobre todo el historial.
+#
+# Los escritores indexan sus movimientos en la misma transacción que los inserta
+# (indexar_ids / indexar_movimientos desde ultimo_id_movimiento), así un movimiento
+# confirmado siempre es buscable; las ediciones llaman a reindexar_movimientos.
+# indexar_pendientes es la puesta al día sin huecos para filas escritas por fuera
+# (scripts, SQL manual): la corre el escritorio al arrancar y la CLI de este módulo.
+#
+# Un término que no es prefijo de ningún token (p. ej. un fragmento del medio de un
+# serial) se busca por subcadena, como antes del índice, sobre los mismos campos.
+INDICE_LOTE = 1000
+HISTORIAL_PAGINA = 300
+TOKEN_MAX = 100
+
+# Palabra: todo lo que no sea espacio ni separador. Se indexa completa ("1-2-16",
+# "AA:BB:CC") y también por partes alfanuméricas ("1", "2", "16").
+_RE_PALABRA = re.compile(r"[^\s,;|()\[\]{}\"'=<>]+")
+_RE_PARTES = re.compile(r"[^\W_]+")
+_BORDES = "-:./#*+!?_"
+
+
+def _normalizar(texto):
+    """Mayúsculas sin tildes ('Móvil' -> 'MOVIL')."""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in texto if not unicodedata.combining(c)).upper()
+
+
+def _palabras(texto):
+    for palabra in _RE_PALABRA.findall(_normalizar(texto)):
+        palabra = palabra.strip(_BORDES)
+        if palabra:
+            yield palabra[:TOKEN_MAX]
+
+
+def tokenizar(*textos):
+    """Conjunto de tokens indexables de los textos dados (None y vacíos se ignoran)."""
+    tokens = set()
+    for texto in textos:
+        if texto is None:
+            continue
+        for palabra in _palabras(texto):
+            tokens.add(palabra)
+            tokens.update(_RE_PARTES.findall(palabra))
+    return tokens
+
+
+def terminos_busqueda(texto):
+    """Términos de una búsqueda del usuario, en orden y sin repetir; cada uno se usa como prefijo."""
+    return list(dict.fromkeys(_palabras(texto or '')))
+
+
+def _sql_insertar_tokens():
+    ignorar = "INSERT IGNORE" if DB_TYPE == 'MYSQL' else "INSERT OR IGNORE"
+    return f"{ignorar} INTO movimientos_tokens (sucursal, token, movimiento_id) VALUES (?, ?, ?)"
+
+
+_SQL_MOVIMIENTOS_A_INDEXAR = """
+    SELECT m.id, COALESCE(m.sucursal, 'CHIRIQUI'), m.sku_producto, m.tipo_movimiento, m.movil_afectado,
+           m.observaciones, m.documento_referencia,
+           (SELECT p.nombre FROM productos p WHERE p.sku = m.sku_producto AND p.ubicacion = 'BODEGA' LIMIT 1)
+    FROM movimientos m
+"""
+
+
+def _indexar_filas(cursor, filas):
+    tokens = []
+    for id_mov, sucursal, *textos in filas:
+        suc = (sucursal or 'CHIRIQUI').upper()
+        tokens.extend((suc, token, id_mov) for token in sorted(tokenizar(*textos)))
+    run_many(cursor, _sql_insertar_tokens(), tokens)
+    return len(tokens)
+
+
+def indexar_movimientos(cursor, desde_id=0, lote=INDICE_LOTE):
+    """
+    Indexa los movimientos con id > desde_id, en bloques por id. Los tokens ya presentes
+    se ignoran, así que repetir un rango es seguro. Retorna el número de movimientos indexados.
+    """
+    total, ultimo = 0, int(desde_id or 0)
+    while True:
+        run_query(cursor, _SQL_MOVIMIENTOS_A_INDEXAR + " WHERE m.id > ? ORDER BY m.id LIMIT ?", (ultimo, lote))
+        filas = cursor.fetchall()
+        if not filas:
+            break
+        _indexar_filas(cursor, filas)
+        total += len(filas)
+        ultimo = filas[-1][0]
+        if len(filas) < lote:
+            break
+    return total
+
+
+def ultimo_id_movimiento(cursor):
+    """Mayor id de movimientos visible; tomarlo antes de insertar y pasarlo a indexar_movimientos."""
+    run_query(cursor, "SELECT MAX(id) FROM movimientos")
+    fila = cursor.fetchone()
+    return (fila[0] or 0) if fila else 0
+
+
+def indexar_ids(cursor, ids):
+    """Indexa los movimientos 'ids' (recién insertados) en la transacción del llamador."""
+    ids = sorted({int(i) for i in ids or () if i})
+    for i in range(0, len(ids), INDICE_LOTE):
+        bloque = ids[i:i + INDICE_LOTE]
+        run_query(cursor, _SQL_MOVIMIENTOS_A_INDEXAR + f" WHERE m.id IN ({','.join(['?' for _ in bloque])})", tuple(bloque))
+        _indexar_filas(cursor, cursor.fetchall())
+
+
+def reindexar_movimientos(cursor, ids):
+    """Vuelve a indexar los movimientos 'ids' tras editar sus textos, en la transacción del llamador."""
+    ids = sorted({int(i) for i in ids or ()})
+    for i in range(0, len(ids), INDICE_LOTE):
+        bloque = ids[i:i + INDICE_LOTE]
+        run_query(cursor, f"DELETE FROM movimientos_tokens WHERE movimiento_id IN ({','.join(['?' for _ in bloque])})", tuple(bloque))
+        indexar_ids(cursor, bloque)
+
+
+def indexar_pendientes(cursor, lote=INDICE_LOTE):
+    """
+    Indexa todos los movimientos que no tienen ningún token, sin importar su antigüedad.
+    Retorna cuántos movimientos indexó.
+    """
+    total, ultimo = 0, 0
+    while True:
+        run_query(cursor, """
+            SELECT m.id FROM movimientos m
+            WHERE m.id > ? AND NOT EXISTS (SELECT 1 FROM movimientos_tokens t WHERE t.movimiento_id = m.id)
+            ORDER BY m.id LIMIT ?
+        """, (ultimo, lote))
+        ids = [fila[0] for fila in cursor.fetchall()]
+        if not ids:
+            break
+        indexar_ids(cursor, ids)
+        total += len(ids)
+        ultimo = ids[-1]
+        if len(ids) < lote:
+            break
+    return total
+
+
+def poner_al_dia_indice():
+    """indexar_pendientes en su propia transacción (todo o nada). Retorna los indexados o None si falla."""
+    try:
+        with db_session() as (conn, cursor):
+            total = indexar_pendientes(cursor)
+        if total:
+            logger.info(f"movimientos_tokens: {total} movimientos sin indexar puestos al día")
+        return total
+    except Exception as e:
+        logger.warning(f"No se pudo poner al día el índice del historial: {e}")
+        return None
+
+
+def reconstruir_indice(cursor):
+    """Borra y vuelve a poblar movimientos_tokens desde todo el historial."""
+    run_query(cursor, "DELETE FROM movimientos_tokens")
+    total = indexar_movimientos(cursor)
+    logger.info(f"movimientos_tokens: {total} movimientos indexados")
+    return total
+
+
+def _patron_prefijo(termino):
+    return termino.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+
+
+def _patron_subcadena(termino):
+    return '%' + _patron_prefijo(termino)
+
+
+def _es_prefijo_indexado(cursor, suc, termino):
+    run_query(cursor, "SELECT 1 FROM movimientos_tokens WHERE sucursal = ? AND token LIKE ? ESCAPE '!' LIMIT 1",
+              (suc, _patron_prefijo(termino)))
+    return cursor.fetchone() is not None
+
+
+def buscar_historial(filtro_texto=None, sucursal=None, limite=HISTORIAL_PAGINA, antes_de_id=None, existing_conn=None):
+    """
+    Una página del historial de movimientos de la sucursal, del más nuevo al más viejo.
+    Cada término de 'filtro_texto' debe ser prefijo de algún token del movimiento; si no es
+    prefijo de ningún token de la sucursal, se busca como subcadena (sin índice).
+    Paginación por clave: la página siguiente se pide con antes_de_id = id de la última fila,
+    así cada página cuesta lo mismo sin importar cuán atrás esté.
+    Retorna [(id, fecha_movimiento, tipo, nombre o sku, cantidad, móvil o '-', observaciones)].
+    """
+    suc = (sucursal or 'CHIRIQUI').upper()
+    terminos = terminos_busqueda(filtro_texto)
+    sql = """
+        SELECT m.id, m.fecha_movimiento, m.tipo_movimiento,
+               COALESCE((SELECT p.nombre FROM productos p
+                         WHERE p.sku = m.sku_producto AND p.ubicacion = 'BODEGA' LIMIT 1), m.sku_producto),
+               m.cantidad_afectada, COALESCE(m.movil_afectado, '-'), COALESCE(m.observaciones, '')
+        FROM movimientos m
+        WHERE (m.sucursal = ? OR (m.sucursal IS NULL AND ? = 'CHIRIQUI'))
+    """
+    params = [suc, suc]
+    if antes_de_id:
+        sql += " AND m.id < ?"
+        params.append(int(antes_de_id))
+
+    with db_session(existing_conn=existing_conn, solo_lectura=True) as (conn, cursor):
+        for termino in terminos:
+            if _es_prefijo_indexado(cursor, suc, termino):
+                sql += """ AND m.id IN (SELECT t.movimiento_id FROM movimientos_tokens t
+                                       WHERE t.sucursal = ? AND t.token LIKE ? ESCAPE '!')"""
+                params.extend([suc, _patron_prefijo(termino)])
+            else:
+                sql += """ AND (m.sku_producto LIKE ? ESCAPE '!' OR m.tipo_movimiento LIKE ? ESCAPE '!'
+                               OR m.movil_afectado LIKE ? ESCAPE '!' OR m.observaciones LIKE ? ESCAPE '!'
+                               OR m.documento_referencia LIKE ? ESCAPE '!'
+                               OR EXISTS (SELECT 1 FROM productos p WHERE p.sku = m.sku_producto
+                                          AND p.ubicacion = 'BODEGA' AND p.nombre LIKE ? ESCAPE '!'))"""
+                params.extend([_patron_subcadena(termino)] * 6)
+        sql += " ORDER BY m.id DESC LIMIT ?"
+        params.append(int(limite))
+        run_query(cursor, sql, tuple(params))
+        return cursor.fetchall()
+
+
+if __name__ == '__main__':
+    # python -m data_layer.search   (reconstruye el índice completo)
+    with db_session() as (conn, cursor):
+        total = reconstruir_indice(cursor)
+    print(f"Índice del historial reconstruido: {total} movimientos.")
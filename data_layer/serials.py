@@ -0,0 +1,118 @@
+import json
+import re
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+from data_layer.core import run_query, run_many
+
+# ─────────────────────────────────────────────────────────
+# ENLACE CONSUMO / MOVIMIENTO -> SERIE
+# ─────────────────────────────────────────────────────────
+# consumo_series (migración 6) guarda una fila por serie usada en un consumo
+# (consumos_pendientes.id) o en un movimiento (movimientos.id), con la serie ya
+# normalizada (UPPER(TRIM)) e indexada. Reemplaza los LIKE '%serie%' sobre el JSON
+# seriales_usados y sobre movimientos.observaciones al rastrear un equipo.
+BACKFILL_LOTE = 1000
+
+_RE_SERIES_OBS = re.compile(r"Series:\s*(.+)$")
+
+
+def _norm_serie(valor):
+    return str(valor).strip().upper() if valor is not None else ''
+
+
+def extraer_seriales(seriales_usados):
+    """Seriales de consumos_pendientes.seriales_usados (JSON de lista o texto separado por comas)."""
+    if not seriales_usados:
+        return []
+    try:
+        valor = json.loads(seriales_usados)
+    except (TypeError, ValueError):
+        valor = str(seriales_usados).split(',')
+    if not isinstance(valor, list):
+        valor = [valor]
+    return [s for s in (_norm_serie(v) for v in valor if v is not None) if s]
+
+
+def extraer_seriales_observacion(observaciones):
+    """Seriales del sufijo 'Series: a, b' que registrar_movimiento_gui agrega a las observaciones."""
+    m = _RE_SERIES_OBS.search(observaciones or '')
+    if not m:
+        return []
+    return [s for s in (_norm_serie(v) for v in m.group(1).split(',')) if s]
+
+
+def registrar_series_consumo(cursor, sucursal, seriales, consumo_id=None, movimiento_id=None):
+    """
+    Enlaza 'seriales' con el consumo y/o movimiento indicados, en la transacción del llamador.
+    Como los demás agregados de escritura, un fallo se propaga (el enlace es parte del registro).
+    """
+    normas = sorted({_norm_serie(s) for s in seriales or () if _norm_serie(s)})
+    if not normas or (consumo_id is None and movimiento_id is None):
+        return
+    suc = (sucursal or 'CHIRIQUI').upper()
+    run_many(cursor, "INSERT INTO consumo_series (consumo_id, movimiento_id, serial_norm, sucursal) VALUES (?, ?, ?, ?)",
+             [(consumo_id, movimiento_id, s, suc) for s in normas])
+
+
+def buscar_consumo_de_serie(cursor, normas, sucursal):
+    """
+    Último consumo (o, si no hay, la última salida/consumo de móvil) de alguna de las series
+    'normas' en la sucursal. Retorna (movil, contrato, fecha) o None. Una sola lectura indexada.
+    """
+    normas = [n for n in normas if n]
+    if not normas:
+        return None
+    sql = f"""
+        SELECT COALESCE(c.movil, m.movil_afectado),
+               COALESCE(NULLIF(TRIM(c.num_contrato), ''), NULLIF(TRIM(c.ticket), ''), m.documento_referencia),
+               COALESCE(c.fecha, m.fecha_evento)
+        FROM consumo_series cs
+        LEFT JOIN consumos_pendientes c ON c.id = cs.consumo_id
+        LEFT JOIN movimientos m ON m.id = cs.movimiento_id
+        WHERE cs.serial_norm IN ({','.join(['?' for _ in normas])}) AND cs.sucursal = ?
+          AND (c.id IS NOT NULL OR m.tipo_movimiento IN ('CONSUMO_MOVIL', 'SALIDA_MOVIL'))
+        ORDER BY CASE WHEN c.id IS NOT NULL THEN 0 WHEN m.tipo_movimiento = 'CONSUMO_MOVIL' THEN 1 ELSE 2 END, cs.id DESC
+        LIMIT 1
+    """
+    run_query(cursor, sql, tuple(normas) + ((sucursal or 'CHIRIQUI').upper(),))
+    return cursor.fetchone()
+
+
+def backfill_consumo_series(cursor, lote=BACKFILL_LOTE):
+    """
+    Llena consumo_series desde el histórico: el JSON de consumos_pendientes y el sufijo
+    'Series: ...' de movimientos. Recorre por id en bloques; parte de cero (borra lo previo).
+    Retorna el número de enlaces creados.
+    """
+    run_query(cursor, "DELETE FROM consumo_series")
+    total = 0
+    fuentes = (
+        ("SELECT id, seriales_usados, sucursal FROM consumos_pendientes "
+         "WHERE id > ? AND seriales_usados IS NOT NULL AND seriales_usados <> '' ORDER BY id LIMIT ?",
+         (), extraer_seriales, 'consumo'),
+        ("SELECT id, observaciones, sucursal FROM movimientos "
+         "WHERE id > ? AND observaciones LIKE ? ORDER BY id LIMIT ?",
+         ('%Series:%',), extraer_seriales_observacion, 'movimiento'),
+    )
+    for sql, filtro, extraer, campo in fuentes:
+        ultimo = 0
+        while True:
+            run_query(cursor, sql, (ultimo,) + filtro + (lote,))
+            filas = cursor.fetchall()
+            if not filas:
+                break
+            enlaces = []
+            for id_fila, texto, sucursal in filas:
+                suc = (sucursal or 'CHIRIQUI').upper()
+                for serie in sorted(set(extraer(texto))):
+                    enlaces.append((id_fila, None, serie, suc) if campo == 'consumo' else (None, id_fila, serie, suc))
+            run_many(cursor, "INSERT INTO consumo_series (consumo_id, movimiento_id, serial_norm, sucursal) VALUES (?, ?, ?, ?)", enlaces)
+            total += len(enlaces)
+            ultimo = filas[-1][0]
+            if len(filas) < lote:
+                break
+    logger.info(f"consumo_series: {total} enlaces reconstruidos desde el histórico")
+    return total
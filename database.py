@@ -17,3 +17,10 @@ from data_layer.inventory import *
 from data_layer.movements import *
 from data_layer.mobile import *
 from data_layer.reminders import *
+from data_layer.jobs import *
+from data_layer.catalog import *
+from data_layer.changes import *
+from data_layer.ledger import *
+from data_layer.serials import *
+from data_layer.search import *
+from data_layer.replica import *
@@ -3,7 +3,7 @@ from tkinter import ttk, messagebox
 import threading
 import os
 from datetime import date
-from config import PRODUCTOS_CON_CODIGO_BARRA
+from database import es_equipo_serializado
 from .styles import Styles
 from .utils import darken_color, mostrar_mensaje_emergente
 from utils.logger import get_logger
@@ -17,9 +17,9 @@ from database import (
     actualizar_movimiento_abasto,
     verificar_serie_existe,
     registrar_series_bulk,
-    obtener_sku_por_codigo_barra,
-    obtener_todos_los_seriales_sucursal # NUEVO
+    obtener_sku_por_codigo_barra
 )
+from .services.scan_index import ScanIndex
 
 class SerialCaptureDialog:
     def __init__(self, parent, sku, nombre, cantidad_total, allow_existing=False):
@@ -35,6 +35,7 @@ class SerialCaptureDialog:
         self.allow_existing = allow_existing
         
         # --- CACHÉ LOCAL PARA ESCANEO RÁPIDO ---
+        # Seriales capturados en esta sesión; los de la BD los resuelve el índice compartido
         self.existing_serials_cache = set()
         self.cache_listo = False
         self._iniciar_carga_cache()
@@ -106,13 +107,15 @@ class SerialCaptureDialog:
         self.top.wait_window()
         
     def _iniciar_carga_cache(self):
-        """Carga todos los seriales de la sucursal en un set para validación instantánea"""
+        """Usa el índice de escaneo de la sucursal (ya cargado si otro escáner lo abrió) para validación instantánea"""
+        self.scan_index = ScanIndex.obtener()
+
         def cargar():
             try:
-                seriales = obtener_todos_los_seriales_sucursal()
-                self.existing_serials_cache = seriales
+                if not self.scan_index.listo.wait(60):
+                    return
                 self.cache_listo = True
-                logger.info(f"🚀 Caché de seriales cargado: {len(seriales)} registros.")
+                logger.info("🚀 Índice de seriales listo para validación instantánea.")
                 # Feedback sutil en UI si sigue abierta
                 try:
                     self.lbl_help.config(text="✅ Escáner Optimizado (Instantáneo)", fg=Styles.SUCCESS_COLOR)
@@ -137,7 +140,7 @@ class SerialCaptureDialog:
             
         # 2. Verificar contra Base de Datos (usando Caché local para velocidad)
         if not self.allow_existing:
-            if val in self.existing_serials_cache:
+            if val in self.existing_serials_cache or self.scan_index.contiene_serial(val):
                 messagebox.showerror("Error", f"El Serial/MAC '{val}' ya existe en el sistema.", parent=self.top)
                 self.entry_serie.delete(0, tk.END)
                 return
@@ -412,7 +415,10 @@ class AbastoWindow:
             if raw_code in self.entry_vars:
                 sku_encontrado = raw_code
             else:
-                found_db = obtener_sku_por_codigo_barra(raw_code)
+                # Índice en memoria primero; la BD solo si el código no está indexado
+                found_db, _, _, _ = ScanIndex.obtener().lookup(raw_code)
+                if not found_db:
+                    found_db = obtener_sku_por_codigo_barra(raw_code)
                 if found_db:
                     found_str = str(found_db).strip().upper()
                     if found_str in self.entry_vars:
@@ -441,7 +447,7 @@ class AbastoWindow:
                                  break
                     break
                     
-            required_serials = sku_encontrado in PRODUCTOS_CON_CODIGO_BARRA
+            required_serials = es_equipo_serializado(sku_encontrado)
             msg_qty = f"Producto: {nombre_prod}\nSKU: {sku_encontrado}\n\nIngrese cantidad a ingresar:"
             if required_serials:
                 msg_qty += "\n(Luego se pedirá escanear las series)"
@@ -532,7 +538,7 @@ class AbastoWindow:
             tk.Label(self.scrollable_frame, text='', bg=bg_color).grid(row=idx, column=4)
             
             # Crear botón de escanear series si el producto lo requiere
-            if sku in PRODUCTOS_CON_CODIGO_BARRA:
+            if es_equipo_serializado(sku):
                 btn_scan = tk.Button(self.scrollable_frame, text="🔍 Escanear Series", 
                                    command=crear_boton_escanear(sku_str, nombre),
                                    bg=Styles.INFO_COLOR, fg='white', font=('Segoe UI', 8),
@@ -592,7 +598,7 @@ class AbastoWindow:
             # --- VALIDACIÓN DE SERIES ---
             items_finales_ajustados = []
             for sku, qty in items_to_save:
-                if sku in PRODUCTOS_CON_CODIGO_BARRA:
+                if es_equipo_serializado(sku):
                     cant_scanned = len(self.series_capturadas.get(sku, []))
                     if sku not in self.series_capturadas or cant_scanned == 0:
                         mostrar_mensaje_emergente(self.window, "Error", 
@@ -848,7 +854,7 @@ class AbastoDetailWindow:
             # Determinar qué mostrar en la columna de series
             if sku in self.series_por_sku and len(self.series_por_sku[sku]) > 0:
                 series_text = f"📋 {len(self.series_por_sku[sku])} códigos"
-            elif sku in PRODUCTOS_CON_CODIGO_BARRA:
+            elif es_equipo_serializado(sku):
                 series_text = "⚠️ Sin series"
             else:
                 series_text = "—"
@@ -918,7 +924,7 @@ class AbastoDetailWindow:
         old_ref = vals[4]
         
         # Si hizo clic en la columna de Series (#6), abrir diálogo de códigos
-        if column == '#6' and sku in PRODUCTOS_CON_CODIGO_BARRA:
+        if column == '#6' and es_equipo_serializado(sku):
             self.ver_codigos_serie(sku, nombre_producto)
             return
         
@@ -928,7 +934,7 @@ class AbastoDetailWindow:
         cursor = conn.cursor()
         
         series_actuales = []
-        if sku in PRODUCTOS_CON_CODIGO_BARRA:
+        if es_equipo_serializado(sku):
             try:
                 sql = """
                     SELECT serial_number 
@@ -983,7 +989,7 @@ class AbastoDetailWindow:
         series_editadas = series_actuales.copy()
         
         # Si el producto tiene series, mostrar sección de edición de series
-        if sku in PRODUCTOS_CON_CODIGO_BARRA:
+        if es_equipo_serializado(sku):
             series_frame = tk.LabelFrame(edit_win, text="📋 Códigos de Serie", 
                                         font=('Segoe UI', 11, 'bold'), padx=10, pady=10)
             series_frame.pack(fill='both', expand=True, padx=20, pady=10)
@@ -1091,7 +1097,7 @@ class AbastoDetailWindow:
                     return
                 
                 # Validar que la cantidad coincida con las series (si aplica)
-                if sku in PRODUCTOS_CON_CODIGO_BARRA:
+                if es_equipo_serializado(sku):
                     if len(series_editadas) != new_q:
                         messagebox.showwarning("Error", 
                             f"La cantidad ({new_q}) no coincide con el número de series ({len(series_editadas)}).\n\n"
@@ -1106,7 +1112,7 @@ class AbastoDetailWindow:
                 
                 
                 # Si tiene series, actualizar en la base de datos
-                if sku in PRODUCTOS_CON_CODIGO_BARRA:
+                if es_equipo_serializado(sku):
                     conn = None
                     try:
                         conn = get_db_connection()
@@ -3,7 +3,6 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 from datetime import date
-from config import PRODUCTOS_CON_CODIGO_BARRA
 from .styles import Styles
 from .utils import darken_color, mostrar_mensaje_emergente, mostrar_cargando_async
 from utils.logger import get_logger
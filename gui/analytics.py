@@ -18,9 +18,10 @@ import time
 from database import (
     obtener_stock_actual_y_moviles,
     obtener_nombres_moviles,
-    get_db_connection,
-    run_query
+    consultar_resumen,
+    consultar_total_por_sku
 )
+from config import TIPOS_CONSUMO, TIPOS_ABASTO
 from .styles import Styles
 from .tooltips import create_tooltip
 
@@ -248,15 +249,18 @@ class AnalyticsTab:
         threading.Thread(target=self._fetch_analytics_data, args=(days,), daemon=True).start()
 
     def _fetch_analytics_data(self, days):
-        """Obtiene todos los datos pesados en segundo plano"""
+        """Obtiene todos los datos en segundo plano (las series salen del resumen diario, no de movimientos)"""
         try:
             fecha_fin = date.today()
             fecha_inicio = fecha_fin - timedelta(days=days)
             
-            # 1. Obtener datos de stock (Pesado)
+            # 1. Stock actual (una sola consulta para KPIs, tendencia y tabla)
             stock_data = obtener_stock_actual_y_moviles()
             
-            # 2. Obtener datos para gráficos específicos (Simulados o consultas reales)
+            # 2. Series del período: consumo/abasto por día y por SKU
+            series = consultar_resumen(fecha_inicio, fecha_fin, agrupar=('fecha', 'tipo'), tipos=TIPOS_CONSUMO + TIPOS_ABASTO)
+            consumo_por_sku = {sku: total for _, sku, total in consultar_total_por_sku(fecha_inicio, fecha_fin, TIPOS_CONSUMO)}
+            
             # Mobile consumption
             mobile_data = self._get_mobile_consumption_data(fecha_inicio, fecha_fin)
             
@@ -265,117 +269,97 @@ class AnalyticsTab:
             
             # Programar actualización en UI
             self.main_app.master.after(0, lambda: self._apply_analytics_data(
-                stock_data, mobile_data, top_products_data, fecha_inicio, fecha_fin
+                stock_data, mobile_data, top_products_data, series, consumo_por_sku, fecha_inicio, fecha_fin
             ))
             
         except Exception as e:
             print(f"Error fetching analytics data: {e}")
 
     def _get_mobile_consumption_data(self, fecha_inicio, fecha_fin):
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            query = """
-                SELECT movil_afectado, SUM(cantidad_afectada) as total
-                FROM movimientos
-                WHERE tipo_movimiento IN ('SALIDA', 'CONSUMO_MOVIL')
-                AND fecha_evento BETWEEN ? AND ?
-                AND movil_afectado IS NOT NULL
-                GROUP BY movil_afectado
-                ORDER BY total DESC
-                LIMIT 10
-            """
-            run_query(cursor, query, (fecha_inicio.isoformat(), fecha_fin.isoformat()))
-            datos = cursor.fetchall()
-            conn.close()
-            return datos
-        except: 
-            return []
+        return consultar_resumen(fecha_inicio, fecha_fin, agrupar=('movil',), tipos=['SALIDA', 'CONSUMO_MOVIL'],
+                                 solo_moviles=True, limite=10)
 
     def _get_top_products_data(self, fecha_inicio, fecha_fin):
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            query = """
-                SELECT p.nombre, SUM(m.cantidad_afectada) as total
-                FROM movimientos m
-                JOIN productos p ON m.sku_producto = p.sku AND p.ubicacion = 'BODEGA'
-                WHERE m.tipo_movimiento IN ('SALIDA', 'CONSUMO_MOVIL', 'DESCARTE')
-                AND m.fecha_evento BETWEEN ? AND ?
-                GROUP BY m.sku_producto, p.nombre
-                ORDER BY total DESC
-                LIMIT 10
-            """
-            run_query(cursor, query, (fecha_inicio.isoformat(), fecha_fin.isoformat()))
-            datos = cursor.fetchall()
-            conn.close()
-            return datos
-        except:
-            return []
+        top = consultar_total_por_sku(fecha_inicio, fecha_fin, ['SALIDA', 'CONSUMO_MOVIL', 'DESCARTE'], limite=10)
+        return [(nombre, total) for nombre, _, total in top]
 
-    def _apply_analytics_data(self, stock_data, mobile_data, top_products_data, fecha_inicio, fecha_fin):
+    @staticmethod
+    def _netos_por_dia(series):
+        """{fecha: (abasto, consumo)} del período a partir de filas (fecha, tipo, total)."""
+        por_dia = defaultdict(lambda: [0, 0])
+        for fecha, tipo, total in series:
+            dia = fecha if isinstance(fecha, date) else date.fromisoformat(str(fecha)[:10])
+            por_dia[dia][0 if tipo in TIPOS_ABASTO else 1] += total or 0
+        return por_dia
+
+    def _apply_analytics_data(self, stock_data, mobile_data, top_products_data, series, consumo_por_sku, fecha_inicio, fecha_fin):
         """Aplica los datos a la UI (debe correr en el hilo principal)"""
         try:
             if not self.notebook.winfo_exists(): return
 
+            por_dia = self._netos_por_dia(series)
+            dias = max((fecha_fin - fecha_inicio).days, 1)
+
             # Calcular KPIs
-            self.calcular_kpis_from_data(stock_data)
+            self.calcular_kpis_from_data(stock_data, por_dia, top_products_data, dias)
             
             # Actualizar gráficos
-            self.actualizar_trend_chart_ui(stock_data, fecha_inicio, fecha_fin)
+            self.actualizar_trend_chart_ui(stock_data, por_dia, fecha_inicio, fecha_fin)
             self.actualizar_mobile_chart_ui(mobile_data)
-            self.actualizar_supply_chart_ui()
+            self.actualizar_supply_chart_ui(por_dia)
             self.actualizar_top_products_chart_ui(top_products_data)
             
             # Actualizar tabla
-            self.actualizar_low_stock_table_ui(stock_data)
+            self.actualizar_low_stock_table_ui(stock_data, consumo_por_sku, dias)
             
         except Exception as e:
             print(f"Error applying analytics data: {e}")
 
-    def calcular_kpis_from_data(self, stock_data):
-        """Calcular KPIs con datos ya obtenidos"""
+    def calcular_kpis_from_data(self, stock_data, por_dia, top_products_data, dias):
+        """Calcular KPIs del período con datos ya obtenidos"""
         try:
             if not stock_data: return
                 
-            # 1. Rotación
-            total_consumo = sum(d[5] for d in stock_data)
+            # 1. Rotación (consumo del período / stock actual)
+            total_consumo = sum(c for _, c in por_dia.values())
             total_stock = sum(d[4] for d in stock_data)
             rotacion = round(total_consumo / total_stock, 2) if total_stock > 0 else 0
             if "rotacion" in self.kpi_labels: self.kpi_labels["rotacion"].config(text=f"{rotacion}x")
             
-            # 2. Días stock
-            dias_stock = round(total_stock / (total_consumo / 30), 1) if total_consumo > 0 else 999
+            # 2. Días stock al ritmo de consumo del período
+            dias_stock = round(total_stock / (total_consumo / dias), 1) if total_consumo > 0 else 999
             if "dias_stock" in self.kpi_labels: self.kpi_labels["dias_stock"].config(text=f"{dias_stock} días")
             
             # 3. Eficiencia
-            total_abasto = sum(d[6] for d in stock_data)
+            total_abasto = sum(a for a, _ in por_dia.values())
             eficiencia = round((total_abasto / total_consumo * 100), 1) if total_consumo > 0 else 0
             if "eficiencia" in self.kpi_labels: self.kpi_labels["eficiencia"].config(text=f"{eficiencia}%")
             
             # 4. Top Producto
-            if stock_data:
-                top_producto = max(stock_data, key=lambda x: x[5])
-                nombre_corto = top_producto[0][:15] + "..." if len(top_producto[0]) > 15 else top_producto[0]
+            if top_products_data:
+                nombre = top_products_data[0][0]
+                nombre_corto = nombre[:15] + "..." if len(nombre) > 15 else nombre
                 if "top_producto" in self.kpi_labels: 
                     self.kpi_labels["top_producto"].config(text=nombre_corto, font=('Segoe UI', 14, 'bold'))
         except Exception as e:
             print(f"Error calculating KPIs: {e}")
 
-    def actualizar_trend_chart_ui(self, stock_data, fecha_inicio, fecha_fin):
+    def actualizar_trend_chart_ui(self, stock_data, por_dia, fecha_inicio, fecha_fin):
         try:
             self.ax_trend.clear()
             if stock_data:
-                total_stock = sum(d[4] for d in stock_data)
+                # Hacia atrás desde el stock actual: al cierre de cada día se descuenta lo neto de los días posteriores
+                stock = sum(d[4] for d in stock_data)
                 dias = (fecha_fin - fecha_inicio).days
                 fechas = [fecha_inicio + timedelta(days=i) for i in range(dias + 1)]
-                variation_range = total_stock // 10
-                if variation_range > 0:
-                    stocks = [total_stock + np.random.randint(-variation_range, variation_range) for _ in fechas]
-                else:
-                    stocks = [total_stock for _ in fechas]
+                stocks = []
+                for fecha in reversed(fechas):
+                    stocks.append(stock)
+                    abasto, consumo = por_dia.get(fecha, (0, 0))
+                    stock -= abasto - consumo
+                stocks.reverse()
                 
-                self.ax_trend.plot(fechas, stocks, color='#3498db', linewidth=2, marker='o', markersize=3)
+                self.ax_trend.plot(fechas, stocks, color='#3498db', linewidth=2, marker='o' if dias <= 31 else None, markersize=3)
                 self.ax_trend.fill_between(fechas, stocks, alpha=0.3, color='#3498db')
                 self.ax_trend.set_ylabel('Stock Total')
                 self.ax_trend.grid(True, alpha=0.3)
@@ -404,18 +388,22 @@ class AnalyticsTab:
         except Exception as e:
             print(f"Error mobile chart: {e}")
 
-    def actualizar_supply_chart_ui(self):
+    def actualizar_supply_chart_ui(self, por_dia):
         try:
             self.ax_supply.clear()
-            meses = ['Mes 1', 'Mes 2', 'Mes 3']
-            abastos = [1200, 1500, 1300]
-            consumos = [1100, 1400, 1350]
+            por_mes = defaultdict(lambda: [0, 0])
+            for dia, (abasto, consumo) in por_dia.items():
+                por_mes[dia.strftime('%m/%Y')][0] += abasto
+                por_mes[dia.strftime('%m/%Y')][1] += consumo
+            meses = sorted(por_mes, key=lambda m: (m[3:], m[:2]))
+            abastos = [por_mes[m][0] for m in meses]
+            consumos = [por_mes[m][1] for m in meses]
             x = np.arange(len(meses))
             width = 0.35
             self.ax_supply.bar(x - width/2, abastos, width, label='Abasto', color='#27ae60')
             self.ax_supply.bar(x + width/2, consumos, width, label='Consumo', color='#e74c3c')
             self.ax_supply.set_xticks(x)
-            self.ax_supply.set_xticklabels(meses)
+            self.ax_supply.set_xticklabels(meses, rotation=45 if len(meses) > 6 else 0, fontsize=8)
             self.ax_supply.set_ylabel('Cantidad')
             self.ax_supply.legend()
             self.ax_supply.grid(True, alpha=0.3, axis='y')
@@ -437,7 +425,7 @@ class AnalyticsTab:
             self.canvas_top.draw()
         except: pass
 
-    def actualizar_low_stock_table_ui(self, stock_data):
+    def actualizar_low_stock_table_ui(self, stock_data, consumo_por_sku, dias):
         try:
             for item in self.low_stock_table.get_children():
                 self.low_stock_table.delete(item)
@@ -445,7 +433,8 @@ class AnalyticsTab:
             
             for producto in stock_data:
                 nombre, sku, bodega, moviles, total, consumo, abasto = producto
-                consumo_diario = consumo / 30 if consumo > 0 else 0
+                # Consumo promedio diario del período seleccionado
+                consumo_diario = consumo_por_sku.get(sku, 0) / dias
                 dias_restantes = round(total / consumo_diario, 1) if consumo_diario > 0 else 999
                 
                 if dias_restantes < 30 and dias_restantes > 0:
@@ -456,219 +445,3 @@ class AnalyticsTab:
             self.low_stock_table.tag_configure('warning', background='#ffebee')
             self.low_stock_table.tag_configure('normal', background='#fff3e0')
         except: pass
-
-            
-    def calcular_kpis(self, fecha_inicio, fecha_fin):
-        """Calcular KPIs principales"""
-        try:
-            # Obtener datos
-            stock_data = obtener_stock_actual_y_moviles()
-            
-            if not stock_data:
-                return
-                
-            # 1. Rotación de inventario (Consumo / Stock Promedio)
-            total_consumo = sum(d[5] for d in stock_data)  # índice 5 es consumo
-            total_stock = sum(d[4] for d in stock_data)    # índice 4 es total
-            rotacion = round(total_consumo / total_stock, 2) if total_stock > 0 else 0
-            self.kpi_labels["rotacion"].config(text=f"{rotacion}x")
-            
-            # 2. Días de stock disponible
-            dias_stock = round(total_stock / (total_consumo / 30), 1) if total_consumo > 0 else 999
-            self.kpi_labels["dias_stock"].config(text=f"{dias_stock} días")
-            
-            # 3. Eficiencia de abasto (Abasto / Consumo * 100)
-            total_abasto = sum(d[6] for d in stock_data)  # índice 6 es abasto
-            eficiencia = round((total_abasto / total_consumo * 100), 1) if total_consumo > 0 else 0
-            self.kpi_labels["eficiencia"].config(text=f"{eficiencia}%")
-            
-            # 4. Producto top (más consumido)
-            if stock_data:
-                top_producto = max(stock_data, key=lambda x: x[5])
-                nombre_corto = top_producto[0][:15] + "..." if len(top_producto[0]) > 15 else top_producto[0]
-                self.kpi_labels["top_producto"].config(text=nombre_corto, font=('Segoe UI', 14, 'bold'))
-                
-        except Exception as e:
-            print(f"Error al calcular KPIs: {e}")
-            
-    def actualizar_trend_chart(self, fecha_inicio, fecha_fin):
-        """Actualizar gráfico de tendencia"""
-        try:
-            self.ax_trend.clear()
-            
-            # Simulación de datos de tendencia (en producción, obtener de BD)
-            # Por ahora mostrar stock actual como línea plana
-            stock_data = obtener_stock_actual_y_moviles()
-            if stock_data:
-                total_stock = sum(d[4] for d in stock_data)
-                
-                # Crear datos de ejemplo para la tendencia
-                dias = (fecha_fin - fecha_inicio).days
-                fechas = [fecha_inicio + timedelta(days=i) for i in range(dias + 1)]
-                # Simular variación de ±10%
-                variation_range = total_stock // 10
-                if variation_range > 0:
-                    stocks = [total_stock + np.random.randint(-variation_range, variation_range) for _ in fechas]
-                else:
-                    stocks = [total_stock for _ in fechas]
-                
-                self.ax_trend.plot(fechas, stocks, color='#3498db', linewidth=2, marker='o', markersize=3)
-                self.ax_trend.fill_between(fechas, stocks, alpha=0.3, color='#3498db')
-                self.ax_trend.set_ylabel('Stock Total')
-                self.ax_trend.grid(True, alpha=0.3)
-                self.ax_trend.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
-                self.ax_trend.tick_params(axis='x', rotation=45, labelsize=8)
-                
-            self.fig_trend.tight_layout()
-            self.canvas_trend.draw()
-            
-        except Exception as e:
-            print(f"Error en gráfico de tendencia: {e}")
-            
-    def actualizar_mobile_chart(self, fecha_inicio, fecha_fin):
-        """Actualizar gráfico de consumo por móvil"""
-        try:
-            self.ax_mobile.clear()
-            
-            # Obtener consumo por móvil desde BD
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT movil_afectado, SUM(cantidad_afectada) as total
-                FROM movimientos
-                WHERE tipo_movimiento IN ('SALIDA', 'CONSUMO_MOVIL')
-                AND fecha_evento BETWEEN ? AND ?
-                AND movil_afectado IS NOT NULL
-                GROUP BY movil_afectado
-                ORDER BY total DESC
-                LIMIT 10
-            """
-            
-            run_query(cursor, query, (fecha_inicio.isoformat(), fecha_fin.isoformat()))
-            datos = cursor.fetchall()
-            conn.close()
-            
-            if datos:
-                moviles = [d[0][:10] + "..." if len(d[0]) > 10 else d[0] for d in datos]
-                consumos = [d[1] for d in datos]
-                
-                colors = plt.cm.Set3(range(len(moviles)))
-                bars = self.ax_mobile.barh(moviles, consumos, color=colors)
-                self.ax_mobile.set_xlabel('Cantidad Consumida')
-                self.ax_mobile.grid(True, alpha=0.3, axis='x')
-                
-                # Valores en las barras
-                for i, bar in enumerate(bars):
-                    width = bar.get_width()
-                    self.ax_mobile.text(width, bar.get_y() + bar.get_height()/2,
-                                       f'{int(width)}', ha='left', va='center', fontsize=8)
-                    
-            self.fig_mobile.tight_layout()
-            self.canvas_mobile.draw()
-            
-        except Exception as e:
-            print(f"Error en gráfico de móviles: {e}")
-            
-    def actualizar_supply_chart(self, fecha_inicio, fecha_fin):
-        """Actualizar gráfico de abasto vs consumo"""
-        try:
-            self.ax_supply.clear()
-            
-            # Datos de ejemplo (en producción, agrupar por mes desde BD)
-            meses = ['Mes 1', 'Mes 2', 'Mes 3']
-            abastos = [1200, 1500, 1300]
-            consumos = [1100, 1400, 1350]
-            
-            x = np.arange(len(meses))
-            width = 0.35
-            
-            self.ax_supply.bar(x - width/2, abastos, width, label='Abasto', color='#27ae60')
-            self.ax_supply.bar(x + width/2, consumos, width, label='Consumo', color='#e74c3c')
-            
-            self.ax_supply.set_xticks(x)
-            self.ax_supply.set_xticklabels(meses)
-            self.ax_supply.set_ylabel('Cantidad')
-            self.ax_supply.legend()
-            self.ax_supply.grid(True, alpha=0.3, axis='y')
-            
-            self.fig_supply.tight_layout()
-            self.canvas_supply.draw()
-            
-        except Exception as e:
-            print(f"Error en gráfico de abasto vs consumo: {e}")
-            
-    def actualizar_top_products_chart(self, fecha_inicio, fecha_fin):
-        """Actualizar gráfico de top productos"""
-        try:
-            self.ax_top.clear()
-            
-            # Obtener top productos consumidos
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT p.nombre, SUM(m.cantidad_afectada) as total
-                FROM movimientos m
-                JOIN productos p ON m.sku_producto = p.sku AND p.ubicacion = 'BODEGA'
-                WHERE m.tipo_movimiento IN ('SALIDA', 'CONSUMO_MOVIL', 'DESCARTE')
-                AND m.fecha_evento BETWEEN ? AND ?
-                GROUP BY m.sku_producto, p.nombre
-                ORDER BY total DESC
-                LIMIT 10
-            """
-            
-            run_query(cursor, query, (fecha_inicio.isoformat(), fecha_fin.isoformat()))
-            datos = cursor.fetchall()
-            conn.close()
-            
-            if datos:
-                productos = [d[0][:20] + "..." if len(d[0]) > 20 else d[0] for d in datos]
-                cantidades = [d[1] for d in datos]
-                
-                colors = plt.cm.viridis(np.linspace(0, 1, len(productos)))
-                self.ax_top.barh(productos, cantidades, color=colors)
-                self.ax_top.set_xlabel('Cantidad Consumida')
-                self.ax_top.grid(True, alpha=0.3, axis='x')
-                
-            self.fig_top.tight_layout()
-            self.canvas_top.draw()
-            
-        except Exception as e:
-            print(f"Error en gráfico de top productos: {e}")
-            
-    def actualizar_low_stock_table(self):
-        """Actualizar tabla de productos con bajo stock"""
-        try:
-            # Limpiar tabla
-            for item in self.low_stock_table.get_children():
-                self.low_stock_table.delete(item)
-                
-            # Obtener productos con bajo stock
-            stock_data = obtener_stock_actual_y_moviles()
-            
-            for producto in stock_data:
-                nombre, sku, bodega, moviles, total, consumo, abasto = producto
-                
-                # Calcular consumo promedio diario (consumo total / 30 días)
-                consumo_diario = consumo / 30 if consumo > 0 else 0
-                
-                # Calcular días restantes
-                dias_restantes = round(total / consumo_diario, 1) if consumo_diario > 0 else 999
-                
-                # Mostrar solo si está bajo stock (menos de 30 días)
-                if dias_restantes < 30 and dias_restantes > 0:
-                    self.low_stock_table.insert('', 'end', values=(
-                        nombre,
-                        total,
-                        "N/A",  # Mínimo (podría obtenerse de productos.minimo_stock)
-                        round(consumo_diario, 2),
-                        f"{dias_restantes} días"
-                    ), tags=('warning' if dias_restantes < 15 else 'normal',))
-                    
-            # Configurar colores
-            self.low_stock_table.tag_configure('warning', background='#ffebee')
-            self.low_stock_table.tag_configure('normal', background='#fff3e0')
-            
-        except Exception as e:
-            print(f"Error al actualizar tabla de bajo stock: {e}")
@@ -0,0 +1,99 @@
+import tkinter as tk
+from tkinter import ttk
+
+from utils.db_connector import obtener_estadisticas_pool
+from utils import query_stats
+
+# Columnas visibles: (clave en obtener_estadisticas_pool, encabezado)
+COLUMNAS = [
+    ('en_uso', 'En uso'),
+    ('libres', 'Libres'),
+    ('tamano', 'Máx.'),
+    ('en_uso_max', 'Pico'),
+    ('checkouts', 'Préstamos'),
+    ('esperas', 'Esperas'),
+    ('espera_media_seg', 'Espera media (s)'),
+    ('espera_max_seg', 'Espera máx. (s)'),
+    ('agotado', 'Timeouts'),
+    ('errores', 'Errores'),
+    ('recicladas', 'Recicladas'),
+    ('descartadas', 'Descartadas'),
+]
+# Top de consultas de este proceso: (clave en query_stats.reporte, encabezado, ancho)
+COLUMNAS_CONSULTAS = [
+    ('total_seg', 'Total (s)', 70),
+    ('llamadas', 'Llamadas', 70),
+    ('media_ms', 'Media (ms)', 75),
+    ('max_ms', 'Máx. (ms)', 75),
+    ('lentas', 'Lentas', 55),
+    ('llamador', 'Llamador', 260),
+    ('sql', 'Sentencia', 420),
+]
+TOP_CONSULTAS = 15
+REFRESCO_MS = 2000
+
+
+class PoolDiagnosticsWindow(tk.Toplevel):
+    """Estado en vivo de los pools de conexión MySQL y de las consultas más costosas (se refresca cada 2 s)."""
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("🩺 StockWare - Diagnóstico de Conexiones")
+        self.geometry("1100x560")
+        self.minsize(700, 400)
+
+        main_frame = tk.Frame(self, bg='#f1f5f9', padx=10, pady=10)
+        main_frame.pack(fill='both', expand=True)
+
+        tk.Label(main_frame, text="POOL DE CONEXIONES (MySQL / TiDB)",
+                 font=('Segoe UI', 12, 'bold'), bg='#f1f5f9', fg='#1e293b').pack(anchor='w', pady=(0, 10))
+
+        columnas = ['db'] + [c for c, _ in COLUMNAS]
+        self.tree = ttk.Treeview(main_frame, columns=columnas, show='headings', height=6)
+        self.tree.heading('db', text='Base de datos')
+        self.tree.column('db', width=140)
+        for clave, titulo in COLUMNAS:
+            self.tree.heading(clave, text=titulo)
+            self.tree.column(clave, width=70, anchor='center')
+        self.tree.pack(fill='x')
+
+        cabecera = tk.Frame(main_frame, bg='#f1f5f9')
+        cabecera.pack(fill='x', pady=(15, 5))
+        tk.Label(cabecera, text=f"CONSULTAS MÁS COSTOSAS (top {TOP_CONSULTAS}, umbral lento {query_stats.SLOW_QUERY_MS:.0f} ms)",
+                 font=('Segoe UI', 12, 'bold'), bg='#f1f5f9', fg='#1e293b').pack(side='left')
+        self.orden = tk.StringVar(value='total')
+        ttk.Combobox(cabecera, textvariable=self.orden, values=['total', 'llamadas', 'max', 'media'],
+                     state='readonly', width=10).pack(side='right')
+        tk.Label(cabecera, text="Ordenar por:", bg='#f1f5f9').pack(side='right', padx=5)
+        tk.Button(cabecera, text="Reiniciar", relief='flat', command=query_stats.reiniciar).pack(side='right', padx=10)
+
+        self.tree_consultas = ttk.Treeview(main_frame, columns=[c for c, _, _ in COLUMNAS_CONSULTAS],
+                                           show='headings', height=10)
+        for clave, titulo, ancho in COLUMNAS_CONSULTAS:
+            self.tree_consultas.heading(clave, text=titulo)
+            self.tree_consultas.column(clave, width=ancho, anchor='w' if clave in ('llamador', 'sql') else 'center')
+        self.tree_consultas.pack(fill='both', expand=True)
+
+        self.lbl_estado = tk.Label(main_frame, text="", font=('Segoe UI', 8, 'italic'),
+                                   bg='#f1f5f9', fg='#64748b')
+        self.lbl_estado.pack(anchor='w', pady=(5, 0))
+
+        self.refrescar()
+
+    def refrescar(self):
+        if not self.winfo_exists():
+            return
+        estadisticas = obtener_estadisticas_pool()
+        self.tree.delete(*self.tree.get_children())
+        for db, st in sorted(estadisticas.items()):
+            self.tree.insert('', tk.END, values=[db] + [st.get(c, 0) for c, _ in COLUMNAS])
+        if not estadisticas:
+            self.lbl_estado.config(text="Sin pools MySQL activos (modo SQLite o aún sin conexiones).")
+        else:
+            self.lbl_estado.config(text=f"Actualizado cada {REFRESCO_MS // 1000} s")
+
+        self.tree_consultas.delete(*self.tree_consultas.get_children())
+        if query_stats.QUERY_STATS_ACTIVO:
+            for fila in query_stats.reporte(TOP_CONSULTAS, self.orden.get()):
+                self.tree_consultas.insert('', tk.END, values=[fila[c] for c, _, _ in COLUMNAS_CONSULTAS])
+        self.after(REFRESCO_MS, self.refrescar)
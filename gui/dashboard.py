@@ -6,11 +6,24 @@ from tkinter import ttk
 from .styles import Styles
 from .tooltips import create_tooltip, TOOLTIPS
 from .utils import ScrollableFrame
-from database import obtener_estadisticas_reales, obtener_inventario, obtener_stock_actual_y_moviles, obtener_ultimos_movimientos
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib
-matplotlib.use('TkAgg')
+from database import obtener_estadisticas_reales, obtener_inventario, obtener_stock_actual_y_moviles, obtener_ultimos_movimientos, LectorCambios
+
+# El auto-refresco solo recalcula si el feed de cambios trae algo nuevo; igual se fuerza
+# una recarga completa cada tantos ciclos (ediciones que no pasan por el outbox).
+RECARGA_COMPLETA_CADA = 10
+
+
+def _cargar_matplotlib():
+    """
+    Importa matplotlib solo cuando hay gráficos que dibujar (no al abrir la app).
+    Se llama primero desde el hilo de datos, así el Tk solo construye las figuras.
+    """
+    import matplotlib
+    matplotlib.use('TkAgg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    return Figure, FigureCanvasTkAgg
+
 
 class DashboardTab:
     def __init__(self, notebook, main_app):
@@ -28,8 +41,15 @@ class DashboardTab:
         self.ax_pie = None
         self.fig_pie = None
         self.canvas_pie = None
+        self._lector_cambios = LectorCambios()
+        self._ciclos_sin_recarga = 0
+        self._recarga_en_vivo = None
         
         self.create_widgets()
+
+        # Cambios de otras estaciones/portal: recarga agrupada a los ~2 s en vez de esperar el ciclo
+        if getattr(self.main_app, 'live_updates', None):
+            self.main_app.live_updates.add_listener(self._on_cambios_inventario)
         
     def create_widgets(self):
         """Crear pestaña de Dashboard"""
@@ -77,13 +97,23 @@ class DashboardTab:
         def refresh_loop():
             # Check if the notebook still exists before updating
             if self.notebook.winfo_exists():
-                self.actualizar_metricas()
+                self._ciclos_sin_recarga += 1
+                self.actualizar_metricas(solo_si_hay_cambios=self._ciclos_sin_recarga < RECARGA_COMPLETA_CADA)
                 # OPTIMIZADO: Reducido de 30 a 60 segundos para disminuir carga en la base de datos
                 self.main_app.master.after(60000, refresh_loop)  # 60 segundos
             # else: the window is closed, stop scheduling
         
         refresh_loop()
         
+    def _on_cambios_inventario(self, eventos):
+        if self._recarga_en_vivo is None and self.notebook.winfo_exists():
+            self._recarga_en_vivo = self.main_app.master.after(2000, self._recargar_en_vivo)
+
+    def _recargar_en_vivo(self):
+        self._recarga_en_vivo = None
+        if self.notebook.winfo_exists():
+            self.actualizar_metricas()
+
     def on_card_click(self, key):
         """Maneja el evento de click en las tarjetas del dashboard"""
         if key == "productos_bodega" or key == "stock_total":
@@ -233,13 +263,22 @@ class DashboardTab:
         
         # self.cargar_datos_recent() # REMOVED: Loaded asynchronously via actualizar_metricas
 
-    def actualizar_metricas(self):
-        """Actualiza las métricas y la tabla en un hilo separado para no bloquear la UI"""
-        self.main_app.set_status("🔄 Actualizando dashboard...")
-        self.current_page = 0  # Reset pagination on refresh
-        
+    def actualizar_metricas(self, solo_si_hay_cambios=False):
+        """
+        Actualiza las métricas y la tabla en un hilo separado para no bloquear la UI.
+        Con 'solo_si_hay_cambios' primero consulta el feed de cambios y, si no hay nada
+        nuevo desde la última carga, no repite las consultas pesadas.
+        """
         def run_update():
             try:
+                if solo_si_hay_cambios and self._lector_cambios.cursor is not None:
+                    if not self._lector_cambios.leer():
+                        return
+                else:
+                    # Posición del feed antes de cargar: lo que llegue durante la carga dispara otra
+                    self._lector_cambios.leer()
+                self.main_app.master.after(0, self.main_app.set_status, "🔄 Actualizando dashboard...")
+
                 # 1. Obtener métricas pesadas
                 estadisticas = obtener_estadisticas_reales()
                 
@@ -248,9 +287,12 @@ class DashboardTab:
                 
                 # 3. Obtener datos para gráficos
                 datos_charts = obtener_stock_actual_y_moviles()
+                _cargar_matplotlib()
                 
                 # Programar actualización de la UI en el hilo principal
                 def _success():
+                    self._ciclos_sin_recarga = 0
+                    self.current_page = 0  # Reset pagination on refresh
                     self.all_movimientos = movimientos
                     self._aplicar_actualizacion_ui(estadisticas, datos_charts)
                     self._update_table_page()
@@ -258,6 +300,7 @@ class DashboardTab:
                 
                 self.main_app.master.after(0, _success)
             except Exception as e:
+                self._lector_cambios = LectorCambios()  # La próxima verificación recarga completo
                 self.main_app.set_status(f"⚠️ Error actualizando dashboard: {e}", timeout=5000)
                 print(f"⚠️ Error al actualizar dashboard: {e}")
                 
@@ -309,6 +352,7 @@ class DashboardTab:
         """Aplica los datos a los gráficos (debe llamarse desde el hilo principal)"""
         if not datos:
             return
+        self._asegurar_charts()
 
         # --- Gráfico de Barras ---
         datos_ordenados = sorted(datos, key=lambda x: x[4], reverse=True)[:5]
@@ -355,28 +399,34 @@ class DashboardTab:
         self._add_pagination_controls(parent)
         charts_frame.pack(fill='both', expand=True, padx=20, pady=10)
 
-        # Frame izquierdo (Barras) y derecho (Torta)
-        self.fig_bar = plt.Figure(figsize=(5, 4), dpi=100)
-        self.ax_bar = self.fig_bar.add_subplot(111)
+        # Frame izquierdo (Barras) y derecho (Torta); las figuras se crean con los primeros datos
+        self.bar_frame = tk.Frame(charts_frame, bg='white', relief='raised', borderwidth=0, highlightthickness=1, highlightbackground='#ddd')
+        self.bar_frame.pack(side='left', fill='both', expand=True, padx=(0, 10))
 
-        self.fig_pie = plt.Figure(figsize=(4, 4), dpi=100)
-        self.ax_pie = self.fig_pie.add_subplot(111)
+        tk.Label(self.bar_frame, text="Top 5 Productos (Mayor Stock)", font=('Segoe UI', 12, 'bold'), bg='white', fg='#2c3e50').pack(pady=10)
 
-        # Canvas
-        bar_frame = tk.Frame(charts_frame, bg='white', relief='raised', borderwidth=0, highlightthickness=1, highlightbackground='#ddd')
-        bar_frame.pack(side='left', fill='both', expand=True, padx=(0, 10))
+        self.pie_frame = tk.Frame(charts_frame, bg='white', relief='raised', borderwidth=0, highlightthickness=1, highlightbackground='#ddd')
+        self.pie_frame.pack(side='right', fill='both', expand=True, padx=(10, 0))
 
-        tk.Label(bar_frame, text="Top 5 Productos (Mayor Stock)", font=('Segoe UI', 12, 'bold'), bg='white', fg='#2c3e50').pack(pady=10)
+        tk.Label(self.pie_frame, text="Distribución de Stock", font=('Segoe UI', 12, 'bold'), bg='white', fg='#2c3e50').pack(pady=10)
 
-        self.canvas_bar = FigureCanvasTkAgg(self.fig_bar, master=bar_frame)
-        self.canvas_bar.get_tk_widget().pack(fill='both', expand=True)
+    def _asegurar_charts(self):
+        """Crea las figuras y sus canvas la primera vez que hay datos para dibujar."""
+        if self.canvas_bar is not None:
+            return
+        Figure, FigureCanvasTkAgg = _cargar_matplotlib()
 
-        pie_frame = tk.Frame(charts_frame, bg='white', relief='raised', borderwidth=0, highlightthickness=1, highlightbackground='#ddd')
-        pie_frame.pack(side='right', fill='both', expand=True, padx=(10, 0))
+        self.fig_bar = Figure(figsize=(5, 4), dpi=100)
+        self.ax_bar = self.fig_bar.add_subplot(111)
+
+        self.fig_pie = Figure(figsize=(4, 4), dpi=100)
+        self.ax_pie = self.fig_pie.add_subplot(111)
 
-        tk.Label(pie_frame, text="Distribución de Stock", font=('Segoe UI', 12, 'bold'), bg='white', fg='#2c3e50').pack(pady=10)
+        # Canvas
+        self.canvas_bar = FigureCanvasTkAgg(self.fig_bar, master=self.bar_frame)
+        self.canvas_bar.get_tk_widget().pack(fill='both', expand=True)
 
-        self.canvas_pie = FigureCanvasTkAgg(self.fig_pie, master=pie_frame)
+        self.canvas_pie = FigureCanvasTkAgg(self.fig_pie, master=self.pie_frame)
         self.canvas_pie.get_tk_widget().pack(fill='both', expand=True)
 
     def _add_pagination_controls(self, parent):
@@ -425,6 +475,7 @@ class DashboardTab:
         datos = obtener_stock_actual_y_moviles()
         if not datos:
             return
+        self._asegurar_charts()
 
         # --- Gráfico de Barras (Top 5 Stock Total) ---
         # datos: (nombre, sku, bodega, moviles, total, consumo, abasto)
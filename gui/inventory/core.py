@@ -11,7 +11,8 @@ from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-from config import DATABASE_NAME, PRODUCTOS_CON_CODIGO_BARRA
+from config import DATABASE_NAME
+from database import es_equipo_serializado
 from database import (
     obtener_inventario, obtener_todos_los_skus_para_movimiento,
     anadir_producto, registrar_movimiento_gui, eliminar_producto,
@@ -57,6 +58,10 @@ class InventoryTab:
         
         self.create_widgets()
 
+        # Cambios en vivo: solo se tocan las filas (sku, ubicación) afectadas
+        if getattr(self.main_app, 'live_updates', None):
+            self.main_app.live_updates.add_listener(self._aplicar_cambios_en_vivo)
+
     def _mostrar_cargando_async(self, ventana, funcion_carga, callback_exito):
         """Muestra pantalla de carga y ejecuta carga de datos en hilo"""
         frame_carga = tk.Frame(ventana, bg=ventana.cget('bg'))
@@ -336,6 +341,35 @@ class InventoryTab:
         # Aplicar filtros si existen (esto inserta en la tabla)
         self.aplicar_filtro_tabla()
         
+    def _aplicar_cambios_en_vivo(self, eventos):
+        """Suma los deltas de BODEGA/DESCARTE a las filas existentes; si falta alguna, recarga la tabla."""
+        if not self.tabla or not self.tabla.winfo_exists() or not getattr(self, 'datos_completos', None):
+            return
+        deltas = {}
+        for e in eventos:
+            if e['ubicacion'] in ('BODEGA', 'DESCARTE'):
+                clave = (e['sku'], e['ubicacion'])
+                deltas[clave] = deltas.get(clave, 0) + e['delta']
+        if not deltas:
+            return
+
+        pendientes = set(deltas)
+        nuevas = {}
+        for i, fila in enumerate(self.datos_completos):
+            clave = (fila[2], fila[4])
+            if clave in deltas:
+                fila = tuple(fila)
+                self.datos_completos[i] = nuevas[str(fila[0])] = fila[:3] + (fila[3] + deltas[clave],) + fila[4:]
+                pendientes.discard(clave)
+        if pendientes:
+            self.cargar_datos_tabla()  # Producto/ubicación nuevo: hace falta la fila completa
+            return
+
+        for item in self.tabla.get_children():
+            fila = nuevas.get(str(self.tabla.item(item, 'values')[0]))
+            if fila:
+                self.tabla.item(item, values=fila, tags=self._tags_fila(fila[3], fila[4], fila[7]))
+
     def aplicar_filtro_tabla(self):
         """Filtra la tabla según criterio de búsqueda y ubicación"""
         if not hasattr(self, 'datos_completos') or not self.datos_completos:
@@ -361,16 +395,19 @@ class InventoryTab:
             
             if match_texto and match_ubicacion:
                 # Llenar la tabla
-                tags = ()
-                if ubicacion == 'BODEGA':
-                    if cantidad < min_stock and cantidad > 0:
-                        tags = ('bajo_stock',)
-                    elif cantidad == 0:
-                        tags = ('agotado',)
-                elif ubicacion == 'DESCARTE':
-                    tags = ('descarte',)
-                    
-                self.tabla.insert('', tk.END, values=(id, nombre, sku, cantidad, ubicacion, categoria, marca, min_stock), tags=tags)
+                self.tabla.insert('', tk.END, values=(id, nombre, sku, cantidad, ubicacion, categoria, marca, min_stock),
+                                  tags=self._tags_fila(cantidad, ubicacion, min_stock))
+
+    @staticmethod
+    def _tags_fila(cantidad, ubicacion, min_stock):
+        if ubicacion == 'BODEGA':
+            if cantidad < min_stock and cantidad > 0:
+                return ('bajo_stock',)
+            elif cantidad == 0:
+                return ('agotado',)
+        elif ubicacion == 'DESCARTE':
+            return ('descarte',)
+        return ()
                 
     def ejecutar_limpieza_duplicados(self):
         """Ejecuta la limpieza completa de duplicados"""
@@ -742,14 +779,13 @@ class InventoryTab:
                 productos_en_movil_origen.clear() # Clear previous data
                 
                 def renderizar_productos(productos_asignados):
-                    from config import PRODUCTOS_CON_CODIGO_BARRA
                     if not productos_asignados:
                         tk.Label(frame_productos, text="No hay productos asignados a este móvil", 
                                 font=('Segoe UI', 10), fg='red').grid(row=1, column=0, columnspan=4, padx=10, pady=10)
                         return
                     
                     # Filtrar solo equipos que tengan serial/MAC
-                    equipos_asignados = [p for p in productos_asignados if p[1] in PRODUCTOS_CON_CODIGO_BARRA]
+                    equipos_asignados = [p for p in productos_asignados if es_equipo_serializado(p[1])]
                     
                     if not equipos_asignados:
                         tk.Label(frame_productos, text="No hay equipos (con MAC) asignados a este móvil", 
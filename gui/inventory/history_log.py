@@ -3,7 +3,7 @@ from tkinter import ttk, messagebox
 import threading
 from datetime import datetime
 
-from database import obtener_historial_completo, buscar_equipo_global, logger
+from database import obtener_historial_completo, buscar_equipo_global, logger, HISTORIAL_PAGINA
 from gui.styles import Styles
 import pandas as pd
 from tkinter import filedialog
@@ -13,6 +13,11 @@ class HistoryLogTab(tk.Frame):
         super().__init__(notebook, bg='#f8f9fa')
         self.notebook = notebook
         self.main_app = main_app
+        # Paginación del historial: filtro de la lista actual, id de su última fila y
+        # generación (descarta respuestas de búsquedas ya reemplazadas al teclear)
+        self._hist_filtro = None
+        self._hist_ultimo_id = None
+        self._hist_generacion = 0
         self.setup_ui()
         self.refresh_historial()
 
@@ -108,6 +113,11 @@ class HistoryLogTab(tk.Frame):
         
         scroll_x.pack(side='bottom', fill='x')
 
+        # Página siguiente del historial (por id, sin recorrer lo ya mostrado)
+        self.btn_cargar_mas = tk.Button(history_panel, text="⬇ Cargar más", command=self.cargar_mas_historial,
+                                        bg='#eceff1', font=('Segoe UI', 9), relief='flat', padx=10, state='disabled')
+        self.btn_cargar_mas.pack(side='bottom', pady=(5, 0))
+
     def search_mac(self):
         term = self.mac_search_var.get().strip()
         if not term: return
@@ -196,30 +206,57 @@ class HistoryLogTab(tk.Frame):
 
     def refresh_historial(self):
         filter_t = self.hist_filter_var.get()
+        self._hist_generacion += 1
+        generacion = self._hist_generacion
         
         def _load():
             # PLAN A: Búsqueda por serial/texto
-            data = obtener_historial_completo(limite=300, filtro_texto=filter_t)
+            filtro, pagina = filter_t, HISTORIAL_PAGINA
+            data = obtener_historial_completo(limite=pagina, filtro_texto=filtro)
             
             # PLAN B (Inteligente): Si no hay nada por serial y tenemos SKU/Paquete, buscar por SKU y Paquete
             if not data and hasattr(self, 'current_search_sku') and self.current_search_sku:
                 # Intentamos buscar por SKU y Paquete en las observaciones o doc_ref
                 # Esto es más útil que dejar la tabla vacía
-                data = obtener_historial_completo(limite=50, filtro_texto=self.current_search_sku)
-                # Filtrar en Python para mayor precisión si se desea, o dejarlo así para que vea el contexto
+                filtro, pagina = self.current_search_sku, 50
+                data = obtener_historial_completo(limite=pagina, filtro_texto=filtro)
             
             # Use main_app.master instead of just self to ensure after is called on a valid root/top
-            try: self.main_app.master.after(0, lambda: self._update_tree(data))
+            try: self.main_app.master.after(0, lambda: self._update_tree(data, generacion, filtro, pagina))
+            except: pass
+            
+        threading.Thread(target=_load, daemon=True).start()
+
+    def cargar_mas_historial(self):
+        """Agrega a la tabla la página siguiente de la búsqueda actual."""
+        if self._hist_ultimo_id is None: return
+        generacion, filtro, ultimo = self._hist_generacion, self._hist_filtro, self._hist_ultimo_id
+        self.btn_cargar_mas.config(state='disabled')
+        
+        def _load():
+            data = obtener_historial_completo(limite=HISTORIAL_PAGINA, filtro_texto=filtro, antes_de_id=ultimo)
+            try: self.main_app.master.after(0, lambda: self._update_tree(data, generacion, filtro, HISTORIAL_PAGINA, agregar=True))
             except: pass
             
         threading.Thread(target=_load, daemon=True).start()
 
-    def _update_tree(self, data):
+    def _update_tree(self, data, generacion=None, filtro=None, pagina=HISTORIAL_PAGINA, agregar=False):
         # Verificar si el widget aún existe antes de actualizar
         if not self.tree.winfo_exists(): return
-        for i in self.tree.get_children(): self.tree.delete(i)
+        # Una búsqueda más nueva ya reemplazó a esta
+        if generacion is not None and generacion != self._hist_generacion: return
+        if not agregar:
+            for i in self.tree.get_children(): self.tree.delete(i)
         for row in data:
             self.tree.insert('', 'end', values=row)
+        
+        # Una página incompleta es la última
+        self._hist_filtro = filtro
+        if data:
+            self._hist_ultimo_id = data[-1][0]
+        elif not agregar:
+            self._hist_ultimo_id = None
+        self.btn_cargar_mas.config(state='normal' if len(data) >= pagina else 'disabled')
 
     def exportar_a_excel(self):
         """Exporta los datos actualmente visibles en la tabla a un archivo Excel"""
@@ -8,6 +8,7 @@ from ..styles import Styles
 from ..utils import mostrar_mensaje_emergente, mostrar_cargando_async
 from utils.logger import get_logger
 from ..pdf_generator import generar_vale_despacho
+from ..services.scan_index import ScanIndex
 
 from database import (
     obtener_todos_los_skus_para_movimiento,
@@ -26,7 +27,8 @@ from database import (
     obtener_todas_las_series_de_ubicacion,
     registrar_faltante_audit,
 )
-from config import TIPO_MOVIMIENTO_DESCARTE, PRODUCTOS_INICIALES, DATABASE_NAME, PRODUCTOS_CON_CODIGO_BARRA
+from config import TIPO_MOVIMIENTO_DESCARTE, PRODUCTOS_INICIALES, DATABASE_NAME
+from database import obtener_catalogo, es_equipo_serializado, es_material_compartido
 
 logger = get_logger(__name__)
 
@@ -997,8 +999,6 @@ class MobileReturnWindow:
         self.session_data['stock_fisico_escaneado'] = {}
         self.session_data['series_cache'] = {}
         self.session_data['excel_data'] = []
-        self.session_data['g_seriales'] = {} # Reset global serials cache
-        self.session_data['g_barcodes'] = {} # Reset global barcodes cache
         for i in self.tree_fisico.get_children(): self.tree_fisico.delete(i)
         self.btn_procesar.config(state='normal', text='⚙️ Procesar')
 
@@ -1061,9 +1061,8 @@ class MobileReturnWindow:
         
         # --- RECONCILIACIÓN DE EQUIPOS (Self-Healing) ---
         # Si hay discrepancias entre la tabla agregada y los seriales reales, confiamos en los seriales.
-        from config import PRODUCTOS_CON_CODIGO_BARRA
         for sku_s, items_s in series_cache.items():
-            if sku_s in PRODUCTOS_CON_CODIGO_BARRA:
+            if es_equipo_serializado(sku_s):
                 if sku_s not in stock_actual:
                     # Traer nombre si se puede
                     from data_layer.inventory import obtener_producto_nombre
@@ -1091,28 +1090,21 @@ class MobileReturnWindow:
                 s_info['PERSONALIZADO'] = max(s_info.get('PERSONALIZADO', 0), counts['PERSONALIZADO'])
                 s_info['total'] = max(s_info.get('total', 0), sum(counts.values()))
 
-        # Cargar diccionarios globales de escaneo rápido
-        # ... (rest of code follows)
-        from database import obtener_diccionarios_escaneo
-        from config import CURRENT_CONTEXT
-        branch = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
-        g_seriales, g_barcodes = obtener_diccionarios_escaneo(sucursal_context=branch)
+        # Índice global de escaneo rápido: compartido y sincronizado por deltas (no se descarga aquí)
+        ScanIndex.obtener()
         
-        return {'stock': stock_actual, 'consumo': consumo_reportado, 'series': series_cache, 'g_seriales': g_seriales, 'g_barcodes': g_barcodes}
+        return {'stock': stock_actual, 'consumo': consumo_reportado, 'series': series_cache}
 
     def _on_data_loaded(self, data):
         self.session_data['stock_teorico'] = data['stock']
         self.session_data['consumo_app'] = data['consumo']
         self.session_data['series_cache'] = data.get('series', {})
-        self.session_data['g_seriales'] = data.get('g_seriales', {})
-        self.session_data['g_barcodes'] = data.get('g_barcodes', {})
         self.update_consumo_ui()
         self.update_fisico_ui()
 
     def update_consumo_ui(self):
         """Calcula el consumo verificado basándose únicamente en lo reportado por la App."""
         paquete_filtro = self.paquete_combo.get()
-        from config import MATERIALES_COMPARTIDOS, PAQUETES_MATERIALES
         
         # Limpiar consumos verificados anteriores
         self.session_data['consumo_verificado'] = {}
@@ -1127,7 +1119,7 @@ class MobileReturnWindow:
             prod_consumo_data = self.session_data['consumo_app'].get(sku, {})
             qty_app_total = sum(prod_consumo_data.values()) # Total móvil
             
-            if paquete_filtro == "TODOS" or sku in MATERIALES_COMPARTIDOS:
+            if paquete_filtro == "TODOS" or es_material_compartido(sku):
                 qty_app = qty_app_total
             else:
                 # REGLA ESTRICTA: Solo lo reportado para este paquete exacto
@@ -1145,7 +1137,6 @@ class MobileReturnWindow:
         all_skus = set(self.session_data['stock_teorico'].keys()) | set(self.session_data['stock_fisico_escaneado'].keys())
         
         paquete_filtro = self.paquete_combo.get() # "TODOS", "PAQUETE A", etc.
-        from config import MATERIALES_COMPARTIDOS, PAQUETES_MATERIALES
 
         # Mapeo global de nombres para items extra
         if not hasattr(self, '_prod_name_map'):
@@ -1154,7 +1145,7 @@ class MobileReturnWindow:
         # Determinar SKUs que pertenecen al paquete actual
         skus_paquete = []
         if paquete_filtro != "TODOS":
-            skus_paquete = [sku for sku, cant in PAQUETES_MATERIALES.get(paquete_filtro, [])]
+            skus_paquete = [sku for sku, cant in obtener_catalogo().paquetes.get(paquete_filtro, [])]
 
         # ORDEN PERSONALIZADO SOLICITADO
         orden_deseado = [
@@ -1171,7 +1162,7 @@ class MobileReturnWindow:
 
         for sku in sorted(all_skus, key=sort_key):
             info = self.session_data['stock_teorico'].get(sku)
-            is_shared = sku in MATERIALES_COMPARTIDOS
+            is_shared = es_material_compartido(sku)
             is_in_package = sku in skus_paquete
 
             # RETORNO: Nunca mostrar materiales compartidos (fibra, UTP, etc.)
@@ -1208,7 +1199,7 @@ class MobileReturnWindow:
 
             # Si es equipo, intentar poner la MAC en el nombre para facilitar identificación
             display_name = name
-            if sku in PRODUCTOS_CON_CODIGO_BARRA:
+            if es_equipo_serializado(sku):
                 # OPTIMIZADO: Usar caché en lugar de consultar la BD en bucle
                 series_data = self.session_data.get('series_cache', {}).get(sku, [])
                 
@@ -1364,20 +1355,12 @@ class MobileReturnWindow:
         ubicacion = None
         paquete_found = None
 
-        # 1. Búsqueda ultra-rápida en diccionarios de memoria (INSTANTÁNEO)
-        # A) Es un Serial
-        if 'g_seriales' in self.session_data and code in self.session_data['g_seriales']:
-            sku_found, ubicacion, paquete_found = self.session_data['g_seriales'][code]
-            is_serial = True
-        
-        # B) Es un Código de Barras Maestro o Legacy
-        elif 'g_barcodes' in self.session_data and code in self.session_data['g_barcodes']:
-            sku_found = self.session_data['g_barcodes'][code]
-            is_serial = False
-            paquete_found = None
+        # 1. Búsqueda ultra-rápida en el índice de escaneo en memoria (INSTANTÁNEO)
+        # Serial/MAC primero, luego Código de Barras Legacy o Maestro
+        sku_found, is_serial, ubicacion, paquete_found = ScanIndex.obtener().lookup(code)
 
         # 2. OPTIMIZACIÓN: Se elimina el Fallback remoto por lentitud.
-        # Si no esta en el g_seriales/g_barcodes de la sucursal, es porque no existe.
+        # Si no esta en el índice de la sucursal, es porque no existe.
         # evitamos esperar un timeout de internet para decir "No encontrado".
         pass 
         
@@ -1569,7 +1552,6 @@ class MobileReturnWindow:
 
         movil = self.session_data['movil']
         fecha_evento = self.entry_fecha.get()
-        from config import MATERIALES_COMPARTIDOS, PRODUCTOS_CON_CODIGO_BARRA
 
         try:
             conn = get_db_connection()
@@ -1599,7 +1581,7 @@ class MobileReturnWindow:
                 esperado = item['esperado']
                 
                 # Materiales compartidos no se tocan en el flujo de retorno regular
-                if sku_p in MATERIALES_COMPARTIDOS: continue
+                if es_material_compartido(sku_p): continue
                     
                 # A) Retorno a Bodega (lo que el técnico TRAE físicamente)
                 if fisico > 0:
@@ -1617,12 +1599,8 @@ class MobileReturnWindow:
                     if ok:
                         exitos_retorno += fisico
                         # NUEVO: Actualizar caché global de memoria para sincronía inmediata con Salida Redireccionada
-                        if seriales_escaneados and 'g_seriales' in self.session_data:
-                            for s in seriales_escaneados:
-                                if s in self.session_data['g_seriales']:
-                                    val = list(self.session_data['g_seriales'][s])
-                                    if len(val) > 1: val[1] = 'BODEGA'
-                                    self.session_data['g_seriales'][s] = tuple(val)
+                        if seriales_escaneados:
+                            ScanIndex.obtener().marcar_ubicacion(seriales_escaneados, 'BODEGA')
                         
                         # NUEVO: Actualizar stock de BODEGA en la lista de productos de sesión
                         for idx_prod, p_data in enumerate(self.productos):
@@ -1641,7 +1619,7 @@ class MobileReturnWindow:
                     seriales_escaneados = self.session_data.get(f"_seriales_{sku_p}", [])
                     
                     seriales_faltantes = []
-                    if sku_p in PRODUCTOS_CON_CODIGO_BARRA:
+                    if es_equipo_serializado(sku_p):
                         # Extraer solo los números de serial/mac del caché
                         ids_teoricos = []
                         for s, m in series_teoricas_full:
@@ -1671,13 +1649,9 @@ class MobileReturnWindow:
                         existing_conn=conn
                     )
                     
-                    # NUEVO: Actualizar seriales a FALTANTE en la caché global
-                    if seriales_faltantes and 'g_seriales' in self.session_data:
-                        for s in seriales_faltantes:
-                            if s in self.session_data['g_seriales']:
-                                val = list(self.session_data['g_seriales'][s])
-                                if len(val) > 1: val[1] = 'FALTANTE'
-                                self.session_data['g_seriales'][s] = tuple(val)
+                    # NUEVO: Actualizar seriales a FALTANTE en el índice global
+                    if seriales_faltantes:
+                        ScanIndex.obtener().marcar_ubicacion(seriales_faltantes, 'FALTANTE')
 
             # 3. Limpieza Residual (borra el stock teórico restante del móvil)
             from database import resetear_stock_movil
@@ -1707,13 +1681,12 @@ class MobileReturnWindow:
             
             try:
                 # --- LÓGICA DE RELLENO (REFILL) BASADO EN PAQUETES ESTÁNDAR Y ASIGNACIONES ---
-                from config import PAQUETES_MATERIALES, MATERIALES_COMPARTIDOS
                 
                 paquete_nombre = self.paquete_combo.get()
                 if paquete_nombre == "TODOS":
                     paquete_nombre = "PAQUETE A" # Default de comparación
                 
-                objetivo_paquete = PAQUETES_MATERIALES.get(paquete_nombre, [])
+                objetivo_paquete = obtener_catalogo().paquetes.get(paquete_nombre, [])
                 skus_paquete = [s for s, c in objetivo_paquete]
                 
                 faltantes_para_rellenar = []
@@ -1729,7 +1702,7 @@ class MobileReturnWindow:
                     scanned_qty = self.session_data.get('stock_fisico_escaneado', {}).get(sku_p, 0)
                     if scanned_qty is None: scanned_qty = 0
                     
-                    is_shared = sku_p in MATERIALES_COMPARTIDOS
+                    is_shared = es_material_compartido(sku_p)
                     is_custom = info.get("PERSONALIZADO", 0) if isinstance(info.get("PERSONALIZADO"), (int, float)) else 0
                     is_custom = is_custom > 0
                     
@@ -1755,7 +1728,7 @@ class MobileReturnWindow:
                         nombre_p = self._prod_name_map.get(sku_p, sku_p)
                         
                         seriales_a_reponer = []
-                        is_equipo = sku_p in PRODUCTOS_CON_CODIGO_BARRA
+                        is_equipo = es_equipo_serializado(sku_p)
                         if is_equipo:
                             seriales_escaneados = self.session_data.get(f'_seriales_{sku_p}', [])
                             seriales_a_reponer = seriales_escaneados[:cant_ideal]
@@ -1804,8 +1777,6 @@ class MobileReturnWindow:
                             initial_movil=movil,
                             initial_package=paquete_nombre,
                             preloaded_data={
-                                'seriales': self.session_data.get('g_seriales', {}),
-                                'barcodes': self.session_data.get('g_barcodes', {}),
                                 'moviles': self.movil_combo['values'],
                                 'cache': {s_sku: {'nombre': s_nombre, 'stock': s_stock} for s_nombre, s_sku, s_stock in self.productos}
                             }
@@ -8,8 +8,9 @@ from datetime import date
 
 # Añadir el path raíz para importaciones
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from database import get_db_connection, run_query, registrar_movimiento_gui
+from database import get_db_connection, run_query, registrar_movimiento_gui, marcar_inventario_movil
 from gui.styles import Styles
+from gui.services.scan_index import ScanIndex
 
 class ReversoConsumoScannerWindow:
     def __init__(self, main_app):
@@ -26,6 +27,7 @@ class ReversoConsumoScannerWindow:
         self.window.grab_set()
         
         self.scanned_items = []
+        self.scan_index = ScanIndex.obtener()
         
         self._build_ui()
         self.scanner_input.focus_set()
@@ -111,6 +113,16 @@ class ReversoConsumoScannerWindow:
         threading.Thread(target=self._lookup_serial_async, args=(serial,), daemon=True).start()
 
     def _lookup_serial_async(self, serial):
+        # Índice en memoria primero (sin red); solo se consulta la BD si no lo conoce
+        encontrado = self.scan_index.serial(serial)
+        if encontrado:
+            sku, ubicacion, _ = encontrado
+            if ubicacion == 'BODEGA':
+                self.window.after(0, self._update_ui_result, serial, sku, ubicacion, "⚠️ Ya está en Bodega", 'warning')
+            else:
+                self.window.after(0, self._add_ready_item, serial, sku, ubicacion)
+            return
+
         conn = None
         try:
             conn = get_db_connection()
@@ -209,6 +221,7 @@ class ReversoConsumoScannerWindow:
                              ORDER BY (CASE WHEN paquete = 'NINGUNO' THEN 1 ELSE 0 END) ASC
                              LIMIT 1
                          """, (sku, ubicacion, sucursal))
+                         marcar_inventario_movil(cursor, sucursal, [ubicacion])
                     
                     # El incremento de stock en BODEGA y la actualización del SERIAL se delegan 
                     # a registrar_movimiento_gui al final para evitar duplicidad.
@@ -294,6 +307,7 @@ class ReversoConsumoScannerWindow:
             
             # 2. Revertir en series_registradas
             run_query(cursor, "UPDATE series_registradas SET ubicacion = 'BODEGA', estado = 'DISPONIBLE', movil = NULL, paquete = 'NINGUNO' WHERE (serial_number = %s OR mac_number = %s) AND sucursal = %s", (serial, serial, sucursal))
+            marcar_inventario_movil(cursor, sucursal, [ubicacion])
             
             # 3. Si estaba fuera de bodega, sumar al stock contable
             if ubicacion in ('CONSUMIDO', 'DESCARTE', 'FALTANTE'):
@@ -334,6 +348,7 @@ class ReversoConsumoScannerWindow:
             )
             
             conn.commit()
+            self.scan_index.marcar_ubicacion([serial], 'BODEGA', paquete='NINGUNO')
             self.window.after(0, self._update_ui_result, serial, sku, ubicacion, "✅ Reversado a Bodega", 'success')
             self.scanned_items.append(serial)
             
@@ -3,7 +3,8 @@ from tkinter import ttk, messagebox, simpledialog
 from datetime import date
 import threading
 
-from config import PAQUETE_INSTALACION, PRODUCTOS_CON_CODIGO_BARRA, CURRENT_CONTEXT
+from config import PAQUETE_INSTALACION, CURRENT_CONTEXT
+from database import obtener_catalogo, es_equipo_serializado, es_material_compartido
 from .styles import Styles
 from .utils import darken_color, mostrar_mensaje_emergente, mostrar_cargando_async
 from utils.logger import get_logger
@@ -58,6 +59,9 @@ class MobileOutputScannerWindow:
         # Cache de detalles de seriales (serial -> {mac_number, ...})
         # Evita repetir consultas DB remotas por cada render de tabla
         self.serial_details_cache = {}
+        # Índice compartido de seriales/códigos de la sucursal (se sincroniza por deltas)
+        from .services.scan_index import ScanIndex
+        self.scan_index = ScanIndex.obtener(CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI'))
         
         self.create_interface()
         self.load_initial_data()
@@ -74,11 +78,9 @@ class MobileOutputScannerWindow:
         
     def load_initial_data(self):
         def on_loaded(result):
-            moviles, cache, seriales, barcodes = result
+            moviles, cache = result
             self.combo_movil['values'] = moviles
             self.productos_cache = cache
-            self.serial_cache = seriales
-            self.barcode_cache = barcodes
             
             # Pre-seleccionar según modo o parámetros iniciales
             if self.initial_movil:
@@ -94,8 +96,6 @@ class MobileOutputScannerWindow:
             # USAR DATOS YA CARGADOS (Instantáneo)
             moviles = self.preloaded_data.get('moviles', [])
             cache = self.preloaded_data.get('cache', {})
-            seriales = self.preloaded_data.get('seriales', {})
-            barcodes = self.preloaded_data.get('barcodes', {})
             
             # Si faltan móviles, cargarlos
             if not moviles:
@@ -103,13 +103,11 @@ class MobileOutputScannerWindow:
                  moviles = obtener_nombres_moviles()
             
             # Simular carga finalizada
-            on_loaded((moviles, cache, seriales, barcodes))
+            on_loaded((moviles, cache))
             return
 
         def load():
-            from database import obtener_nombres_moviles, obtener_todos_los_skus_para_movimiento, obtener_diccionarios_escaneo
-            from config import CURRENT_CONTEXT
-            branch = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
+            from database import obtener_nombres_moviles, obtener_todos_los_skus_para_movimiento
             
             # Cargar móviles
             moviles = obtener_nombres_moviles()
@@ -118,10 +116,7 @@ class MobileOutputScannerWindow:
             prods = obtener_todos_los_skus_para_movimiento()
             cache = {sku: {'nombre': nombre, 'stock': stock} for nombre, sku, stock in prods}
             
-            # Cargar cachés de escaneo rápido
-            seriales, barcodes = obtener_diccionarios_escaneo(sucursal_context=branch)
-            
-            return moviles, cache, seriales, barcodes
+            return moviles, cache
             
         mostrar_cargando_async(self.window, load, on_loaded, self.window)
 
@@ -177,9 +172,8 @@ class MobileOutputScannerWindow:
 
         # Selector de Paquete (NUEVO)
         if self.mode == 'SALIDA_MOVIL':
-            from config import PAQUETES_MATERIALES
             tk.Label(frame, text="Paquete:", bg=Styles.LIGHT_BG).pack(side='left', padx=(20, 5))
-            self.lista_paquetes = list(PAQUETES_MATERIALES.keys()) + ["PERSONALIZADO"]
+            self.lista_paquetes = list(obtener_catalogo().paquetes.keys()) + ["PERSONALIZADO"]
             self.combo_paquete = ttk.Combobox(frame, values=self.lista_paquetes, state='readonly', width=18, font=('Segoe UI', 10))
             
             start_paq = self.initial_package if self.initial_package and self.initial_package in self.lista_paquetes else "PAQUETE A"
@@ -288,12 +282,10 @@ class MobileOutputScannerWindow:
         for widget in self.frame_lista_progreso.winfo_children():
             widget.destroy()
             
-        from config import MATERIALES_COMPARTIDOS
-        
         for sku, cantidad_esperada in self.paquete_base.items():
             completado = self.items_completados.get(sku, 0)
             nombre = self.productos_cache.get(sku, {}).get('nombre', sku)
-            es_compartido = sku in MATERIALES_COMPARTIDOS
+            es_compartido = es_material_compartido(sku)
             
             # Truncar nombre si es muy largo
             if len(nombre) > 25: nombre = nombre[:22] + "..."
@@ -320,8 +312,7 @@ class MobileOutputScannerWindow:
 
     def auto_rellenar_item(self, sku, nombre, cantidad_faltante):
         """Auto-rellena un material (sin serial) en el carrito"""
-        from config import PRODUCTOS_CON_CODIGO_BARRA
-        es_equipo = sku in PRODUCTOS_CON_CODIGO_BARRA
+        es_equipo = es_equipo_serializado(sku)
         
         # Validación dinámica adicional basada en la base de datos
         if not es_equipo:
@@ -349,14 +340,13 @@ class MobileOutputScannerWindow:
 
     def on_package_change(self, event=None):
         """Maneja el cambio de paquete seleccionado"""
-        from config import PAQUETES_MATERIALES
         seleccion = self.combo_paquete.get()
         
         if seleccion == "PERSONALIZADO":
             self.paquete_base = {}
         else:
             # Convertir lista de tuplas a dict
-            self.paquete_base = {sku: cant for sku, cant in PAQUETES_MATERIALES.get(seleccion, [])}
+            self.paquete_base = {sku: cant for sku, cant in obtener_catalogo().paquetes.get(seleccion, [])}
             
         self.items_completados = {sku: 0 for sku in self.paquete_base}
         
@@ -393,10 +383,10 @@ class MobileOutputScannerWindow:
             nombre_serial = None
             ubicacion_actual = None
 
-            # 1. Intentar reconocer como serial/MAC en memoria caché (INSTANTÁNEO)
-            if hasattr(self, 'serial_cache') and codigo in self.serial_cache:
-                sku_serial, ub, *extra = self.serial_cache[codigo]
-                sku = sku_serial
+            # 1. Intentar reconocer como serial/MAC en el índice de escaneo (INSTANTÁNEO)
+            sku_indice, es_serial, ub, _ = self.scan_index.lookup(codigo)
+            if es_serial:
+                sku = sku_indice
                 origen_serial = True
                 nombre_serial = codigo
                 ubicacion_actual = ub
@@ -410,12 +400,12 @@ class MobileOutputScannerWindow:
             if not origen_serial:
                 if codigo in self.productos_cache:
                     sku = codigo
-                # Buscar en caché de códigos de barra en memoria (INSTANTÁNEO)
-                elif hasattr(self, 'barcode_cache') and codigo in self.barcode_cache:
-                    sku = self.barcode_cache[codigo]
+                # Buscar en el índice de códigos de barra en memoria (INSTANTÁNEO)
+                elif sku_indice:
+                    sku = sku_indice
                     logger.debug(f"Cache Hit: Barcode {codigo} -> SKU {sku}")
                 # OPTIMIZACIÓN: Se elimina el Fallback remoto por lentitud. 
-                # Si el código de barras no está en el b_cache ni serial_cache, no existe en la sucursal.
+                # Si el código no está en el índice de escaneo, no existe en la sucursal.
                 pass
                 # if obtener_sku_por_codigo_barra:
                 #     try:
@@ -467,7 +457,7 @@ class MobileOutputScannerWindow:
                     self.entry_scanner.focus()
                     return
 
-                requires_serial = sku in PRODUCTOS_CON_CODIGO_BARRA
+                requires_serial = es_equipo_serializado(sku)
                 seriales = []
                 cant = 1
 
@@ -603,8 +593,7 @@ class MobileOutputScannerWindow:
         sku_clean = sku.strip().upper()
         es_paquete = sku_clean in self.paquete_base
         
-        from config import PRODUCTOS_CON_CODIGO_BARRA
-        requires_serial = sku_clean in PRODUCTOS_CON_CODIGO_BARRA
+        requires_serial = es_equipo_serializado(sku_clean)
         
         if requires_serial:
             # Los equipos con serial NO se agrupan: se agregan uno por uno para visualización clara
@@ -836,13 +825,22 @@ class MobileOutputScannerWindow:
         items_to_process = list(self.items_carrito)
         
         def process_background():
-            from database import registrar_movimiento_gui, actualizar_ubicacion_serial, get_db_connection, close_connection
+            from database import registrar_movimientos_batch, actualizar_ubicacion_series_bulk, get_db_connection, close_connection
             count = 0
             errores = []
             exitosos = []
             branch = CURRENT_CONTEXT.get('BRANCH')
             paquete_sel = self.combo_paquete.get() if hasattr(self, 'combo_paquete') else None
             
+            # Determinar tipo de movimiento
+            tipo_mov = 'SALIDA_MOVIL'
+            if self.mode == 'PRESTAMO_SANTIAGO':
+                tipo_mov = 'PRESTAMO_SANTIAGO'
+            elif self.mode == 'DEVOLUCION_SANTIAGO':
+                tipo_mov = 'RETORNO_MOVIL'
+            elif self.mode == 'TRASLADO':
+                tipo_mov = 'TRASLADO'
+            
             # OPTIMIZACIÓN: Una sola conexión compartida para todos los items (reduce latencia MySQL)
             shared_conn = None
             try:
@@ -851,58 +849,42 @@ class MobileOutputScannerWindow:
                 logger.warning(f"No se pudo abrir conexión compartida: {e}. Usando conexiones individuales.")
                 shared_conn = None
             
-            total = len(items_to_process)
+            lote = [{
+                'sku': item['sku'],
+                'tipo_movimiento': tipo_mov,
+                'cantidad_afectada': item['cantidad'],
+                'movil_afectado': movil,
+                'paquete_asignado': paquete_sel,
+            } for item in items_to_process]
+            
             try:
-                for idx, item in enumerate(items_to_process, 1):
-                    sku = item['sku']
-                    nombre = item['nombre']
-                    cantidad = item['cantidad']
+                # 1. Registrar todo el carrito en un solo lote (prefetch + escritura agrupada).
+                #    Las líneas sin stock se omiten y se reportan; el resto se registra.
+                ok_lote, msg_lote, resultados = registrar_movimientos_batch(
+                    lote, fecha_evento=fecha, existing_conn=shared_conn,
+                    sucursal_context=branch, atomico=False
+                )
+                
+                for item, (ok, msg) in zip(items_to_process, resultados):
+                    if not ok:
+                        errores.append(f"{item['nombre']}: {msg}")
+                        continue
                     seriales = [s.strip().upper() for s in item.get('seriales', [])]
-                    
-                    # Feedback de progreso en el botón
-                    if self.window.winfo_exists():
-                        self.window.after(0, lambda i=idx, t=total: 
-                            self.btn_registrar.config(text=f"⏳ Procesando {i}/{t}...") 
-                            if hasattr(self, 'btn_registrar') else None)
-                    
-                    try:
-                        # Determinar tipo de movimiento
-                        tipo_mov = 'SALIDA_MOVIL'
-                        if self.mode == 'PRESTAMO_SANTIAGO':
-                            tipo_mov = 'PRESTAMO_SANTIAGO'
-                        elif self.mode == 'DEVOLUCION_SANTIAGO':
-                            tipo_mov = 'RETORNO_MOVIL'
-                        elif self.mode == 'TRASLADO':
-                            tipo_mov = 'TRASLADO'
-                        
-                        # 1. Registrar usando conexión compartida para velocidad
-                        ok, msg = registrar_movimiento_gui(
-                            sku=sku,
-                            tipo_movimiento=tipo_mov,
-                            cantidad_afectada=cantidad,
-                            movil_afectado=movil,
-                            fecha_evento=fecha,
-                            paquete_asignado=paquete_sel,
-                            sucursal_context=branch,
-                            existing_conn=shared_conn
-                        )
-                        
-                        if not ok:
-                            errores.append(f"{nombre}: {msg}")
-                            continue
-                        
-                        # 2. Actualizar ubicación de seriales si aplica
-                        if seriales:
-                            for s in seriales:
-                                s_ok, s_msg = actualizar_ubicacion_serial(s, movil, paquete=paquete_sel, existing_conn=shared_conn, sucursal_context=branch)
-                                if not s_ok:
-                                    logger.warning(f"No se pudo actualizar ubicación de serial {s}: {s_msg}")
-                        
-                        exitosos.append((sku, seriales))
-                        count += 1
-
-                    except Exception as e:
-                        errores.append(f"{nombre}: {e}")
+                    exitosos.append((item['sku'], seriales))
+                    count += 1
+                
+                if not ok_lote and count == 0 and shared_conn:
+                    # Fallo de BD o guarda atómica: descartar cualquier escritura parcial
+                    shared_conn.rollback()
+                
+                # 2. Actualizar ubicación de seriales de las líneas registradas
+                seriales_ok = [s for _, ser in exitosos for s in ser]
+                if seriales_ok:
+                    s_ok, s_msg = actualizar_ubicacion_series_bulk(seriales_ok, movil, paquete=paquete_sel, existing_conn=shared_conn, sucursal_context=branch)
+                    if not s_ok:
+                        logger.warning(f"No se pudo actualizar ubicación de seriales: {s_msg}")
+                    else:
+                        self.scan_index.marcar_ubicacion(seriales_ok, movil, paquete=paquete_sel)
                 
                 # Commit final único para todos los items
                 if shared_conn:
@@ -910,6 +892,8 @@ class MobileOutputScannerWindow:
                         shared_conn.commit()
                     except Exception as ce:
                         logger.error(f"Error en commit final: {ce}")
+            except Exception as e:
+                errores.append(str(e))
             finally:
                 if shared_conn:
                     try:
@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, simpledialog, messagebox
 from config import PAQUETES_MATERIALES, save_custom_packages
-import copy
+from database import obtener_catalogo, guardar_paquetes_catalogo
 from gui.styles import Styles
 
 class PackageEditorDialog(tk.Toplevel):
@@ -21,8 +21,8 @@ class PackageEditorDialog(tk.Toplevel):
         except:
             self.prod_map = {}
             
-        # Working copy
-        self.pack_data = copy.deepcopy(PAQUETES_MATERIALES)
+        # Working copy (del catálogo en BD, compartido con el portal)
+        self.pack_data = {p: list(items) for p, items in obtener_catalogo(forzar=True).paquetes.items()}
         
         self.create_widgets()
         
@@ -121,6 +121,11 @@ class PackageEditorDialog(tk.Toplevel):
 
     def guardar(self):
         if messagebox.askyesno("Confirmar", "¿Desea aplicar y guardar la configuración de progreso de estos paquetes?"):
+            ok, msg = guardar_paquetes_catalogo(self.pack_data)
+            if not ok:
+                messagebox.showerror("Error", f"No se pudieron guardar los paquetes:\n{msg}")
+                return
+            # Copia local: respaldo si la BD no responde al próximo inicio
             PAQUETES_MATERIALES.clear()
             PAQUETES_MATERIALES.update(self.pack_data)
             save_custom_packages()
@@ -9,8 +9,10 @@ from tkcalendar import DateEntry
 from database import obtener_asignacion_movil, registrar_movimiento_gui
 from config import PRODUCTOS_INICIALES
 import sqlite3 
-import difflib
 from config import DATABASE_NAME 
+from utils.excel_stream import agrupar_consumos_excel
+
+COLUMNAS_CONSUMO = ['fecha', 'movil', 'sku', 'cantidad']
 
 class ReconciliationWindow:
     def __init__(self, master_app, mode='excel'):
@@ -165,12 +167,14 @@ class ReconciliationWindow:
         self.top.update()
         
         try:
-            df = pd.read_excel(filename)
-            col_map = self._mapear_columnas(df)
+            # Lectura en streaming: solo se guarda el agrupado (fecha, movil, sku) -> cantidad
+            agrupado, info = agrupar_consumos_excel(filename, productos=PRODUCTOS_INICIALES)
+            df = pd.DataFrame([(f, m, sku, cant) for (f, m, sku), cant in agrupado.items()],
+                              columns=COLUMNAS_CONSUMO)
             
             self.current_df_excel = df
-            self.col_map_cache = col_map
-            self.lbl_file.config(text=f"Archivo: {filename}")
+            self.col_map_cache = {c: c for c in COLUMNAS_CONSUMO}
+            self.lbl_file.config(text=f"Archivo: {filename} ({info['filas_leidas']} filas)")
             
             # self.procesar_datos(df, col_map, auto_set_dates=True)
             self.lbl_status.config(text="Archivo cargado. Por favor, seleccione un Móvil para ver la conciliación.")
@@ -194,21 +198,6 @@ class ReconciliationWindow:
              # No mobile, no file
              pass
 
-    def _mapear_columnas(self, df):
-        keywords = {
-            'fecha': ['fecha', 'date', 'dia', 'time'],
-            'movil': ['movil', 'patente', 'camion', 'resource', 'técnico'],
-            'sku': ['sku', 'codigo', 'cod', 'item', 'material'],
-            'cantidad': ['cantidad', 'qty', 'cant', 'consumo', 'usado']
-        }
-        found_map = {}
-        for key, possible_names in keywords.items():
-            for col in df.columns:
-                if str(col).lower().strip() in possible_names:
-                    found_map[key] = col
-                    break
-        return found_map
-
     def procesar_datos(self, df, col_map, movil_manual=None, auto_set_dates=True):
         # Clear table
         for item in self.tree.get_children():
@@ -247,28 +236,8 @@ class ReconciliationWindow:
         
         # --- SCENARIO B: Reconciliation (Excel Loaded) ---
         elif df is not None:
-            df_procesado = None
-            
-            # 1. Try Long Format
-            required_keys = ['fecha', 'movil', 'sku', 'cantidad']
-            if all(k in col_map for k in required_keys):
-                try:
-                    data = df.rename(columns={col_map[k]: k for k in required_keys})
-                    # Clean proper types
-                    fecha_clean = pd.to_datetime(data['fecha'], errors='coerce')
-                    data = data.assign(fecha=fecha_clean.dt.strftime('%Y-%m-%d'))
-                    data = self._limpiar_tipos(data)
-                    df_procesado = data
-                except Exception as e:
-                    print(f"Error Long Format: {e}")
-            
-            # 2. Try Wide Format
-            if df_procesado is None:
-                try:
-                    df_procesado = self.detectar_y_procesar_formato(df, col_map)
-                except Exception as e:
-                    messagebox.showerror("Error de Formato", f"No se pudo interpretar el formato.\n{e}")
-                    return
+            # El agrupado ya viene en formato largo (los formatos anchos se resuelven al leer)
+            df_procesado = df.rename(columns={col_map[k]: k for k in COLUMNAS_CONSUMO})
 
             # --- FILTERING LOGIC ---
             # If User selected a specific mobile, FILTER Excel to only show that mobile.
@@ -453,135 +422,6 @@ class ReconciliationWindow:
         self.recalcular_con_fechas()
 
 
-    def detectar_y_procesar_formato(self, df, col_map_std):
-        # ... logic identical to previous ...
-        # (Included for completeness of overwrite)
-        if 'sku' in col_map_std and 'cantidad' in col_map_std:
-            data = df.rename(columns={
-                col_map_std['fecha']: 'fecha',
-                col_map_std['movil']: 'movil',
-                col_map_std['sku']: 'sku',
-                col_map_std['cantidad']: 'cantidad'
-            })
-            return self._limpiar_tipos(data)
-
-        cols_fecha = ['fecha_cierre', 'fecha', 'date', 'closure date']
-        cols_movil = ['nombre_movil', 'codigo_movil', 'movil', 'patente', 'resource']
-        
-        col_fecha_found = None
-        col_movil_found = None
-        df_cols_lower = [str(c).lower().strip() for c in df.columns]
-        col_real_names = dict(zip(df_cols_lower, df.columns))
-        
-        for c in cols_fecha:
-            if c in df_cols_lower: col_fecha_found = col_real_names[c]; break
-        for c in cols_movil:
-            if c in df_cols_lower: col_movil_found = col_real_names[c]; break
-            
-        if not col_fecha_found or not col_movil_found:
-             if 'fecha' in col_map_std: col_fecha_found = df.columns[df.columns.str.lower() == col_map_std['fecha']].tolist()[0]
-             if 'movil' in col_map_std: col_movil_found = df.columns[df.columns.str.lower() == col_map_std['movil']].tolist()[0]
-             if not col_fecha_found or not col_movil_found: raise ValueError("Meta-data missing")
-
-        # Detect Products
-        from config import PRODUCTOS_INICIALES
-        mapa_sistema_nombres = {n.lower().strip(): sku for n, sku, _ in PRODUCTOS_INICIALES}
-        mapa_sku_columna = {}
-        for col in df.columns:
-            cl = str(col).lower().strip()
-            if col == col_fecha_found or col == col_movil_found:
-                continue
-                
-            # Clean column name once (Aggressive)
-            # Remove dots, dashes, quotes, brackets, parents
-            cl_clean = cl.lower().replace('.', ' ').replace('-', ' ').replace('"', '').replace("'", "").replace('[', '').replace(']', '').replace('(', '').replace(')', '').strip()
-            
-            # 1. Exact Match (already checked via dict lookups above roughly)
-            # 2. Substring Match
-            # 3. Token Match (New)
-            # 4. Fuzzy Match (New - difflib)
-            
-            best_ratio = 0
-            best_match_sku = None
-            
-            for sn, ss in mapa_sistema_nombres.items():
-                # Clean System Name same way
-                sn_clean = sn.replace('.', ' ').replace('-', ' ').replace('"', '').replace("'", "").replace('[', '').replace(']', '').replace('(', '').replace(')', '').strip()
-                
-                # A) Substring (High confidence)
-                # Check cleaned versions too!
-                if sn_clean in cl_clean or cl_clean in sn_clean:
-                    # Relaxed: Allow 3+ chars (e.g. "ONT", "UTP", "STB")
-                    if len(sn_clean)>2 and len(cl_clean)>2:
-                         mapa_sku_columna[col] = ss
-                         best_match_sku = None 
-                         print(f"  [MATCH] '{col}' -> {ss} (Substring)")
-                         break
-                
-                # B) Token Subset (Medium confidence)
-                tokens_col = set(cl_clean.split())
-                tokens_sys = set(sn_clean.split())
-                
-                # Relaxed: Allow single token match if it's significant (len>2)
-                if len(tokens_col) >= 1:
-                    # Filter out tiny tokens from the set to be safe?
-                    # basic safety: assume cl_clean > 2 already checked conceptually or rely on issubset
-                    if tokens_col.issubset(tokens_sys):
-                        # Avoid matching generic words if possible? 
-                        # For now, trust the user's column isn't just "DE" or "EL"
-                        mapa_sku_columna[col] = ss
-                        best_match_sku = None
-                        print(f"  [MATCH] '{col}' -> {ss} (Token Subset)")
-                        break
-                
-                # C) Fuzzy Match (Low confidence fallback)
-                # Only check if we haven't found a match yet
-                ratio = difflib.SequenceMatcher(None, cl_clean, sn_clean).ratio()
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_match_sku = ss
-            
-            # Apply fuzzy match if threshold met and no better match found
-            if best_match_sku and col not in mapa_sku_columna:
-                if best_ratio > 0.6: # 60% similarity
-                    print(f"  [MATCH] '{col}' -> {best_match_sku} (Fuzzy {best_ratio:.2f})")
-                    mapa_sku_columna[col] = best_match_sku
-        
-        # Debug Report of Unmapped
-        mapped_cols = set(mapa_sku_columna.keys())
-        all_cols = set(df.columns)
-        unmapped = all_cols - mapped_cols - {col_fecha_found, col_movil_found}
-        if unmapped:
-            print(f"⚠️ [WARNING] Unmapped Columns: {unmapped}")
-        
-        if not mapa_sku_columna: 
-            # Fallback: List columns to help user debug
-            cols_debug = ", ".join(df.columns[:5])
-            raise ValueError(f"No valid products found in columns. Saw: {cols_debug}...")
-        
-        cols_keep = [col_fecha_found, col_movil_found] + list(mapa_sku_columna.keys())
-        cols_keep = list(set(cols_keep) & set(df.columns))
-        
-        df_melt = df[cols_keep].melt(id_vars=[col_fecha_found, col_movil_found], 
-                                     value_vars=[c for c in mapa_sku_columna.keys() if c in df.columns],
-                                     var_name='_col', value_name='cantidad')
-        df_melt['sku'] = df_melt['_col'].map(mapa_sku_columna)
-        df_melt = df_melt.rename(columns={col_fecha_found:'fecha', col_movil_found:'movil'})
-        
-        return self._limpiar_tipos(df_melt[['fecha', 'movil', 'sku', 'cantidad']])
-
-    def _limpiar_tipos(self, data):
-        data = data.copy()
-        data['fecha'] = pd.to_datetime(data['fecha'], errors='coerce').dt.strftime('%Y-%m-%d')
-        def cq(x):
-            if str(x).lower().strip() in ['no', 'nan', '', 'none']: return 0
-            try: return int(float(x))
-            except: return 0
-        data['cantidad'] = data['cantidad'].apply(cq)
-        data['sku'] = data['sku'].astype(str).str.strip()
-        data['movil'] = data['movil'].astype(str).str.strip()
-        return data.dropna(subset=['fecha'])
-
 def abrir_ventana_conciliacion_excel(master_app, mode='excel'):
     win = ReconciliationWindow(master_app, mode=mode)
     return win
@@ -8,7 +8,7 @@ from database import (
     obtener_info_serial,
     logger
 )
-from config import COLORS, PRODUCTOS_CON_CODIGO_BARRA
+from config import COLORS
 
 class SantiagoAuditPhysTab:
     def __init__(self, master, app_instance):
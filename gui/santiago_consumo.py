@@ -11,7 +11,8 @@ from database import (
     obtener_info_serial,
     logger
 )
-from config import COLORS, MOVILES_SANTIAGO, PRODUCTOS_CON_CODIGO_BARRA
+from config import COLORS, MOVILES_SANTIAGO
+from database import es_equipo_serializado
 
 class SantiagoConsumoTab:
     def __init__(self, master, app_instance):
@@ -132,7 +133,7 @@ class SantiagoConsumoTab:
         
         for p in self.all_products:
             nombre, sku, cant = p
-            es_equipo = sku in PRODUCTOS_CON_CODIGO_BARRA
+            es_equipo = es_equipo_serializado(sku)
             cat = "EQUIPO (Escaneo)" if es_equipo else "MATERIAL (Cantidad)"
             
             if search_term in nombre.lower() or search_term in sku.lower():
@@ -159,7 +160,7 @@ class SantiagoConsumoTab:
         from database import obtener_sku_por_codigo_barra
         # 1. Intentar identificar como código maestro de un MATERIAL
         sku_material = obtener_sku_por_codigo_barra(sn)
-        if sku_material and sku_material not in PRODUCTOS_CON_CODIGO_BARRA:
+        if sku_material and not es_equipo_serializado(sku_material):
             nombre_prod = "Material"
             stock = 0
             if hasattr(self, 'all_products'):
@@ -236,7 +237,7 @@ class SantiagoConsumoTab:
         tk.Label(info_frame, text=f"Móvil: {movil}  |  Stock Bodega: {stock}", 
                  font=('Segoe UI', 10), bg='#f8f9fa').pack()
 
-        es_equipo = sku in PRODUCTOS_CON_CODIGO_BARRA
+        es_equipo = es_equipo_serializado(sku)
 
         if es_equipo:
             tk.Label(main, text=" ESCANEE EL SERIAL / MAC: ", font=('Segoe UI', 11, 'bold'), 
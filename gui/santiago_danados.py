@@ -12,7 +12,8 @@ from database import (
     obtener_nombres_moviles,
     logger
 )
-from config import COLORS, PRODUCTOS_CON_CODIGO_BARRA
+from config import COLORS
+from database import es_equipo_serializado
 from .utils import ScrollableFrame
 
 class SantiagoDanadosTab:
@@ -229,7 +230,7 @@ class SantiagoDanadosTab:
             # 1. Intentar identificar el código maestro de un MATERIAL
             sku_material = obtener_sku_por_codigo_barra(sn)
             
-            if sku_material and sku_material not in PRODUCTOS_CON_CODIGO_BARRA:
+            if sku_material and not es_equipo_serializado(sku_material):
                 # Es un material, pedir cantidad
                 nombre_prod = "Material"
                 stock_disponible = 0
@@ -445,7 +446,7 @@ class SantiagoDanadosTab:
         
         for p in self.all_products:
             nombre, sku, cant = p
-            es_equipo = sku in PRODUCTOS_CON_CODIGO_BARRA
+            es_equipo = es_equipo_serializado(sku)
             tipo = "EQUIPO" if es_equipo else "MATERIAL"
             
             if search_term in nombre.lower() or search_term in sku.lower():
@@ -482,7 +483,7 @@ class SantiagoDanadosTab:
         tk.Label(main, text="Confirmar Reporte de Daño", font=('Segoe UI', 10), bg='white').pack()
         tk.Label(main, text=nombre, font=('Segoe UI', 12, 'bold'), bg='white', fg='#c0392b', wraplength=400).pack(pady=10)
         
-        es_equipo = sku in PRODUCTOS_CON_CODIGO_BARRA
+        es_equipo = es_equipo_serializado(sku)
 
         if es_equipo:
             tk.Label(main, text="Escanee Serial/MAC del equipo dañado:", bg='white').pack(pady=(10, 5))
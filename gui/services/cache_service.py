@@ -38,37 +38,42 @@ class CacheService:
         if self.is_syncing: return
         
         def run_sync():
-            self.is_syncing = True
-            logger.info("🔄 [CACHE] Sincronizando datos con la nube...")
-            try:
-                # 1. Fetch SKUs
-                raw_products = obtener_todos_los_skus_para_movimiento()
-                # Store as list of dicts or objects for easier access
-                self.products = [
-                    {"nombre": p[0], "sku": p[1], "stock": p[2]} 
-                    for p in raw_products
-                ]
-                
-                # 2. Fetch Mobiles
-                self.moviles = obtener_nombres_moviles()
-                
-                # 3. Fetch Technicians
-                self.tecnicos = obtener_tecnicos(solo_activos=True)
-                
-                self.last_sync = datetime.now()
-                logger.info(f"✅ [CACHE] Sincronización completada. {len(self.products)} productos cargados.")
-                
-                if callback: callback(True)
-            except Exception as e:
-                logger.error(f"❌ [CACHE] Error en la sincronización: {e}")
-                if callback: callback(False, str(e))
-            finally:
-                self.is_syncing = False
+            ok, error = self.refresh_now()
+            if callback:
+                callback(ok) if ok else callback(False, error)
 
         if not hasattr(self, '_executor'):
             self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
         self._executor.submit(run_sync)
 
+    def refresh_now(self):
+        """Blocking refresh (for callers already on a worker thread). Returns (success, error)."""
+        self.is_syncing = True
+        logger.info("🔄 [CACHE] Sincronizando datos con la nube...")
+        try:
+            # 1. Fetch SKUs
+            raw_products = obtener_todos_los_skus_para_movimiento()
+            # Store as list of dicts or objects for easier access
+            self.products = [
+                {"nombre": p[0], "sku": p[1], "stock": p[2]} 
+                for p in raw_products
+            ]
+            
+            # 2. Fetch Mobiles
+            self.moviles = obtener_nombres_moviles()
+            
+            # 3. Fetch Technicians
+            self.tecnicos = obtener_tecnicos(solo_activos=True)
+            
+            self.last_sync = datetime.now()
+            logger.info(f"✅ [CACHE] Sincronización completada. {len(self.products)} productos cargados.")
+            return True, None
+        except Exception as e:
+            logger.error(f"❌ [CACHE] Error en la sincronización: {e}")
+            return False, str(e)
+        finally:
+            self.is_syncing = False
+
     def get_products(self):
         return self.products
 
@@ -1,5 +1,9 @@
+import logging
+import threading
 from datetime import date
-from database import obtener_recordatorios_pendientes
+from database import obtener_recordatorios_pendientes, DifusorCambios
+
+logger = logging.getLogger(__name__)
 
 class NotificationService:
     """Service to handle business logic for notifications and reminders."""
@@ -34,3 +38,72 @@ class NotificationService:
                 mensaje += f"   • {r[1]} - Paquete {r[2]}\n"
                 
         return mensaje
+
+
+class InventoryChangeSubscriber:
+    """
+    Live inventory changes for the desktop: subscribes to the change feed
+    (DifusorCambios, ~1 s latency) instead of waiting for 60 s polling timers.
+
+    Events are applied on the Tk thread: the CacheService bodega stock is adjusted
+    in place and every registered listener gets the events of the active branch
+    (each tab refreshes only its affected rows).
+    """
+
+    def __init__(self, master, cache_service=None):
+        self.master = master
+        self.cache_service = cache_service
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def start(self):
+        if self._token is None:
+            self._token = DifusorCambios.obtener().suscribir(self._on_events)
+        return self
+
+    def stop(self):
+        if self._token is not None:
+            DifusorCambios.obtener().desuscribir(self._token)
+            self._token = None
+
+    def add_listener(self, callback):
+        """callback(events) runs on the Tk thread. Returns a function that removes it."""
+        with self._lock:
+            self._listeners.append(callback)
+        def remove():
+            with self._lock:
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+        return remove
+
+    def _on_events(self, events):
+        # Feed thread: hand over to Tk
+        try:
+            self.master.after(0, self._apply, events)
+        except RuntimeError:
+            self.stop()  # The main loop is gone
+
+    def _apply(self, events):
+        from config import CURRENT_CONTEXT
+        branch = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
+        events = [e for e in events if e['sucursal'] == branch]
+        if not events:
+            return
+
+        if self.cache_service is not None:
+            deltas = {}
+            for e in events:
+                if e['ubicacion'] == 'BODEGA':
+                    deltas[e['sku']] = deltas.get(e['sku'], 0) + e['delta']
+            for product in self.cache_service.products:
+                if product['sku'] in deltas:
+                    product['stock'] += deltas[product['sku']]
+
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(events)
+            except Exception as e:
+                logger.warning(f"[LIVE] Listener failed: {e}")
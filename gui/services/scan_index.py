@@ -0,0 +1,209 @@
+import threading
+import logging
+import time
+from datetime import datetime, timedelta
+from database import obtener_cambios_escaneo
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se piden deltas mientras algún escáner está en uso
+INTERVALO_SYNC_SEG = 3
+# Sin uso durante este tiempo, el hilo de sincronización se duerme
+INACTIVIDAD_SEG = 300
+# Recarga completa periódica (recoge borrados, que no dejan marca de actualización)
+RECARGA_COMPLETA_SEG = 600
+# Solape aplicado a la marca para no perder transacciones confirmadas tarde
+SOLAPE_SEG = 10
+
+
+def _clave(valor):
+    return str(valor).strip().upper() if valor and str(valor).strip() else None
+
+
+def _clave_barra(valor):
+    """Misma normalización de comillas/apóstrofes que el resto de búsquedas por código de barra."""
+    clave = _clave(valor)
+    return clave.replace("'", "-").replace("´", "-").replace("`", "-") if clave else None
+
+
+class ScanIndex:
+    """
+    Índice en memoria de seriales/MACs y códigos de barra de una sucursal.
+
+    Se carga una sola vez y luego aplica deltas de series_registradas/productos
+    usando la columna 'actualizado_en' como marca. Compartido por todas las
+    ventanas de escaneo: abrir un escáner ya no descarga la sucursal completa.
+    """
+
+    _instancias = {}
+    _lock_instancias = threading.Lock()
+
+    @classmethod
+    def obtener(cls, sucursal=None):
+        """Devuelve (creándolo si hace falta) el índice de la sucursal y lo mantiene al día."""
+        if not sucursal:
+            from config import CURRENT_CONTEXT
+            sucursal = CURRENT_CONTEXT.get('BRANCH', 'CHIRIQUI')
+        sucursal = sucursal.upper()
+        with cls._lock_instancias:
+            if sucursal not in cls._instancias:
+                cls._instancias[sucursal] = cls(sucursal)
+            indice = cls._instancias[sucursal]
+        indice.precalentar()
+        return indice
+
+    def __init__(self, sucursal):
+        self.sucursal = sucursal
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._despertar = threading.Event()
+        self.listo = threading.Event()
+        self._hilo = None
+        self._activo_hasta = 0
+        self._limpiar()
+
+    def _limpiar(self):
+        self._series = {}             # clave normalizada -> (sku, ubicacion, paquete)
+        self._series_por_id = {}      # id -> claves que aporta la fila
+        self._barras = {}             # codigo_barra -> sku
+        self._maestros = {}           # codigo_barra_maestro -> sku
+        self._skus = {}               # sku normalizado -> {id producto: sku}
+        self._productos_por_id = {}   # id -> (sku, barra, maestro)
+        self._marca = None
+        self._ultima_completa = 0
+
+    # ─────────────────────────────────────────────────────────
+    # SINCRONIZACIÓN
+    # ─────────────────────────────────────────────────────────
+    def precalentar(self):
+        """Marca el índice como en uso y arranca (o despierta) el hilo de sincronización."""
+        inactivo = time.monotonic() > self._activo_hasta
+        self._activo_hasta = time.monotonic() + INACTIVIDAD_SEG
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle, daemon=True, name=f"ScanIndex-{self.sucursal}")
+            self._hilo.start()
+        if inactivo:
+            self._despertar.set()
+
+    def _bucle(self):
+        while True:
+            if time.monotonic() > self._activo_hasta:
+                self._despertar.wait()
+            self._despertar.clear()
+            self.sincronizar()
+            self._despertar.wait(INTERVALO_SYNC_SEG)
+
+    def sincronizar(self, forzar_completa=False):
+        """Aplica los cambios pendientes (o recarga todo). Retorna True si quedó al día."""
+        with self._sync_lock:
+            completa = (forzar_completa or self._marca is None
+                        or time.monotonic() - self._ultima_completa > RECARGA_COMPLETA_SEG)
+            desde = None if completa else self._marca_con_solape()
+            inicio = time.perf_counter()
+
+            cambios = obtener_cambios_escaneo(desde=desde, sucursal_context=self.sucursal)
+            if cambios is None:
+                return False
+            series, productos, marca = cambios
+
+            with self._lock:
+                if completa:
+                    self._limpiar()
+                    self._ultima_completa = time.monotonic()
+                for fila in series:
+                    self._aplicar_serie(*fila)
+                for fila in productos:
+                    self._aplicar_producto(*fila)
+                self._marca = marca or self._marca
+
+            if completa:
+                logger.info(f"🔎 [SCAN] Índice {self.sucursal} cargado: {len(self._series)} seriales, "
+                            f"{len(self._barras) + len(self._maestros)} códigos ({time.perf_counter() - inicio:.2f}s)")
+            elif series or productos:
+                logger.debug(f"[SCAN] Delta {self.sucursal}: {len(series)} series, {len(productos)} productos")
+            self.listo.set()
+            return True
+
+    def _marca_con_solape(self):
+        try:
+            return (datetime.strptime(self._marca, '%Y-%m-%d %H:%M:%S') - timedelta(seconds=SOLAPE_SEG)).strftime('%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError):
+            return self._marca
+
+    def _aplicar_serie(self, id_serie, sku, serial_norm, mac_norm, ubicacion, paquete, sucursal):
+        for clave in self._series_por_id.pop(id_serie, ()):
+            self._series.pop(clave, None)
+        if sucursal != self.sucursal:
+            return
+        claves = tuple(c for c in {_clave(serial_norm), _clave(mac_norm)} if c)
+        for clave in claves:
+            self._series[clave] = (sku, ubicacion, paquete)
+        self._series_por_id[id_serie] = claves
+
+    def _aplicar_producto(self, id_prod, sku, barra, maestro, ubicacion):
+        anterior = self._productos_por_id.pop(id_prod, None)
+        if anterior:
+            sku_ant, barra_ant, maestro_ant = anterior
+            ids = self._skus.get(_clave(sku_ant))
+            if ids:
+                ids.pop(id_prod, None)
+                if not ids: self._skus.pop(_clave(sku_ant), None)
+            if barra_ant and self._barras.get(barra_ant) == sku_ant: self._barras.pop(barra_ant, None)
+            if maestro_ant and self._maestros.get(maestro_ant) == sku_ant: self._maestros.pop(maestro_ant, None)
+        if ubicacion != 'BODEGA' or not sku:
+            return
+        barra, maestro = _clave_barra(barra), _clave_barra(maestro)
+        if barra: self._barras[barra] = sku
+        if maestro: self._maestros[maestro] = sku
+        self._skus.setdefault(_clave(sku), {})[id_prod] = sku
+        self._productos_por_id[id_prod] = (sku, barra, maestro)
+
+    # ─────────────────────────────────────────────────────────
+    # CONSULTAS (O(1), sin red)
+    # ─────────────────────────────────────────────────────────
+    def lookup(self, codigo):
+        """
+        Misma prioridad que identificar_codigo_escaneado_gui:
+        1. Serial/MAC, 2. Código de barra, 3. Código maestro, 4. SKU.
+        Retorna: (sku, es_serial, ubicacion_serial, paquete_serial)
+        """
+        raw_code = _clave(codigo)
+        if not raw_code:
+            return None, False, None, None
+        self.precalentar()
+        codigo_norm = _clave_barra(raw_code)
+
+        with self._lock:
+            serie = self._series.get(raw_code)
+            if serie:
+                sku, ubicacion, paquete = serie
+                return sku, True, ubicacion, paquete
+            for mapa in (self._barras, self._maestros):
+                if codigo_norm in mapa:
+                    return mapa[codigo_norm], False, None, None
+            for c in (codigo_norm, raw_code):
+                if c in self._skus:
+                    return next(iter(self._skus[c].values())), False, None, None
+        return None, False, None, None
+
+    def serial(self, codigo):
+        """Retorna (sku, ubicacion, paquete) del serial/MAC en la sucursal, o None."""
+        clave = _clave(codigo)
+        if not clave:
+            return None
+        self.precalentar()
+        with self._lock:
+            return self._series.get(clave)
+
+    def contiene_serial(self, codigo):
+        return self.serial(codigo) is not None
+
+    def marcar_ubicacion(self, seriales, ubicacion, paquete=None):
+        """Actualización optimista tras una escritura propia (el delta la confirmará después)."""
+        with self._lock:
+            for s in seriales or []:
+                clave = _clave(s)
+                if clave in self._series:
+                    sku, _, paquete_ant = self._series[clave]
+                    self._series[clave] = (sku, ubicacion, paquete if paquete is not None else paquete_ant)
+        self._despertar.set()
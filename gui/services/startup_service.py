@@ -0,0 +1,66 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupService:
+    """
+    Fases de arranque del escritorio ejecutadas en paralelo, después de mostrar la ventana.
+
+    Cada fase es una función sin argumentos; su duración queda en el log y en 'tiempos'.
+    Los callbacks se invocan desde los hilos del pool: la GUI debe reenviarlos con after().
+    """
+
+    def __init__(self, max_workers=3):
+        self._fases = []
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._inicio = time.perf_counter()
+        self.tiempos = {}
+
+    def marcar(self, nombre, inicio):
+        """Registra una fase medida por fuera del pool (p. ej. construir la ventana)."""
+        self._registrar(nombre, time.perf_counter() - inicio)
+
+    def agregar_fase(self, nombre, funcion):
+        self._fases.append((nombre, funcion))
+
+    def _registrar(self, nombre, segundos):
+        with self._lock:
+            self.tiempos[nombre] = segundos
+        logger.info(f"⏱️ [STARTUP] {nombre}: {segundos:.2f}s")
+
+    def ejecutar(self, al_terminar_fase=None, al_terminar=None):
+        """
+        Lanza todas las fases a la vez y retorna sin esperar.
+        al_terminar_fase(nombre, ok, resultado_o_error); al_terminar(tiempos).
+        """
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='startup')
+        pendientes = [len(self._fases)]
+
+        def correr(nombre, funcion):
+            inicio = time.perf_counter()
+            try:
+                resultado, ok = funcion(), True
+            except Exception as e:
+                logger.error(f"[STARTUP] Fase '{nombre}' falló: {e}")
+                resultado, ok = e, False
+            self._registrar(nombre, time.perf_counter() - inicio)
+            if al_terminar_fase:
+                al_terminar_fase(nombre, ok, resultado)
+
+            with self._lock:
+                pendientes[0] -= 1
+                ultima = pendientes[0] == 0
+            if ultima:
+                self._registrar('total', time.perf_counter() - self._inicio)
+                logger.info("⏱️ [STARTUP] Resumen: " + ", ".join(f"{k}={v:.2f}s" for k, v in self.tiempos.items()))
+                if al_terminar:
+                    al_terminar(dict(self.tiempos))
+
+        for nombre, funcion in self._fases:
+            pool.submit(correr, nombre, funcion)
+        pool.shutdown(wait=False)
@@ -1,6 +1,8 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import importlib
+import threading
+import time
 import types
 import logging
 
@@ -28,8 +30,8 @@ class TabManager:
             # Update navigation button styles
             self._update_nav_buttons(tab_name)
                     
-            # Lazy load the tab if needed
-            self.load_tab(tab_name)
+            # Lazy load the tab if needed (import off the Tk thread)
+            self.load_tab(tab_name, en_segundo_plano=True)
         except Exception as e:
             logger.error(f"Error in on_tab_changed: {e}")
 
@@ -41,8 +43,12 @@ class TabManager:
             else:
                 btn.configure(bg='#2c3e50', fg='#ecf0f1', font=('Segoe UI', 11))
 
-    def load_tab(self, tab_name):
-        """Load a tab module and instantiate its class."""
+    def load_tab(self, tab_name, en_segundo_plano=False):
+        """
+        Load a tab module and instantiate its class.
+        With en_segundo_plano=True the import (pandas, matplotlib, openpyxl...) runs on a
+        worker thread and only the widget construction happens on the Tk thread.
+        """
         data = self.tabs_data.get(tab_name)
         if not data or data['loaded']:
             return
@@ -53,25 +59,51 @@ class TabManager:
                 child.pack(fill='both', expand=True)
             data['frame'].add = types.MethodType(_fake_add, data['frame'])
 
-        # Show loading indicator
-        loading_label = tk.Label(data['frame'],
-                                text="⏳  Cargando...",
-                                font=('Segoe UI', 18, 'bold'),
-                                fg='#3498db', bg='#ecf0f1')
-        loading_label.place(relx=0.5, rely=0.5, anchor='center')
-        data['frame'].update_idletasks()
+        if data.get('loading'):
+            if en_segundo_plano:
+                return
+        else:
+            # Show loading indicator
+            loading_label = tk.Label(data['frame'],
+                                    text="⏳  Cargando...",
+                                    font=('Segoe UI', 18, 'bold'),
+                                    fg='#3498db', bg='#ecf0f1')
+            loading_label.place(relx=0.5, rely=0.5, anchor='center')
+            data['frame'].update_idletasks()
 
         logger.info(f"Lazy loading tab: {tab_name}...")
-        
+        inicio = time.perf_counter()
+
+        if not en_segundo_plano:
+            try:
+                module = importlib.import_module(data['module'])
+            except Exception as e:
+                self._show_load_error(tab_name, data, e)
+                return
+            self._build_tab(tab_name, data, module, inicio, time.perf_counter())
+            return
+
+        data['loading'] = True
+
+        def importar():
+            try:
+                module = importlib.import_module(data['module'])
+                fin_import = time.perf_counter()
+                self.master.after(0, lambda: self._build_tab(tab_name, data, module, inicio, fin_import))
+            except Exception as e:
+                self.master.after(0, lambda: self._show_load_error(tab_name, data, e))
+
+        threading.Thread(target=importar, daemon=True, name=f"TabImport-{tab_name}").start()
+
+    def _build_tab(self, tab_name, data, module, inicio, fin_import):
+        """Instantiate the tab class on the Tk thread (the module is already imported)."""
+        data['loading'] = False
+        if data['loaded']:
+            return  # A synchronous load_tab() got here first
         try:
-            module = importlib.import_module(data['module'])
             cls = getattr(module, data['class'])
             
-            # Remove loading indicator
-            if loading_label.winfo_exists():
-                loading_label.destroy()
-            
-            # Clear frame
+            # Clear frame (also removes the loading indicator)
             for widget in data['frame'].winfo_children():
                 widget.destroy()
                 
@@ -89,16 +121,21 @@ class TabManager:
             self._apply_legacy_mappings(tab_name, instance)
             
             data['loaded'] = True
-            logger.info(f"Tab {tab_name} loaded successfully.")
+            logger.info(f"⏱️ [STARTUP] Pestaña {tab_name}: import {fin_import - inicio:.2f}s, "
+                        f"construcción {time.perf_counter() - fin_import:.2f}s")
             
         except Exception as e:
-            if loading_label.winfo_exists():
-                loading_label.destroy()
+            self._show_load_error(tab_name, data, e)
+
+    def _show_load_error(self, tab_name, data, e):
+        data['loading'] = False
+        for widget in data['frame'].winfo_children():
+            widget.destroy()
 
-            logger.error(f"Error loading tab {tab_name}: {e}")
-            import traceback
-            traceback.print_exc()
-            tk.Label(data['frame'], text=f"Error cargando módulo:\n{e}", fg='red').pack()
+        logger.error(f"Error loading tab {tab_name}: {e}")
+        import traceback
+        traceback.print_exc()
+        tk.Label(data['frame'], text=f"Error cargando módulo:\n{e}", fg='red').pack()
 
     def _apply_legacy_mappings(self, tab_name, instance):
         """Maintain legacy attribute names for compatibility."""
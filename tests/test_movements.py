@@ -24,6 +24,21 @@ def patch_db_type(monkeypatch):
     import config
     monkeypatch.setattr(config, 'DB_TYPE', 'SQLITE')
     monkeypatch.setattr(config, 'DATABASE_NAME', ':memory:')
+    # Los módulos importan DB_TYPE por nombre: parchear también su copia
+    import utils.db_connector
+    import data_layer.core
+    import data_layer.movements
+    import data_layer.mobile
+    import data_layer.ledger
+    import data_layer.search
+    import data_layer.inventory
+    monkeypatch.setattr(utils.db_connector, 'DB_TYPE', 'SQLITE')
+    monkeypatch.setattr(data_layer.core, 'DB_TYPE', 'SQLITE')
+    monkeypatch.setattr(data_layer.movements, 'DB_TYPE', 'SQLITE')
+    monkeypatch.setattr(data_layer.mobile, 'DB_TYPE', 'SQLITE')
+    monkeypatch.setattr(data_layer.ledger, 'DB_TYPE', 'SQLITE')
+    monkeypatch.setattr(data_layer.search, 'DB_TYPE', 'SQLITE')
+    monkeypatch.setattr(data_layer.inventory, 'DB_TYPE', 'SQLITE')
 
 
 @pytest.fixture
@@ -81,7 +96,77 @@ def in_memory_conn():
             fecha_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
             sucursal VARCHAR(50) DEFAULT 'CHIRIQUI',
             paquete VARCHAR(50),
-            estado VARCHAR(50) DEFAULT 'DISPONIBLE'
+            estado VARCHAR(50) DEFAULT 'DISPONIBLE',
+            serial_norm VARCHAR(100) GENERATED ALWAYS AS (UPPER(TRIM(serial_number))) VIRTUAL,
+            mac_norm VARCHAR(100) GENERATED ALWAYS AS (UPPER(TRIM(mac_number))) VIRTUAL
+        );
+        CREATE TABLE inventario_movil_version (
+            clave VARCHAR(100) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (clave, sucursal)
+        );
+        CREATE TABLE inventario_movil_snapshot (
+            movil VARCHAR(100) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            version_movil INTEGER NOT NULL DEFAULT 0,
+            version_globales INTEGER NOT NULL DEFAULT 0,
+            payload TEXT,
+            generado_en DATETIME,
+            PRIMARY KEY (movil, sucursal)
+        );
+        CREATE TABLE consumos_pendientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            movil VARCHAR(100), sku VARCHAR(50), cantidad INTEGER,
+            tecnico_nombre VARCHAR(255), ayudante_nombre VARCHAR(255),
+            ticket VARCHAR(255), fecha DATE, colilla VARCHAR(255), num_contrato VARCHAR(255),
+            seriales_usados TEXT, estado VARCHAR(50) DEFAULT 'PENDIENTE',
+            paquete VARCHAR(50), sucursal VARCHAR(50) DEFAULT 'CHIRIQUI'
+        );
+        CREATE TABLE envios_portal (
+            clave VARCHAR(64) NOT NULL PRIMARY KEY,
+            ruta VARCHAR(50) NOT NULL,
+            respuesta TEXT,
+            creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE cambios_inventario (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sucursal VARCHAR(50) NOT NULL,
+            sku VARCHAR(50) NOT NULL,
+            ubicacion VARCHAR(100) NOT NULL,
+            paquete VARCHAR(50),
+            delta INTEGER NOT NULL,
+            origen VARCHAR(30),
+            creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE saldos_movimientos (
+            sku VARCHAR(50) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            consumo_total INTEGER NOT NULL DEFAULT 0,
+            abasto_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sku, sucursal)
+        );
+        CREATE TABLE resumen_diario_movimientos (
+            fecha DATE NOT NULL,
+            sucursal VARCHAR(50) NOT NULL,
+            sku VARCHAR(50) NOT NULL,
+            movil VARCHAR(100) NOT NULL DEFAULT '',
+            tipo_movimiento VARCHAR(50) NOT NULL,
+            cantidad INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, sucursal, sku, movil, tipo_movimiento)
+        );
+        CREATE TABLE consumo_series (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consumo_id INTEGER,
+            movimiento_id INTEGER,
+            serial_norm VARCHAR(100) NOT NULL,
+            sucursal VARCHAR(50) NOT NULL
+        );
+        CREATE TABLE movimientos_tokens (
+            sucursal VARCHAR(50) NOT NULL,
+            token VARCHAR(100) NOT NULL,
+            movimiento_id INTEGER NOT NULL,
+            PRIMARY KEY (sucursal, token, movimiento_id)
         );
         CREATE TABLE recordatorios_pendientes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -242,6 +327,128 @@ class TestRegistrarMovimiento:
         assert not ok
 
 
+# ──────────────────────────────────────────────
+# Tests de registrar_movimientos_batch
+# ──────────────────────────────────────────────
+
+class TestRegistrarMovimientosBatch:
+
+    def _stock(self, conn, sku):
+        cur = conn.cursor()
+        cur.execute("SELECT cantidad FROM productos WHERE sku=? AND ubicacion='BODEGA' AND sucursal='CHIRIQUI'", (sku,))
+        return cur.fetchone()[0]
+
+    def test_lote_salida_movil_descuenta_y_asigna(self, in_memory_conn):
+        """Un lote de varias líneas debe dejar el mismo estado que llamadas sucesivas."""
+        from data_layer.movements import registrar_movimientos_batch
+
+        items = [
+            {'sku': '1-2-16', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 10, 'movil': 'Movil 200', 'paquete': 'PAQUETE A'},
+            {'sku': '1-2-16', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 5, 'movil': 'Movil 200', 'paquete': 'PAQUETE A'},
+            {'sku': '4-4-644', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 3, 'movil': 'Movil 200', 'paquete': 'PAQUETE A'},
+        ]
+        ok, msg, resultados = registrar_movimientos_batch(
+            items, fecha_evento=date.today().isoformat(), existing_conn=in_memory_conn, sucursal_context='CHIRIQUI'
+        )
+
+        assert ok, msg
+        assert all(r[0] for r in resultados)
+        assert self._stock(in_memory_conn, '1-2-16') == 85
+        assert self._stock(in_memory_conn, '4-4-644') == 7
+
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT cantidad FROM asignacion_moviles WHERE sku_producto='1-2-16' AND movil='Movil 200' AND paquete='PAQUETE A'")
+        assert cur.fetchone()[0] == 15
+        cur.execute("SELECT COUNT(*) FROM movimientos")
+        assert cur.fetchone()[0] == 3
+
+    def test_lote_atomico_no_escribe_si_una_linea_falla(self, in_memory_conn):
+        """En modo atómico una línea sin stock cancela todo el lote."""
+        from data_layer.movements import registrar_movimientos_batch
+
+        items = [
+            {'sku': '1-2-16', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 10, 'movil': 'Movil 200'},
+            {'sku': '4-4-644', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 50, 'movil': 'Movil 200'},
+        ]
+        ok, msg, resultados = registrar_movimientos_batch(
+            items, fecha_evento=date.today().isoformat(), existing_conn=in_memory_conn, sucursal_context='CHIRIQUI'
+        )
+
+        assert not ok
+        assert 'insuficiente' in msg.lower()
+        assert resultados[0][0] and not resultados[1][0]
+        assert self._stock(in_memory_conn, '1-2-16') == 100
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM movimientos")
+        assert cur.fetchone()[0] == 0
+
+    def test_lote_parcial_registra_lineas_validas(self, in_memory_conn):
+        """Con atomico=False las líneas inválidas se omiten y el resto se registra."""
+        from data_layer.movements import registrar_movimientos_batch
+
+        items = [
+            {'sku': '1-2-16', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 10, 'movil': 'Movil 200'},
+            {'sku': '4-4-644', 'tipo_movimiento': 'SALIDA_MOVIL', 'cantidad': 50, 'movil': 'Movil 200'},
+        ]
+        ok, _, resultados = registrar_movimientos_batch(
+            items, fecha_evento=date.today().isoformat(), existing_conn=in_memory_conn,
+            sucursal_context='CHIRIQUI', atomico=False
+        )
+
+        assert ok
+        assert [r[0] for r in resultados] == [True, False]
+        assert self._stock(in_memory_conn, '1-2-16') == 90
+        assert self._stock(in_memory_conn, '4-4-644') == 10
+
+    def test_retorno_con_paquete_no_drena_otro_paquete(self, in_memory_conn):
+        """RETORNO con PAQUETE A drena ese paquete y los sin etiqueta, nunca el PAQUETE B."""
+        from data_layer.movements import registrar_movimientos_batch
+
+        in_memory_conn.executemany(
+            "INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES (?, ?, ?, ?, 'CHIRIQUI')",
+            [('1-2-16', 'Movil 201', 'PAQUETE A', 4), ('1-2-16', 'Movil 201', 'NINGUNO', 3), ('1-2-16', 'Movil 201', 'PAQUETE B', 9)]
+        )
+        in_memory_conn.commit()
+
+        ok, msg, _ = registrar_movimientos_batch(
+            [{'sku': '1-2-16', 'tipo_movimiento': 'RETORNO_MOVIL', 'cantidad': 6, 'movil': 'Movil 201', 'paquete': 'PAQUETE A'}],
+            fecha_evento=date.today().isoformat(), existing_conn=in_memory_conn, sucursal_context='CHIRIQUI'
+        )
+
+        assert ok, msg
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT paquete, cantidad FROM asignacion_moviles WHERE movil='Movil 201'")
+        por_paquete = dict(cur.fetchall())
+        assert por_paquete == {'PAQUETE A': 0, 'NINGUNO': 1, 'PAQUETE B': 9}
+        assert self._stock(in_memory_conn, '1-2-16') == 106
+
+    def test_guarda_fallida_en_conexion_compartida_no_deja_medio_plan(self, in_memory_conn, monkeypatch):
+        """Si otra sesión vacía el móvil entre la precarga y la escritura, se deshace todo el lote."""
+        from data_layer import movements
+
+        in_memory_conn.execute("INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES ('1-2-16', 'Movil 201', 'NINGUNO', 5, 'CHIRIQUI')")
+        in_memory_conn.commit()
+        precargar = movements._precargar_estado_lote
+
+        def precargar_y_competir(conn, cursor, movs):
+            estado = precargar(conn, cursor, movs)
+            cursor.execute("UPDATE asignacion_moviles SET cantidad = 0 WHERE movil = 'Movil 201'")
+            return estado
+        monkeypatch.setattr(movements, '_precargar_estado_lote', precargar_y_competir)
+
+        ok, msg, _ = movements.registrar_movimientos_batch(
+            [{'sku': '1-2-16', 'tipo_movimiento': 'ABASTO', 'cantidad': 3},
+             {'sku': '1-2-16', 'tipo_movimiento': 'RETORNO_MOVIL', 'cantidad': 2, 'movil': 'Movil 201'}],
+            fecha_evento=date.today().isoformat(), existing_conn=in_memory_conn, sucursal_context='CHIRIQUI'
+        )
+
+        assert not ok and 'atómico' in msg
+        assert self._stock(in_memory_conn, '1-2-16') == 100
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM movimientos")
+        assert cur.fetchone()[0] == 0
+
+
 # ──────────────────────────────────────────────
 # Tests de validators
 # ──────────────────────────────────────────────
@@ -268,3 +475,853 @@ class TestValidators:
         from utils.validators import ValidationError
         with pytest.raises(ValidationError):
             validate_quantity(0, allow_zero=False)
+
+
+# ──────────────────────────────────────────────
+# Tests de la caché de productos globales
+# ──────────────────────────────────────────────
+
+class TestCacheGlobales:
+
+    def test_cache_usa_conexion_existente_e_invalida(self, in_memory_conn, monkeypatch):
+        """La consulta usa existing_conn (sin conexión lateral) y se relee cuando sube la versión de globales en BD."""
+        import database  # noqa: F401  (resuelve el import circular inventory ↔ movements)
+        from data_layer import inventory
+        from data_layer.core import marcar_inventario_movil
+
+        def _sin_conexion_lateral(*a, **kw):
+            raise AssertionError("No debe abrirse una conexión lateral")
+        monkeypatch.setattr('utils.db_connector.get_db_connection', _sin_conexion_lateral)
+
+        in_memory_conn.executescript("""
+            CREATE TABLE productos_globales (sku VARCHAR(50), sucursal VARCHAR(50), UNIQUE (sku, sucursal));
+            INSERT INTO productos_globales VALUES ('1-2-16', 'CHIRIQUI');
+        """)
+        inventory.invalidar_cache_globales()
+
+        assert inventory.obtener_skus_globales('CHIRIQUI', existing_conn=in_memory_conn) == ['1-2-16']
+
+        # Sin cambio de versión en BD, la caché sigue sirviendo el valor anterior
+        in_memory_conn.execute("INSERT INTO productos_globales VALUES ('4-4-644', 'CHIRIQUI')")
+        assert inventory.obtener_skus_globales('CHIRIQUI', existing_conn=in_memory_conn) == ['1-2-16']
+
+        # Otro proceso (sin tocar la caché local) sube la versión de globales: se relee
+        marcar_inventario_movil(in_memory_conn.cursor(), 'CHIRIQUI', globales=True)
+        assert sorted(inventory.obtener_skus_globales('CHIRIQUI', existing_conn=in_memory_conn)) == ['1-2-16', '4-4-644']
+        inventory.invalidar_cache_globales()
+
+    def test_consumo_de_global_descuenta_bodega(self, in_memory_conn):
+        """Un CONSUMO_MOVIL de un SKU global descuenta directamente de BODEGA."""
+        import database  # noqa: F401
+        from data_layer import inventory
+        from data_layer.movements import registrar_movimiento_gui
+
+        in_memory_conn.executescript("""
+            CREATE TABLE productos_globales (sku VARCHAR(50), sucursal VARCHAR(50), UNIQUE (sku, sucursal));
+            INSERT INTO productos_globales VALUES ('1-2-16', 'CHIRIQUI');
+        """)
+        inventory.invalidar_cache_globales()
+
+        ok, msg = registrar_movimiento_gui(
+            sku='1-2-16', tipo_movimiento='CONSUMO_MOVIL', cantidad_afectada=7, movil_afectado='Movil 200',
+            fecha_evento=date.today().isoformat(), sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+        )
+        inventory.invalidar_cache_globales()
+
+        assert ok, msg
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT cantidad FROM productos WHERE sku='1-2-16' AND ubicacion='BODEGA'")
+        assert cur.fetchone()[0] == 93
+
+
+# ──────────────────────────────────────────────
+# Tests de columnas normalizadas de series
+# ──────────────────────────────────────────────
+
+class TestSeriesNormalizadas:
+
+    def test_consumo_con_serial_en_minusculas_actualiza_estado(self, in_memory_conn):
+        """El lote encuentra la serie por serial_norm aunque el escaneo venga en otro formato."""
+        from data_layer.movements import registrar_movimientos_batch
+
+        in_memory_conn.execute(
+            "INSERT INTO series_registradas (sku, serial_number, mac_number, sucursal) VALUES ('4-4-644', ' 48575443ABCD ', 'aa:bb:cc', 'CHIRIQUI')"
+        )
+        in_memory_conn.execute(
+            "INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES ('4-4-644', 'Movil 200', 'NINGUNO', 2, 'CHIRIQUI')"
+        )
+        in_memory_conn.commit()
+
+        ok, msg, _ = registrar_movimientos_batch(
+            [{'sku': '4-4-644', 'tipo_movimiento': 'CONSUMO_MOVIL', 'cantidad': 1, 'movil': 'Movil 200', 'seriales': ['AA:BB:CC']}],
+            fecha_evento=date.today().isoformat(), existing_conn=in_memory_conn, sucursal_context='CHIRIQUI'
+        )
+
+        assert ok, msg
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT estado, serial_norm FROM series_registradas")
+        assert cur.fetchone() == ('CONSUMIDO', '48575443ABCD')
+
+    def test_validar_seriales_lote_reporta_estado_por_serial(self, in_memory_conn):
+        """Una sola llamada clasifica cada serial: OK, SKU incorrecto, fuera de bodega, otra sucursal o inexistente."""
+        from data_layer.inventory import validar_seriales_lote
+
+        in_memory_conn.executescript("""
+            INSERT INTO series_registradas (sku, serial_number, mac_number, sucursal) VALUES ('1-2-16', 'S-OK', 'MAC-OK', 'CHIRIQUI');
+            INSERT INTO series_registradas (sku, serial_number, sucursal) VALUES ('1-2-16', 'S-SANTIAGO', 'SANTIAGO');
+            INSERT INTO series_registradas (sku, serial_number, ubicacion, sucursal) VALUES ('1-2-16', 'S-MOVIL', 'Movil 200', 'CHIRIQUI');
+        """)
+        in_memory_conn.commit()
+
+        ok, resultados = validar_seriales_lote(
+            ['mac-ok', {'serial': 'S-OK', 'sku': '9-9-99'}, 'S-SANTIAGO', 'S-MOVIL', 'NADA'],
+            sucursal_context='CHIRIQUI', sku_esperado='1-2-16', existing_conn=in_memory_conn
+        )
+
+        assert ok
+        assert [r['estado'] for r in resultados] == ['OK', 'SKU_INCORRECTO', 'OTRA_SUCURSAL', 'NO_EN_BODEGA', 'NO_EXISTE']
+        assert resultados[0]['nombre'] == 'Cable Fiber'
+
+    def test_actualizar_ubicacion_encuentra_seriales_en_otro_formato(self, in_memory_conn):
+        """Las actualizaciones de ubicación (masiva y unitaria) buscan por serial_norm / mac_norm."""
+        from data_layer.inventory import actualizar_ubicacion_series_bulk, actualizar_ubicacion_serial
+
+        in_memory_conn.executescript("""
+            INSERT INTO series_registradas (sku, serial_number, mac_number, sucursal) VALUES ('4-4-644', 'ZTEG1234', 'AA:BB:01', 'CHIRIQUI');
+            INSERT INTO series_registradas (sku, serial_number, mac_number, sucursal) VALUES ('4-4-644', 'ZTEG5678', 'AA:BB:02', 'CHIRIQUI');
+        """)
+        in_memory_conn.commit()
+
+        ok, msg = actualizar_ubicacion_series_bulk([' zteg1234 ', 'aa:bb:02'], 'Movil 200', 'PAQUETE A',
+                                                   existing_conn=in_memory_conn, sucursal_context='CHIRIQUI')
+        assert ok and msg.startswith('2 ')
+        ok, _ = actualizar_ubicacion_serial('zteg5678 ', 'BODEGA', existing_conn=in_memory_conn, sucursal_context='CHIRIQUI')
+        assert ok
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT serial_number, ubicacion FROM series_registradas ORDER BY serial_number")
+        assert cur.fetchall() == [('ZTEG1234', 'Movil 200'), ('ZTEG5678', 'BODEGA')]
+
+
+# ──────────────────────────────────────────────
+# Tests del índice de escaneo incremental
+# ──────────────────────────────────────────────
+
+class TestScanIndex:
+
+    def test_delta_actualiza_y_retira_seriales(self, monkeypatch):
+        """Los deltas mueven/quitan seriales sin recarga completa y se respeta la prioridad Serial > Barra > SKU."""
+        import gui.services.scan_index as scan_index
+
+        respuestas = [
+            ([(1, '4-4-644', 'SN1', 'MAC1', 'BODEGA', None, 'CHIRIQUI')],
+             [(10, '1-2-16', '7501', None, 'BODEGA'), (11, '4-4-644', None, 'ONT-M', 'BODEGA')],
+             '2026-01-01 10:00:00'),
+            ([(1, '4-4-644', 'SN1', 'MAC1', 'Movil 200', 'PAQUETE A', 'CHIRIQUI'),
+              (2, '4-4-644', 'SN2', None, 'BODEGA', None, 'SANTIAGO')],
+             [],
+             '2026-01-01 10:00:05'),
+        ]
+        pedidos = []
+
+        def fake_cambios(desde=None, sucursal_context=None):
+            pedidos.append(desde)
+            return respuestas[len(pedidos) - 1]
+
+        monkeypatch.setattr(scan_index, 'obtener_cambios_escaneo', fake_cambios)
+        indice = scan_index.ScanIndex('CHIRIQUI')
+        monkeypatch.setattr(indice, 'precalentar', lambda: None)  # sin hilo de fondo: sincronización manual
+
+        assert indice.sincronizar()
+        assert indice.lookup('mac1') == ('4-4-644', True, 'BODEGA', None)
+        assert indice.lookup("ONT'M") == ('4-4-644', False, None, None)
+        assert indice.lookup('1-2-16') == ('1-2-16', False, None, None)
+
+        assert indice.sincronizar()
+        assert pedidos == [None, '2026-01-01 09:59:50']
+        assert indice.serial('SN1') == ('4-4-644', 'Movil 200', 'PAQUETE A')
+        assert not indice.contiene_serial('SN2')
+
+
+# ──────────────────────────────────────────────
+# Tests del snapshot de inventario por móvil
+# ──────────────────────────────────────────────
+
+class TestSnapshotInventarioMovil:
+
+    def test_snapshot_se_reutiliza_y_se_invalida_con_movimientos(self, in_memory_conn):
+        """La segunda lectura sale del snapshot; un movimiento del móvil incrementa su versión y fuerza recálculo."""
+        from data_layer import inventory
+        from data_layer.movements import registrar_movimiento_gui
+        from data_layer.mobile import obtener_inventario_movil_snapshot
+        inventory.invalidar_cache_globales()
+
+        def salida(cantidad):
+            ok, msg = registrar_movimiento_gui(
+                sku='1-2-16', tipo_movimiento='SALIDA_MOVIL', cantidad_afectada=cantidad, movil_afectado='Movil 200',
+                fecha_evento=date.today().isoformat(), paquete_asignado='PAQUETE A',
+                sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+            )
+            assert ok, msg
+
+        salida(10)
+        inventario, desde_snapshot = obtener_inventario_movil_snapshot('Movil 200', 'CHIRIQUI', existing_conn=in_memory_conn)
+        assert not desde_snapshot
+        assert [(i['sku'], i['paquete'], i['cantidad_total'], i['nombre']) for i in inventario] == [('1-2-16', 'PAQUETE A', 10, 'Cable Fiber')]
+
+        assert obtener_inventario_movil_snapshot('Movil 200', 'CHIRIQUI', existing_conn=in_memory_conn) == (inventario, True)
+
+        salida(5)
+        inventario, desde_snapshot = obtener_inventario_movil_snapshot('Movil 200', 'CHIRIQUI', existing_conn=in_memory_conn)
+        assert not desde_snapshot
+        assert inventario[0]['cantidad_total'] == 15
+
+
+# ──────────────────────────────────────────────
+# Tests de envíos idempotentes del portal
+# ──────────────────────────────────────────────
+
+class TestEnviosIdempotentes:
+
+    def test_clave_repetida_no_vuelve_a_descontar(self, in_memory_conn):
+        """La clave se guarda en la transacción del consumo: un reintento choca y se revierte entero."""
+        from data_layer.mobile import registrar_consumo_directo, guardar_respuesta_envio, obtener_respuesta_envio
+
+        def enviar():
+            cur = in_memory_conn.cursor()
+            try:
+                ok, msg = registrar_consumo_directo(
+                    sku='1-2-16', cantidad=4, movil='Movil 200', tecnico='Tec', ticket='P-1',
+                    sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+                )
+                assert ok, msg
+                guardar_respuesta_envio(cur, 'clave-1', 'registrar_santiago', {"exito": True, "mensaje": msg})
+                in_memory_conn.commit()
+                return True
+            except sqlite3.IntegrityError:
+                in_memory_conn.rollback()
+                return False
+
+        assert obtener_respuesta_envio('clave-1', existing_conn=in_memory_conn) is None
+        assert enviar() is True
+        assert enviar() is False
+        assert obtener_respuesta_envio('clave-1', existing_conn=in_memory_conn)['exito'] is True
+
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT cantidad FROM productos WHERE sku = '1-2-16' AND ubicacion = 'BODEGA'")
+        assert cur.fetchone()[0] == 96
+        cur.execute("SELECT COUNT(*) FROM consumos_pendientes")
+        assert cur.fetchone()[0] == 1
+
+
+# ──────────────────────────────────────────────
+# Tests de trabajos en segundo plano
+# ──────────────────────────────────────────────
+
+class TestTrabajosPortal:
+
+    def test_ciclo_de_vida_y_trabajo_abandonado(self, in_memory_conn):
+        """El resultado se guarda como JSON; un trabajo sin avance reciente se reporta como ERROR."""
+        from data_layer.core import SQL_TABLA_TRABAJOS_PORTAL
+        from data_layer import jobs
+        in_memory_conn.execute(SQL_TABLA_TRABAJOS_PORTAL)
+
+        id_trabajo = jobs.crear_trabajo('comparar_excel', total=10, existing_conn=in_memory_conn)
+        jobs.actualizar_trabajo(id_trabajo, estado=jobs.TRABAJO_COMPLETADO, progreso=10,
+                                resultado={"total_filas": 10}, existing_conn=in_memory_conn)
+        trabajo = jobs.obtener_trabajo(id_trabajo, existing_conn=in_memory_conn)
+        assert (trabajo['estado'], trabajo['progreso'], trabajo['resultado']) == ('COMPLETADO', 10, {"total_filas": 10})
+
+        perdido = jobs.crear_trabajo('registrar_bulk', existing_conn=in_memory_conn)
+        assert jobs.obtener_trabajo(perdido, existing_conn=in_memory_conn)['estado'] == 'PENDIENTE'
+        in_memory_conn.execute("UPDATE trabajos_portal SET actualizado_en = '2000-01-01 00:00:00' WHERE id = ?", (perdido,))
+        assert jobs.obtener_trabajo(perdido, existing_conn=in_memory_conn)['estado'] == 'ERROR'
+        assert jobs.obtener_trabajo('no-existe', existing_conn=in_memory_conn) is None
+
+
+# ──────────────────────────────────────────────
+# Tests de lectura de Excel en streaming
+# ──────────────────────────────────────────────
+
+class TestExcelStream:
+
+    def _libro(self, filas):
+        import io
+        import openpyxl
+        wb = openpyxl.Workbook()
+        for fila in filas:
+            wb.active.append(fila)
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+    def test_formato_largo_agrupa_por_fecha_movil_sku(self):
+        from datetime import datetime
+        from utils.excel_stream import agrupar_consumos_excel
+        libro = self._libro([
+            ['Fecha', 'Movil', 'SKU', 'Cantidad'],
+            [datetime(2024, 5, 2, 9, 30), 'Movil 200', '1-2-16', 3],
+            ['02/05/2024', 'Movil 200', '1-2-16', '2'],
+            ['2024-05-02', 'Movil 201', '1-2-16', 'no'],
+            ['sin fecha', 'Movil 200', '1-2-16', 9],
+        ])
+        agrupado, info = agrupar_consumos_excel(libro)
+        assert agrupado == {('2024-05-02', 'Movil 200', '1-2-16'): 5, ('2024-05-02', 'Movil 201', '1-2-16'): 0}
+        assert (info['formato'], info['filas_leidas'], info['filas_descartadas']) == ('LARGO', 4, 1)
+
+    def test_formato_ancho_mapea_columnas_de_producto(self):
+        from utils.excel_stream import agrupar_consumos_excel
+        libro = self._libro([
+            ['fecha_cierre', 'nombre_movil', 'FIBUNHILO', 'Columna Desconocida Zeta'],
+            ['2024-05-02', 'Movil 200', 4, 7],
+            ['2024-05-02', 'Movil 200', 1, 7],
+        ])
+        agrupado, info = agrupar_consumos_excel(libro, productos=[('FIBUNHILO', '1-2-16', '001')])
+        assert info['formato'] == 'ANCHO'
+        assert agrupado == {('2024-05-02', 'Movil 200', '1-2-16'): 5}
+
+
+# ──────────────────────────────────────────────
+# Tests de migraciones versionadas
+# ──────────────────────────────────────────────
+
+class TestMigracionesEsquema:
+
+    def test_migracion_se_aplica_una_vez_y_no_se_repite_si_cambia(self, in_memory_conn):
+        """Solo se aplican las versiones que faltan; cambiar el cuerpo de una aplicada no la re-ejecuta."""
+        from data_layer.core import _aplicar_migraciones_pendientes
+        llamadas = []
+
+        def crear_tabla_demo(cursor, T, add_col, add_idx):
+            llamadas.append('v1')
+            cursor.execute("CREATE TABLE IF NOT EXISTS demo (id INTEGER)")
+
+        def agregar_columna_demo(cursor, T, add_col, add_idx):
+            llamadas.append('v2')
+            add_col('demo', 'nombre', 'TEXT')
+
+        registro = [(1, "demo", crear_tabla_demo)]
+        cur = in_memory_conn.cursor()
+        assert _aplicar_migraciones_pendientes(in_memory_conn, cur, registro) == [1]
+        assert _aplicar_migraciones_pendientes(in_memory_conn, cur, registro) == []
+
+        registro.append((2, "demo nombre", agregar_columna_demo))
+        assert _aplicar_migraciones_pendientes(in_memory_conn, cur, registro) == [2]
+        assert _aplicar_migraciones_pendientes(in_memory_conn, cur, [(1, "demo", agregar_columna_demo)]) == []
+        assert llamadas == ['v1', 'v2']
+
+    def test_columna_critica_fallida_no_registra_la_version(self, in_memory_conn):
+        """Si el DDL crítico falla la versión no queda en schema_version y el próximo arranque la repite."""
+        from data_layer.core import _aplicar_migraciones_pendientes
+
+        def columna_en_tabla_faltante(cursor, T, add_col, add_idx):
+            add_col('tabla_que_no_existe', 'valor_norm', 'TEXT', critica=True)
+
+        def columna_corregida(cursor, T, add_col, add_idx):
+            cursor.execute("CREATE TABLE IF NOT EXISTS tabla_que_no_existe (id INTEGER)")
+            add_col('tabla_que_no_existe', 'valor_norm', 'TEXT', critica=True)
+
+        cur = in_memory_conn.cursor()
+        with pytest.raises(Exception):
+            _aplicar_migraciones_pendientes(in_memory_conn, cur, [(1, "norm", columna_en_tabla_faltante)])
+        cur.execute("SELECT COUNT(*) FROM schema_version")
+        assert cur.fetchone()[0] == 0
+        assert _aplicar_migraciones_pendientes(in_memory_conn, cur, [(1, "norm", columna_corregida)]) == [1]
+
+
+# ──────────────────────────────────────────────
+# Tests del catálogo de productos
+# ──────────────────────────────────────────────
+
+class TestCatalogoProductos:
+
+    def test_siembra_desde_config_y_recarga_por_version(self, in_memory_conn, monkeypatch):
+        """La migración siembra el catálogo; un cambio sube la versión y se ve sin reiniciar."""
+        from data_layer import catalog
+        from data_layer.core import _migracion_catalogo_productos, _get_sql_types
+        monkeypatch.setattr(catalog, '_catalogo', None)
+        _migracion_catalogo_productos(in_memory_conn.cursor(), _get_sql_types(), None, None)
+
+        inicial = catalog.obtener_catalogo(existing_conn=in_memory_conn)
+        assert '4-4-644' in inicial.con_serial and '4-4-644' not in inicial.compartidos
+        assert '1-2-16' in inicial.compartidos
+        assert inicial.nombres_excel['4-4-644'] == 'O_EG8145V5'
+        assert dict(inicial.paquetes['PAQUETE A'])['1-4-61'] == 5
+
+        ok, _ = catalog.guardar_producto_catalogo('9-9-999', nombre_excel='NUEVO', con_serial=True, existing_conn=in_memory_conn)
+        assert ok
+        actual = catalog.obtener_catalogo(existing_conn=in_memory_conn)
+        assert actual.version > inicial.version
+        assert '9-9-999' in actual.con_serial and actual.nombres_excel['9-9-999'] == 'NUEVO'
+
+
+# ──────────────────────────────────────────────
+# Tests del pool de conexiones MySQL
+# ──────────────────────────────────────────────
+
+class TestPoolConexiones:
+
+    class _ConexionFalsa:
+        def __init__(self):
+            self.in_transaction = False
+            self.cerrada = False
+            self.viva = True
+        def ping(self, reconnect=False):
+            if not self.viva:
+                raise Exception("MySQL server has gone away")
+        def rollback(self): pass
+        def reset_session(self): pass
+        def close(self): self.cerrada = True
+
+    def test_timeout_devolucion_y_reemplazo_de_conexion_caida(self, monkeypatch):
+        """Sin cupo se espera y falla con PoolError; una conexión caída se reemplaza al prestarla."""
+        from mysql.connector import errors
+        from utils import db_pool
+        creadas = []
+        def conectar(**kwargs):
+            creadas.append(self._ConexionFalsa())
+            return creadas[-1]
+        monkeypatch.setattr(db_pool.mysql.connector, 'connect', conectar)
+        pool = db_pool.PoolMySQL('test', {}, minimo=0, maximo=1, timeout=0.05, ping_inactiva_seg=0)
+
+        conn = pool.obtener()
+        with pytest.raises(errors.PoolError):
+            pool.obtener()
+        conn.close()
+        conn.close()  # Idempotente: no devuelve dos veces
+
+        creadas[0].viva = False
+        otra = pool.obtener()
+        assert otra._entrada['conn'] is creadas[1] and creadas[0].cerrada
+        otra.close()
+
+        st = pool.estadisticas()
+        assert (st['checkouts'], st['agotado'], st['esperas'], st['descartadas']) == (2, 1, 1, 1)
+        assert (st['en_uso'], st['abiertas'], st['libres']) == (0, 1, 1)
+
+
+# ──────────────────────────────────────────────
+# Tests de la instrumentación de consultas
+# ──────────────────────────────────────────────
+
+class TestInstrumentacionConsultas:
+
+    def test_agrupa_por_sentencia_y_llamador_y_registra_lentas(self, in_memory_conn, monkeypatch):
+        """Listas IN de distinto largo cuentan como una consulta; las lentas van a slow_queries.log."""
+        from utils import query_stats
+        from utils.db_connector import run_query
+        query_stats.reiniciar()
+        lentas = []
+        monkeypatch.setattr(query_stats, 'SLOW_QUERY_MS', 0)
+        monkeypatch.setattr(query_stats.slow_logger, 'warning', lentas.append)
+
+        cursor = in_memory_conn.cursor()
+        for skus in (('A', 'B'), ('A', 'B', 'C')):
+            run_query(cursor, f"SELECT sku FROM productos WHERE sku IN ({', '.join('?' * len(skus))})", skus)
+
+        fila, = [r for r in query_stats.reporte(top=0) if 'IN (' in r['sql']]
+        assert fila['sql'] == "SELECT sku FROM productos WHERE sku IN (?...)"
+        assert fila['llamadas'] == 2 and fila['lentas'] == 2
+        assert 'test_agrupa_por_sentencia_y_llamador' in fila['llamador']
+        assert sum('sql=SELECT sku FROM productos' in l for l in lentas) == 2
+        assert query_stats.reporte_desde_log([]) == []
+        query_stats.reiniciar()
+
+
+# ──────────────────────────────────────────────
+# Tests del pivote de asignación por paquetes
+# ──────────────────────────────────────────────
+
+class TestAsignacionConPaquetes:
+
+    def test_pivote_por_paquete_y_globales_desde_bodega(self, in_memory_conn, monkeypatch):
+        """Un renglón por SKU con saldo por paquete; los globales muestran el stock de bodega en todas las columnas."""
+        import database  # noqa: F401
+        import config
+        from data_layer import inventory
+        from data_layer.mobile import obtener_asignacion_movil_con_paquetes
+        monkeypatch.setitem(config.CURRENT_CONTEXT, 'BRANCH', 'CHIRIQUI')
+
+        in_memory_conn.executescript("""
+            CREATE TABLE productos_globales (sku VARCHAR(50), sucursal VARCHAR(50), UNIQUE (sku, sucursal));
+            INSERT INTO productos_globales VALUES ('1-2-16', 'CHIRIQUI');
+            INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad) VALUES
+                ('4-4-644', 'Movil 200', 'PAQUETE A', 3), ('4-4-644', 'Movil 200', 'PAQUETE B', 2),
+                ('4-4-644', 'Movil 200', 'NINGUNO', 1), ('4-4-644', 'Movil 200', NULL, 1),
+                ('4-4-644', 'Movil 201', 'CARRO', 9), ('9-9-999', 'Movil 200', 'CARRO', 0);
+        """)
+        inventory.invalidar_cache_globales()
+
+        resultado = obtener_asignacion_movil_con_paquetes('movil 200', existing_conn=in_memory_conn)
+        inventory.invalidar_cache_globales()
+
+        assert resultado == [
+            ('ONT Huawei', '4-4-644', 7, 3, 2, 0, 2, 0),
+            ('Cable Fiber', '1-2-16', 100, 100, 100, 100, 100, 100),
+        ]
+
+
+# ──────────────────────────────────────────────
+# Tests del outbox de cambios de inventario
+# ──────────────────────────────────────────────
+
+class TestOutboxCambios:
+
+    def test_movimientos_y_consumo_quedan_en_el_feed(self, in_memory_conn):
+        """Cada escritura agrega su delta neto por ubicación; changes_since solo entrega lo nuevo."""
+        import database  # noqa: F401
+        from data_layer.changes import changes_since
+        from data_layer.movements import registrar_movimiento_gui
+        from data_layer.mobile import registrar_consumo_directo
+
+        ok, msg = registrar_movimiento_gui(
+            sku='1-2-16', tipo_movimiento='SALIDA_MOVIL', cantidad_afectada=10, movil_afectado='Movil 200',
+            fecha_evento=date.today().isoformat(), paquete_asignado='PAQUETE A',
+            sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+        )
+        assert ok, msg
+        cursor_id, eventos = changes_since(0, 'CHIRIQUI', existing_conn=in_memory_conn)
+        assert sorted((e['sku'], e['ubicacion'], e['paquete'], e['delta']) for e in eventos) == [
+            ('1-2-16', 'BODEGA', None, -10), ('1-2-16', 'Movil 200', 'PAQUETE A', 10)]
+
+        ok, msg = registrar_consumo_directo('4-4-644', 2, 'Movil 200', 'Tecnico', sucursal_context='CHIRIQUI', existing_conn=in_memory_conn)
+        assert ok, msg
+        nuevo_cursor, eventos = changes_since(cursor_id, existing_conn=in_memory_conn)
+        assert nuevo_cursor > cursor_id
+        assert [(e['sku'], e['ubicacion'], e['delta'], e['origen']) for e in eventos] == [('4-4-644', 'BODEGA', -2, 'consumo')]
+        assert changes_since(nuevo_cursor, existing_conn=in_memory_conn) == (nuevo_cursor, [])
+
+    def test_difusor_reparte_por_sucursal_y_se_detiene_sin_suscriptores(self, monkeypatch):
+        """Un solo hilo lee el feed; cada suscriptor recibe solo su sucursal."""
+        import threading
+        from data_layer import changes
+        feed = [{'id': 1, 'sucursal': 'CHIRIQUI', 'sku': 'A', 'ubicacion': 'BODEGA', 'delta': -1},
+                {'id': 2, 'sucursal': 'SANTIAGO', 'sku': 'B', 'ubicacion': 'BODEGA', 'delta': 3}]
+        def leer(lector):
+            eventos = [e for e in feed if e['id'] > (lector.cursor or 0)]
+            lector.cursor = 2
+            return eventos
+        monkeypatch.setattr(changes.LectorCambios, 'leer', leer)
+
+        difusor = changes.DifusorCambios(intervalo=0.01)
+        recibidos, listo = [], threading.Event()
+        def santiago(eventos):
+            recibidos.extend(eventos)
+            listo.set()
+        token = difusor.suscribir(santiago, 'santiago')
+        assert listo.wait(2)
+        assert [e['sku'] for e in recibidos] == ['B']
+
+        hilo = difusor._hilo
+        difusor.desuscribir(token)
+        hilo.join(2)
+        assert difusor._hilo is None and difusor.lector is None
+
+    def test_lector_entrega_eventos_confirmados_fuera_de_orden(self, in_memory_conn):
+        """Un id menor que el cursor confirmado tarde se entrega una sola vez."""
+        import database  # noqa: F401
+        from data_layer.changes import LectorCambios
+        cur = in_memory_conn.cursor()
+        insertar = "INSERT INTO cambios_inventario (id, sucursal, sku, ubicacion, paquete, delta, origen) VALUES (?, 'CHIRIQUI', ?, 'BODEGA', NULL, ?, 'test')"
+        cur.execute(insertar, (100, '1-2-16', -1))
+        in_memory_conn.commit()
+
+        lector = LectorCambios()
+        assert lector.leer(existing_conn=in_memory_conn) == []
+        assert lector.cursor == 100
+
+        cur.execute(insertar, (200, '1-2-16', -2))
+        in_memory_conn.commit()
+        assert [e['id'] for e in lector.leer(existing_conn=in_memory_conn)] == [200]
+
+        # Otro nodo (o una transacción más lenta) confirma un id menor después
+        cur.execute(insertar, (150, '4-4-644', -3))
+        in_memory_conn.commit()
+        assert [(e['id'], e['sku']) for e in lector.leer(existing_conn=in_memory_conn)] == [(150, '4-4-644')]
+        assert lector.leer(existing_conn=in_memory_conn) == []
+        assert lector.cursor == 200
+
+
+# ──────────────────────────────────────────────
+# Tests: saldos acumulados de movimientos
+# ──────────────────────────────────────────────
+
+class TestSaldosMovimientos:
+
+    def test_escritores_mantienen_saldos_y_verificar_detecta_desvio(self, in_memory_conn):
+        """Entradas y salidas suman al saldo en la misma transacción; verificar/reconstruir corrigen el desvío."""
+        import database  # noqa: F401
+        from data_layer.ledger import verificar_saldos, reconstruir_saldos
+        from data_layer.movements import registrar_movimiento_gui
+
+        hoy = date.today().isoformat()
+        for tipo, cantidad in (('ENTRADA', 20), ('SALIDA', 3), ('SALIDA_MOVIL', 5)):
+            ok, msg = registrar_movimiento_gui(
+                sku='1-2-16', tipo_movimiento=tipo, cantidad_afectada=cantidad, movil_afectado='Movil 200' if tipo == 'SALIDA_MOVIL' else None,
+                fecha_evento=hoy, paquete_asignado='PAQUETE A' if tipo == 'SALIDA_MOVIL' else None,
+                sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+            )
+            assert ok, msg
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT sku, sucursal, consumo_total, abasto_total FROM saldos_movimientos")
+        assert cur.fetchall() == [('1-2-16', 'CHIRIQUI', 3, 20)]
+        assert verificar_saldos(existing_conn=in_memory_conn) == []
+
+        # Un INSERT directo (fuera de los escritores) deja el saldo desfasado
+        cur.execute("INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, fecha_evento, sucursal) VALUES ('1-2-16', 'ABASTO', 7, ?, 'CHIRIQUI')", (hoy,))
+        assert verificar_saldos(existing_conn=in_memory_conn) == [('1-2-16', 'CHIRIQUI', (3, 20), (3, 27))]
+        assert reconstruir_saldos(cur) == 1
+        assert verificar_saldos(existing_conn=in_memory_conn) == []
+
+
+# ──────────────────────────────────────────────
+# Tests: resumen diario de movimientos
+# ──────────────────────────────────────────────
+
+class TestResumenDiario:
+
+    def test_resumen_por_movil_y_dia_cuadra_con_movimientos(self, in_memory_conn):
+        """Los escritores alimentan el resumen; la consulta por rango y la reconstrucción dan lo mismo."""
+        import database  # noqa: F401
+        from datetime import timedelta
+        from data_layer.ledger import consultar_resumen, verificar_resumen_diario, reconstruir_resumen_diario, renombrar_movil_resumen
+        from data_layer.movements import registrar_movimiento_gui
+
+        hoy = date.today()
+        ayer = (hoy - timedelta(days=1)).isoformat()
+        for movil, cantidad, fecha in (('Movil 200', 4, ayer), ('Movil 200', 6, hoy.isoformat()), ('Movil 201', 2, hoy.isoformat())):
+            ok, msg = registrar_movimiento_gui(
+                sku='1-2-16', tipo_movimiento='SALIDA_MOVIL', cantidad_afectada=cantidad, movil_afectado=movil,
+                fecha_evento=fecha, paquete_asignado='PAQUETE A', sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+            )
+            assert ok, msg
+
+        assert consultar_resumen(ayer, hoy, agrupar=('movil',), tipos=['SALIDA_MOVIL'], solo_moviles=True, limite=10,
+                                 existing_conn=in_memory_conn) == [('Movil 200', 10), ('Movil 201', 2)]
+        assert consultar_resumen(hoy, hoy, agrupar=('fecha',), existing_conn=in_memory_conn) == [(hoy.isoformat(), 8)]
+        assert verificar_resumen_diario(existing_conn=in_memory_conn) == []
+
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT fecha, movil, cantidad FROM resumen_diario_movimientos ORDER BY fecha, movil")
+        antes = cur.fetchall()
+        assert reconstruir_resumen_diario(cur) == 3
+        cur.execute("SELECT fecha, movil, cantidad FROM resumen_diario_movimientos ORDER BY fecha, movil")
+        assert cur.fetchall() == antes
+
+        # Renombrar Movil 200 -> Movil 201 (como editar_movil) fusiona sus filas del resumen
+        cur.execute("UPDATE movimientos SET movil_afectado = 'Movil 201' WHERE movil_afectado = 'Movil 200'")
+        assert renombrar_movil_resumen(cur, 'Movil 200', 'Movil 201') == 2
+        assert verificar_resumen_diario(existing_conn=in_memory_conn) == []
+        assert consultar_resumen(ayer, hoy, agrupar=('movil',), tipos=['SALIDA_MOVIL'], solo_moviles=True, limite=10,
+                                 existing_conn=in_memory_conn) == [('Movil 201', 12)]
+
+
+# ──────────────────────────────────────────────
+# Tests: enlace consumo -> serie
+# ──────────────────────────────────────────────
+
+class TestConsumoSeries:
+
+    def test_consumo_con_seriales_se_rastrea_y_backfill_equivale(self, in_memory_conn):
+        """El consumo directo enlaza sus seriales; el backfill desde JSON/observaciones da el mismo rastro."""
+        import database  # noqa: F401
+        from data_layer.serials import buscar_consumo_de_serie, backfill_consumo_series
+        from data_layer.mobile import registrar_consumo_directo
+        from data_layer.movements import registrar_movimiento_gui
+
+        ok, msg = registrar_movimiento_gui(
+            sku='1-2-16', tipo_movimiento='SALIDA_MOVIL', cantidad_afectada=1, movil_afectado='Movil 200',
+            fecha_evento=date.today().isoformat(), paquete_asignado='PAQUETE A', seriales=['mac-01'],
+            sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+        )
+        assert ok, msg
+        ok, msg = registrar_consumo_directo('4-4-644', 1, 'Movil 201', 'Tecnico', ticket='C-77', seriales=[' sn-9 '],
+                                            sucursal_context='CHIRIQUI', existing_conn=in_memory_conn)
+        assert ok, msg
+
+        cur = in_memory_conn.cursor()
+        assert buscar_consumo_de_serie(cur, ['MAC-01'], 'CHIRIQUI')[0] == 'Movil 200'
+        assert buscar_consumo_de_serie(cur, ['SN-9'], 'CHIRIQUI')[:2] == ('Movil 201', 'C-77')
+        assert buscar_consumo_de_serie(cur, ['SN-9'], 'SANTIAGO') is None
+
+        cur.execute("SELECT consumo_id, movimiento_id, serial_norm FROM consumo_series ORDER BY serial_norm")
+        antes = cur.fetchall()
+        assert backfill_consumo_series(cur) == 2
+        cur.execute("SELECT serial_norm FROM consumo_series ORDER BY serial_norm")
+        assert [f[0] for f in cur.fetchall()] == [f[2] for f in antes]
+        assert buscar_consumo_de_serie(cur, ['SN-9'], 'CHIRIQUI')[:2] == ('Movil 201', 'C-77')
+
+
+# ──────────────────────────────────────────────
+# Tests: búsqueda indexada del historial
+# ──────────────────────────────────────────────
+
+class TestBusquedaHistorial:
+
+    def test_busqueda_por_tokens_y_paginacion_por_id(self, in_memory_conn):
+        """Busca por prefijos (nombre, móvil, serie) y pagina con antes_de_id sin repetir filas."""
+        import database  # noqa: F401
+        from data_layer.search import buscar_historial, indexar_pendientes
+        from data_layer.movements import registrar_movimiento_gui
+
+        hoy = date.today().isoformat()
+        for i in range(5):
+            ok, msg = registrar_movimiento_gui(
+                sku='1-2-16', tipo_movimiento='SALIDA_MOVIL', cantidad_afectada=1, movil_afectado='Movil 200',
+                fecha_evento=hoy, paquete_asignado='PAQUETE A', seriales=[f'mac-0{i}'],
+                sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+            )
+            assert ok, msg
+        ok, msg = registrar_movimiento_gui(
+            sku='4-4-644', tipo_movimiento='ENTRADA', cantidad_afectada=3, fecha_evento=hoy,
+            sucursal_context='CHIRIQUI', existing_conn=in_memory_conn
+        )
+        assert ok, msg
+
+        pagina1 = buscar_historial('cable móvil 200', 'CHIRIQUI', limite=3, existing_conn=in_memory_conn)
+        pagina2 = buscar_historial('cable móvil 200', 'CHIRIQUI', limite=3, antes_de_id=pagina1[-1][0],
+                                   existing_conn=in_memory_conn)
+        ids = [f[0] for f in pagina1 + pagina2]
+        assert len(ids) == 5 and ids == sorted(ids, reverse=True)
+        assert all(f[3] == 'Cable Fiber' for f in pagina1 + pagina2)
+
+        assert len(buscar_historial('MAC-03', 'CHIRIQUI', existing_conn=in_memory_conn)) == 1
+        assert [f[3] for f in buscar_historial('huawei', 'CHIRIQUI', existing_conn=in_memory_conn)] == ['ONT Huawei']
+        assert buscar_historial('cable', 'SANTIAGO', existing_conn=in_memory_conn) == []
+        assert len(buscar_historial(None, 'CHIRIQUI', existing_conn=in_memory_conn)) == 6
+
+        # Los escritores indexan en su transacción; un fragmento interno se busca por subcadena
+        cur = in_memory_conn.cursor()
+        cur.execute("SELECT COUNT(DISTINCT movimiento_id) FROM movimientos_tokens")
+        assert cur.fetchone()[0] == 6
+        assert len(buscar_historial('ac-03', 'CHIRIQUI', existing_conn=in_memory_conn)) == 1
+
+        # Filas sin tokens (escritas por fuera) se ponen al día por "sin tokens", sin ventana de ids
+        cur.execute("INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, observaciones, sucursal) "
+                    "VALUES ('1-2-16', 'AJUSTE', 1, 'carga manual', 'CHIRIQUI')")
+        cur.execute("DELETE FROM movimientos_tokens WHERE movimiento_id = (SELECT MIN(id) FROM movimientos)")
+        assert indexar_pendientes(cur) == 2 and indexar_pendientes(cur) == 0
+        assert len(buscar_historial('manual', 'CHIRIQUI', existing_conn=in_memory_conn)) == 1
+
+
+# ──────────────────────────────────────────────
+# Tests: conexiones SQLite por hilo
+# ──────────────────────────────────────────────
+
+class TestConexionesSQLite:
+
+    def test_reutiliza_por_hilo_en_wal_y_descarta_lo_no_confirmado(self, tmp_path):
+        """close() devuelve la conexión al hilo sin su transacción abierta; la de solo lectura no escribe."""
+        from utils.sqlite_pool import obtener_sqlite, cerrar_conexiones_hilo
+
+        db = str(tmp_path / 'local.db')
+        conn = obtener_sqlite(db)
+        try:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.commit()
+            conn.execute("INSERT INTO t VALUES (1)")
+            conn.close()
+
+            otra = obtener_sqlite(db)
+            assert otra is conn and not otra.in_transaction
+            assert otra.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+            anidada = obtener_sqlite(db)
+            assert anidada is not otra
+            anidada.close()
+            otra.close()
+
+            lectura = obtener_sqlite(db, solo_lectura=True)
+            with pytest.raises(sqlite3.OperationalError):
+                lectura.execute("INSERT INTO t VALUES (2)")
+            lectura.close()
+        finally:
+            cerrar_conexiones_hilo()
+
+
+# ──────────────────────────────────────────────
+# Tests: réplica local de lectura
+# ──────────────────────────────────────────────
+
+class TestReplicaLocal:
+
+    def test_sincroniza_por_marca_feed_y_borrados_e_invalida_escrituras_propias(self, in_memory_conn, tmp_path, monkeypatch):
+        """La réplica copia por marca, relee móviles del feed, quita borrados y se salta mientras está sucia."""
+        import database  # noqa: F401
+        from data_layer.replica import ReplicaLocal, sesion_lectura
+        from data_layer.changes import registrar_cambios
+        from utils.sqlite_pool import cerrar_conexiones_hilo
+
+        cur = in_memory_conn.cursor()
+        cur.executescript("""
+            ALTER TABLE productos ADD COLUMN actualizado_en DATETIME;
+            ALTER TABLE series_registradas ADD COLUMN actualizado_en DATETIME;
+            UPDATE productos SET actualizado_en = '2026-01-01 10:00:00';
+            CREATE TABLE moviles (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre VARCHAR(100), activo INTEGER DEFAULT 1);
+            CREATE TABLE tecnicos (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre VARCHAR(255), activo INTEGER DEFAULT 1);
+            INSERT INTO moviles (nombre) VALUES ('Movil 200');
+        """)
+        in_memory_conn.commit()
+
+        replica = ReplicaLocal(ruta=str(tmp_path / 'replica.db'))
+        monkeypatch.setattr(ReplicaLocal, '_instancia', replica)
+        try:
+            replica.sincronizar(existing_conn=in_memory_conn)
+            assert replica.disponible(('productos', 'moviles'))
+            with sesion_lectura(('productos',)) as (conn, c):
+                assert getattr(conn, 'es_replica', False)
+                c.execute("SELECT cantidad FROM productos WHERE sku = %s", ('1-2-16',))
+                assert c.fetchone()[0] == 100
+
+            # Escritura propia: la tabla queda sucia hasta la próxima sincronización
+            cur.execute("UPDATE productos SET cantidad = 90, actualizado_en = '2026-01-01 10:05:00' WHERE sku = '1-2-16'")
+            cur.execute("DELETE FROM productos WHERE sku = '4-4-644'")
+            cur.execute("INSERT INTO asignacion_moviles (sku_producto, movil, paquete, cantidad, sucursal) VALUES ('1-2-16', 'Movil 200', 'PAQUETE A', 10, 'CHIRIQUI')")
+            registrar_cambios(cur, 'CHIRIQUI', {('1-2-16', 'Movil 200', 'PAQUETE A'): 10}, 'test')
+            in_memory_conn.commit()
+            replica._invalidar({'productos': True})
+            assert not replica.disponible(('productos',)) and replica.disponible(('moviles',))
+
+            replica.sincronizar(existing_conn=in_memory_conn)
+            assert replica.disponible(('productos', 'asignacion_moviles'))
+            with sesion_lectura(('productos', 'asignacion_moviles')) as (conn, c):
+                c.execute("SELECT sku, cantidad FROM productos ORDER BY sku")
+                assert c.fetchall() == [('1-2-16', 90)]
+                c.execute("SELECT movil, cantidad FROM asignacion_moviles")
+                assert c.fetchall() == [('Movil 200', 10)]
+        finally:
+            cerrar_conexiones_hilo()
+
+
+# ──────────────────────────────────────────────
+# Tests: sincronización del stock serializado
+# ──────────────────────────────────────────────
+
+class TestSincronizarStockSerializado:
+
+    def test_recalcula_solo_los_skus_tocados_en_la_transaccion(self, in_memory_conn):
+        """Solo los SKUs indicados (y con serial) toman el conteo de series; los faltantes se crean en BODEGA."""
+        import database  # noqa: F401
+        from data_layer.movements import sincronizar_stock_bodega_serializado
+
+        cur = in_memory_conn.cursor()
+        cur.executemany("INSERT INTO series_registradas (sku, serial_number, ubicacion, estado, sucursal) VALUES (?, ?, ?, ?, ?)", [
+            ('4-4-644', 'S1', 'BODEGA', 'DISPONIBLE', 'CHIRIQUI'),
+            ('4-4-644', 'S2', 'BODEGA', 'DISPONIBLE', 'CHIRIQUI'),
+            ('4-4-644', 'S3', 'MOVIL 200', 'DISPONIBLE', 'CHIRIQUI'),
+            ('4-4-644', 'S4', 'BODEGA', 'DISPONIBLE', 'SANTIAGO'),
+            ('4-4-656', 'S5', 'BODEGA', 'DISPONIBLE', 'CHIRIQUI'),
+        ])
+
+        def bodega(sku):
+            cur.execute("SELECT cantidad FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = 'CHIRIQUI'", (sku,))
+            fila = cur.fetchone()
+            return fila[0] if fila else None
+
+        assert sincronizar_stock_bodega_serializado('CHIRIQUI', skus=['4-4-656', '1-2-16'], existing_conn=in_memory_conn)
+        assert bodega('4-4-656') == 1
+        assert bodega('4-4-644') == 10 and bodega('1-2-16') == 100
+
+        assert sincronizar_stock_bodega_serializado('CHIRIQUI', skus=['4-4-644'], existing_conn=in_memory_conn)
+        assert bodega('4-4-644') == 2
+        assert in_memory_conn.in_transaction  # no confirma la transacción del llamador
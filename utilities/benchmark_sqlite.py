@@ -0,0 +1,117 @@
+"""
+Benchmark del modo local SQLite: conexión nueva por llamada (comportamiento anterior)
+contra conexiones reutilizadas por hilo en WAL (utils/sqlite_pool.py).
+
+Simula la carga del escritorio: varios hilos consultan productos por SKU (escáner,
+dashboard) mientras otros registran movimientos (INSERT + UPDATE de stock + commit).
+Usa una BD temporal; no toca inventario_sqlite.db.
+
+Uso: python -m utilities.benchmark_sqlite [--segundos 5] [--lectores 6] [--escritores 2]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.sqlite_pool import obtener_sqlite, cerrar_conexiones_hilo, estadisticas
+
+N_PRODUCTOS = 2000
+
+
+def conexion_anterior(db_path, solo_lectura=False):
+    """Lo que hacía get_db_connection antes: connect + PRAGMA foreign_keys en cada llamada."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def conexion_nueva(db_path, solo_lectura=False):
+    return obtener_sqlite(db_path, solo_lectura)
+
+
+def preparar(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE productos (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT, sku TEXT,
+                                cantidad INTEGER, ubicacion TEXT, sucursal TEXT, UNIQUE (sku, ubicacion, sucursal));
+        CREATE TABLE movimientos (id INTEGER PRIMARY KEY AUTOINCREMENT, sku_producto TEXT, tipo_movimiento TEXT,
+                                  cantidad_afectada INTEGER, movil_afectado TEXT, fecha_evento TEXT, sucursal TEXT);
+    """)
+    conn.executemany("INSERT INTO productos (nombre, sku, cantidad, ubicacion, sucursal) VALUES (?, ?, ?, 'BODEGA', 'CHIRIQUI')",
+                     [(f"Producto {i}", f"SKU-{i}", 1000) for i in range(N_PRODUCTOS)])
+    conn.commit()
+    conn.close()
+
+
+def _lector(conectar, db_path, hasta, res):
+    ops = 0
+    while time.perf_counter() < hasta:
+        conn = conectar(db_path, solo_lectura=True)
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT nombre, cantidad FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = 'CHIRIQUI'",
+                        (f"SKU-{random.randrange(N_PRODUCTOS)}",))
+            cur.fetchone()
+            ops += 1
+        except sqlite3.OperationalError:
+            res['bloqueos'] += 1
+        finally:
+            conn.close()
+    res['lecturas'] += ops
+    cerrar_conexiones_hilo()
+
+
+def _escritor(conectar, db_path, hasta, res):
+    ops = 0
+    while time.perf_counter() < hasta:
+        conn = conectar(db_path)
+        try:
+            sku = f"SKU-{random.randrange(N_PRODUCTOS)}"
+            cur = conn.cursor()
+            cur.execute("INSERT INTO movimientos (sku_producto, tipo_movimiento, cantidad_afectada, movil_afectado, fecha_evento, sucursal) "
+                        "VALUES (?, 'SALIDA_MOVIL', 1, 'Movil 200', date('now'), 'CHIRIQUI')", (sku,))
+            cur.execute("UPDATE productos SET cantidad = cantidad - 1 WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = 'CHIRIQUI'", (sku,))
+            conn.commit()
+            ops += 1
+        except sqlite3.OperationalError:
+            res['bloqueos'] += 1
+        finally:
+            conn.close()
+    res['movimientos'] += ops
+    cerrar_conexiones_hilo()
+
+
+def correr(nombre, conectar, segundos, lectores, escritores):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, f"bench_{nombre}.db")
+        preparar(db_path)
+        res = {'lecturas': 0, 'movimientos': 0, 'bloqueos': 0}
+        hasta = time.perf_counter() + segundos
+        hilos = [threading.Thread(target=_lector, args=(conectar, db_path, hasta, res)) for _ in range(lectores)]
+        hilos += [threading.Thread(target=_escritor, args=(conectar, db_path, hasta, res)) for _ in range(escritores)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+    print(f"{nombre:<10} lecturas/s={res['lecturas'] / segundos:>10.0f}   movimientos/s={res['movimientos'] / segundos:>8.0f}"
+          f"   bloqueos={res['bloqueos']}")
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput de lecturas por SKU y movimientos en SQLite local")
+    parser.add_argument('--segundos', type=float, default=5.0)
+    parser.add_argument('--lectores', type=int, default=6)
+    parser.add_argument('--escritores', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{args.lectores} lectores + {args.escritores} escritores, {args.segundos:.0f}s por modo")
+    correr('anterior', conexion_anterior, args.segundos, args.lectores, args.escritores)
+    correr('wal+hilo', conexion_nueva, args.segundos, args.lectores, args.escritores)
+    print(f"conexiones: {estadisticas()}")
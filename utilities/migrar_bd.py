@@ -0,0 +1,20 @@
+"""
+Aplica las migraciones pendientes de schema_version una sola vez por despliegue,
+fuera de los workers de gunicorn (ver startCommand en render.yaml), y pone al día
+el índice del historial.
+En MySQL/TiDB las migraciones se serializan con GET_LOCK: si el escritorio u otra
+instancia ya está migrando, este proceso espera y luego no repite nada.
+
+Uso: python -m utilities.migrar_bd
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import inicializar_bd, poner_al_dia_indice
+
+if __name__ == '__main__':
+    if not inicializar_bd(mostrar_errores=False):
+        sys.exit(1)
+    poner_al_dia_indice()
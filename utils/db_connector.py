@@ -1,10 +1,15 @@
 import sqlite3
 import mysql.connector
-from mysql.connector import pooling
 import os
+import re
 import sys
+import threading
+import time
 from contextlib import contextmanager
 from utils.logger import get_logger
+from utils.db_pool import PoolMySQL
+from utils.sqlite_pool import obtener_sqlite
+from utils import query_stats
 from config import (
     DATABASE_NAME,
     DB_TYPE,
@@ -14,17 +19,91 @@ from config import (
 # Inicializar logger
 logger = get_logger(__name__)
 
-# Diccionario de pools por nombre de base de datos
+# Pools por nombre de base de datos (creación protegida por lock: la app usa muchos hilos)
 _mysql_pools = {}
+_mysql_pools_lock = threading.Lock()
 
-def get_db_connection(target_db=None):
+# Escrituras MySQL de cada hilo desde su último commit, para los observadores
+# (la réplica local las usa para invalidar su espejo: data_layer/replica.py)
+_RE_ESCRITURA = re.compile(r"^\s*(INSERT|REPLACE|UPDATE|DELETE)\b(?:\s+(?:LOW_PRIORITY|IGNORE|INTO|FROM))*\s+`?(\w+)", re.IGNORECASE)
+_escrituras_hilo = threading.local()
+_observadores_escrituras = []
+
+
+def registrar_observador_escrituras(callback):
+    """
+    Registra callback({tabla: hubo_borrados}). Se llama en el hilo escritor tras cada
+    commit MySQL, con las tablas que ese hilo escribió desde su commit anterior.
+    """
+    if callback not in _observadores_escrituras:
+        _observadores_escrituras.append(callback)
+
+
+def _anotar_escritura(query):
+    m = _RE_ESCRITURA.match(query)
+    if not m:
+        return
+    tablas = getattr(_escrituras_hilo, 'tablas', None)
+    if tablas is None:
+        tablas = _escrituras_hilo.tablas = {}
+    tabla = m.group(2).lower()
+    tablas[tabla] = tablas.get(tabla, False) or m.group(1).upper() == 'DELETE'
+
+
+def _notificar_confirmacion():
+    tablas = getattr(_escrituras_hilo, 'tablas', None)
+    if not tablas:
+        return
+    _escrituras_hilo.tablas = {}
+    for callback in list(_observadores_escrituras):
+        try:
+            callback(tablas)
+        except Exception as e:
+            logger.warning(f"[DB] Observador de escrituras falló: {e}")
+
+
+def _obtener_pool(db_name):
+    """Pool de la BD, creándolo una sola vez aunque varios hilos lo pidan a la vez."""
+    pool = _mysql_pools.get(db_name)
+    if pool is None:
+        with _mysql_pools_lock:
+            pool = _mysql_pools.get(db_name)
+            if pool is None:
+                logger.info(f"[POOL] Creando pool de conexiones para MySQL -> DB: {db_name}")
+                pool = PoolMySQL(db_name, dict(
+                    host=MYSQL_HOST,
+                    user=MYSQL_USER,
+                    password=MYSQL_PASS,
+                    port=MYSQL_PORT,
+                    connect_timeout=30,
+                    use_pure=True
+                ), al_confirmar=_notificar_confirmacion)
+                _mysql_pools[db_name] = pool
+    return pool
+
+
+def obtener_estadisticas_pool():
+    """
+    Retorna la utilización de los pools MySQL por base de datos:
+        {db: {'tamano', 'en_uso', 'en_uso_max', 'checkouts', 'agotado', 'esperas',
+              'espera_total_seg', 'espera_media_seg', 'espera_max_seg', 'errores', ...}}
+    'en_uso_max' cercano a 'tamano' indica conexiones laterales/anidadas por petición.
+    """
+    with _mysql_pools_lock:
+        pools = list(_mysql_pools.items())
+    return {db_name: pool.estadisticas() for db_name, pool in pools}
+
+def get_db_connection(target_db=None, solo_lectura=False):
     """
     Retorna una conexión activa a la base de datos de la sucursal actual.
-    Implementa pooling para MySQL y conexión estándar para SQLite.
+    Implementa pooling para MySQL (utils/db_pool.py) y conexiones reutilizadas por hilo,
+    en modo WAL, para SQLite (utils/sqlite_pool.py).
     
     Args:
         target_db (str, optional): Nombre específico de la BD a conectar. 
                                   Si es None, usa la BD del contexto actual.
+        solo_lectura (bool): En SQLite, conexión de solo lectura para consultas
+                             (en MySQL se ignora).
     
     Returns:
         Connection: objeto de conexión (MySQLConnection o sqlite3.Connection)
@@ -32,8 +111,6 @@ def get_db_connection(target_db=None):
     Raises:
         Exception: Si no se puede establecer la conexión.
     """
-    global _mysql_pools
-    
     # 1. Resolver Nombre de BD
     if target_db:
         db_name = target_db
@@ -49,61 +126,15 @@ def get_db_connection(target_db=None):
     # 2. Conectar según tipo de BD
     if DB_TYPE == 'MYSQL':
         try:
-            if db_name not in _mysql_pools:
-                logger.info(f"[POOL] Creando pool de conexiones para MySQL -> DB: {db_name}")
-                _mysql_pools[db_name] = pooling.MySQLConnectionPool(
-                    pool_name=f"pool_{db_name.replace('-', '_')}",
-                    pool_size=10,
-                    pool_reset_session=True,
-                    host=MYSQL_HOST,
-                    user=MYSQL_USER,
-                    password=MYSQL_PASS,
-                    database=db_name,
-                    port=MYSQL_PORT,
-                    connect_timeout=30,
-                    use_pure=True
-                )
-
-            # Obtener conexión del pool
-            return _mysql_pools[db_name].get_connection()
-
-        except (mysql.connector.errors.PoolError,
-                mysql.connector.errors.OperationalError,
-                mysql.connector.errors.InterfaceError) as err:
-            logger.warning(f"[POOL] Error de conexión para {db_name}, reintentando una vez: {err}")
-            # Limpiar pool si falló
-            if db_name in _mysql_pools:
-                try: del _mysql_pools[db_name]
-                except: pass
-            
-            # Un solo reintento directo
-            try:
-                if db_name not in _mysql_pools:
-                    _mysql_pools[db_name] = pooling.MySQLConnectionPool(
-                        pool_name=f"pool_{db_name.replace('-', '_')}_retry",
-                        pool_size=10,
-                        pool_reset_session=True,
-                        host=MYSQL_HOST,
-                        user=MYSQL_USER,
-                        password=MYSQL_PASS,
-                        database=db_name,
-                        port=MYSQL_PORT,
-                        connect_timeout=30,
-                        use_pure=True
-                    )
-                return _mysql_pools[db_name].get_connection()
-            except Exception as e:
-                logger.error(f"[DB] Error fatal conectando a {db_name}: {e}")
-                raise e
+            # El pool valida (ping/reciclaje) y reconecta con backoff; no se recrea en cada error
+            return _obtener_pool(db_name).obtener()
         except Exception as e:
-            logger.error(f"Error inesperado conectando a MySQL ({db_name}): {e}")
+            logger.error(f"[DB] Error conectando a MySQL ({db_name}): {e}")
             raise e
     else:
         # SQLite
         try:
-            conn = sqlite3.connect(db_name)
-            conn.execute("PRAGMA foreign_keys = ON")
-            return conn
+            return obtener_sqlite(db_name, solo_lectura)
         except Exception as e:
             logger.error(f"Error conectando a SQLite ({db_name}): {e}")
             raise e
@@ -129,10 +160,11 @@ def close_connection(conn, cursor=None):
         logger.warning(f"Error cerrando conexión: {e}")
 
 @contextmanager
-def db_session(target_db=None, existing_conn=None):
+def db_session(target_db=None, existing_conn=None, solo_lectura=False):
     """
     Context manager para manejar el ciclo de vida automatizando commit/rollback y finally.
     Acepta 'existing_conn' para permitir transacciones anidadas (unirse al padre).
+    'solo_lectura' pide en SQLite una conexión de solo lectura (ver get_db_connection).
     Patrón de uso:
         with db_session() as (conn, cursor):
             ...
@@ -143,7 +175,7 @@ def db_session(target_db=None, existing_conn=None):
 
     try:
         if conn is None:
-            conn = get_db_connection(target_db)
+            conn = get_db_connection(target_db, solo_lectura)
             we_created_conn = True
 
         # Usar cursores con buffer para MySQL para evitar problemas de "Unread result found"
@@ -179,20 +211,53 @@ def run_query(cursor, query, params=None):
     """
     Ejecuta una consulta ajustando la sintaxis según el motor de DB.
     Convierte '?' a '%s' si el motor es MySQL.
-    Registra errores de consulta.
+    Registra errores de consulta y, si DB_QUERY_STATS está activo, el tiempo de
+    cada ejecución por sentencia y llamador (ver utils/query_stats.py).
     """
     if DB_TYPE == 'MYSQL':
         # Reemplazo básico de placeholder para MySQL
         query = query.replace('?', '%s')
+        if _observadores_escrituras:
+            _anotar_escritura(query)
     
     try:
+        inicio = time.perf_counter()
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
+        if query_stats.QUERY_STATS_ACTIVO:
+            query_stats.registrar(query, time.perf_counter() - inicio, cursor.rowcount, params)
         return cursor.rowcount
     except Exception as e:
         logger.error(f"Error SQL ejecución: {e}")
         logger.error(f"   Query: {query}")
         logger.error(f"   Params: {params}")
         raise e
+
+def run_many(cursor, query, seq_params):
+    """
+    Ejecuta la misma sentencia para una lista de parámetros (executemany).
+    Misma conversión de placeholders que run_query. En MySQL el conector
+    agrupa los INSERT en una sola sentencia multi-fila (un viaje de red).
+    Retorna el total de filas afectadas.
+    """
+    seq_params = list(seq_params)
+    if not seq_params:
+        return 0
+    if DB_TYPE == 'MYSQL':
+        query = query.replace('?', '%s')
+        if _observadores_escrituras:
+            _anotar_escritura(query)
+
+    try:
+        inicio = time.perf_counter()
+        cursor.executemany(query, seq_params)
+        if query_stats.QUERY_STATS_ACTIVO:
+            query_stats.registrar(query, time.perf_counter() - inicio, cursor.rowcount, seq_params[0], lote=len(seq_params))
+        return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Error SQL ejecución (executemany): {e}")
+        logger.error(f"   Query: {query}")
+        logger.error(f"   Filas: {len(seq_params)}")
+        raise e
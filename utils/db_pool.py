@@ -0,0 +1,308 @@
+import os
+import time
+import threading
+from collections import deque
+
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# ─────────────────────────────────────────────────────────
+# CONFIGURACIÓN (variables de entorno, con valores por defecto)
+# ─────────────────────────────────────────────────────────
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+# Espera máxima por una conexión libre antes de PoolError
+POOL_TIMEOUT_SEG = float(os.environ.get('DB_POOL_TIMEOUT', 15))
+# TiDB/MySQL cortan conexiones inactivas: se reciclan por edad y se hace ping si llevan rato sin uso
+POOL_RECICLAR_SEG = float(os.environ.get('DB_POOL_RECYCLE', 1500))
+POOL_PING_INACTIVA_SEG = float(os.environ.get('DB_POOL_PING_IDLE', 60))
+# Reconexión: intentos por préstamo y espera inicial (se duplica tras cada fallo, hasta el máximo).
+# Mientras dura la espera los préstamos fallan al instante en vez de insistir contra un servidor caído.
+POOL_REINTENTOS = int(os.environ.get('DB_POOL_RETRIES', 2))
+POOL_BACKOFF_SEG = float(os.environ.get('DB_POOL_BACKOFF', 0.5))
+POOL_BACKOFF_MAX_SEG = float(os.environ.get('DB_POOL_BACKOFF_MAX', 30))
+
+
+class _ConexionPrestada:
+    """
+    Envoltorio de la conexión entregada al llamador: close() la devuelve al pool.
+    El resto de atributos (cursor, commit, rollback...) se delegan en la conexión real.
+    """
+
+    def __init__(self, pool, entrada):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_entrada', entrada)
+
+    def __getattr__(self, nombre):
+        entrada = object.__getattribute__(self, '_entrada')
+        if entrada is None:
+            raise mysql_errors.OperationalError("La conexión ya fue devuelta al pool.")
+        return getattr(entrada['conn'], nombre)
+
+    def __setattr__(self, nombre, valor):
+        entrada = object.__getattribute__(self, '_entrada')
+        if entrada is None:
+            raise mysql_errors.OperationalError("La conexión ya fue devuelta al pool.")
+        setattr(entrada['conn'], nombre, valor)
+
+    def commit(self):
+        self.__getattr__('commit')()
+        self._pool._confirmada()
+
+    def close(self):
+        entrada = object.__getattribute__(self, '_entrada')
+        if entrada is not None:
+            object.__setattr__(self, '_entrada', None)
+            self._pool._devolver(entrada)
+
+    def __del__(self):
+        # Red de seguridad: una conexión olvidada sin close() no debe perder su cupo
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class PoolMySQL:
+    """
+    Pool de conexiones MySQL/TiDB thread-safe para una base de datos.
+
+    - Tamaño mínimo (precalentado en segundo plano) y máximo configurables.
+    - Las peticiones sin conexión libre esperan hasta 'timeout' segundos (luego PoolError).
+    - Al prestar: recicla conexiones viejas y hace ping a las inactivas (desconexión por idle).
+    - Conectar reintenta con backoff exponencial.
+    - Métricas en vivo: estadisticas().
+    - 'al_confirmar()' se llama en el hilo del llamador tras cada commit() exitoso.
+    """
+
+    def __init__(self, db_name, conectar_kwargs, minimo=POOL_MIN, maximo=POOL_MAX, timeout=POOL_TIMEOUT_SEG,
+                 reciclar_seg=POOL_RECICLAR_SEG, ping_inactiva_seg=POOL_PING_INACTIVA_SEG, al_confirmar=None):
+        self.db_name = db_name
+        self.al_confirmar = al_confirmar
+        self.minimo = max(0, min(minimo, maximo))
+        self.maximo = max(1, maximo)
+        self.timeout = timeout
+        self.reciclar_seg = reciclar_seg
+        self.ping_inactiva_seg = ping_inactiva_seg
+        self._conectar_kwargs = dict(conectar_kwargs, database=db_name)
+
+        self._cond = threading.Condition()
+        self._libres = deque()    # entradas {'conn', 'creada', 'usada'}; LIFO: la más reciente primero
+        self._total = 0           # abiertas (libres + prestadas + en creación)
+        self._en_uso = 0
+        self._stats = {
+            'checkouts': 0, 'en_uso_max': 0, 'esperas': 0, 'espera_total_seg': 0.0, 'espera_max_seg': 0.0,
+            'agotado': 0, 'errores': 0, 'creadas': 0, 'recicladas': 0, 'descartadas': 0,
+        }
+        self._reconectar_desde = 0.0   # monotonic: antes de esto no se intenta conectar
+        self._backoff = POOL_BACKOFF_SEG
+        self._ultimo_error = None
+
+        if self.minimo:
+            threading.Thread(target=self._precalentar, daemon=True, name=f"pool-{db_name}").start()
+
+    # ─────────────────────────────────────────────────────────
+    # CONEXIONES FÍSICAS
+    # ─────────────────────────────────────────────────────────
+    def _conectar(self):
+        """Abre una conexión real con reintentos y backoff exponencial."""
+        with self._cond:
+            pendiente = self._reconectar_desde - time.monotonic()
+            if pendiente > 0:
+                raise mysql_errors.InterfaceError(
+                    f"Sin conexión a {self.db_name} (próximo intento en {pendiente:.0f}s): {self._ultimo_error}")
+
+        espera = POOL_BACKOFF_SEG
+        for intento in range(1, POOL_REINTENTOS + 1):
+            try:
+                conn = mysql.connector.connect(**self._conectar_kwargs)
+                ahora = time.monotonic()
+                with self._cond:
+                    self._stats['creadas'] += 1
+                    self._backoff = POOL_BACKOFF_SEG
+                return {'conn': conn, 'creada': ahora, 'usada': ahora}
+            except (mysql_errors.OperationalError, mysql_errors.InterfaceError) as e:
+                with self._cond:
+                    self._stats['errores'] += 1
+                    if intento == POOL_REINTENTOS:
+                        self._ultimo_error = e
+                        self._reconectar_desde = time.monotonic() + self._backoff
+                        logger.error(f"[POOL] {self.db_name}: no se pudo conectar ({e}); nuevo intento en {self._backoff:.1f}s")
+                        self._backoff = min(self._backoff * 2, POOL_BACKOFF_MAX_SEG)
+                        raise
+                logger.warning(f"[POOL] {self.db_name}: fallo al conectar ({e}); reintento {intento}/{POOL_REINTENTOS - 1} en {espera:.1f}s")
+                time.sleep(espera)
+                espera *= 2
+
+    def _cerrar(self, entrada):
+        try:
+            entrada['conn'].close()
+        except Exception:
+            pass
+
+    def _precalentar(self):
+        """Abre las conexiones mínimas sin bloquear a quien creó el pool."""
+        while True:
+            with self._cond:
+                if self._total >= self.minimo:
+                    return
+                self._total += 1
+            try:
+                entrada = self._conectar()
+            except Exception as e:
+                with self._cond:
+                    self._total -= 1
+                logger.warning(f"[POOL] {self.db_name}: no se pudo precalentar: {e}")
+                return
+            with self._cond:
+                self._libres.append(entrada)
+                self._cond.notify()
+
+    def _validar(self, entrada):
+        """Retorna la entrada si sirve; si es vieja o no responde al ping, la reemplaza."""
+        ahora = time.monotonic()
+        if ahora - entrada['creada'] > self.reciclar_seg:
+            self._cerrar(entrada)
+            with self._cond:
+                self._stats['recicladas'] += 1
+            return self._conectar()
+        if ahora - entrada['usada'] > self.ping_inactiva_seg:
+            try:
+                entrada['conn'].ping(reconnect=False)
+            except Exception:
+                self._cerrar(entrada)
+                with self._cond:
+                    self._stats['descartadas'] += 1
+                logger.info(f"[POOL] {self.db_name}: conexión inactiva cortada por el servidor, se reemplaza")
+                return self._conectar()
+        return entrada
+
+    # ─────────────────────────────────────────────────────────
+    # PRÉSTAMO / DEVOLUCIÓN
+    # ─────────────────────────────────────────────────────────
+    def obtener(self):
+        """Presta una conexión (esperando hasta 'timeout'). Lanza PoolError si no hay cupo."""
+        inicio = time.monotonic()
+        espero = False
+        with self._cond:
+            while True:
+                if self._libres:
+                    entrada, crear = self._libres.pop(), False
+                    break
+                if self._total < self.maximo:
+                    self._total += 1
+                    entrada, crear = None, True
+                    break
+                restante = self.timeout - (time.monotonic() - inicio)
+                if restante <= 0:
+                    self._registrar_espera(self.timeout)
+                    self._stats['agotado'] += 1
+                    logger.warning(f"[POOL] {self.db_name}: sin conexiones libres tras {self.timeout:.0f}s ({self._en_uso}/{self.maximo} en uso)")
+                    raise mysql_errors.PoolError(f"Pool {self.db_name} agotado ({self.maximo} conexiones en uso)")
+                espero = True
+                self._cond.wait(restante)
+
+            self._en_uso += 1
+            self._stats['checkouts'] += 1
+            self._stats['en_uso_max'] = max(self._stats['en_uso_max'], self._en_uso)
+            if espero:
+                self._registrar_espera(time.monotonic() - inicio)
+
+        try:
+            entrada = self._conectar() if crear else self._validar(entrada)
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._en_uso -= 1
+                self._cond.notify()
+            raise
+        return _ConexionPrestada(self, entrada)
+
+    def _registrar_espera(self, segundos):
+        """Llamar con el lock tomado."""
+        st = self._stats
+        st['esperas'] += 1
+        st['espera_total_seg'] += segundos
+        st['espera_max_seg'] = max(st['espera_max_seg'], segundos)
+
+    def _confirmada(self):
+        if self.al_confirmar:
+            try:
+                self.al_confirmar()
+            except Exception as e:
+                logger.warning(f"[POOL] {self.db_name}: al_confirmar falló: {e}")
+
+    def _devolver(self, entrada):
+        """Limpia la sesión (como pool_reset_session) y la deja libre; si falla, la descarta."""
+        conn = entrada['conn']
+        sana = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.reset_session()
+        except Exception:
+            sana = False
+            self._cerrar(entrada)
+
+        with self._cond:
+            self._en_uso -= 1
+            if sana:
+                entrada['usada'] = time.monotonic()
+                self._libres.append(entrada)
+            else:
+                self._total -= 1
+                self._stats['descartadas'] += 1
+            self._cond.notify()
+
+    def cerrar(self):
+        """Cierra las conexiones libres (las prestadas se cierran al devolverse)."""
+        with self._cond:
+            libres, self._libres = list(self._libres), deque()
+            self._total -= len(libres)
+        for entrada in libres:
+            self._cerrar(entrada)
+
+    def estadisticas(self):
+        with self._cond:
+            st = dict(self._stats)
+            st.update({
+                'tamano': self.maximo,
+                'minimo': self.minimo,
+                'abiertas': self._total,
+                'libres': len(self._libres),
+                'en_uso': self._en_uso,
+                'espera_media_seg': round(st['espera_total_seg'] / st['esperas'], 4) if st['esperas'] else 0.0,
+            })
+        st['espera_total_seg'] = round(st['espera_total_seg'], 4)
+        st['espera_max_seg'] = round(st['espera_max_seg'], 4)
+        return st
+
+
+def metricas_prometheus(estadisticas):
+    """Formato de texto de Prometheus para {db: estadisticas()} (endpoint /metrics)."""
+    metricas = [
+        ('en_uso', 'gauge', 'Conexiones prestadas en este momento'),
+        ('libres', 'gauge', 'Conexiones abiertas sin prestar'),
+        ('abiertas', 'gauge', 'Conexiones abiertas en total'),
+        ('tamano', 'gauge', 'Tamaño máximo del pool'),
+        ('en_uso_max', 'gauge', 'Pico de conexiones prestadas'),
+        ('checkouts', 'counter', 'Conexiones prestadas desde el arranque'),
+        ('esperas', 'counter', 'Préstamos que tuvieron que esperar'),
+        ('espera_total_seg', 'counter', 'Segundos esperados por una conexión'),
+        ('agotado', 'counter', 'Préstamos rechazados por timeout'),
+        ('errores', 'counter', 'Errores al conectar'),
+        ('recicladas', 'counter', 'Conexiones cerradas por edad'),
+        ('descartadas', 'counter', 'Conexiones muertas descartadas'),
+    ]
+    lineas = []
+    for clave, tipo, ayuda in metricas:
+        nombre = f"stockware_db_pool_{clave}"
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for db, st in sorted(estadisticas.items()):
+            lineas.append(f'{nombre}{{db="{db}"}} {st.get(clave, 0)}')
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,213 @@
+"""
+Lectura de Excel en streaming para StockWare
+
+Recorre la primera hoja con openpyxl en modo read_only (fila a fila, sin cargar
+el libro completo) y acumula (fecha, movil, sku) -> cantidad sobre la marcha.
+La usan /api/comparar_excel (web) y la ventana de conciliación (escritorio).
+"""
+
+import difflib
+from collections import defaultdict
+from functools import lru_cache
+from datetime import datetime, date
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Formato largo: una fila por (fecha, móvil, sku, cantidad)
+PALABRAS_COLUMNA = {
+    'fecha': ['fecha', 'date', 'dia', 'time'],
+    'movil': ['movil', 'patente', 'camion', 'resource', 'técnico'],
+    'sku': ['sku', 'codigo', 'cod', 'item', 'material'],
+    'cantidad': ['cantidad', 'qty', 'cant', 'consumo', 'usado'],
+}
+# Formato ancho: fecha + móvil y una columna por producto
+COLUMNAS_FECHA_ANCHO = ['fecha_cierre', 'fecha', 'date', 'closure date']
+COLUMNAS_MOVIL_ANCHO = ['nombre_movil', 'codigo_movil', 'movil', 'patente', 'resource']
+
+_FORMATOS_FECHA = (
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d',
+    '%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d-%m-%Y',
+)
+REPORTE_CADA_FILAS = 1000
+
+
+def iterar_filas_excel(origen, nombre=None):
+    """
+    Genera las filas (tuplas de valores) de la primera hoja; la primera son los encabezados.
+    'origen' es una ruta o un objeto tipo archivo (BytesIO); 'nombre' ayuda a detectar .xls.
+    """
+    if str(nombre or origen).lower().endswith('.xls'):
+        # openpyxl no lee el formato binario antiguo: se delega en pandas (xlrd), en memoria
+        import pandas as pd
+        df = pd.read_excel(origen, header=None)
+        for fila in df.itertuples(index=False, name=None):
+            yield tuple(None if pd.isna(v) else v for v in fila)
+        return
+
+    import openpyxl
+    wb = openpyxl.load_workbook(origen, read_only=True, data_only=True)
+    try:
+        for fila in wb.active.iter_rows(values_only=True):
+            yield fila
+    finally:
+        wb.close()
+
+
+def normalizar_fecha(valor):
+    """Fecha ISO (YYYY-MM-DD) o None si la celda no es una fecha reconocible."""
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    texto = str(valor or '').strip()
+    return _fecha_desde_texto(texto) if texto else None
+
+
+@lru_cache(maxsize=4096)
+def _fecha_desde_texto(texto):
+    """Las fechas se repiten miles de veces en un export: se parsea cada texto una sola vez."""
+    for formato in _FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(texto).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def normalizar_cantidad(valor):
+    """Cantidad entera; 'no', vacíos y textos no numéricos cuentan como 0."""
+    if str(valor).lower().strip() in ('no', 'nan', '', 'none'):
+        return 0
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _limpiar_nombre(texto):
+    return (str(texto).lower().replace('.', ' ').replace('-', ' ').replace('"', '').replace("'", "")
+            .replace('[', '').replace(']', '').replace('(', '').replace(')', '').strip())
+
+
+def _sku_para_columna(columna, nombres_sistema):
+    """Empareja un encabezado con un producto: subcadena, subconjunto de palabras o difflib (>60%)."""
+    col = _limpiar_nombre(columna)
+    mejor_ratio, mejor_sku = 0, None
+    for nombre, sku in nombres_sistema:
+        if (nombre in col or col in nombre) and len(nombre) > 2 and len(col) > 2:
+            return sku
+        if col.split() and set(col.split()).issubset(set(nombre.split())):
+            return sku
+        ratio = difflib.SequenceMatcher(None, col, nombre).ratio()
+        if ratio > mejor_ratio:
+            mejor_ratio, mejor_sku = ratio, sku
+    return mejor_sku if mejor_ratio > 0.6 else None
+
+
+def mapear_columnas_consumo(encabezados, productos=None):
+    """
+    Resuelve UNA vez qué columna es cada dato.
+    Retorna dict: formato ('LARGO'|'ANCHO'), índices fecha/movil(/sku/cantidad)
+    y, en formato ancho, productos {índice: sku}. Lanza ValueError si no lo reconoce.
+    """
+    normalizados = [str(h).lower().strip() for h in encabezados]
+
+    largo = {}
+    for clave, posibles in PALABRAS_COLUMNA.items():
+        for i, h in enumerate(normalizados):
+            if h in posibles:
+                largo[clave] = i
+                break
+    if len(largo) == len(PALABRAS_COLUMNA):
+        return dict(largo, formato='LARGO')
+
+    def buscar(candidatos, respaldo):
+        for c in candidatos:
+            if c in normalizados:
+                return normalizados.index(c)
+        return largo.get(respaldo)
+
+    idx_fecha = buscar(COLUMNAS_FECHA_ANCHO, 'fecha')
+    idx_movil = buscar(COLUMNAS_MOVIL_ANCHO, 'movil')
+    if idx_fecha is None or idx_movil is None:
+        raise ValueError("No se encontraron las columnas de fecha y móvil.")
+
+    if productos is None:
+        from config import PRODUCTOS_INICIALES as productos
+    nombres_sistema = [(_limpiar_nombre(nombre), sku) for nombre, sku, *_ in productos]
+
+    columnas_producto = {}
+    for i, h in enumerate(encabezados):
+        if i in (idx_fecha, idx_movil) or not str(h).strip():
+            continue
+        sku = _sku_para_columna(h, nombres_sistema)
+        if sku:
+            columnas_producto[i] = sku
+        else:
+            logger.debug(f"[EXCEL] Columna sin producto: '{h}'")
+
+    if not columnas_producto:
+        raise ValueError(f"No se reconocen productos en las columnas. Se vio: {', '.join(map(str, encabezados[:5]))}...")
+    return {'formato': 'ANCHO', 'fecha': idx_fecha, 'movil': idx_movil, 'productos': columnas_producto}
+
+
+def _celda(fila, indice):
+    return fila[indice] if indice is not None and indice < len(fila) else None
+
+
+def agrupar_consumos_excel(origen, nombre=None, productos=None, reportar=None):
+    """
+    Lee el Excel fila a fila y acumula los consumos sin guardar las filas.
+    Retorna (agrupado, info): agrupado = {(fecha, movil, sku): cantidad};
+    info = {'encabezados', 'formato', 'filas_leidas', 'filas_descartadas'}.
+    'reportar(n)' se llama cada REPORTE_CADA_FILAS filas.
+    """
+    filas = iterar_filas_excel(origen, nombre)
+    encabezados = [str(v).strip() if v is not None else '' for v in next(filas, ())]
+    mapa = mapear_columnas_consumo(encabezados, productos)
+
+    agrupado = defaultdict(int)
+    leidas = descartadas = 0
+    for fila in filas:
+        if not any(v is not None for v in fila):
+            continue
+        leidas += 1
+        if reportar and leidas % REPORTE_CADA_FILAS == 0:
+            reportar(leidas)
+
+        fecha = normalizar_fecha(_celda(fila, mapa['fecha']))
+        if not fecha:
+            descartadas += 1
+            continue
+        movil = str(_celda(fila, mapa['movil']) or '').strip()
+
+        if mapa['formato'] == 'LARGO':
+            sku = str(_celda(fila, mapa['sku']) or '').strip()
+            agrupado[(fecha, movil, sku)] += normalizar_cantidad(_celda(fila, mapa['cantidad']))
+        else:
+            for indice, sku in mapa['productos'].items():
+                agrupado[(fecha, movil, sku)] += normalizar_cantidad(_celda(fila, indice))
+
+    info = {'encabezados': encabezados, 'formato': mapa['formato'],
+            'filas_leidas': leidas, 'filas_descartadas': descartadas}
+    logger.info(f"[EXCEL] {leidas} filas ({mapa['formato']}) -> {len(agrupado)} grupos, {descartadas} sin fecha")
+    return dict(agrupado), info
+
+
+def vista_previa_excel(origen, nombre=None, limite=1000):
+    """Encabezados y hasta 'limite' filas como dicts de texto (para formatos no reconocidos)."""
+    filas = iterar_filas_excel(origen, nombre)
+    encabezados = [str(v).strip() if v is not None else '' for v in next(filas, ())]
+    vista, total = [], 0
+    for fila in filas:
+        if not any(v is not None for v in fila):
+            continue
+        total += 1
+        if len(vista) < limite:
+            vista.append({encabezados[i]: str(v or '').strip() for i, v in enumerate(fila) if i < len(encabezados)})
+    return encabezados, vista, total
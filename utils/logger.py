@@ -131,6 +131,38 @@ def get_logger(name: str = None) -> logging.Logger:
     return StockWareLogger.get_logger(name)
 
 
+def get_slow_query_logger() -> logging.Logger:
+    """
+    Logger exclusivo para consultas lentas (logs/slow_queries.log con rotación).
+
+    No se propaga al log general para no inundarlo; en Render/cloud va a stdout.
+    """
+    name = 'stockware.slow_queries'
+    if name in StockWareLogger._loggers:
+        return StockWareLogger._loggers[name]
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        is_render = os.getenv('RENDER', '').lower() in ('true', '1', 'yes')
+        if is_render or os.getenv('DYNO') or os.getenv('RAILWAY_ENVIRONMENT'):
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            handler = RotatingFileHandler(
+                os.path.join(LOG_DIR, 'slow_queries.log'),
+                maxBytes=5 * 1024 * 1024,  # 5 MB
+                backupCount=3,
+                encoding='utf-8',
+                delay=True
+            )
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        logger.addHandler(handler)
+
+    StockWareLogger._loggers[name] = logger
+    return logger
+
+
 def log_function_call(func):
     """
     Decorador para loggear llamadas a funciones.
@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import threading
+from functools import lru_cache
+
+from utils.logger import get_slow_query_logger
+
+# ─────────────────────────────────────────────────────────
+# CONFIGURACIÓN (variables de entorno, con valores por defecto)
+# ─────────────────────────────────────────────────────────
+# DB_QUERY_STATS=0 desactiva la medición (run_query vuelve a solo ejecutar)
+QUERY_STATS_ACTIVO = os.environ.get('DB_QUERY_STATS', '1').lower() not in ('0', 'false', 'no')
+# Sentencias más lentas que esto van a logs/slow_queries.log
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', 500))
+# Tope de combinaciones (sentencia, llamador) en memoria; el excedente se agrupa en '(otras)'
+MAX_ENTRADAS = int(os.environ.get('DB_QUERY_STATS_MAX', 2000))
+
+# Módulos que no cuentan como "llamador" (la capa de ejecución en sí)
+_MODULOS_INTERNOS = ('utils.db_connector', 'utils.query_stats', 'contextlib')
+
+_RE_CADENA = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_stats = {}   # (sql normalizado, llamador) -> [llamadas, total_seg, max_seg, filas, lentas]
+
+slow_logger = get_slow_query_logger()
+
+
+@lru_cache(maxsize=4096)
+def normalizar_sql(query):
+    """
+    Forma canónica de una sentencia para agrupar: literales -> ?, listas IN (?, ?, ...) -> (?...),
+    espacios colapsados. Así 'IN (?, ?)' e 'IN (?, ?, ?)' cuentan como la misma consulta.
+    """
+    sql = _RE_CADENA.sub('?', query)
+    sql = _RE_NUMERO.sub('?', sql)
+    sql = _RE_LISTA.sub('(?...)', sql)
+    return _RE_ESPACIOS.sub(' ', sql).strip()
+
+
+def _llamador():
+    """'modulo.funcion:linea' del primer marco fuera de la capa de ejecución."""
+    marco = sys._getframe(2)
+    while marco is not None:
+        modulo = marco.f_globals.get('__name__', '?')
+        if not modulo.startswith(_MODULOS_INTERNOS):
+            return f"{modulo}.{marco.f_code.co_name}:{marco.f_lineno}"
+        marco = marco.f_back
+    return '?'
+
+
+def registrar(query, segundos, filas=0, params=None, lote=1):
+    """
+    Acumula una ejecución de run_query/run_many. 'lote' es el número de juegos de
+    parámetros (executemany). Si supera SLOW_QUERY_MS se escribe en slow_queries.log.
+    """
+    sql = normalizar_sql(query)
+    llamador = _llamador()
+    lenta = segundos * 1000 >= SLOW_QUERY_MS
+    filas = filas if filas and filas > 0 else 0
+
+    with _lock:
+        clave = (sql, llamador)
+        entrada = _stats.get(clave)
+        if entrada is None:
+            if len(_stats) >= MAX_ENTRADAS:
+                clave = ('(otras)', '(otras)')
+                entrada = _stats.get(clave)
+            if entrada is None:
+                entrada = _stats[clave] = [0, 0.0, 0.0, 0, 0]
+        entrada[0] += 1
+        entrada[1] += segundos
+        entrada[2] = max(entrada[2], segundos)
+        entrada[3] += filas
+        entrada[4] += lenta
+
+    if lenta:
+        detalle = f"lote={lote} | " if lote > 1 else ""
+        params_txt = repr(params)
+        if len(params_txt) > 300:
+            params_txt = params_txt[:300] + '...'
+        slow_logger.warning(f"ms={segundos * 1000:.1f} | filas={filas} | {detalle}llamador={llamador} | "
+                            f"sql={sql} | params={params_txt}")
+
+
+def reporte(top=20, orden='total'):
+    """
+    Las consultas que más pesan, de mayor a menor según 'orden' ('total', 'llamadas', 'max' o 'media').
+    Retorna una lista de dicts {sql, llamador, llamadas, total_seg, media_ms, max_ms, filas, lentas}.
+    """
+    with _lock:
+        filas = [(sql, llamador, list(v)) for (sql, llamador), v in _stats.items()]
+    return _ordenar(filas, top, orden)
+
+
+def _ordenar(filas, top, orden):
+    resultado = [{
+        'sql': sql,
+        'llamador': llamador,
+        'llamadas': v[0],
+        'total_seg': round(v[1], 4),
+        'media_ms': round(v[1] * 1000 / v[0], 2) if v[0] else 0.0,
+        'max_ms': round(v[2] * 1000, 2),
+        'filas': v[3],
+        'lentas': v[4],
+    } for sql, llamador, v in filas]
+    clave = {'total': 'total_seg', 'llamadas': 'llamadas', 'max': 'max_ms', 'media': 'media_ms'}.get(orden, 'total_seg')
+    resultado.sort(key=lambda r: r[clave], reverse=True)
+    return resultado[:top] if top else resultado
+
+
+def formatear_reporte(filas):
+    """Tabla de texto plano para consola/endpoint."""
+    if not filas:
+        return "Sin consultas registradas.\n"
+    lineas = [f"{'TOTAL(s)':>9} {'LLAMADAS':>9} {'MEDIA(ms)':>10} {'MAX(ms)':>9} {'LENTAS':>7}  LLAMADOR / SQL"]
+    for r in filas:
+        sql = r['sql'] if len(r['sql']) <= 160 else r['sql'][:160] + '...'
+        lineas.append(f"{r['total_seg']:>9.3f} {r['llamadas']:>9} {r['media_ms']:>10.2f} {r['max_ms']:>9.2f} "
+                      f"{r['lentas']:>7}  {r['llamador']}")
+        lineas.append(f"{'':>48}  {sql}")
+    return "\n".join(lineas) + "\n"
+
+
+def reiniciar():
+    """Borra lo acumulado (p. ej. para medir un escenario concreto)."""
+    with _lock:
+        _stats.clear()
+
+
+# ─────────────────────────────────────────────────────────
+# REPORTE DESDE slow_queries.log (procesos ya terminados)
+# ─────────────────────────────────────────────────────────
+_RE_LINEA_LENTA = re.compile(r"ms=(?P<ms>[\d.]+) \| filas=(?P<filas>\d+) \| (?:lote=\d+ \| )?"
+                             r"llamador=(?P<llamador>.*?) \| sql=(?P<sql>.*?) \| params=")
+
+
+def reporte_desde_log(rutas, top=20, orden='total'):
+    """Agrega las líneas de slow_queries.log (y sus rotaciones) con el mismo formato que reporte()."""
+    agregado = {}
+    for ruta in rutas:
+        try:
+            with open(ruta, encoding='utf-8', errors='replace') as f:
+                for linea in f:
+                    m = _RE_LINEA_LENTA.search(linea)
+                    if not m:
+                        continue
+                    seg = float(m.group('ms')) / 1000
+                    v = agregado.setdefault((m.group('sql'), m.group('llamador')), [0, 0.0, 0.0, 0, 0])
+                    v[0] += 1
+                    v[1] += seg
+                    v[2] = max(v[2], seg)
+                    v[3] += int(m.group('filas'))
+                    v[4] += 1
+        except OSError:
+            continue
+    return _ordenar([(sql, llamador, v) for (sql, llamador), v in agregado.items()], top, orden)
+
+
+if __name__ == '__main__':
+    # python -m utils.query_stats [--orden total|llamadas|max|media] [--top N] [archivo.log ...]
+    import argparse
+    import glob
+    from utils.logger import LOG_DIR
+
+    parser = argparse.ArgumentParser(description="Top de consultas lentas según slow_queries.log")
+    parser.add_argument('archivos', nargs='*')
+    parser.add_argument('--orden', default='total', choices=['total', 'llamadas', 'max', 'media'])
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    rutas = args.archivos or sorted(glob.glob(os.path.join(LOG_DIR, 'slow_queries.log*')))
+    print(formatear_reporte(reporte_desde_log(rutas, args.top, args.orden)), end='')
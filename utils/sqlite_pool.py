@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# ─────────────────────────────────────────────────────────
+# CONFIGURACIÓN (variables de entorno, con valores por defecto)
+# ─────────────────────────────────────────────────────────
+# Espera ante un bloqueo de escritura antes de "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+# Caché de páginas por conexión (KiB) y ventana de mmap: las tablas calientes
+# (productos, series_registradas, agregados de movimientos) caben completas
+SQLITE_CACHE_KIB = int(os.environ.get('SQLITE_CACHE_KIB', 32768))
+SQLITE_MMAP_BYTES = int(os.environ.get('SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+# Conexiones libres que conserva cada hilo por BD (las anidadas por encima se cierran)
+SQLITE_LIBRES_POR_HILO = int(os.environ.get('SQLITE_IDLE_PER_THREAD', 2))
+
+
+class ConexionSQLite(sqlite3.Connection):
+    """
+    Conexión SQLite reutilizable por hilo: close() deshace lo no confirmado y la deja
+    libre para la próxima get_db_connection() del mismo hilo; cerrar() la cierra de verdad.
+    """
+
+    def close(self):
+        _devolver(self)
+
+    def cerrar(self):
+        super().close()
+
+
+_hilo = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'abiertas': 0, 'reutilizadas': 0, 'cerradas': 0, 'solo_lectura': 0}
+
+
+def _contar(clave):
+    with _stats_lock:
+        _stats[clave] += 1
+
+
+def _libres():
+    """{(db_name, solo_lectura): [conexiones libres]} del hilo actual."""
+    libres = getattr(_hilo, 'libres', None)
+    if libres is None:
+        libres = _hilo.libres = {}
+    return libres
+
+
+def _abrir(db_name, solo_lectura):
+    timeout = SQLITE_BUSY_TIMEOUT_MS / 1000.0
+    conn = None
+    if solo_lectura and db_name != ':memory:' and os.path.exists(db_name):
+        try:
+            uri = f"file:{pathname2url(os.path.abspath(db_name))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=timeout, factory=ConexionSQLite)
+            conn.execute("PRAGMA query_only = ON")
+            _contar('solo_lectura')
+        except sqlite3.Error as e:
+            # Sin permisos o sin archivos del WAL todavía: se lee por una conexión normal
+            logger.warning(f"[SQLITE] Sin conexión de solo lectura a {db_name}, se usa una normal: {e}")
+            conn = None
+    if conn is None:
+        conn = sqlite3.connect(db_name, timeout=timeout, factory=ConexionSQLite)
+        if db_name != ':memory:':
+            # WAL: los lectores no bloquean al escritor ni al revés (persistente en el archivo)
+            conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # Una BD en memoria es distinta en cada conexión: no se reutiliza
+    conn._clave = None if db_name == ':memory:' else (db_name, bool(solo_lectura))
+    conn._hilo = threading.get_ident()
+    _contar('abiertas')
+    return conn
+
+
+def obtener_sqlite(db_name, solo_lectura=False):
+    """Conexión SQLite del hilo actual: una libre si la hay, o una nueva ya configurada."""
+    libres = _libres().get((db_name, bool(solo_lectura)))
+    if libres:
+        _contar('reutilizadas')
+        return libres.pop()
+    return _abrir(db_name, solo_lectura)
+
+
+def _devolver(conn):
+    clave = getattr(conn, '_clave', None)
+    if clave is not None and getattr(conn, '_hilo', None) == threading.get_ident():
+        libres = _libres().setdefault(clave, [])
+        if conn in libres:
+            return  # close() repetido
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            if len(libres) < SQLITE_LIBRES_POR_HILO:
+                libres.append(conn)
+                return
+        except sqlite3.Error:
+            pass
+    try:
+        conn.cerrar()
+        _contar('cerradas')
+    except sqlite3.Error as e:
+        logger.warning(f"[SQLITE] Error cerrando conexión: {e}")
+
+
+def cerrar_conexiones_hilo():
+    """Cierra las conexiones libres del hilo actual (p. ej. antes de reemplazar el archivo de la BD)."""
+    libres, _hilo.libres = _libres(), {}
+    for conexiones in libres.values():
+        for conn in conexiones:
+            try:
+                conn.cerrar()
+                _contar('cerradas')
+            except sqlite3.Error:
+                pass
+
+
+def estadisticas():
+    """Contadores del proceso: conexiones abiertas, reutilizadas, cerradas y de solo lectura."""
+    with _stats_lock:
+        return dict(_stats)
@@ -1,5 +1,6 @@
 print(">>> LOADING WEB SERVER MODULE <<<")
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, make_response, Response, g
+from functools import wraps
 from datetime import date
 import socket
 import os
@@ -11,45 +12,26 @@ from database import (
     obtener_detalles_moviles,
     registrar_consumo_directo,
     inicializar_bd,
-    obtener_tecnicos
+    obtener_tecnicos,
+    obtener_catalogo
 )
 import threading
 import json
-from config import (
-    DB_TYPE, PAQUETES_MATERIALES, MATERIALES_COMPARTIDOS, 
-    MOVILES_SANTIAGO, PRODUCTOS_CON_CODIGO_BARRA
-)
+import time
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from config import DB_TYPE, MOVILES_SANTIAGO
 import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Mapeo SKU → Nombre Excel (para mostrar nombres cortos en portal)
-SKU_TO_EXCEL_NAME = {
-    "1-2-16": "FIBUNHILO",
-    "7-1-171": "C_UTP_CAT6",
-    "10-1-04": "CONEC_RJ45",
-    "5-2-443": "MOLDU",
-    "1-4-61": "PLACAS_F_O",
-    "1-8-40": "FAJILLA_8",
-    "1-8-41": "TAPE",
-    "2-5-02": "GRAPAS",
-    "2-5-03": "G_C_PARED6",
-    "2-7-07": "Sticker",
-    "2-7-11": "COLILLA",
-    "4-2-41": "TOALLAS",
-    "4-3-18": "CONEC_MECA",
-    "4-3-42": "TENSOR_FO",
-    "U4-4-633": "HG8247W5",
-    "4-4-644": "O_EG8145V5",
-    "4-4-656": "O_EG8041X6",
-    "4-4-646": "R_K562E_10",
-    "4-4-647": "WIFI_NET",
-    "8-1-902": "T_PLAYPRO",
-    "8-1-903": "T_PLAY",
-    "8-1-904": "E_T_PLAY",
-}
+# Nombres cortos del Excel, equipos con serial, compartidos y paquetes vienen del
+# catálogo en BD (data_layer/catalog.py): agregar un producto ya no requiere redeploy.
+def _nombres_excel():
+    return dict(obtener_catalogo().nombres_excel)
 
 if getattr(sys, 'frozen', False):
     # Estamos corriendo en ejecutable (PyInstaller)
@@ -61,14 +43,8 @@ else:
     app = Flask(__name__)
 
 # INICIALIZACIÓN DE BASE DE DATOS (MIGRACIONES)
-try:
-    # Desactivado en web_server para evitar Timeout 521 en Render.
-    # El inicializar_bd() toma ~36s por red y Gunicorn mata el worker a los 30s.
-    # La inicialización ya se hace desde app_inventario.py (Desktop).
-    # inicializar_bd()
-    pass
-except Exception as e:
-    print(f"Error inicializando BD: {e}")
+# Los workers de gunicorn no migran: en Render se ejecuta una sola vez antes de arrancar
+# (python -m utilities.migrar_bd en el startCommand) y en el escritorio desde app_inventario.py.
 
 @app.errorhandler(500)
 def handle_500_error(e):
@@ -91,12 +67,113 @@ def handle_500_error(e):
     </html>
     """, 500
 
+# ─────────────────────────────────────────────────────────
+# CACHÉ DE RESPUESTAS (ETag / If-None-Match)
+# ─────────────────────────────────────────────────────────
+# Cada página se guarda junto a la versión de datos de su sucursal; los escritores
+# (data_layer) incrementan esa versión en su misma transacción. La versión se relee
+# de la BD como máximo cada VERSION_TTL_SEG segundos: entre medio, una página sin
+# cambios se sirve (o se responde 304) sin tocar la base de datos.
+VERSION_TTL_SEG = 10
+RESPUESTA_MAX_SEG = 300  # Tope para cambios que no versionan (config, SQL manual)
+# LRU acotado: la clave lleva argumentos de ruta (nombre del móvil) que vienen del cliente
+RESPUESTAS_CACHE_MAX = int(os.getenv('PORTAL_CACHE_MAX_RESPUESTAS', '200'))
+
+_cache_lock = threading.Lock()
+_versiones_sucursal = {}   # sucursal -> (version, leida_en)
+_respuestas_cache = OrderedDict()  # (vista, args de ruta, params leídos) -> dict(etag, body, mimetype, version, dia, creada_en)
+
+
+def _version_sucursal(sucursal):
+    from database import obtener_version_sucursal
+    ahora = time.monotonic()
+    with _cache_lock:
+        guardada = _versiones_sucursal.get(sucursal)
+    if guardada and ahora - guardada[1] < VERSION_TTL_SEG:
+        return guardada[0]
+    version = obtener_version_sucursal(sucursal)
+    if version is not None:
+        with _cache_lock:
+            _versiones_sucursal[sucursal] = (version, ahora)
+    return version
+
+
+def invalidar_cache_sucursal(sucursal):
+    """Tras una escritura desde el portal: obliga a releer la versión en la próxima petición."""
+    with _cache_lock:
+        _versiones_sucursal.pop((sucursal or 'CHIRIQUI').upper(), None)
+
+
+def no_cachear():
+    """
+    La vista la llama cuando responde 200 con un error o datos incompletos (BD caída,
+    plantilla rota): respuesta_cacheada la entrega tal cual, sin guardarla ni poner ETag.
+    """
+    g.respuesta_no_cacheable = True
+
+
+def respuesta_cacheada(sucursal, parametros=()):
+    """
+    Decorador para GETs de solo lectura. 'sucursal' es un string o una función
+    que recibe los mismos argumentos que la vista.
+    'parametros': los query params que la vista lee; son los únicos que forman la clave
+    (cualquier otro query string comparte la misma entrada).
+    Responde con ETag fuerte y 304 si el cliente ya tiene la versión vigente.
+    Solo se guardan las respuestas 200 para las que la vista no llamó a no_cachear().
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            suc = (sucursal(*args, **kwargs) if callable(sucursal) else sucursal).upper()
+            version = _version_sucursal(suc)
+            if version is None:
+                return vista(*args, **kwargs)  # Sin versión fiable no se cachea
+
+            clave = (vista.__name__, tuple(sorted(kwargs.items())), tuple(request.args.get(p, '') for p in parametros))
+            hoy = date.today().isoformat()
+            with _cache_lock:
+                entrada = _respuestas_cache.get(clave)
+                if entrada:
+                    _respuestas_cache.move_to_end(clave)
+            vigente = (entrada and entrada['version'] == version and entrada['dia'] == hoy
+                       and time.monotonic() - entrada['creada_en'] < RESPUESTA_MAX_SEG)
+
+            if not vigente:
+                g.respuesta_no_cacheable = False
+                resp = make_response(vista(*args, **kwargs))
+                if resp.status_code != 200 or g.respuesta_no_cacheable:
+                    return resp
+                body = resp.get_data()
+                entrada = {
+                    'etag': hashlib.sha1(f"{suc}:{version}:{hoy}:".encode() + body).hexdigest(),
+                    'body': body, 'mimetype': resp.mimetype,
+                    'version': version, 'dia': hoy, 'creada_en': time.monotonic()
+                }
+                with _cache_lock:
+                    _respuestas_cache[clave] = entrada
+                    _respuestas_cache.move_to_end(clave)
+                    while len(_respuestas_cache) > RESPUESTAS_CACHE_MAX:
+                        _respuestas_cache.popitem(last=False)
+
+            resp = Response(entrada['body'], mimetype=entrada['mimetype'])
+            resp.set_etag(entrada['etag'])
+            resp.headers['Cache-Control'] = 'no-cache'  # El navegador siempre revalida (barato: 304)
+            return resp.make_conditional(request)
+        return envoltura
+    return decorador
+
+
+def _sucursal_de_movil(movil):
+    return 'SANTIAGO' if movil in MOVILES_SANTIAGO else 'CHIRIQUI'
+
+
 @app.route('/health')
 def health_check():
     """Ruta de salud para Render"""
     return jsonify({"status": "ok", "service": "stockware-portal"}), 200
 
 @app.route('/')
+@respuesta_cacheada('CHIRIQUI')
 def index():
     status = "OK"
     engine = DB_TYPE
@@ -125,9 +202,10 @@ def index():
             productos = [p for p in productos if p[1] != '4-4-654']
             
             # MODIFICADO: Usar nombres del Excel en vez de nombres largos de BD
+            catalogo = obtener_catalogo()
             productos_excel = []
             for nombre_largo, sku, cantidad in productos:
-                nombre_excel = SKU_TO_EXCEL_NAME.get(sku, nombre_largo)  # Fallback a nombre largo si no está en mapeo
+                nombre_excel = catalogo.nombres_excel.get(sku, nombre_largo)  # Fallback a nombre largo si no está en mapeo
                 productos_excel.append((nombre_excel, sku, cantidad))
             
             details_moviles = obtener_detalles_moviles()
@@ -148,15 +226,17 @@ def index():
             details_moviles = {}
             tecnicos = []
 
+    if status != "OK":
+        no_cachear()
     try:
         return render_template('index.html', 
                                  hoy=date.today().isoformat(), 
                                  moviles=moviles if 'moviles' in locals() else [], 
                                  productos=productos_excel if 'productos_excel' in locals() else [],
                                  details_moviles=json.dumps(details_moviles if 'details_moviles' in locals() else {}),
-                                 sku_to_excel_name=json.dumps(SKU_TO_EXCEL_NAME),
-                                 paquetes=json.dumps(PAQUETES_MATERIALES),
-                                 materiales_compartidos=json.dumps(MATERIALES_COMPARTIDOS),
+                                 sku_to_excel_name=json.dumps(_nombres_excel()),
+                                 paquetes=json.dumps(dict(obtener_catalogo().paquetes)),
+                                 materiales_compartidos=json.dumps(sorted(obtener_catalogo().compartidos)),
                                  tecnicos=tecnicos if 'tecnicos' in locals() else [],
                                  db_status=status,
                                  db_engine=engine,
@@ -164,9 +244,11 @@ def index():
                                  count_m=count_m,
                                  count_p=count_p)
     except Exception as template_err:
+        no_cachear()
         return f"<h1>⚠️ Error de Servidor</h1><p>Estado: {status}</p><p>Detalle: {error_detail}</p><p>Template: {str(template_err)}</p>"
 
 @app.route('/santiago')
+@respuesta_cacheada('SANTIAGO')
 def santiago():
     """Página principal del Portal Santiago (Consumo Directo)"""
     status = "OK"
@@ -182,9 +264,10 @@ def santiago():
         stock_map = {sku: cantidad for _, sku, cantidad in raw_stock}
         
         from config import PRODUCTOS_INICIALES
+        con_serial = obtener_catalogo().con_serial
         for name_excel, sku, _ in PRODUCTOS_INICIALES:
             cantidad = stock_map.get(sku, 0)
-            es_equipo = sku in PRODUCTOS_CON_CODIGO_BARRA
+            es_equipo = sku in con_serial
             productos_santiago.append({
                 "nombre": name_excel,
                 "sku": sku,
@@ -196,6 +279,7 @@ def santiago():
         status = "ERROR"
         error_detail = str(e)
         logger.error(f"Error cargando portal Santiago: {e}")
+        no_cachear()
  
     try:
         return render_template('santiago.html',
@@ -204,14 +288,16 @@ def santiago():
                                productos=productos_santiago,
                                details_moviles=json.dumps(obtener_detalles_moviles()),
                                tecnicos=obtener_tecnicos(solo_activos=True),
-                               sku_to_excel_name=json.dumps(SKU_TO_EXCEL_NAME),
+                               sku_to_excel_name=json.dumps(_nombres_excel()),
                                db_status=status,
                                error_detail=error_detail)
     except Exception as template_err:
         logger.error(f"Error renderizando santiago.html: {template_err}")
+        no_cachear()
         return f"<h1>⚠️ Error Santiago</h1><p>Status: {status}</p><p>Detail: {error_detail}</p><p>Template: {str(template_err)}</p>"
 
 @app.route('/modo_lunes')
+@respuesta_cacheada('CHIRIQUI')
 def modo_lunes():
     """Página del Plan B (Lunes) - Consumo Directo de Bodega"""
     status = "OK"
@@ -220,8 +306,9 @@ def modo_lunes():
     productos_materiales = []
     
     try:
-        from config import PRODUCTOS_INICIALES, PRODUCTOS_CON_CODIGO_BARRA
+        from config import PRODUCTOS_INICIALES
         from database import obtener_todos_los_skus_para_movimiento
+        con_serial = obtener_catalogo().con_serial
         
         # Obtenemos stock actual para mostrar referencias si es necesario
         raw_stock = obtener_todos_los_skus_para_movimiento()
@@ -237,7 +324,7 @@ def modo_lunes():
                 "stock_bodega": stock_map.get(sku, 0)
             }
             
-            if sku in PRODUCTOS_CON_CODIGO_BARRA:
+            if sku in con_serial:
                 productos_equipos.append(p_data)
             else:
                 productos_materiales.append(p_data)
@@ -255,6 +342,7 @@ def modo_lunes():
         moviles = []
         details_moviles = {}
         tecnicos = []
+        no_cachear()
 
     try:
         return render_template('modo_lunes.html',
@@ -264,11 +352,12 @@ def modo_lunes():
                                materiales=productos_materiales,
                                details_moviles=json.dumps(details_moviles),
                                tecnicos=tecnicos,
-                               sku_to_excel_name=json.dumps(SKU_TO_EXCEL_NAME),
+                               sku_to_excel_name=json.dumps(_nombres_excel()),
                                db_status=status,
                                error_detail=error_detail)
     except Exception as template_err:
         logger.error(f"Error renderizando modo_lunes.html: {template_err}")
+        no_cachear()
         return f"<h1>⚠️ Error Modo Lunes</h1><p>Status: {status}</p><p>Detail: {error_detail}</p><p>Template: {str(template_err)}</p>"
 
 
@@ -278,59 +367,7 @@ def registrar_lunes_post():
     data = request.json
     if not data:
         return jsonify({"exito": False, "mensaje": "Sin datos"})
-
-    try:
-        exitos = 0
-        materiales = data.get('materiales', [])
-        movil = data.get('movil')
-        tecnico = data.get('tecnico')
-        ayudante = data.get('ayudante')
-        ticket = data.get('contrato')
-        fecha = data.get('fecha', date.today().isoformat())
-
-        from database import verificar_seriales_bodega, registrar_consumo_directo
-        from config import MYSQL_DB, MOVILES_SANTIAGO
-
-        for item in materiales:
-            sku = item['sku']
-            cantidad = item.get('cantidad', 1)
-            seriales = item.get('seriales', [])
-            
-            # 1. DETERMINAR SUCURSAL SEGÚN EL MÓVIL SELECCIONADO
-            sucursal_ctx = 'SANTIAGO' if movil in MOVILES_SANTIAGO else 'CHIRIQUI'
-            target_db_ctx = MYSQL_DB
-
-            # 2. VALIDAR SERIALES
-            if seriales:
-                ok_v, msg_v = verificar_seriales_bodega(seriales, sucursal_context=sucursal_ctx, target_db=target_db_ctx)
-                if not ok_v:
-                    return jsonify({"exito": False, "mensaje": msg_v})
-
-            # 3. REGISTRAR COMO CONSUMO DIRECTO (DESCUENTA DE BODEGA)
-            exito, msg = registrar_consumo_directo(
-                sku=sku,
-                cantidad=cantidad,
-                movil=movil,
-                tecnico=tecnico,
-                ayudante=ayudante,
-                ticket=ticket,
-                fecha_evento=fecha,
-                seriales=seriales,
-                observaciones=f"Plan B Lunes - Ticket {ticket}",
-                target_db=target_db_ctx,
-                sucursal_context=sucursal_ctx
-            )
-            
-            if not exito:
-                raise Exception(f"Error en {sku}: {msg}")
-            
-            exitos += 1
-            
-        return jsonify({"exito": True, "mensaje": f"Reporte de Lunes procesado correctamente ({exitos} equipos)."})
-
-    except Exception as e:
-        logger.error(f"Error en registrar_lunes: {e}")
-        return jsonify({"exito": False, "mensaje": str(e)})
+    return jsonify(_aplicar_envio('registrar_lunes', data, _clave_envio(data)))
 
 @app.route('/registrar_santiago', methods=['POST'])
 def registrar_santiago_post():
@@ -338,58 +375,77 @@ def registrar_santiago_post():
     data = request.json
     if not data:
         return jsonify({"exito": False, "mensaje": "Sin datos"})
+    return jsonify(_aplicar_envio('registrar_santiago', data, _clave_envio(data)))
 
-    try:
-        exitos = 0
-        materiales = data.get('materiales', [])
-        movil = data.get('movil')
-        tecnico = data.get('tecnico')
-        ticket = data.get('contrato')
-        fecha = data.get('fecha', date.today().isoformat())
-
-        from database import verificar_seriales_bodega
-        from config import MYSQL_DB as _MYSQL_DB
 
+def _registrar_consumo_portal(data, clave, ruta, observacion, mensaje_ok):
+    """
+    Consumo directo desde BODEGA de todo el formulario en UNA transacción:
+    o se descuentan todos los materiales (y se guarda la clave del envío) o ninguno.
+    """
+    from database import get_db_connection, close_connection, verificar_seriales_bodega, registrar_consumo_directo, guardar_respuesta_envio
+    from config import MYSQL_DB
+
+    materiales = data.get('materiales', [])
+    movil = data.get('movil')
+    ticket = data.get('contrato')
+    fecha = data.get('fecha', date.today().isoformat())
+    # 1. DETERMINAR SUCURSAL SEGÚN EL MÓVIL SELECCIONADO (forzando la DB de Render)
+    sucursal_ctx = _sucursal_de_movil(movil)
+    conn = None
+    try:
+        # 2. VALIDAR SERIALES/MACs (EQUIPOS) antes de abrir la transacción
         for item in materiales:
-            sku = item['sku']
-            cantidad = item.get('cantidad', 1)
-            seriales = item.get('seriales', [])
-            
-            # 1. DETERMINAR CONTEXTO Y DB
-            sucursal_ctx = 'SANTIAGO' if movil in MOVILES_SANTIAGO else 'CHIRIQUI'
-            # Forzar DB correcta de Render para evitar 'inventario_santiago'
-            target_db_ctx = _MYSQL_DB
-
-            # 2. VALIDAR SERIALES/MACs (EQUIPOS)
-            if seriales:
-                ok_v, msg_v = verificar_seriales_bodega(seriales, sucursal_context=sucursal_ctx, target_db=target_db_ctx)
+            if item.get('seriales'):
+                ok_v, msg_v = verificar_seriales_bodega(item['seriales'], sucursal_context=sucursal_ctx, target_db=MYSQL_DB)
                 if not ok_v:
-                    return jsonify({"exito": False, "mensaje": msg_v})
+                    return {"exito": False, "mensaje": msg_v}
 
-            # 3. REGISTRAR
+        # 3. REGISTRAR COMO CONSUMO DIRECTO (DESCUENTA DE BODEGA)
+        conn = get_db_connection(target_db=MYSQL_DB)
+        for item in materiales:
+            sku = item['sku']
             exito, msg = registrar_consumo_directo(
                 sku=sku,
-                cantidad=cantidad,
+                cantidad=item.get('cantidad', 1),
                 movil=movil,
-                tecnico=tecnico,
+                tecnico=data.get('tecnico'),
+                ayudante=data.get('ayudante'),
                 ticket=ticket,
                 fecha_evento=fecha,
-                seriales=seriales,
-                observaciones=f"Consumo Web Santiago - Ticket {ticket}",
-                target_db=target_db_ctx,
-                sucursal_context=sucursal_ctx
+                seriales=item.get('seriales', []),
+                observaciones=f"{observacion} - Ticket {ticket}",
+                target_db=MYSQL_DB,
+                sucursal_context=sucursal_ctx,
+                existing_conn=conn
             )
-            
             if not exito:
                 raise Exception(f"Error en {sku}: {msg}")
-            
-            exitos += 1
-            
-        return jsonify({"exito": True, "mensaje": f"Consumo registrado exitosamente ({exitos} items)."})
+
+        respuesta = {"exito": True, "mensaje": mensaje_ok.format(n=len(materiales))}
+        if clave:
+            cursor = conn.cursor(buffered=True) if DB_TYPE == 'MYSQL' else conn.cursor()
+            guardar_respuesta_envio(cursor, clave, ruta, respuesta)
+        conn.commit()
+        invalidar_cache_sucursal(sucursal_ctx)
+        return respuesta
 
     except Exception as e:
-        logger.error(f"Error en registrar_santiago: {e}")
-        return jsonify({"exito": False, "mensaje": str(e)})
+        if conn: conn.rollback()
+        logger.error(f"Error en {ruta}: {e}")
+        return {"exito": False, "mensaje": str(e)}
+    finally:
+        if conn: close_connection(conn)
+
+
+def _registrar_lunes(data, clave=None):
+    return _registrar_consumo_portal(data, clave, 'registrar_lunes', "Plan B Lunes",
+                                     "Reporte de Lunes procesado correctamente ({n} equipos).")
+
+
+def _registrar_santiago(data, clave=None):
+    return _registrar_consumo_portal(data, clave, 'registrar_santiago', "Consumo Web Santiago",
+                                     "Consumo registrado exitosamente ({n} items).")
 
 @app.route('/api/validar_serial')
 def api_validar_serial():
@@ -416,11 +472,11 @@ def api_validar_serial():
         
         clean_sn = serial.upper()
         
-        # Verificar la existencia, ubicación y SKU
+        # Verificar la existencia, ubicación y SKU (columnas normalizadas indexadas)
         sql = """
             SELECT sku, ubicacion, estado 
             FROM series_registradas 
-            WHERE (UPPER(serial_number) = ? OR UPPER(mac_number) = ?)
+            WHERE (serial_norm = ? OR mac_norm = ?)
             AND sucursal = ?
         """
         run_query(cursor, sql, (clean_sn, clean_sn, sucursal))
@@ -455,6 +511,42 @@ def api_validar_serial():
         if conn:
             conn.close()
 
+@app.route('/api/validar_seriales', methods=['POST'])
+def api_validar_seriales():
+    """
+    Valida varios seriales/MACs en una sola petición.
+    Body: {"movil": ..., "sku": opcional, "seriales": [serial | {"serial": ..., "sku": ...}]}
+    """
+    data = request.json or {}
+    seriales = data.get('seriales') or []
+    movil = str(data.get('movil') or '').strip()
+
+    if not seriales or not movil:
+        return jsonify({"exito": False, "mensaje": "Falta la lista de seriales o el móvil para validación."})
+    if len(seriales) > 500:
+        return jsonify({"exito": False, "mensaje": "Máximo 500 seriales por validación."})
+
+    try:
+        from database import validar_seriales_lote
+        from config import MOVILES_SANTIAGO, MYSQL_DB
+
+        sucursal = 'SANTIAGO' if movil in MOVILES_SANTIAGO else 'CHIRIQUI'
+        # Misma DB forzada que /api/validar_serial
+        ok, resultados = validar_seriales_lote(
+            seriales, sucursal_context=sucursal,
+            sku_esperado=(str(data.get('sku') or '').strip() or None),
+            target_db=MYSQL_DB
+        )
+        if not ok:
+            return jsonify({"exito": False, "mensaje": f"Error verificando: {resultados}"})
+
+        invalidos = [r for r in resultados if r['estado'] != 'OK']
+        mensaje = "Validado" if not invalidos else f"{len(invalidos)} de {len(resultados)} seriales con problemas."
+        return jsonify({"exito": not invalidos, "mensaje": mensaje, "resultados": resultados})
+
+    except Exception as e:
+        return jsonify({"exito": False, "mensaje": f"Error verificando: {e}"})
+
 @app.route('/debug/productos')
 def debug_productos():
     """Endpoint de diagnóstico para verificar productos en BD"""
@@ -578,127 +670,26 @@ def debug_asignaciones():
 
 
 @app.route('/api/inventario/<movil>')
+@respuesta_cacheada(_sucursal_de_movil)
 def get_inventario_movil(movil):
     """
     API para obtener inventario del técnico con seriales disponibles.
     Retorna JSON con inventario actual del móvil.
-    Los MATERIALES_COMPARTIDOS aparecen en AMBOS paquetes (A y B).
+    Los materiales compartidos del catálogo aparecen en AMBOS paquetes (A y B).
+    Se sirve desde el snapshot precalculado del móvil (se recalcula solo si hubo movimientos).
     """
-    from database import get_db_connection, run_query
-    from config import PRODUCTOS_CON_CODIGO_BARRA, MATERIALES_COMPARTIDOS
+    from database import obtener_inventario_movil_snapshot
+    from config import MOVILES_SANTIAGO
     
     try:
-        # Detectar DB correcta (Chiriquí o Santiago)
-        target_db = None
-        from config import MOVILES_SANTIAGO
-        if movil in MOVILES_SANTIAGO:
-            pass
-            
-        conn = get_db_connection(target_db=target_db)
-        cursor = conn.cursor()
-        
         # DETERMINAR FILTRO DE SUCURSAL
         sucursal_ctx = 'SANTIAGO' if movil in MOVILES_SANTIAGO else 'CHIRIQUI'
 
-        # 0. OBTENER SKUS GLOBALES (NUEVO)
-        run_query(cursor, "SELECT sku FROM productos_globales WHERE sucursal = ?", (sucursal_ctx,))
-        skus_globales = [r[0] for r in cursor.fetchall()]
-
-        # Obtener TODAS las asignaciones del móvil (FILTRADO POR SUCURSAL)
-        # HAVING > 0: No mostrar ítems con cantidad 0 (evita registros residuales)
-        sql_asignacion = """
-            SELECT (SELECT p2.nombre FROM productos p2 WHERE p2.sku = a.sku_producto AND p2.sucursal = ? LIMIT 1) as nombre,
-                   a.sku_producto, SUM(a.cantidad) as total, COALESCE(a.paquete, 'NINGUNO') as paquete
-            FROM asignacion_moviles a
-            WHERE a.movil = ? AND a.sucursal = ?
-            GROUP BY a.sku_producto, COALESCE(a.paquete, 'NINGUNO')
-            HAVING SUM(a.cantidad) > 0
-        """
-        run_query(cursor, sql_asignacion, (sucursal_ctx, movil, sucursal_ctx))
-        asignacion_rows = cursor.fetchall()
-        logger.info(f"[INVENTARIO API] Móvil={movil}, Sucursal={sucursal_ctx}, Items encontrados={len(asignacion_rows)}")
-        
-        # Agrupar por SKU para poder calcular totales de compartidos
-        # Estructura: {sku: {paquete: cantidad, ...}}
-        por_sku = {}
-        nombres_sku = {}
-        for nombre, sku, cantidad, paquete in asignacion_rows:
-            nombres_sku[sku] = nombre
-            if sku not in por_sku:
-                por_sku[sku] = {}
-            por_sku[sku][paquete] = por_sku[sku].get(paquete, 0) + cantidad
-
-        # Construir inventario final
-        inventario = []
-        
-        for nombre, sku, cantidad, paquete in asignacion_rows:
-            nombre_final = nombres_sku.get(sku, nombre or sku)
-            
-            if sku in PRODUCTOS_CON_CODIGO_BARRA:
-                # FILTRO CRÍTICO: Buscar seriales SOLO de este paquete específico para este SKU y SUCURSAL
-                # Restaurado a petición del usuario: Es vital mantener la separación estricta entre paquetes (días).
-                sql_series = """
-                    SELECT serial_number 
-                    FROM series_registradas 
-                    WHERE sku = ? AND ubicacion = ? AND COALESCE(paquete, 'NINGUNO') = ? AND sucursal = ?
-                    ORDER BY serial_number
-                """
-                pq_query = paquete if paquete else 'NINGUNO'
-                run_query(cursor, sql_series, (sku, movil, pq_query, sucursal_ctx))
-                seriales = [row[0] for row in cursor.fetchall()]
-                
-                # SI ES GLOBAL: Sobre-escribir cantidad con la de BODEGA
-                final_qty_s = len(seriales)
-                if sku in skus_globales:
-                     run_query(cursor, "SELECT cantidad FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ? LIMIT 1", (sku, sucursal_ctx))
-                     res_b_s = cursor.fetchone()
-                     if res_b_s: final_qty_s = res_b_s[0]
-
-                inventario.append({
-                    "sku": sku, "nombre": nombre_final, "paquete": paquete,
-                    "seriales": seriales, "cantidad_total": final_qty_s,
-                    "tiene_series": True, "compartido": (sku in MATERIALES_COMPARTIDOS or sku in skus_globales or paquete == 'PERSONALIZADO'),
-                    "es_global": sku in skus_globales
-                })
-            else:
-                # SI ES GLOBAL: Sobre-escribir cantidad con la de BODEGA
-                final_qty_ns = cantidad
-                if sku in skus_globales:
-                     run_query(cursor, "SELECT cantidad FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ? LIMIT 1", (sku, sucursal_ctx))
-                     res_b_ns = cursor.fetchone()
-                     if res_b_ns: final_qty_ns = res_b_ns[0]
-
-                inventario.append({
-                    "sku": sku, "nombre": nombre_final, "paquete": paquete,
-                    "cantidad_total": final_qty_ns, "tiene_series": False, 
-                    "compartido": (sku in MATERIALES_COMPARTIDOS or sku in skus_globales or paquete == 'PERSONALIZADO'),
-                    "es_global": sku in skus_globales
-                })
-
-        # --- SECCION: INYECTAR PRODUCTOS GLOBALES FALTANTES (NUEVO) ---
-        # Si un producto es global pero no tiene NINGUNA asignación en el móvil, 
-        # lo agregamos manualmente desde la bodega para que el técnico lo vea.
-        skus_en_inventario = {item['sku'] for item in inventario}
-        for g_sku in skus_globales:
-            if g_sku not in skus_en_inventario:
-                # Obtener stock de bodega
-                run_query(cursor, "SELECT nombre, cantidad FROM productos WHERE sku = ? AND ubicacion = 'BODEGA' AND sucursal = ?", (g_sku, sucursal_ctx))
-                res_g = cursor.fetchone()
-                if res_g:
-                    nombre_g, cant_g = res_g
-                    # Lo agregamos para ambos paquetes A y B
-                    for p_tag in ['PAQUETE A', 'PAQUETE B']:
-                        inventario.append({
-                            "sku": g_sku, 
-                            "nombre": SKU_TO_EXCEL_NAME.get(g_sku, nombre_g), 
-                            "paquete": p_tag,
-                            "cantidad_total": cant_g, 
-                            "tiene_series": False, 
-                            "compartido": True,
-                            "es_global": True
-                        })
-        
-        conn.close()
+        inventario, desde_snapshot = obtener_inventario_movil_snapshot(
+            movil, sucursal_context=sucursal_ctx, nombres_globales=obtener_catalogo().nombres_excel
+        )
+        logger.info(f"[INVENTARIO API] Móvil={movil}, Sucursal={sucursal_ctx}, Items encontrados={len(inventario)}, Snapshot={'HIT' if desde_snapshot else 'MISS'}")
+
         return jsonify({
             "movil": movil,
             "inventario": inventario,
@@ -713,11 +704,132 @@ def get_inventario_movil(movil):
         }), 500
 
 
+@app.route('/metrics')
+def metrics():
+    """Métricas del pool de conexiones en formato Prometheus (en uso, esperas, errores...)."""
+    from utils.db_connector import obtener_estadisticas_pool
+    from utils.db_pool import metricas_prometheus
+    return Response(metricas_prometheus(obtener_estadisticas_pool()), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/consultas')
+def metrics_consultas():
+    """Top de consultas SQL de este proceso (?orden=total|llamadas|max|media&top=N&formato=json)."""
+    from utils import query_stats
+    orden = request.args.get('orden', 'total')
+    top = request.args.get('top', 20, type=int)
+    filas = query_stats.reporte(top, orden)
+    if request.args.get('formato') == 'json':
+        return jsonify({'activo': query_stats.QUERY_STATS_ACTIVO, 'umbral_ms': query_stats.SLOW_QUERY_MS, 'consultas': filas})
+    return Response(query_stats.formatear_reporte(filas), mimetype='text/plain')
+
+
+# ─────────────────────────────────────────────────────────
+# EVENTOS EN VIVO (Server-Sent Events sobre el feed de cambios)
+# ─────────────────────────────────────────────────────────
+# Cada stream ocupa un hilo del worker gthread (8 en render.yaml) durante toda su
+# duración: el tope deja la mayoría de los hilos para index/registrar. El cliente
+# recibe 503 al superarlo (EventSource no reintenta) y la página sigue sin vivo.
+# EventSource reconecta solo al cumplirse la duración y retoma desde Last-Event-ID.
+SSE_MAX_CLIENTES = int(os.environ.get('SSE_MAX_CLIENTES', 2))
+SSE_DURACION_MAX_SEG = 300
+SSE_LATIDO_SEG = 15
+SSE_COLA_MAX = 1000
+_sse_clientes = [0]
+_sse_lock = threading.Lock()
+
+
+def _evento_sse(evento):
+    datos = {
+        'id': evento['id'], 'sucursal': evento['sucursal'], 'sku': evento['sku'],
+        'movil': evento['ubicacion'], 'paquete': evento['paquete'],
+        'delta': evento['delta'], 'origen': evento['origen'],
+    }
+    return f"id: {evento['id']}\nevent: cambio\ndata: {json.dumps(datos, default=str)}\n\n"
+
+
+@app.route('/events')
+def events():
+    """
+    Stream SSE de cambios de inventario: ?sucursal=CHIRIQUI|SANTIAGO (todas si se omite).
+    Con Last-Event-ID (o ?desde=<id>) primero reenvía lo que el cliente se perdió.
+    Si el cliente se atrasa demasiado recibe 'event: reset' y debe recargar completo.
+    """
+    import queue
+    from database import DifusorCambios, changes_since
+    sucursal = (request.args.get('sucursal') or '').upper() or None
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    try:
+        desde = int(desde) if desde else None
+    except ValueError:
+        desde = None
+
+    with _sse_lock:
+        if _sse_clientes[0] >= SSE_MAX_CLIENTES:
+            return Response("Demasiados clientes en vivo", status=503, headers={'Retry-After': '30'})
+        _sse_clientes[0] += 1
+
+    cola = queue.Queue(maxsize=SSE_COLA_MAX)
+
+    def _encolar(eventos):
+        try:
+            cola.put_nowait(eventos)
+        except queue.Full:
+            pass  # El generador detecta la cola llena y manda 'reset'
+
+    difusor = DifusorCambios.obtener()
+    token = difusor.suscribir(_encolar, sucursal)
+    liberado = []
+
+    def _liberar():
+        # Desde el generador o desde call_on_close (si el cliente se fue antes del primer byte)
+        with _sse_lock:
+            if liberado:
+                return
+            liberado.append(True)
+            _sse_clientes[0] -= 1
+        difusor.desuscribir(token)
+
+    def generar():
+        reenviados = set()
+        try:
+            yield "retry: 3000\n\n"
+            if desde is not None:
+                # Suscrito antes de reenviar: lo que llegue en vivo y ya se reenvió se descarta por id
+                _, perdidos = changes_since(desde, sucursal)
+                for evento in perdidos:
+                    reenviados.add(evento['id'])
+                    yield _evento_sse(evento)
+
+            fin = time.monotonic() + SSE_DURACION_MAX_SEG
+            while time.monotonic() < fin:
+                if cola.full():
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+                try:
+                    eventos = cola.get(timeout=SSE_LATIDO_SEG)
+                except queue.Empty:
+                    yield ": latido\n\n"
+                    continue
+                # El difusor ya no repite ids, pero puede entregar uno menor confirmado tarde
+                for evento in eventos:
+                    if evento['id'] not in reenviados:
+                        yield _evento_sse(evento)
+        finally:
+            _liberar()
+
+    respuesta = Response(generar(), mimetype='text/event-stream',
+                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    respuesta.call_on_close(_liberar)
+    return respuesta
+
+
 @app.route('/debug')
 def debug():
     import os
     from config import MYSQL_HOST, MYSQL_USER, DB_TYPE
     from database import get_db_connection
+    from utils.db_connector import obtener_estadisticas_pool
     
     test_conn = "SIN PROBAR"
     test_error = ""
@@ -737,7 +849,8 @@ def debug():
         "CONEXION_REAL": test_conn,
         "ERROR_CONEXION": test_error,
         "ENV_EXISTS": os.path.exists('.env'),
-        "DIRECTORIO": os.getcwd()
+        "DIRECTORIO": os.getcwd(),
+        "POOL": obtener_estadisticas_pool()
     }
     return jsonify(info)
 
@@ -746,8 +859,27 @@ def registrar_bulk():
     data = request.json
     if not data:
         return jsonify({"exito": False, "mensaje": "Sin datos"})
-
-    from database import get_db_connection, run_query
+    clave = _clave_envio(data)
+
+    # Un envío normal (pocas líneas) se procesa en el mismo request, sin fila de trabajo.
+    # Solo los lotes grandes corren en el pool: el worker de gunicorn espera poco y,
+    # si no terminó, responde 202 con el id del trabajo para que el teléfono consulte.
+    materiales = data.get('materiales', [])
+    tamano = len(materiales) + sum(len(m.get('seriales') or []) for m in materiales if isinstance(m, dict))
+    if tamano <= BULK_INLINE_MAX_ITEMS:
+        return jsonify(_aplicar_envio('registrar_bulk', data, clave))
+
+    id_trabajo, futuro = _encolar_trabajo(
+        'registrar_bulk', lambda reportar: _aplicar_envio('registrar_bulk', data, clave),
+        total=len(data.get('materiales', []))
+    )
+    if not id_trabajo:
+        return jsonify(_aplicar_envio('registrar_bulk', data, clave))
+    return _respuesta_trabajo(id_trabajo, futuro)
+
+
+def _registrar_bulk(data, clave=None):
+    from database import get_db_connection, run_query, guardar_respuesta_envio
     import json
     conn = None
     try:
@@ -761,15 +893,18 @@ def registrar_bulk():
         else:
             sucursal_ctx = 'CHIRIQUI'
 
-        print(f"[ROUTING] Bulk de {movil} -> Sucursal: {sucursal_ctx} (DB: {target_db or 'Default'})")
+        logger.debug(f"[ROUTING] Bulk de {movil} -> Sucursal: {sucursal_ctx} (DB: {target_db or 'Default'})")
         logger.info(f"[CONSUMO WEB] Móvil={movil}, Sucursal={sucursal_ctx}, Items={len(data.get('materiales', []))}, Ticket={data.get('contrato')}")
             
         conn = get_db_connection(target_db=target_db)
         cursor = conn.cursor()
         
-        exitos = 0
         materiales = data.get('materiales', [])
+        obs = f"Consumo Web - Ticket: {data.get('contrato')} - Colilla: {data.get('colilla')}"
         
+        lote = []
+        filas_consumo = []
+        seriales_consumidos = []
         for item in materiales:
             sku = item['sku']
             # Extraer seriales si existen
@@ -777,42 +912,15 @@ def registrar_bulk():
             seriales_json = json.dumps(seriales) if seriales else None
             cantidad = item.get('cantidad', len(seriales) if seriales else 0)
             
-            # 1. DEDUCCIÓN INMEDIATA DEL STOCK (Para que funcione Offline/PC Apagada)
-            try:
-                # Importar función de movimiento (asegurar que está disponible)
-                from database import registrar_movimiento_gui
-                
-                # Crear observación
-                obs = f"Consumo Web - Ticket: {data.get('contrato')} - Colilla: {data.get('colilla')}"
-                
-                # Registrar movimiento REAL inmediatamente
-                exito_mov, msg_mov = registrar_movimiento_gui(
-                    sku=sku,
-                    tipo_movimiento='CONSUMO_MOVIL',
-                    cantidad_afectada=cantidad,
-                    movil_afectado=data['movil'],
-                    fecha_evento=data['fecha'],
-                    paquete_asignado=None, # Modificado: Forzar auto-deducción inteligente de stock global del móvil
-                    observaciones=obs,
-                    documento_referencia=data.get('contrato'),
-                    existing_conn=conn, # Usar misma conexión
-                    sucursal_context=sucursal_ctx
-                )
-                
-                if not exito_mov:
-                    raise Exception(f"Fallo al descontar {sku}: {msg_mov}")
-                    
-            except Exception as e:
-                # Si falla la deducción, abortamos todo el bloque
-                raise Exception(f"Error procesando {sku}: {str(e)}")
-
-            # 2. CREAR REGISTRO DE AUDITORÍA (AUTO_APROBADO)
-            # Esto permite que en la PC se vea el registro, pero marcado como ya procesado
-            run_query(cursor, """
-                INSERT INTO consumos_pendientes 
-                (movil, sku, cantidad, tecnico_nombre, ayudante_nombre, ticket, fecha, colilla, num_contrato, seriales_usados, estado, paquete, sucursal)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'AUTO_APROBADO', ?, ?)
-            """, (
+            lote.append({
+                'sku': sku,
+                'tipo_movimiento': 'CONSUMO_MOVIL',
+                'cantidad_afectada': cantidad,
+                'movil_afectado': data['movil'],
+                'paquete_asignado': None, # Forzar auto-deducción inteligente de stock global del móvil
+                'observaciones': obs,
+            })
+            filas_consumo.append((
                 data['movil'],
                 sku,
                 cantidad,
@@ -826,29 +934,212 @@ def registrar_bulk():
                 data.get('paquete', 'NINGUNO'),
                 sucursal_ctx
             ))
-            
-            # 3. Actualizar ubicación de series a CONSUMIDO (Redundante si registrar_movimiento lo hace, pero seguro)
-            if seriales:
-                print(f"[WEB] Actualizando {len(seriales)} series a CONSUMIDO para {sku} en {sucursal_ctx}")
-                for serial in seriales:
-                    run_query(cursor, """
-                        UPDATE series_registradas
-                        SET ubicacion = 'CONSUMIDO'
-                        WHERE serial_number = ? AND sucursal = ?
-                    """, (serial, sucursal_ctx))
-            
-            exitos += 1
+            seriales_consumidos.extend(seriales)
+        
+        # 1. DEDUCCIÓN INMEDIATA DEL STOCK (Para que funcione Offline/PC Apagada)
+        #    Un solo lote atómico: si una línea falla, se aborta todo el bloque.
+        from database import registrar_movimientos_batch, run_many, registrar_series_consumo
+        exito_mov, msg_mov, resultados = registrar_movimientos_batch(
+            lote,
+            fecha_evento=data['fecha'],
+            documento_referencia=data.get('contrato'),
+            existing_conn=conn, # Usar misma conexión
+            sucursal_context=sucursal_ctx
+        )
+        if not exito_mov:
+            fallido = next((i for i, r in enumerate(resultados) if not r[0]), 0)
+            sku_fallido = lote[fallido]['sku'] if lote else ''
+            raise Exception(f"Error procesando {sku_fallido}: Fallo al descontar {sku_fallido}: {msg_mov}")
+
+        # 2. CREAR REGISTRO DE AUDITORÍA (AUTO_APROBADO)
+        # Esto permite que en la PC se vea el registro, pero marcado como ya procesado.
+        # Las filas con seriales van una a una para enlazar su id en consumo_series.
+        sql_consumo = """
+            INSERT INTO consumos_pendientes 
+            (movil, sku, cantidad, tecnico_nombre, ayudante_nombre, ticket, fecha, colilla, num_contrato, seriales_usados, estado, paquete, sucursal)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'AUTO_APROBADO', ?, ?)
+        """
+        bloque = []
+        for fila, item in zip(filas_consumo, materiales):
+            if not item.get('seriales'):
+                bloque.append(fila)
+                continue
+            run_many(cursor, sql_consumo, bloque)
+            bloque = []
+            run_query(cursor, sql_consumo, fila)
+            registrar_series_consumo(cursor, sucursal_ctx, item['seriales'], consumo_id=cursor.lastrowid)
+        run_many(cursor, sql_consumo, bloque)
         
+        # 3. Actualizar ubicación de series a CONSUMIDO (Redundante si registrar_movimiento lo hace, pero seguro)
+        if seriales_consumidos:
+            logger.info(f"[WEB] Actualizando {len(seriales_consumidos)} series a CONSUMIDO en {sucursal_ctx}")
+            normas = sorted({str(s).strip().upper() for s in seriales_consumidos if s and str(s).strip()})
+            for i in range(0, len(normas), 200):
+                bloque = normas[i:i + 200]
+                ph = ','.join(['?'] * len(bloque))
+                run_query(cursor, f"""
+                    UPDATE series_registradas
+                    SET ubicacion = 'CONSUMIDO'
+                    WHERE (serial_norm IN ({ph}) OR mac_norm IN ({ph})) AND sucursal = ?
+                """, tuple(bloque + bloque + [sucursal_ctx]))
+        
+        exitos = len(lote)
+        respuesta = {"exito": True, "mensaje": f"Consumo procesado y descontado exitosamente ({exitos} items)"}
+
+        # 4. Clave del envío en la misma transacción: un reintento no vuelve a descontar
+        if clave:
+            guardar_respuesta_envio(cursor, clave, 'registrar_bulk', respuesta)
+
         conn.commit()
-        return jsonify({"exito": True, "mensaje": f"Consumo procesado y descontado exitosamente ({exitos} items)"})
+        invalidar_cache_sucursal(sucursal_ctx)
+        return respuesta
 
     except Exception as e:
         if conn: conn.rollback()
-        return jsonify({"exito": False, "mensaje": f"Error de base de datos: {str(e)}"})
+        return {"exito": False, "mensaje": f"Error de base de datos: {str(e)}"}
     finally:
         if conn: conn.close()
 
+
+# ─────────────────────────────────────────────────────────
+# ENVÍOS IDEMPOTENTES (cola offline del portal)
+# ─────────────────────────────────────────────────────────
+MAX_ENVIOS_LOTE = 50
+
+_REGISTRADORES_PORTAL = {
+    'registrar_bulk': _registrar_bulk,
+    'registrar_lunes': _registrar_lunes,
+    'registrar_santiago': _registrar_santiago,
+}
+
+
+def _clave_envio(data):
+    """Clave de idempotencia: cabecera Idempotency-Key o campo 'clave_envio' del cuerpo."""
+    clave = request.headers.get('Idempotency-Key') or (data or {}).get('clave_envio') or ''
+    return str(clave).strip()[:64] or None
+
+
+def _aplicar_envio(ruta, data, clave=None):
+    """Aplica un envío del portal una sola vez por clave; un reintento recibe la respuesta original."""
+    from database import asegurar_tabla_envios, obtener_respuesta_envio
+    if clave and not asegurar_tabla_envios():
+        clave = None  # Sin tabla de claves se procesa como antes
+    if clave:
+        previa = obtener_respuesta_envio(clave)
+        if previa is not None:
+            logger.info(f"[ENVÍO] {ruta} {clave} ya aplicado, se devuelve la respuesta original")
+            return dict(previa, duplicado=True)
+
+    respuesta = _REGISTRADORES_PORTAL[ruta](data, clave)
+    if clave and not respuesta.get('exito'):
+        # Si perdió la carrera contra un reintento simultáneo, el otro ya lo aplicó
+        previa = obtener_respuesta_envio(clave)
+        if previa is not None:
+            return dict(previa, duplicado=True)
+    return respuesta
+
+
+@app.route('/api/envios_lote', methods=['POST'])
+def api_envios_lote():
+    """
+    Vacía la cola offline del portal en un solo request.
+    Body: {"envios": [{"clave", "ruta", "datos"}, ...]}. Cada envío es su propia
+    transacción y se aplican en orden; los ya registrados no se repiten.
+    """
+    envios = (request.json or {}).get('envios') or []
+    if not envios:
+        return jsonify({"exito": False, "mensaje": "Sin envíos", "resultados": []})
+    if len(envios) > MAX_ENVIOS_LOTE:
+        return jsonify({"exito": False, "mensaje": f"Máximo {MAX_ENVIOS_LOTE} envíos por lote", "resultados": []})
+
+    resultados = []
+    for envio in envios:
+        ruta = envio.get('ruta')
+        clave = str(envio.get('clave') or '').strip()[:64] or None
+        if ruta not in _REGISTRADORES_PORTAL or not envio.get('datos'):
+            respuesta = {"exito": False, "mensaje": f"Envío inválido ({ruta})"}
+        else:
+            respuesta = _aplicar_envio(ruta, envio['datos'], clave)
+        resultados.append(dict(respuesta, clave=envio.get('clave')))
+
+    logger.info(f"[ENVÍOS LOTE] {len(resultados)} envíos, {sum(1 for r in resultados if r['exito'])} OK")
+    return jsonify({"exito": all(r['exito'] for r in resultados), "resultados": resultados})
+
+
+# ─────────────────────────────────────────────────────────
+# TRABAJOS EN SEGUNDO PLANO
+# ─────────────────────────────────────────────────────────
+# Pool propio del proceso: los trabajos largos no ocupan el worker sync de gunicorn
+# (timeout 90 s en render.yaml). El estado vive en trabajos_portal (data_layer/jobs.py).
+TRABAJOS_WORKERS = int(os.getenv('PORTAL_TRABAJOS_WORKERS', '2'))
+ESPERA_INLINE_SEG = 5          # Lo que el request espera antes de responder 202
+BULK_INLINE_MAX_ITEMS = int(os.getenv('PORTAL_BULK_INLINE_MAX', '40'))  # Líneas + seriales procesados sin trabajo
+INTERVALO_PROGRESO_SEG = 1     # Escrituras de progreso como máximo cada segundo
+
+_pool_trabajos = ThreadPoolExecutor(max_workers=TRABAJOS_WORKERS, thread_name_prefix='trabajo-portal')
+
+
+def _encolar_trabajo(tipo, funcion, total=0):
+    """
+    Registra el trabajo y lo lanza en el pool. 'funcion' recibe reportar(progreso, total=None)
+    y retorna un resultado serializable a JSON.
+    Retorna (id, future), o (None, None) si no hay tabla de trabajos (el llamador procesa en línea).
+    """
+    from database import asegurar_tabla_trabajos, crear_trabajo, actualizar_trabajo
+    if not asegurar_tabla_trabajos():
+        return None, None
+    id_trabajo = crear_trabajo(tipo, total=total)
+    if not id_trabajo:
+        return None, None
+
+    ultimo_reporte = [0.0]
+
+    def reportar(progreso, total=None):
+        ahora = time.monotonic()
+        if ahora - ultimo_reporte[0] >= INTERVALO_PROGRESO_SEG:
+            ultimo_reporte[0] = ahora
+            actualizar_trabajo(id_trabajo, progreso=progreso, total=total)
+
+    def ejecutar():
+        from database import TRABAJO_EN_PROCESO, TRABAJO_COMPLETADO, TRABAJO_ERROR
+        inicio = time.perf_counter()
+        actualizar_trabajo(id_trabajo, estado=TRABAJO_EN_PROCESO)
+        try:
+            resultado = funcion(reportar)
+        except Exception as e:
+            logger.error(f"[TRABAJO] {tipo} {id_trabajo} falló: {e}")
+            actualizar_trabajo(id_trabajo, estado=TRABAJO_ERROR, error=e)
+            raise
+        actualizar_trabajo(id_trabajo, estado=TRABAJO_COMPLETADO, progreso=total, resultado=resultado)
+        logger.info(f"[TRABAJO] {tipo} {id_trabajo} completado en {time.perf_counter() - inicio:.2f}s")
+        return resultado
+
+    return id_trabajo, _pool_trabajos.submit(ejecutar)
+
+
+def _respuesta_trabajo(id_trabajo, futuro, espera=ESPERA_INLINE_SEG):
+    """Resultado directo si el trabajo termina dentro de 'espera'; si no, 202 con el id a consultar."""
+    try:
+        resultado = futuro.result(timeout=espera)
+        return jsonify(dict(resultado, job_id=id_trabajo))
+    except FuturesTimeout:
+        return jsonify({"job_id": id_trabajo, "estado": "PENDIENTE",
+                        "mensaje": "Procesando en segundo plano"}), 202
+    except Exception as e:
+        return jsonify({"job_id": id_trabajo, "error": str(e)}), 500
+
+
+@app.route('/api/jobs/<id_trabajo>')
+def api_estado_trabajo(id_trabajo):
+    """Estado, progreso y (al terminar) resultado de un trabajo en segundo plano."""
+    from database import obtener_trabajo
+    trabajo = obtener_trabajo(id_trabajo)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo)
+
 @app.route('/auditoria')
+@respuesta_cacheada('CHIRIQUI')
 def auditoria():
     """Página de Auditoría de Terreno y Retorno"""
     try:
@@ -857,12 +1148,13 @@ def auditoria():
     except Exception:
         moviles = []
         details_moviles = {}
+        no_cachear()
 
     return render_template('auditoria.html',
                            hoy=date.today().isoformat(),
                            moviles=moviles,
                            details_moviles=json.dumps(details_moviles),
-                           sku_to_excel_name=json.dumps(SKU_TO_EXCEL_NAME))
+                           sku_to_excel_name=json.dumps(_nombres_excel()))
 
 @app.route('/api/consumos_dia')
 def api_consumos_dia():
@@ -907,10 +1199,11 @@ def api_consumos_dia():
         rows = cursor.fetchall()
         conn.close()
 
+        nombres_excel = obtener_catalogo().nombres_excel
         consumos = []
         for row in rows:
             id_, movil_r, sku, cantidad, tecnico, ayudante, ticket, fecha_r, colilla, contrato, seriales_json, estado = row
-            nombre = SKU_TO_EXCEL_NAME.get(sku, sku)
+            nombre = nombres_excel.get(sku, sku)
             seriales = []
             if seriales_json:
                 try:
@@ -941,75 +1234,86 @@ def api_consumos_dia():
 
 @app.route('/api/comparar_excel', methods=['POST'])
 def api_comparar_excel():
-    """Recibe un Excel, lo parsea y compara con los consumos de la DB"""
+    """Recibe un Excel y lo compara con los consumos de la DB en un trabajo en segundo plano"""
     if 'archivo' not in request.files:
         return jsonify({"error": "No se recibió archivo"}), 400
 
     archivo = request.files['archivo']
+    contenido = archivo.read()
     movil = request.form.get('movil', '')
     fecha = request.form.get('fecha', date.today().isoformat())
 
-    try:
-        import openpyxl
-        import io
+    id_trabajo, futuro = _encolar_trabajo(
+        'comparar_excel', lambda reportar: _comparar_excel(contenido, movil, fecha, reportar, archivo.filename)
+    )
+    if id_trabajo:
+        return _respuesta_trabajo(id_trabajo, futuro)
 
-        wb = openpyxl.load_workbook(io.BytesIO(archivo.read()), data_only=True)
-        ws = wb.active
+    try:
+        return jsonify(_comparar_excel(contenido, movil, fecha, nombre_archivo=archivo.filename))
+    except Exception as e:
+        import traceback
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
 
-        # Leer encabezados de la primera fila
-        headers = []
-        for cell in ws[1]:
-            headers.append(str(cell.value or '').strip())
 
-        # Leer filas de datos
-        filas_excel = []
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if any(v is not None for v in row):
-                fila = {headers[i]: str(v or '').strip() for i, v in enumerate(row) if i < len(headers)}
-                filas_excel.append(fila)
+def _comparar_excel(contenido, movil, fecha, reportar=None, nombre_archivo=None):
+    """
+    Agrupa el Excel por (fecha, móvil, sku) en streaming y lo cruza con consumos_pendientes
+    del día (y móvil, si se indica). Si el formato no se reconoce, devuelve una vista previa.
+    """
+    import io
+    from utils.excel_stream import agrupar_consumos_excel, vista_previa_excel
+    nombres_excel = obtener_catalogo().nombres_excel
 
-        # Obtener consumos de la DB para comparar
-        from database import get_db_connection, run_query
-        from config import MOVILES_SANTIAGO
+    try:
+        agrupado, info = agrupar_consumos_excel(
+            io.BytesIO(contenido), nombre=nombre_archivo, reportar=reportar
+        )
+        headers = ['Fecha', 'Móvil', 'SKU', 'Producto', 'Cantidad']
+        filas_excel = [
+            {'Fecha': f, 'Móvil': m, 'SKU': sku, 'Producto': nombres_excel.get(sku, sku), 'Cantidad': str(cant)}
+            for (f, m, sku), cant in sorted(agrupado.items()) if cant
+        ]
+        total_filas = info['filas_leidas']
+    except ValueError as e:
+        logger.info(f"[COMPARAR EXCEL] Formato no reconocido ({e}), se devuelve vista previa")
+        headers, filas_excel, total_filas = vista_previa_excel(io.BytesIO(contenido), nombre=nombre_archivo)
+
+    # Obtener consumos de la DB para comparar
+    from database import get_db_connection, run_query
 
-        target_db = None
-        pass
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
 
-        try:
-            conn = get_db_connection(target_db=target_db)
-            cursor = conn.cursor()
-
-            if movil:
-                run_query(cursor, """
-                    SELECT sku, SUM(cantidad) as total
-                    FROM consumos_pendientes
-                    WHERE fecha = ? AND movil = ?
-                    GROUP BY sku
-                """, (fecha, movil))
-            else:
-                run_query(cursor, """
-                    SELECT sku, SUM(cantidad) as total
-                    FROM consumos_pendientes
-                    WHERE fecha = ?
-                    GROUP BY sku
-                """, (fecha,))
-
-            consumos_db = {row[0]: row[1] for row in cursor.fetchall()}
-        finally:
-            if conn:
-                conn.close()
+        if movil:
+            run_query(cursor, """
+                SELECT sku, SUM(cantidad) as total
+                FROM consumos_pendientes
+                WHERE fecha = ? AND movil = ?
+                GROUP BY sku
+            """, (fecha, movil))
+        else:
+            run_query(cursor, """
+                SELECT sku, SUM(cantidad) as total
+                FROM consumos_pendientes
+                WHERE fecha = ?
+                GROUP BY sku
+            """, (fecha,))
 
-        return jsonify({
-            "headers": headers,
-            "filas": filas_excel,
-            "consumos_db": {sku: {"cantidad": qty, "nombre": SKU_TO_EXCEL_NAME.get(sku, sku)}
-                            for sku, qty in consumos_db.items()},
-            "total_filas": len(filas_excel)
-        })
+        consumos_db = {row[0]: row[1] for row in cursor.fetchall()}
+    finally:
+        if conn:
+            conn.close()
 
-    except Exception as e:
-        import traceback
-        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+    return {
+        "headers": headers,
+        "filas": filas_excel,
+        "consumos_db": {sku: {"cantidad": qty, "nombre": nombres_excel.get(sku, sku)}
+                        for sku, qty in consumos_db.items()},
+        "total_filas": total_filas
+    }
 
 @app.route('/api/stock_movil/<movil>')
 def api_stock_movil(movil):